@@ -3,12 +3,12 @@ API Server para el Agente de Análisis de Calidad de Imágenes
 Servidor FastAPI para integración web
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Form
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Form, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import asyncio
 import uvicorn
 import json
@@ -18,8 +18,16 @@ from datetime import datetime
 from pathlib import Path
 
 from src.image_quality_analyzer import ImageQualityAnalyzer, QualityAnalysisRequest
+from src.batch_stream import MultipartSpooler, SpooledUpload, stream_batch_analysis
 from config import AgentConfig, get_config
 
+# Formatos de respuesta de /analyze/batch y su media type
+BATCH_FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream"
+}
+
 # Modelos Pydantic para la API
 class AnalysisResponse(BaseModel):
     """Respuesta de análisis de calidad"""
@@ -56,6 +64,22 @@ class AnalysisOptions(BaseModel):
     cache_result: bool = True
     quality_threshold: str = "default"  # default, premium, bulk
 
+class UploadStreamingResponse(StreamingResponse):
+    """Respuesta en streaming que empieza antes de terminar de recibir la petición
+
+    Starlette detecta la desconexión del cliente leyendo `receive`, el mismo
+    canal por el que llega el cuerpo; mientras se está leyendo la subida esa
+    escucha se pospone para no robarle mensajes.
+    """
+    
+    def __init__(self, content, body_consumed: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_consumed = body_consumed
+    
+    async def listen_for_disconnect(self, receive):
+        await self.body_consumed.wait()
+        await super().listen_for_disconnect(receive)
+
 class ImageQAAPIServer:
     """Servidor API principal"""
     
@@ -83,6 +107,10 @@ class ImageQAAPIServer:
         # Configurar rutas
         self._setup_routes()
         
+        # Liberar pool de análisis, sesión HTTP y caches al parar el servidor (handler asíncrono:
+        # la sesión queda cerrada antes de que termine el event loop)
+        self.app.add_event_handler("shutdown", self.analyzer.shutdown)
+        
         logger.info(f"ImageQAAPIServer inicializado en {self.config.api_host}:{self.config.api_port}")
 
     def _setup_routes(self):
@@ -103,6 +131,7 @@ class ImageQAAPIServer:
                     "analyze_file": "/analyze/file",
                     "analyze_url": "/analyze/url",
                     "performance": "/performance",
+                    "duplicates": "/duplicates",
                     "cache": "/cache"
                 }
             }
@@ -273,96 +302,84 @@ class ImageQAAPIServer:
                     timestamp=datetime.now().isoformat()
                 )
         
-        @self.app.post("/analyze/batch", response_model=BatchAnalysisResponse)
+        @self.app.post("/analyze/batch")
         async def analyze_batch(
-            background_tasks: BackgroundTasks,
-            files: List[UploadFile] = File(..., description="Lista de archivos de imagen"),
-            options: str = Form("{}", description="Opciones de análisis en JSON")
+            request: Request,
+            options: Optional[str] = None,
+            format: Optional[str] = None
         ):
-            """Analiza múltiples imágenes en lote"""
+            """Analiza múltiples imágenes en lote, cada una en cuanto termina de subirse
+
+            Las subidas se vuelcan a disco por bloques y se analizan mientras
+            llega el resto. Con `format=ndjson` (o `Accept: application/x-ndjson`)
+            o `format=sse` (o `Accept: text/event-stream`) los resultados se
+            devuelven en orden de finalización según terminan; por defecto se
+            responde un BatchAnalysisResponse al acabar el lote. Las opciones
+            van en el parámetro `options` o en el campo de formulario `options`
+            enviado antes que los ficheros.
+            """
+            response_format = format or self._negotiate_batch_format(request.headers.get("accept", ""))
+            if response_format not in BATCH_FORMATS:
+                raise HTTPException(status_code=400, detail=f"Formato de respuesta no soportado: {response_format}")
             try:
-                start_time = datetime.now()
-                
-                # Validar cantidad de archivos
-                if len(files) > 50:  # Límite razonable para lotes
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Máximo 50 imágenes por lote"
-                    )
-                
-                # Parsear opciones
-                analysis_options = json.loads(options) if options else {}
-                
-                # Preparar requests
-                requests = []
-                for file in files:
-                    if not file.filename.lower().endswith(tuple(self.config.supported_formats)):
-                        logger.warning(f"Archivo ignorado por formato no soportado: {file.filename}")
-                        continue
-                    
-                    # Leer datos del archivo
-                    image_data = await file.read()
-                    
-                    # Verificar tamaño
-                    if len(image_data) > self.config.max_image_size:
-                        logger.warning(f"Archivo ignorado por tamaño: {file.filename}")
-                        continue
-                    
-                    requests.append(QualityAnalysisRequest(
-                        image_data=image_data,
-                        analysis_options=analysis_options
-                    ))
-                
-                if not requests:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="No se proporcionaron imágenes válidas"
-                    )
-                
-                # Analizar en lote
-                results = await self.analyzer.analyze_batch(requests)
-                
-                # Preparar respuestas
-                responses = []
-                successful = 0
-                failed = 0
-                
-                for result in results:
-                    response_data = self._format_analysis_result(result, analysis_options)
-                    
-                    responses.append(AnalysisResponse(
-                        success=True,
-                        result=response_data,
-                        processing_time=result.processing_time,
-                        timestamp=result.analysis_timestamp.isoformat()
-                    ))
-                    successful += 1
-                
-                total_processing_time = (datetime.now() - start_time).total_seconds()
-                
-                return BatchAnalysisResponse(
-                    success=True,
-                    total_images=len(files),
-                    successful_analyses=successful,
-                    failed_analyses=failed,
-                    results=responses,
-                    total_processing_time=total_processing_time,
-                    timestamp=datetime.now().isoformat()
-                )
-                
-            except HTTPException:
-                raise
-            except Exception as e:
-                logger.error(f"Error en análisis por lotes: {e}")
-                return BatchAnalysisResponse(
-                    success=False,
-                    total_images=len(files) if files else 0,
-                    successful_analyses=0,
-                    failed_analyses=len(files) if files else 0,
-                    results=[],
-                    total_processing_time=0.0,
-                    timestamp=datetime.now().isoformat()
+                spooler = MultipartSpooler(
+                    request.headers.get("content-type", ""),
+                    max_file_size=self.config.max_image_size,
+                    allowed_suffixes=self.config.supported_formats,
+                    max_files=self.config.api_max_batch_files,
+                    spool_dir=self.config.api_spool_dir
                 )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            
+            parsed_options: Dict[str, Dict[str, Any]] = {}
+            
+            async def analyze(upload: SpooledUpload) -> Dict[str, Any]:
+                # Las opciones se fijan con el primer fichero (el campo de formulario ya llegó)
+                if 'value' not in parsed_options:
+                    raw_options = options or spooler.fields.get('options') or "{}"
+                    parsed_options['value'] = json.loads(raw_options)
+                analysis_options = parsed_options['value']
+                image_data = await asyncio.to_thread(upload.read)
+                result = await self.analyzer.analyze_image(QualityAnalysisRequest(
+                    image_data=image_data,
+                    analysis_options=analysis_options
+                ))
+                response_data = self._format_analysis_result(result, analysis_options)
+                response_data["image_path"] = upload.filename
+                return response_data
+            
+            concurrency = max(self.config.max_concurrent_analyses, self.analyzer.executor.concurrency)
+            events = stream_batch_analysis(
+                spooler.uploads(request.stream()), analyze,
+                concurrency=concurrency,
+                max_pending=max(self.config.api_max_pending_uploads, concurrency)
+            )
+            
+            if response_format == "json":
+                try:
+                    return await self._collect_batch_response(events)
+                finally:
+                    spooler.cleanup()
+            
+            async def body():
+                try:
+                    async for event in events:
+                        data = json.dumps(event, ensure_ascii=False, default=str)
+                        if response_format == "sse":
+                            yield f"event: {event['event']}\ndata: {data}\n\n"
+                        else:
+                            yield data + "\n"
+                finally:
+                    await events.aclose()
+                    spooler.cleanup()
+            
+            return UploadStreamingResponse(
+                body(),
+                body_consumed=spooler.body_complete,
+                media_type=BATCH_FORMATS[response_format],
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
         
         @self.app.get("/performance", response_model=Dict[str, Any])
         async def get_performance_stats():
@@ -375,6 +392,22 @@ class ImageQAAPIServer:
                 logger.error(f"Error obteniendo estadísticas: {e}")
                 raise HTTPException(status_code=500, detail=str(e))
         
+        @self.app.get("/duplicates", response_model=Dict[str, Any])
+        async def get_duplicate_clusters(min_size: int = 2, limit: int = 100):
+            """Clusters de imágenes casi idénticas (hash perceptual)"""
+            try:
+                clusters = self.analyzer.get_duplicate_clusters(min_size=max(min_size, 2), limit=limit)
+                return {
+                    "total_clusters": len(clusters),
+                    "indexed_images": len(self.analyzer.duplicate_index),
+                    "hash_radius": self.analyzer.duplicate_index.radius,
+                    "clusters": clusters,
+                    "timestamp": datetime.now().isoformat()
+                }
+            except Exception as e:
+                logger.error(f"Error obteniendo clusters de duplicados: {e}")
+                raise HTTPException(status_code=500, detail=str(e))
+        
         @self.app.delete("/cache")
         async def clear_cache():
             """Limpia el cache de análisis"""
@@ -407,6 +440,51 @@ class ImageQAAPIServer:
                 logger.error(f"Error obteniendo configuración: {e}")
                 raise HTTPException(status_code=500, detail=str(e))
 
+    def _negotiate_batch_format(self, accept: str) -> str:
+        """Formato de respuesta de /analyze/batch según la cabecera Accept"""
+        if "text/event-stream" in accept:
+            return "sse"
+        if "application/x-ndjson" in accept:
+            return "ndjson"
+        return "json"
+
+    async def _collect_batch_response(self, events) -> BatchAnalysisResponse:
+        """Respuesta agregada (formato original) a partir de los eventos del lote"""
+        responses: List[Tuple[int, AnalysisResponse]] = []
+        summary: Dict[str, Any] = {}
+        error = None
+        async for event in events:
+            if event['event'] == 'result':
+                result = event.get('result') or {}
+                responses.append((event['index'], AnalysisResponse(
+                    success=event['success'],
+                    result=event.get('result'),
+                    error=event.get('error'),
+                    processing_time=result.get('processing_time', 0.0),
+                    timestamp=datetime.now().isoformat()
+                )))
+            elif event['event'] == 'error':
+                error = event['error']
+            else:
+                summary = event
+        
+        if error and not responses:
+            raise HTTPException(status_code=400, detail=error)
+        if not responses:
+            raise HTTPException(status_code=400, detail="No se proporcionaron imágenes válidas")
+        
+        # Orden de la petición, como antes del streaming
+        responses.sort(key=lambda item: item[0])
+        return BatchAnalysisResponse(
+            success=error is None,
+            total_images=summary.get('total_files', len(responses)),
+            successful_analyses=summary.get('successful', 0),
+            failed_analyses=summary.get('failed', 0),
+            results=[response for _, response in responses],
+            total_processing_time=summary.get('total_processing_time', 0.0),
+            timestamp=datetime.now().isoformat()
+        )
+
     def _format_analysis_result(self, result, analysis_options: Dict[str, Any]) -> Dict[str, Any]:
         """Formatea resultado de análisis para respuesta API"""
         # Incluir métricas detalladas según opciones
@@ -417,6 +495,7 @@ class ImageQAAPIServer:
         response = {
             # Información básica
             "image_path": result.image_path,
+            "duplicate_of": result.duplicate_of,
             "overall_score": result.overall_score,
             "overall_level": result.overall_level.value,
             "processing_time": result.processing_time,
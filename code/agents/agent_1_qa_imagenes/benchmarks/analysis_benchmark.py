@@ -0,0 +1,718 @@
+#!/usr/bin/env python3
+"""
+Benchmark del analizador de calidad de imágenes
+Mide throughput y bloqueo del event loop por backend, precisión frente a velocidad del modo preview
+sensibilidad y coste del BRISQUE/NIQE nativo (comparado con cv2.quality si está disponible)
+memoria pico del análisis por teselas frente al completo en imágenes grandes
+latencia del índice de casi-duplicados con un millón de huellas
+throughput de descargas por URL contra un servidor HTTP local
+latencia del modo watch (imagen nueva hasta resultado) y coste de reconciliar un catálogo sin cambios
+y calibración de umbrales y pesos sobre la matriz de métricas de 100k imágenes
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from pathlib import Path
+from typing import Any, Dict, List
+
+# Agregar el directorio del agente y src al path
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+import cv2
+import numpy as np
+from loguru import logger
+
+from analysis_executor import REDUCED_DECODE_FLAGS, fingerprint_encoded
+from catalog_watcher import CatalogWatcher
+from config import AgentConfig, QualityThresholds, QualityWeights
+from image_quality_analyzer import ImageQualityAnalyzer, QualityAnalysisRequest
+from metric_matrix import refresh_metric_matrix
+from nss_quality import NSSModel, stack_images
+from perceptual_index import Fingerprint, PerceptualIndex
+from result_cache import ResultCache
+from threshold_calibration import calibrate
+from url_fetcher import ImageFetcher, UrlCache
+from quality_metrics import BRISQUEMetric, ImageContext, PreviewCalibration
+
+SCENARIOS = ("backends", "preview", "nss", "tiled", "dedup", "urls", "watch", "calibration")
+BACKENDS = ("inline", "thread", "process")
+
+
+def _synthetic_photo(rng: np.random.Generator, width: int, height: int, max_blur: float = 3.0) -> np.ndarray:
+    """Foto de producto sintética: textura multi-octava (espectro ~1/f), objeto, desenfoque y ruido"""
+    texture = np.zeros((height, width), np.float32)
+    amplitude, cells = 1.0, 8
+    while cells <= max(width, height):
+        small = rng.normal(0, 1, (max(2, height * cells // max(width, height)), cells)).astype(np.float32)
+        texture += amplitude * cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+        amplitude *= 0.95
+        cells *= 2
+    texture = (texture - texture.mean()) / texture.std()
+
+    gradient = np.linspace(60, 200, width, dtype=np.float32)[None, :]
+    image = np.repeat((gradient + rng.uniform(20, 60) * texture)[:, :, None], 3, axis=2)
+    center = (int(width * rng.uniform(0.3, 0.7)), int(height * rng.uniform(0.3, 0.7)))
+    cv2.circle(image, center, min(width, height) // 4, tuple(float(c) for c in rng.uniform(0, 255, 3)), -1)
+
+    sigma = rng.uniform(0, max_blur)
+    if sigma > 0.3:
+        image = cv2.GaussianBlur(image, (0, 0), sigma)
+    image += rng.normal(0, rng.uniform(0.5, 3), image.shape).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def generate_images(directory: Path, count: int, width: int, height: int, seed: int = 0,
+                    max_blur: float = 3.0) -> List[str]:
+    """Genera fotos de producto sintéticas en JPEG con nitidez variable"""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        path = directory / f"product_{i:05d}.jpg"
+        cv2.imwrite(str(path), _synthetic_photo(rng, width, height, max_blur), [cv2.IMWRITE_JPEG_QUALITY, 92])
+        paths.append(str(path))
+    return paths
+
+
+def list_images(directory: str, limit: int) -> List[str]:
+    suffixes = {".jpg", ".jpeg", ".png", ".tiff", ".bmp", ".webp"}
+    paths = sorted(str(p) for p in Path(directory).rglob("*") if p.suffix.lower() in suffixes)
+    return paths[:limit]
+
+
+async def _measure_loop_lag(stop: asyncio.Event, interval: float, lags: List[float]):
+    """Retraso con el que el event loop atiende un temporizador periódico"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run_backend(config: AgentConfig, paths: List[str], backend: str) -> Dict[str, Any]:
+    analyzer = ImageQualityAnalyzer(replace(config, executor_backend=backend))
+    requests = [QualityAnalysisRequest(image_path=path) for path in paths]
+    try:
+        # Calentamiento: arranque de los procesos trabajadores e imports
+        await analyzer.analyze_image(requests[0])
+        analyzer.clear_cache()
+
+        stop = asyncio.Event()
+        lags: List[float] = []
+        ticker = asyncio.create_task(_measure_loop_lag(stop, 0.01, lags))
+        start = time.perf_counter()
+        results = await analyzer.analyze_batch(requests)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await ticker
+    finally:
+        await analyzer.shutdown()
+
+    lags.sort()
+    return {
+        "backend": backend,
+        "workers": analyzer.executor.max_workers,
+        "images": len(results),
+        "seconds": elapsed,
+        "images_per_second": len(results) / elapsed,
+        "loop_lag_p50_ms": lags[len(lags) // 2] * 1000 if lags else 0.0,
+        "loop_lag_max_ms": lags[-1] * 1000 if lags else 0.0
+    }
+
+
+async def _timed_batch(analyzer: ImageQualityAnalyzer, paths: List[str], mode: str):
+    requests = [QualityAnalysisRequest(image_path=p, analysis_options={"analysis_mode": mode}) for p in paths]
+    start = time.perf_counter()
+    results = await analyzer.analyze_batch(requests)
+    return results, time.perf_counter() - start
+
+
+async def run_preview(config: AgentConfig, paths: List[str]) -> List[Dict[str, Any]]:
+    """Precisión y velocidad del modo preview (sin y con escalado) frente al modo completo"""
+    variants = [("full", "full", 0.0),
+                ("preview", "preview", 0.0),
+                ("preview+escalado", "preview", config.preview_escalation_margin)]
+    reference = None
+    rows = []
+    for label, mode, margin in variants:
+        analyzer = ImageQualityAnalyzer(replace(config, preview_escalation_margin=margin))
+        try:
+            await analyzer.analyze_image(QualityAnalysisRequest(image_path=paths[0]))  # calentamiento
+            analyzer.clear_cache()
+            results, elapsed = await _timed_batch(analyzer, paths, mode)
+            stats = analyzer.get_performance_stats()
+        finally:
+            await analyzer.shutdown()
+
+        if reference is None:
+            reference = results
+        errors = [abs(r.overall_score - ref.overall_score) for r, ref in zip(results, reference)]
+        agreement = sum(r.overall_level == ref.overall_level for r, ref in zip(results, reference))
+        sharpness_agreement = sum(r.sharpness_level == ref.sharpness_level for r, ref in zip(results, reference))
+        row = {
+            "variant": label,
+            "seconds_per_image": elapsed / len(results),
+            "speedup": rows[0]["seconds_per_image"] / (elapsed / len(results)) if rows else 1.0,
+            "overall_mae": float(np.mean(errors)),
+            "overall_level_agreement": agreement / len(results),
+            "sharpness_level_agreement": sharpness_agreement / len(results),
+            "escalation_rate": stats["preview_escalation_rate"] if mode == "preview" else 0.0
+        }
+        rows.append(row)
+        print(f"{label:<17} {row['seconds_per_image'] * 1000:>8.1f}ms/img  x{row['speedup']:>5.2f}  "
+              f"MAE score {row['overall_mae']:>5.2f}  nivel {row['overall_level_agreement']:>6.1%}  "
+              f"nitidez {row['sharpness_level_agreement']:>6.1%}  escalado {row['escalation_rate']:>6.1%}")
+    return rows
+
+
+def fit_calibration(paths: List[str], output: str) -> PreviewCalibration:
+    """Ajusta las correcciones de preview comparando cada factor de reducción con la resolución completa"""
+    brisque = BRISQUEMetric(AgentConfig().quality_thresholds)
+    samples = {factor: [] for factor in REDUCED_DECODE_FLAGS}
+    for path in paths:
+        for factor, flag in REDUCED_DECODE_FLAGS.items():
+            # Contexto con escala 1 para obtener los valores sin corregir
+            context = ImageContext(cv2.imread(path, flag))
+            samples[factor].append((context.laplacian_variance, brisque._calculate_brisque_score(context)))
+
+    full = np.array(samples[1])
+    calibration = PreviewCalibration(sharpness={}, brisque={})
+    for factor in (2, 4, 8):
+        reduced = np.array(samples[factor])
+        slope, intercept = np.polyfit(np.log(np.maximum(reduced[:, 0], 1e-6)), np.log(np.maximum(full[:, 0], 1e-6)), 1)
+        calibration.sharpness[factor] = (round(float(slope), 3), round(float(intercept), 3))
+        slope, intercept = np.polyfit(reduced[:, 1], full[:, 1], 1)
+        calibration.brisque[factor] = (round(float(slope), 3), round(float(intercept), 3))
+        print(f"x{factor}: nitidez log-lineal {calibration.sharpness[factor]}, brisque {calibration.brisque[factor]}")
+    calibration.save(output)
+    print(f"Calibración guardada en {output}")
+    return calibration
+
+
+# Distorsiones y niveles con los que se comprueba que el score BRISQUE crece con la degradación
+DISTORTIONS = {
+    "blur": (0.5, 1.0, 2.0, 4.0),
+    "noise": (3.0, 8.0, 15.0, 30.0),
+    "jpeg": (80, 40, 15, 5)
+}
+
+
+def _distort(gray: np.ndarray, kind: str, level: float, rng: np.random.Generator) -> np.ndarray:
+    if kind == "blur":
+        return cv2.GaussianBlur(gray, (0, 0), level)
+    if kind == "noise":
+        return np.clip(gray + rng.normal(0, level, gray.shape), 0, 255).astype(np.uint8)
+    _, encoded = cv2.imencode(".jpg", gray, [cv2.IMWRITE_JPEG_QUALITY, int(level)])
+    return cv2.imdecode(encoded, cv2.IMREAD_GRAYSCALE)
+
+
+def _spearman(x: List[float], y: List[float]) -> float:
+    rx, ry = np.argsort(np.argsort(x)), np.argsort(np.argsort(y))
+    return float(np.corrcoef(rx, ry)[0, 1])
+
+
+def _opencv_brisque(args):
+    """Evaluador BRISQUE de opencv-contrib si está instalado y se dan sus modelos"""
+    if not hasattr(cv2, "quality") or not (args.opencv_brisque_model and args.opencv_brisque_range):
+        return None
+    return lambda gray: float(cv2.quality.QualityBRISQUE_compute(
+        gray, args.opencv_brisque_model, args.opencv_brisque_range)[0])
+
+
+def run_nss(paths: List[str], model: NSSModel, args) -> Dict[str, Any]:
+    """Coste por imagen y en lote, y monotonía del score frente a distorsiones sintéticas"""
+    grays = [model.working_image(cv2.imread(path, cv2.IMREAD_GRAYSCALE), model.max_side) for path in paths]
+
+    start = time.perf_counter()
+    single = [model.score(gray)[0] for gray in grays]
+    single_ms = (time.perf_counter() - start) / len(grays) * 1000
+    stack = stack_images(grays)
+    start = time.perf_counter()
+    model.score_batch(stack)
+    batch_ms = (time.perf_counter() - start) / len(grays) * 1000
+    print(f"nativo {single_ms:>7.1f}ms/img  en lote {batch_ms:>7.1f}ms/img  "
+          f"({grays[0].shape[1]}x{grays[0].shape[0]})  score medio {np.mean(single):.1f}")
+    results: Dict[str, Any] = {"native_ms_per_image": single_ms, "batch_ms_per_image": batch_ms,
+                               "mean_score": float(np.mean(single)), "distortions": {}}
+
+    rng = np.random.default_rng(args.seed)
+    opencv = _opencv_brisque(args)
+    native_all, opencv_all, opencv_ms = [], [], []
+    for kind, levels in DISTORTIONS.items():
+        severities, scores = [], []
+        for severity, level in enumerate(levels, start=1):
+            for gray in grays:
+                distorted = _distort(gray, kind, level, rng)
+                score = model.score(distorted)[0]
+                severities.append(severity)
+                scores.append(score)
+                native_all.append(score)
+                if opencv:
+                    start = time.perf_counter()
+                    opencv_all.append(opencv(distorted))
+                    opencv_ms.append(time.perf_counter() - start)
+        means = [float(np.mean(scores[i * len(grays):(i + 1) * len(grays)])) for i in range(len(levels))]
+        results["distortions"][kind] = {"spearman": _spearman(severities, scores), "mean_scores": means}
+        print(f"{kind:<6} spearman severidad-score {results['distortions'][kind]['spearman']:>5.2f}  "
+              f"medias {' '.join(f'{m:5.1f}' for m in means)}")
+
+    if opencv:
+        results["opencv"] = {
+            "ms_per_image": float(np.mean(opencv_ms) * 1000),
+            "spearman_vs_native": _spearman(opencv_all, native_all)
+        }
+        print(f"opencv {results['opencv']['ms_per_image']:>7.1f}ms/img  "
+              f"spearman con nativo {results['opencv']['spearman_vs_native']:.2f}")
+    else:
+        print("cv2.quality.QualityBRISQUE no disponible (o sin --opencv-brisque-model/--opencv-brisque-range)")
+    return results
+
+
+def fit_nss_model(paths: List[str], output: str, description: str) -> NSSModel:
+    """Ajusta el modelo prístino de BRISQUE/NIQE con imágenes de referencia y lo guarda"""
+    model = NSSModel.fit((cv2.imread(path) for path in paths), source=f"{len(paths)} {description}")
+    model.save(output)
+    print(f"Modelo NSS ajustado con {len(paths)} imágenes guardado en {output}")
+    return model
+
+
+def generate_large_image(path: Path, width: int, height: int, seed: int = 0) -> str:
+    """Foto grande en JPEG formada por mosaico de fotos sintéticas, con una esquina desenfocada"""
+    rng = np.random.default_rng(seed)
+    base = _synthetic_photo(rng, 2000, 1500, max_blur=0.5)
+    image = np.tile(base, (-(-height // 1500), -(-width // 2000), 1))[:height, :width]
+    image[:height // 4, -width // 4:] = cv2.GaussianBlur(image[:height // 4, -width // 4:], (0, 0), 5)
+    cv2.imwrite(str(path), image, [cv2.IMWRITE_JPEG_QUALITY, 92])
+    return str(path)
+
+
+def _peak_memory_child(path: str, config: AgentConfig) -> Dict[str, Any]:
+    """Se ejecuta en un proceso nuevo: memoria pico (RSS) del proceso tras un análisis"""
+    analyzer = ImageQualityAnalyzer(config)
+    start = time.perf_counter()
+    result = asyncio.run(analyzer.analyze_image(QualityAnalysisRequest(image_path=path)))
+    return {
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "overall_score": result.overall_score,
+        "sharpness_variance": result.sharpness_variance,
+        "worst_region": result.worst_region
+    }
+
+
+def run_tiled(config: AgentConfig, directory: Path, args) -> List[Dict[str, Any]]:
+    """Memoria pico y resultado del análisis completo, por teselas y por teselas con presupuesto de píxeles"""
+    path = generate_large_image(directory / "large.jpg", args.large_width, args.large_height, args.seed)
+    base = replace(config, executor_backend="inline", result_cache_path=None)
+    variants = [
+        ("completo", replace(base, tiled_min_pixels=None)),
+        ("teselas", replace(base, tiled_min_pixels=0, tiled_max_pixels=args.large_width * args.large_height)),
+        ("teselas+presupuesto", replace(base, tiled_min_pixels=0))
+    ]
+    rows = []
+    context = multiprocessing.get_context("spawn")
+    for label, variant in variants:
+        # Un proceso por variante para que el pico de memoria de una no contamine a las demás
+        with context.Pool(1) as pool:
+            row = {"variant": label, **pool.apply(_peak_memory_child, (path, variant))}
+        rows.append(row)
+        region = row["worst_region"]
+        print(f"{label:<20} {row['seconds']:>6.2f}s  RSS pico {row['peak_rss_mb']:>6.0f}MB  "
+              f"score {row['overall_score']:>5.1f}  nitidez {row['sharpness_variance']:>8.1f}  "
+              f"peor región {(region['x'], region['y']) if region else '-'}")
+    return rows
+
+
+def run_dedup(paths: List[str], args) -> Dict[str, Any]:
+    """Coste de la huella perceptual y latencia de consulta del índice con `--dedup-size` huellas
+
+    Las huellas son aleatorias (uniformes); pHash reales se agrupan más y sus
+    cubos son mayores, así que la latencia real depende del catálogo.
+    """
+    start = time.perf_counter()
+    for path in paths:
+        fingerprint_encoded(Path(path).read_bytes())
+    fingerprint_ms = (time.perf_counter() - start) / len(paths) * 1000
+
+    rng = np.random.default_rng(args.seed)
+    hashes = rng.integers(0, 2**64, args.dedup_size, dtype=np.uint64).tolist()
+    index = PerceptualIndex(radius=args.dedup_radius)
+    start = time.perf_counter()
+    for i, phash in enumerate(hashes):
+        # Carga directa en memoria: add() además busca vecinos y escribe en SQLite
+        index._append(f"{i:032x}", Fingerprint(phash, phash, 0, 0, 0.0, 0.0), i)
+    build_seconds = time.perf_counter() - start
+
+    # Consultas a distancia 2 de huellas indexadas
+    latencies = []
+    for phash in hashes[::max(1, args.dedup_size // 2000)]:
+        query = phash ^ (1 << int(rng.integers(64))) ^ (1 << int(rng.integers(64)))
+        start = time.perf_counter()
+        index.query(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    result = {
+        "indexed": args.dedup_size,
+        "radius": args.dedup_radius,
+        "fingerprint_ms": fingerprint_ms,
+        "build_seconds": build_seconds,
+        "query_p50_ms": float(np.percentile(latencies, 50)),
+        "query_p99_ms": float(np.percentile(latencies, 99)),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+    print(f"huella {fingerprint_ms:.1f}ms/imagen  índice de {args.dedup_size} en {build_seconds:.1f}s  "
+          f"consulta radio {args.dedup_radius} p50 {result['query_p50_ms']:.3f}ms "
+          f"p99 {result['query_p99_ms']:.3f}ms  RSS {result['peak_rss_mb']:.0f}MB")
+    return result
+
+
+async def _start_image_server(paths: List[str], latency: float, handshake: float):
+    """Servidor HTTP local que sirve las imágenes con ETag
+
+    Simula la red: cada respuesta espera `latency` y la primera petición de
+    cada conexión además `handshake` (el coste de DNS, TCP y TLS que en local
+    no existe).
+    """
+    from aiohttp import web
+
+    bodies = [Path(path).read_bytes() for path in paths]
+    etags = [f'"{hashlib.md5(body).hexdigest()}"' for body in bodies]
+    seen_connections = set()
+
+    async def image(request):
+        connection = id(request.transport)
+        if connection not in seen_connections:
+            seen_connections.add(connection)
+            await asyncio.sleep(handshake)
+        await asyncio.sleep(latency)
+        index = int(request.match_info["index"]) % len(bodies)
+        if request.headers.get("If-None-Match") == etags[index]:
+            return web.Response(status=304, headers={"ETag": etags[index]})
+        return web.Response(body=bodies[index], content_type="image/jpeg", headers={"ETag": etags[index]})
+
+    app = web.Application()
+    app.router.add_get("/img/{index}.jpg", image)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, seen_connections, f"http://127.0.0.1:{port}/img"
+
+
+async def run_urls(config: AgentConfig, paths: List[str], directory: Path, args) -> List[Dict[str, Any]]:
+    """Descargas por URL: sesión nueva por URL (comportamiento anterior), sesión compartida y revalidación 304"""
+    import aiohttp
+
+    runner, connections, base_url = await _start_image_server(
+        paths, args.url_latency_ms / 1000, args.url_handshake_ms / 1000
+    )
+    urls = [f"{base_url}/{i}.jpg" for i in range(args.url_requests)]
+    semaphore = asyncio.Semaphore(args.url_concurrency)
+
+    async def download_new_session(url: str) -> int:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                return len(await response.read())
+
+    def shared_fetcher(max_per_host: int, cache: bool = False) -> ImageFetcher:
+        return ImageFetcher(
+            max_bytes=config.max_image_size,
+            max_connections=config.url_max_connections,
+            max_per_host=max_per_host,
+            cache=UrlCache(str(directory / "url_cache"), config.url_cache_max_bytes) if cache else None
+        )
+
+    async def measure(label: str, download) -> Dict[str, Any]:
+        async def bounded(url):
+            async with semaphore:
+                return await download(url)
+
+        connections.clear()
+        start = time.perf_counter()
+        sizes = await asyncio.gather(*[bounded(url) for url in urls])
+        elapsed = time.perf_counter() - start
+        row = {
+            "variant": label,
+            "requests": len(urls),
+            "images_per_second": len(urls) / elapsed,
+            "mb_per_second": sum(sizes) / elapsed / 1e6,
+            "connections": len(connections)
+        }
+        print(f"{label:<22} {row['images_per_second']:>7.1f} img/s  {row['mb_per_second']:>7.1f} MB/s  "
+              f"{row['connections']:>4} conexiones")
+        return row
+
+    rows = []
+    try:
+        rows.append(await measure("sesión por URL", download_new_session))
+
+        # Misma concurrencia que la sesión por URL: solo cambia la reutilización de conexiones
+        fetcher = shared_fetcher(args.url_concurrency)
+        rows.append(await measure("sesión compartida", lambda url: _fetched_size(fetcher, url)))
+        await fetcher.aclose()
+
+        per_host = config.url_max_connections_per_host
+        fetcher = shared_fetcher(per_host)
+        rows.append(await measure(f"compartida, {per_host}/host", lambda url: _fetched_size(fetcher, url)))
+        await fetcher.aclose()
+
+        fetcher = shared_fetcher(args.url_concurrency, cache=True)
+        await measure("compartida (llenado)", lambda url: _fetched_size(fetcher, url))
+        rows.append(await measure("revalidación 304", lambda url: _fetched_size(fetcher, url)))
+        await fetcher.aclose()
+    finally:
+        await runner.cleanup()
+    return rows
+
+
+async def _fetched_size(fetcher: ImageFetcher, url: str) -> int:
+    return len((await fetcher.fetch(url)).data)
+
+
+async def run_watch(config: AgentConfig, paths: List[str], directory: Path, args) -> Dict[str, Any]:
+    """Modo watch: reconciliación de un catálogo ya indexado y latencia de una imagen nueva por backend"""
+    catalog = directory / "watch_catalog"
+    thumbnail = cv2.imencode(".jpg", np.full((64, 64, 3), 128, dtype=np.uint8))[1].tobytes()
+    for i in range(args.watch_catalog):
+        folder = catalog / f"lote_{i // 1000:03d}"
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / f"{i:06d}.jpg").write_bytes(thumbnail)
+    index_path = str(directory / "watch.db")
+
+    async def indexed(path: Path) -> Dict[str, Any]:
+        return {"success": True, "overall_score": 80.0, "overall_level": "good"}
+
+    async def start(watcher: CatalogWatcher) -> asyncio.Task:
+        task = asyncio.create_task(watcher.run())
+        while watcher.stats["rescans"] == 0:
+            await asyncio.sleep(0.01)
+        await watcher.idle(timeout=600)
+        return task
+
+    async def finish(watcher: CatalogWatcher, task: asyncio.Task):
+        watcher.stop()
+        await task
+        watcher.index.close()
+
+    # Primer arranque (todo nuevo) y segundo (nada cambió): solo stat frente al índice
+    timings = {}
+    for label in ("indexado inicial", "reconciliación"):
+        watcher = CatalogWatcher(indexed, str(catalog), index_path, config.supported_formats,
+                                 backend="polling", debounce=0.0, poll_interval=3600)
+        start_time = time.perf_counter()
+        task = await start(watcher)
+        timings[label] = time.perf_counter() - start_time
+        await finish(watcher, task)
+    print(f"catálogo de {args.watch_catalog} imágenes: indexado inicial {timings['indexado inicial']:.2f}s, "
+          f"reconciliación sin cambios {timings['reconciliación']:.2f}s")
+
+    analyzer = ImageQualityAnalyzer(config)
+
+    async def analyze(path: Path) -> Dict[str, Any]:
+        result = await analyzer.analyze_image(QualityAnalysisRequest(image_path=str(path)))
+        return {"success": True, "overall_score": result.overall_score, "overall_level": result.overall_level.value}
+
+    latencies = []
+    for backend in ("inotify", "polling"):
+        watcher = CatalogWatcher(analyze, str(catalog), index_path, config.supported_formats, backend=backend,
+                                 debounce=config.watch_debounce, poll_interval=config.watch_poll_interval)
+        task = await start(watcher)
+        samples = []
+        for i, source in enumerate(paths[:args.watch_drops]):
+            name = f"nueva_{backend}_{i}.jpg"
+            (catalog / (name + ".part")).write_bytes(Path(source).read_bytes())
+            dropped = time.perf_counter()
+            (catalog / (name + ".part")).rename(catalog / name)
+            while watcher.index.signature(name) is None:
+                await asyncio.sleep(0.005)
+            samples.append(time.perf_counter() - dropped)
+        await finish(watcher, task)
+        row = {
+            "backend": backend,
+            "debounce_s": config.watch_debounce,
+            "poll_interval_s": config.watch_poll_interval if backend == "polling" else None,
+            "latency_p50_s": float(np.percentile(samples, 50)),
+            "latency_max_s": float(max(samples))
+        }
+        latencies.append(row)
+        print(f"{backend:<8} imagen nueva hasta resultado p50 {row['latency_p50_s']:.2f}s  "
+              f"máx {row['latency_max_s']:.2f}s")
+    await analyzer.shutdown()
+    return {
+        "catalog_images": args.watch_catalog,
+        "initial_index_seconds": timings["indexado inicial"],
+        "reconcile_seconds": timings["reconciliación"],
+        "latency": latencies
+    }
+
+
+def run_calibration(directory: Path, args) -> Dict[str, Any]:
+    """Calibración sobre la matriz de métricas: construcción desde el cache, refresco incremental y cálculo"""
+    rng = np.random.default_rng(args.seed)
+    n = args.calibration_size
+    cache = ResultCache(str(directory / "calibration_results.db"))
+
+    def synthetic_results(start: int, count: int):
+        brisque = rng.uniform(5, 60, count)
+        variance = np.exp(rng.normal(5.5, 1.0, count))
+        exposure = rng.uniform(40, 100, count)
+        for i in range(count):
+            # Resultado con el tamaño y los campos de QualityAnalysisResult.to_dict
+            yield f"{start + i:032x}", "full", {
+                "image_path": f"catalogo/{start + i:07d}.jpg",
+                "brisque_score": brisque[i], "sharpness_variance": variance[i],
+                "exposure_balance_score": exposure[i], "exposure_histogram": {"shadows": 0.2, "midtones": 0.6},
+                "width": 4000, "height": 3000, "aspect_ratio_score": 100.0, "overall_score": 70.0,
+                "issues_detected": ["Nitidez: Imagen ligeramente desenfocada"] * 2,
+                "recommendations": ["Enfocar correctamente la cámara"] * 4
+            }
+
+    cache.put_many(synthetic_results(0, n))
+    matrix_path = str(directory / "metric_matrix.npz")
+
+    start = time.perf_counter()
+    matrix = refresh_metric_matrix(cache, "full", matrix_path)
+    build = time.perf_counter() - start
+
+    cache.put_many(synthetic_results(n, n // 100))
+    start = time.perf_counter()
+    matrix = refresh_metric_matrix(cache, "full", matrix_path)
+    refresh = time.perf_counter() - start
+
+    start = time.perf_counter()
+    calibrate(matrix, QualityThresholds(), QualityWeights(), fit_weights=False)
+    percentiles = time.perf_counter() - start
+
+    # Etiquetas dependientes de nitidez y BRISQUE con ruido
+    logit = (np.log(matrix["sharpness_variance"]) - 5.5) * 2 - (matrix["brisque"] - 30) / 15
+    labels = logit + rng.normal(0, 0.5, len(matrix)) > 0
+    start = time.perf_counter()
+    report = calibrate(matrix, QualityThresholds(), QualityWeights(), labels=labels,
+                       labeled_rows=np.arange(len(matrix)))
+    labeled = time.perf_counter() - start
+    cache.close()
+
+    row = {
+        "images": len(matrix),
+        "build_seconds": build,
+        "incremental_refresh_seconds": refresh,
+        "percentile_seconds": percentiles,
+        "roc_and_weights_seconds": labeled,
+        "auc_current_weights": report["current_weights"]["auc"],
+        "auc_calibrated_weights": report["calibrated_weights"]["auc"]
+    }
+    print(f"matriz de {row['images']} imágenes: construcción {build:.2f}s, refresco de {n // 100} nuevas {refresh:.2f}s")
+    print(f"percentiles {percentiles * 1000:.1f}ms  ROC + pesos {labeled:.2f}s  "
+          f"AUC {row['auc_current_weights']:.3f} -> {row['auc_calibrated_weights']:.3f}")
+    return row
+
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.images_dir:
+            paths = list_images(args.images_dir, args.images)
+        else:
+            paths = generate_images(Path(tmp), args.images, args.width, args.height, args.seed, args.max_blur)
+        if args.fit_calibration:
+            fit_calibration(paths, args.fit_calibration)
+        if args.fit_nss_model:
+            description = (f"imágenes de {args.images_dir}" if args.images_dir else
+                           f"fotos sintéticas {args.width}x{args.height} (desenfoque máx. {args.max_blur})")
+            fit_nss_model(paths, args.fit_nss_model, description)
+
+        config = AgentConfig(
+            result_cache_path=None,
+            executor_workers=args.workers,
+            max_concurrent_analyses=args.concurrency,
+            preview_max_side=args.preview_max_side,
+            preview_escalation_margin=args.escalation_margin,
+            preview_calibration_path=args.calibration or args.fit_calibration,
+            nss_model_path=args.nss_model or args.fit_nss_model,
+            duplicate_policy="off",
+            url_cache_dir=None
+        )
+        results: Dict[str, Any] = {}
+        if "backends" in args.scenarios:
+            results["backends"] = []
+            for backend in args.backends:
+                result = await run_backend(config, paths, backend)
+                results["backends"].append(result)
+                print(f"{backend:<8} {result['workers']:>3} trabajadores  "
+                      f"{result['images_per_second']:>7.2f} img/s  "
+                      f"lag event loop p50 {result['loop_lag_p50_ms']:>7.1f}ms  "
+                      f"máx {result['loop_lag_max_ms']:>7.1f}ms")
+        if "preview" in args.scenarios:
+            results["preview"] = await run_preview(replace(config, executor_backend=args.backends[0]), paths)
+        if "nss" in args.scenarios:
+            results["nss"] = run_nss(paths, NSSModel.load(config.nss_model_path), args)
+        if "tiled" in args.scenarios:
+            results["tiled"] = run_tiled(config, Path(tmp), args)
+        if "dedup" in args.scenarios:
+            results["dedup"] = run_dedup(paths, args)
+        if "urls" in args.scenarios:
+            results["urls"] = await run_urls(config, paths, Path(tmp), args)
+        if "watch" in args.scenarios:
+            results["watch"] = await run_watch(config, paths, Path(tmp), args)
+        if "calibration" in args.scenarios:
+            results["calibration"] = run_calibration(Path(tmp), args)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del analizador de calidad de imágenes")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--images", type=int, default=24)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--large-width", type=int, default=12000, help="Ancho de la imagen del escenario tiled")
+    parser.add_argument("--large-height", type=int, default=8000)
+    parser.add_argument("--dedup-size", type=int, default=1_000_000, help="Huellas en el índice del escenario dedup")
+    parser.add_argument("--dedup-radius", type=int, default=AgentConfig.duplicate_hash_radius)
+    parser.add_argument("--url-requests", type=int, default=400, help="Descargas del escenario urls")
+    parser.add_argument("--url-concurrency", type=int, default=32)
+    parser.add_argument("--url-latency-ms", type=float, default=20.0, help="Latencia simulada por respuesta")
+    parser.add_argument("--url-handshake-ms", type=float, default=30.0,
+                        help="Coste simulado de abrir conexión (DNS+TCP+TLS)")
+    parser.add_argument("--watch-catalog", type=int, default=20_000, help="Imágenes ya indexadas del escenario watch")
+    parser.add_argument("--watch-drops", type=int, default=8, help="Imágenes nuevas por backend del escenario watch")
+    parser.add_argument("--calibration-size", type=int, default=100_000, help="Imágenes de la matriz de calibración")
+    parser.add_argument("--max-blur", type=float, default=3.0, help="Desenfoque máximo de las imágenes sintéticas")
+    parser.add_argument("--images-dir", type=str, help="Usar imágenes reales de este directorio")
+    parser.add_argument("--preview-max-side", type=int, default=1024)
+    parser.add_argument("--escalation-margin", type=float, default=AgentConfig.preview_escalation_margin,
+                        help="Puntos alrededor de un umbral de nivel que fuerzan análisis completo")
+    parser.add_argument("--calibration", type=str, help="JSON de correcciones de preview a usar")
+    parser.add_argument("--fit-calibration", type=str,
+                        help="Ajustar las correcciones de preview con estas imágenes y guardarlas en este JSON")
+    parser.add_argument("--nss-model", type=str, help="Modelo prístino de BRISQUE/NIQE a usar")
+    parser.add_argument("--fit-nss-model", type=str,
+                        help="Ajustar el modelo prístino con estas imágenes y guardarlo en este JSON")
+    parser.add_argument("--opencv-brisque-model", type=str, help="brisque_model_live.yml de opencv-contrib")
+    parser.add_argument("--opencv-brisque-range", type=str, help="brisque_range_live.yml de opencv-contrib")
+    parser.add_argument("--workers", type=int, default=None, help="Trabajadores del executor (por defecto CPUs)")
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--output", type=str, help="Guardar resultados en JSON")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+
+    results = asyncio.run(run_benchmark(args))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ Parámetros de configuración para análisis de calidad de imágenes
 """
 
 from dataclasses import dataclass
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from enum import Enum
 
 class QualityLevel(Enum):
@@ -60,6 +60,51 @@ class AgentConfig:
     max_image_size: int = 50 * 1024 * 1024  # 50MB
     analysis_timeout: int = 30  # segundos
     
+    # Modo de análisis: "full" (resolución completa) o "preview" (imagen reducida con corrección)
+    analysis_mode: str = "full"
+    preview_max_side: int = 1024  # lado largo mínimo de la imagen reducida
+    preview_escalation_margin: float = 2.5  # puntos alrededor de un umbral de nivel que fuerzan análisis completo
+    preview_calibration_path: Optional[str] = None  # JSON de correcciones (None = valores por defecto)
+    
+    # Modelo prístino de BRISQUE/NIQE (None = modelo genérico de models/, ajustado con fotos sintéticas)
+    nss_model_path: Optional[str] = None
+    
+    # Análisis por teselas de imágenes grandes: memoria acotada y región más desenfocada
+    tiled_min_pixels: Optional[int] = 16_000_000  # a partir de este tamaño (None = nunca)
+    tiled_max_pixels: int = 64_000_000  # píxeles decodificados como máximo; por encima se decodifica reducida
+    tile_size: int = 1024
+    tile_overlap: int = 8
+    tile_workers: int = 1
+    
+    # Ejecución de decodificación y métricas: "inline", "thread" o "process"
+    executor_backend: str = "thread"
+    executor_workers: Optional[int] = None  # None = número de CPUs
+    
+    # Cache persistente de resultados (None = solo en memoria)
+    result_cache_path: Optional[str] = "cache/analysis_results.db"
+
+    # Casi-duplicados por hash perceptual: "off", "index" (solo clusters) o "reuse" (reutiliza el análisis)
+    duplicate_policy: str = "reuse"
+    duplicate_index_path: Optional[str] = "cache/perceptual_index.db"  # None = solo en memoria
+    duplicate_hash_radius: int = 6  # distancia de Hamming máxima entre pHash (y dHash) de 64 bits
+    duplicate_detail_tolerance: float = 0.15  # diferencia relativa de detalle admitida al reutilizar
+
+    # Matriz de métricas por imagen para calibrar umbrales y pesos sin reanalizar (None = solo en memoria)
+    metric_matrix_path: Optional[str] = "cache/metric_matrix.npz"
+
+    # Descarga de imágenes por URL con una sesión HTTP compartida
+    url_max_connections: int = 64  # conexiones abiertas en total
+    url_max_connections_per_host: int = 8
+    url_connect_timeout: float = 10.0  # segundos (la descarga completa se limita con analysis_timeout)
+    url_cache_dir: Optional[str] = "cache/url_cache"  # cuerpos y ETag/Last-Modified (None = sin cache condicional)
+    url_cache_max_bytes: int = 2 * 1024 * 1024 * 1024
+
+    # Modo watch: análisis incremental de un directorio de catálogo
+    watch_backend: str = "auto"  # "auto" (inotify si está disponible), "inotify" o "polling"
+    watch_debounce: float = 1.0  # segundos sin cambios antes de analizar un fichero
+    watch_poll_interval: float = 5.0  # segundos entre escaneos con polling
+    watch_index_path: Optional[str] = None  # índice de resultados (None = uno estable por directorio en cache/)
+
     # Configuración de umbrales y pesos
     quality_thresholds: QualityThresholds = None
     quality_weights: QualityWeights = None
@@ -68,6 +113,9 @@ class AgentConfig:
     api_host: str = "0.0.0.0"
     api_port: int = 8081
     api_debug: bool = False
+    api_max_batch_files: int = 1000  # ficheros por petición a /analyze/batch
+    api_max_pending_uploads: int = 16  # ficheros recibidos sin analizar antes de dejar de leer la petición
+    api_spool_dir: Optional[str] = None  # directorio para volcar las subidas (None = temporal del sistema)
     
     # Configuración de logging
     log_level: str = "INFO"
@@ -111,6 +159,8 @@ PREMIUM_CONFIG = AgentConfig(
 BULK_PROCESSING_CONFIG = AgentConfig(
     agent_id="agent_1_qa_imagenes_bulk",
     max_concurrent_analyses=10,
+    executor_backend="process",  # Escala con los núcleos disponibles
+    analysis_mode="preview",  # Triaje rápido; los casos dudosos se analizan completos
     analysis_timeout=15,  # Más rápido para procesamiento masivo
     api_debug=False,
     enable_performance_logging=False
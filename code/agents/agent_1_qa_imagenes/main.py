@@ -16,12 +16,12 @@ sys.path.append(str(Path(__file__).parent / "api"))
 
 from config import AgentConfig, get_config
 from src.image_quality_analyzer import ImageQualityAnalyzer
-from src.queue_integration import create_queue_integrated_agent, handle_queue_task
+from src.queue_integration import ImageQAQueueIntegration, create_queue_integrated_agent, handle_queue_task
 from api.api_server import run_server
 
 def main():
     parser = argparse.ArgumentParser(description="Agente 1: Analista de Calidad de Imágenes")
-    parser.add_argument("--mode", choices=["api", "queue", "standalone"], 
+    parser.add_argument("--mode", choices=["api", "queue", "standalone", "watch"], 
                        default="api", help="Modo de ejecución")
     parser.add_argument("--config", choices=["default", "premium", "bulk"],
                        default="default", help="Configuración a usar")
@@ -33,6 +33,11 @@ def main():
     parser.add_argument("--image", help="Imagen a analizar en modo standalone")
     parser.add_argument("--batch", help="Archivo con lista de imágenes para análisis por lotes")
     
+    # Opciones para modo watch
+    parser.add_argument("--watch-dir", help="Directorio a vigilar en modo watch")
+    parser.add_argument("--watch-backend", choices=["auto", "inotify", "polling"],
+                       help="Detección de cambios en modo watch (por defecto la de la configuración)")
+    
     # Opciones para integración con colas
     parser.add_argument("--queue-config", help="Configuración JSON para tarea de cola")
     
@@ -51,6 +56,8 @@ def main():
         run_queue_integration(config)
     elif args.mode == "standalone":
         run_standalone_analysis(config, args)
+    elif args.mode == "watch":
+        run_watch_mode(config, args)
     else:
         print(f"Modo no reconocido: {args.mode}")
         sys.exit(1)
@@ -163,5 +170,33 @@ def run_standalone_analysis(config: AgentConfig, args):
     else:
         asyncio.run(analyze_single())
 
+def run_watch_mode(config: AgentConfig, args):
+    """Vigila un directorio y analiza solo las imágenes nuevas o modificadas"""
+    if not args.watch_dir:
+        print("Debe especificar --watch-dir para el modo watch")
+        sys.exit(1)
+    if args.watch_backend:
+        config.watch_backend = args.watch_backend
+    
+    integration = ImageQAQueueIntegration(ImageQualityAnalyzer(config))
+    
+    def print_result(event):
+        if event.get('success'):
+            print(f"{event['image']}: {event['overall_score']:.1f}/100 ({event['overall_level']})")
+        else:
+            print(f"{event['image']}: error - {event.get('error')}")
+    
+    integration.add_event_listener(print_result)
+    watcher = integration.create_directory_watcher(args.watch_dir)
+    print(f"Vigilando {args.watch_dir} (Ctrl+C para terminar)")
+    try:
+        asyncio.run(watcher.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        summary = watcher.index.summary()
+        print(f"\nÍndice: {summary['total_images']} imágenes, score promedio {summary['average_score']:.1f}/100")
+        watcher.index.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,286 @@
+"""
+Ejecución de la decodificación y las métricas fuera del event loop
+Backends en línea, en hilos o en un pool de procesos con la imagen en memoria compartida
+"""
+
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from loguru import logger
+
+from perceptual_index import Fingerprint, compute_fingerprint
+from quality_metrics import BaseMetric, ImageContext, MetricResult, TiledImageContext, TilingConfig
+
+# Orden de las métricas en la lista de resultados (el que espera _compile_results)
+METRIC_ORDER = ['brisque', 'sharpness', 'exposure', 'resolution', 'aspect_ratio']
+IMAGE_METRICS = {'brisque', 'sharpness', 'exposure'}
+
+# Métricas y dimensiones de la imagen original (width, height, channels)
+AnalysisOutput = Tuple[List[MetricResult], Dict[str, int]]
+
+# Lado largo mínimo de la imagen reducida con la que se calcula la huella perceptual
+FINGERPRINT_MIN_SIDE = 512
+
+# Decodificación reducida: en JPEG se hace en el dominio DCT, sin decodificar a tamaño completo
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# El análisis por teselas solo necesita luminancia: decodificar en grises ocupa un tercio
+REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+}
+
+
+def read_image_size(image_data) -> Optional[Tuple[int, int]]:
+    """(ancho, alto) leídos de la cabecera sin decodificar; None si no se puede"""
+    try:
+        from PIL import Image
+        with Image.open(io.BytesIO(image_data)) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def read_image_channels(image_data) -> Optional[int]:
+    """Número de canales según la cabecera; None si no se puede leer"""
+    try:
+        from PIL import Image
+        with Image.open(io.BytesIO(image_data)) as image:
+            return len(image.getbands())
+    except Exception:
+        return None
+
+
+def budget_reduction(size: Tuple[int, int], max_pixels: int) -> int:
+    """Menor factor de reducción con el que la imagen decodificada cabe en `max_pixels`"""
+    for factor in (1, 2, 4, 8):
+        if size[0] * size[1] / (factor * factor) <= max_pixels:
+            return factor
+    return 8
+
+
+def preview_reduction(size: Tuple[int, int], max_side: int) -> int:
+    """Mayor factor de reducción que deja el lado largo en al menos `max_side` píxeles"""
+    reduction = 1
+    for factor in (2, 4, 8):
+        if max(size) / factor >= max_side:
+            reduction = factor
+    return reduction
+
+
+def decode_flags(reduction: int = 1, tiling: Optional[TilingConfig] = None) -> int:
+    return (REDUCED_GRAYSCALE_FLAGS if tiling else REDUCED_DECODE_FLAGS)[reduction]
+
+
+def decode_image(image_data, reduction: int = 1, tiling: Optional[TilingConfig] = None) -> np.ndarray:
+    """Decodifica una imagen desde un buffer (bytes, memoryview o array uint8)"""
+    buffer = image_data if isinstance(image_data, np.ndarray) else np.frombuffer(image_data, np.uint8)
+    image = cv2.imdecode(buffer, decode_flags(reduction, tiling))
+    if image is None:
+        raise ValueError("No se pudo decodificar la imagen")
+    return image
+
+
+def fingerprint_encoded(image_data) -> Optional[Fingerprint]:
+    """Huella perceptual desde la imagen codificada, decodificando reducida y en grises
+
+    Devuelve None si la imagen no se puede decodificar o es casi plana.
+    """
+    size = read_image_size(image_data)
+    reduction = preview_reduction(size, FINGERPRINT_MIN_SIDE) if size else 1
+    buffer = np.frombuffer(image_data, np.uint8)
+    gray = cv2.imdecode(buffer, REDUCED_GRAYSCALE_FLAGS[reduction])
+    if gray is None:
+        return None
+    return compute_fingerprint(gray, size or (gray.shape[1], gray.shape[0]))
+
+
+def compute_metrics(image: np.ndarray, metrics: Dict[str, BaseMetric], reduction: int = 1,
+                    original_size: Optional[Tuple[int, int]] = None,
+                    tiling: Optional[TilingConfig] = None, channels: Optional[int] = None) -> AnalysisOutput:
+    """Calcula todas las métricas sobre una imagen decodificada
+
+    Con `reduction` > 1 la imagen viene reducida: resolución y aspect ratio se
+    evalúan con `original_size` y las métricas de imagen aplican su corrección.
+    Con `tiling` la imagen llega en grises y se analiza por teselas; los
+    canales originales se toman de la cabecera (`channels`).
+    """
+    width, height = original_size or (image.shape[1], image.shape[0])
+    if (width > height) != (image.shape[1] > image.shape[0]):
+        # La cabecera no aplica la orientación EXIF que sí aplica imdecode
+        width, height = height, width
+    dimensions = {
+        'width': width,
+        'height': height,
+        'channels': channels or (image.shape[2] if len(image.shape) > 2 else 1)
+    }
+    # Grises, histograma y pirámide se calculan una vez para todas las métricas
+    if tiling:
+        context = TiledImageContext(image, scale=reduction, tiling=tiling)
+    else:
+        context = ImageContext(image, scale=reduction)
+    results = [
+        metrics[name].compute(context if name in IMAGE_METRICS else dimensions)
+        for name in METRIC_ORDER
+    ]
+    return results, dimensions
+
+
+def analyze_encoded(image_data, metrics: Dict[str, BaseMetric], reduction: int = 1,
+                    original_size: Optional[Tuple[int, int]] = None,
+                    tiling: Optional[TilingConfig] = None) -> AnalysisOutput:
+    channels = read_image_channels(image_data) if tiling else None
+    return compute_metrics(decode_image(image_data, reduction, tiling), metrics, reduction, original_size,
+                           tiling, channels)
+
+
+def _analyze_shared(shm_name: str, size: int, metrics: Dict[str, BaseMetric], reduction: int = 1,
+                    original_size: Optional[Tuple[int, int]] = None,
+                    tiling: Optional[TilingConfig] = None) -> AnalysisOutput:
+    """Punto de entrada en el proceso trabajador: lee la imagen codificada de memoria compartida"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        buffer = np.ndarray((size,), dtype=np.uint8, buffer=shm.buf)
+        # imdecode copia los píxeles, así que el bloque puede cerrarse enseguida
+        image = cv2.imdecode(buffer, decode_flags(reduction, tiling))
+        channels = read_image_channels(shm.buf[:size]) if tiling else None
+        del buffer
+    finally:
+        shm.close()
+    if image is None:
+        raise ValueError("No se pudo decodificar la imagen")
+    return compute_metrics(image, metrics, reduction, original_size, tiling, channels)
+
+
+class AnalysisExecutor:
+    """Ejecuta decodificación y métricas en el propio event loop (comportamiento original)"""
+
+    backend = "inline"
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    @property
+    def concurrency(self) -> int:
+        """Análisis que tiene sentido mantener en curso a la vez"""
+        return 1
+
+    async def analyze(self, image_data: bytes, metrics: Dict[str, BaseMetric], reduction: int = 1,
+                      original_size: Optional[Tuple[int, int]] = None,
+                      tiling: Optional[TilingConfig] = None) -> AnalysisOutput:
+        return analyze_encoded(image_data, metrics, reduction, original_size, tiling)
+
+    async def fingerprint(self, image_data: bytes) -> Optional[Fingerprint]:
+        return fingerprint_encoded(image_data)
+
+    def shutdown(self):
+        pass
+
+
+class ThreadAnalysisExecutor(AnalysisExecutor):
+    """Pool de hilos: OpenCV libera el GIL en la mayor parte del trabajo"""
+
+    backend = "thread"
+
+    def __init__(self, max_workers: Optional[int] = None):
+        super().__init__(max_workers)
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="qa-analysis")
+
+    @property
+    def concurrency(self) -> int:
+        return self.max_workers
+
+    async def analyze(self, image_data: bytes, metrics: Dict[str, BaseMetric], reduction: int = 1,
+                      original_size: Optional[Tuple[int, int]] = None,
+                      tiling: Optional[TilingConfig] = None) -> AnalysisOutput:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, analyze_encoded, image_data, metrics,
+                                          reduction, original_size, tiling)
+
+    async def fingerprint(self, image_data: bytes) -> Optional[Fingerprint]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, fingerprint_encoded, image_data)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ProcessAnalysisExecutor(AnalysisExecutor):
+    """Pool de procesos; la imagen codificada viaja por memoria compartida en lugar de serializarse
+
+    Solo cruzan la frontera entre procesos el nombre del bloque compartido, las
+    métricas configuradas y los MetricResult, todos de pocos KB. La imagen
+    decodificada nunca sale del proceso trabajador.
+    """
+
+    backend = "process"
+
+    def __init__(self, max_workers: Optional[int] = None):
+        super().__init__(max_workers)
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def concurrency(self) -> int:
+        return self.max_workers
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            # spawn evita heredar hilos y conexiones SQLite del proceso principal
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"Pool de análisis iniciado con {self.max_workers} procesos")
+        return self.pool
+
+    async def analyze(self, image_data: bytes, metrics: Dict[str, BaseMetric], reduction: int = 1,
+                      original_size: Optional[Tuple[int, int]] = None,
+                      tiling: Optional[TilingConfig] = None) -> AnalysisOutput:
+        size = len(image_data)
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        try:
+            shm.buf[:size] = image_data
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_pool(), _analyze_shared, shm.name, size, metrics,
+                                              reduction, original_size, tiling)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    async def fingerprint(self, image_data: bytes) -> Optional[Fingerprint]:
+        # Una decodificación reducida no compensa el viaje al proceso trabajador
+        return await asyncio.to_thread(fingerprint_encoded, image_data)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+
+EXECUTOR_BACKENDS = {
+    "inline": AnalysisExecutor,
+    "thread": ThreadAnalysisExecutor,
+    "process": ProcessAnalysisExecutor
+}
+
+
+def create_executor(backend: str = "thread", max_workers: Optional[int] = None) -> AnalysisExecutor:
+    """Crea el executor de análisis configurado"""
+    if backend not in EXECUTOR_BACKENDS:
+        raise ValueError(f"Backend de ejecución no soportado: {backend} "
+                         f"(disponibles: {', '.join(EXECUTOR_BACKENDS)})")
+    return EXECUTOR_BACKENDS[backend](max_workers)
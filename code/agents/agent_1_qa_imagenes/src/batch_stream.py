@@ -0,0 +1,261 @@
+"""
+Análisis de lotes subidos en streaming
+Parseo incremental de multipart/form-data con volcado a disco y resultados en orden de finalización
+"""
+
+import asyncio
+import shutil
+import tempfile
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, BinaryIO, Callable, Deque, Dict, Iterable, Optional
+
+from loguru import logger
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+MAX_FIELD_SIZE = 64 * 1024  # campos de formulario (opciones en JSON)
+
+
+@dataclass
+class SpooledUpload:
+    """Fichero de un lote ya recibido por completo y volcado a disco"""
+    index: int  # posición en la petición
+    filename: str
+    path: Optional[Path] = None
+    size: int = 0
+    error: Optional[str] = None  # si no se puede analizar (formato, tamaño, subida incompleta)
+
+    def read(self) -> bytes:
+        return self.path.read_bytes()
+
+    def discard(self):
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+            self.path = None
+
+
+class MultipartSpooler:
+    """Parsea multipart/form-data a medida que llega y vuelca cada fichero a disco por bloques
+
+    Cada fichero se entrega en cuanto termina su parte, sin esperar al resto
+    de la petición; en memoria solo está el bloque en curso. Los campos de
+    formulario quedan en `fields` (llegan en el orden en que los envía el
+    cliente, así que solo los anteriores a un fichero están disponibles al
+    entregarlo). La escritura es síncrona: son bloques del tamaño de los
+    mensajes del servidor sobre un directorio temporal local.
+    """
+
+    def __init__(self, content_type: str, max_file_size: int, allowed_suffixes: Iterable[str],
+                 max_files: int, spool_dir: Optional[str] = None):
+        mime, params = parse_options_header(content_type or "")
+        boundary = params.get(b"boundary")
+        if mime != b"multipart/form-data" or not boundary:
+            raise ValueError("Se esperaba multipart/form-data con boundary")
+        if spool_dir:
+            Path(spool_dir).mkdir(parents=True, exist_ok=True)
+
+        self.max_file_size = max_file_size
+        self.allowed_suffixes = tuple(suffix.lower() for suffix in allowed_suffixes)
+        self.max_files = max_files
+        self.directory = Path(tempfile.mkdtemp(prefix="qa-batch-", dir=spool_dir))
+        self.fields: Dict[str, str] = {}
+        self.file_count = 0
+        self.body_complete = asyncio.Event()  # se dejó de leer la petición (terminada o con error)
+
+        self._ready: Deque[SpooledUpload] = deque()
+        self._headers: Dict[str, bytes] = {}
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._upload: Optional[SpooledUpload] = None
+        self._file: Optional[BinaryIO] = None
+        self._field_name: Optional[str] = None
+        self._field_value = bytearray()
+
+        self.parser = MultipartParser(boundary, {
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': lambda data, start, end: self._header_field.extend(data[start:end]),
+            'on_header_value': lambda data, start, end: self._header_value.extend(data[start:end]),
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._upload = None
+        self._field_name = None
+
+    def _on_header_end(self):
+        self._headers[bytes(self._header_field).decode("latin-1").lower()] = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get("content-disposition", b""))
+        name = params.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" not in params:
+            self._field_name = name
+            self._field_value = bytearray()
+            return
+
+        if self.file_count >= self.max_files:
+            raise ValueError(f"Máximo {self.max_files} imágenes por lote")
+        filename = Path(params[b"filename"].decode("utf-8", "replace")).name
+        upload = self._upload = SpooledUpload(index=self.file_count, filename=filename)
+        self.file_count += 1
+
+        suffix = Path(filename).suffix.lower()
+        if suffix not in self.allowed_suffixes:
+            upload.error = f"Formato no soportado. Use: {list(self.allowed_suffixes)}"
+            return
+        upload.path = self.directory / f"{upload.index:06d}{suffix}"
+        self._file = open(upload.path, "wb")
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._field_name is not None:
+            if len(self._field_value) + end - start > MAX_FIELD_SIZE:
+                raise ValueError(f"Campo de formulario demasiado grande: {self._field_name}")
+            self._field_value.extend(data[start:end])
+            return
+
+        upload = self._upload
+        if upload is None or upload.error:
+            return
+        upload.size += end - start
+        if upload.size > self.max_file_size:
+            upload.error = f"Archivo demasiado grande. Máximo: {self.max_file_size} bytes"
+            self._close_file()
+            upload.discard()
+            return
+        self._file.write(data[start:end])
+
+    def _on_part_end(self):
+        if self._field_name is not None:
+            self.fields[self._field_name] = self._field_value.decode("utf-8", "replace")
+            self._field_name = None
+        elif self._upload is not None:
+            self._close_file()
+            self._ready.append(self._upload)
+            self._upload = None
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def uploads(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[SpooledUpload]:
+        """Consume el cuerpo de la petición y entrega cada fichero en cuanto está completo"""
+        try:
+            async for chunk in chunks:
+                error = None
+                try:
+                    self.parser.write(chunk)
+                except ValueError as e:
+                    # Los ficheros completados en este bloque se entregan antes del error
+                    error = e
+                while self._ready:
+                    yield self._ready.popleft()
+                if error:
+                    raise error
+            self.parser.finalize()
+            while self._ready:
+                yield self._ready.popleft()
+            if self._upload is not None:
+                # El cuerpo terminó a mitad de un fichero
+                self._upload.error = "Subida incompleta"
+                self._close_file()
+                self._upload.discard()
+                yield self._upload
+        finally:
+            self._close_file()
+            self.body_complete.set()
+
+    def cleanup(self):
+        self._close_file()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+async def stream_batch_analysis(uploads: AsyncIterator[SpooledUpload],
+                                analyze: Callable[[SpooledUpload], Awaitable[Dict[str, Any]]],
+                                concurrency: int,
+                                max_pending: int) -> AsyncIterator[Dict[str, Any]]:
+    """Analiza cada fichero en cuanto llega y emite los resultados en orden de finalización
+
+    Emite eventos `result` (uno por fichero, con su `index` en la petición) y
+    un `summary` final; un error al leer la petición se emite como `error`.
+    Con `max_pending` ficheros recibidos y sin terminar de analizar se deja de
+    leer la petición, de modo que el cliente no adelanta más de lo que se
+    analiza (memoria y disco acotados). Cada fichero se borra al analizarse.
+    """
+    start = time.monotonic()
+    events: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(concurrency)
+    slots = asyncio.Semaphore(max_pending)
+    tasks = set()
+
+    async def run(upload: SpooledUpload):
+        try:
+            if upload.error:
+                event = {'success': False, 'error': upload.error}
+            else:
+                async with semaphore:
+                    try:
+                        event = {'success': True, 'result': await analyze(upload)}
+                    except Exception as e:
+                        logger.warning(f"Error analizando {upload.filename} del lote: {e}")
+                        event = {'success': False, 'error': str(e)}
+            upload.discard()
+            await events.put({'event': 'result', 'index': upload.index, 'filename': upload.filename,
+                              **event, 'elapsed': time.monotonic() - start})
+        finally:
+            slots.release()
+
+    async def produce():
+        try:
+            iterator = uploads.__aiter__()
+            while True:
+                await slots.acquire()
+                upload = await anext(iterator, None)
+                if upload is None:
+                    slots.release()
+                    break
+                task = asyncio.create_task(run(upload))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            logger.warning(f"Error recibiendo el lote: {e}")
+            await events.put({'event': 'error', 'error': str(e)})
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            await events.put(None)
+
+    producer = asyncio.create_task(produce())
+    counts = {'total_files': 0, 'successful': 0, 'failed': 0}
+    first_result = None
+    try:
+        while (event := await events.get()) is not None:
+            if event['event'] == 'result':
+                counts['total_files'] += 1
+                counts['successful' if event['success'] else 'failed'] += 1
+                if first_result is None:
+                    first_result = event['elapsed']
+            yield event
+        yield {
+            'event': 'summary',
+            **counts,
+            'time_to_first_result': first_result,
+            'total_processing_time': time.monotonic() - start
+        }
+    finally:
+        # Cliente desconectado o consumidor cerrado: no seguir analizando
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
+        await asyncio.gather(producer, *tasks, return_exceptions=True)
@@ -0,0 +1,302 @@
+"""
+Pipeline de verificación masiva de calidad
+Recorre catálogos de forma perezosa, con ventana de análisis acotada, resultados JSONL y reanudación por checkpoint
+"""
+
+import asyncio
+import heapq
+import inspect
+import json
+import os
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from loguru import logger
+
+ProgressCallback = Callable[[Dict[str, Any]], Union[None, Awaitable[None]]]
+
+
+def iter_image_files(root: Path, extensions: Iterable[str], recursive: bool = True,
+                     after: Optional[str] = None) -> Iterator[Tuple[Path, str]]:
+    """Recorre el directorio en profundidad y en orden alfabético, sin listar el catálogo entero
+
+    Devuelve (ruta, ruta relativa en formato posix). El orden es total sobre las
+    rutas relativas, de modo que `after` permite continuar justo después de la
+    última imagen procesada y se saltan sin recorrerlos los subdirectorios
+    anteriores. En memoria solo está el listado del directorio en curso.
+    """
+    suffixes = {ext.lower() for ext in extensions}
+    after_key = tuple(Path(after).parts) if after else None
+
+    def walk(directory: str, prefix: Tuple[str, ...]) -> Iterator[Tuple[Path, str]]:
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            logger.warning(f"No se pudo leer el directorio {directory}: {e}")
+            return
+
+        for entry in entries:
+            key = prefix + (entry.name,)
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                # Todo el subdirectorio queda antes del punto de reanudación
+                if recursive and (after_key is None or key >= after_key[:len(key)]):
+                    yield from walk(entry.path, key)
+            elif os.path.splitext(entry.name)[1].lower() in suffixes:
+                if after_key is None or key > after_key:
+                    yield Path(entry.path), "/".join(key)
+
+    yield from walk(str(root), ())
+
+
+@dataclass
+class BulkSummary:
+    """Agregados del recorrido que no crecen con el tamaño del catálogo"""
+    total_images: int = 0
+    failed: int = 0
+    high_quality: int = 0
+    medium_quality: int = 0
+    low_quality: int = 0
+    duplicates: int = 0  # casi-duplicados cuyo análisis se reutilizó
+    score_sum: float = 0.0
+    worst_images: List[Tuple[float, str]] = field(default_factory=list)  # (score, ruta relativa)
+
+    def add(self, relative_path: str, score: Optional[float], quality_threshold: float, worst_limit: int,
+            duplicate: bool = False):
+        self.total_images += 1
+        if score is None:
+            self.failed += 1
+            return
+        if duplicate:
+            self.duplicates += 1
+        self.score_sum += score
+        if score >= quality_threshold:
+            self.high_quality += 1
+        elif score >= 50:
+            self.medium_quality += 1
+        else:
+            self.low_quality += 1
+
+        # Montículo de máximos (scores negados) con las peores imágenes
+        entry = (-score, relative_path)
+        if len(self.worst_images) < worst_limit:
+            heapq.heappush(self.worst_images, entry)
+        elif entry > self.worst_images[0]:
+            heapq.heapreplace(self.worst_images, entry)
+
+    def to_report(self, quality_threshold: float) -> Dict[str, Any]:
+        analyzed = self.total_images - self.failed
+        return {
+            'total_images': self.total_images,
+            'analyzed_images': analyzed,
+            'failed_analyses': self.failed,
+            'high_quality': self.high_quality,
+            'medium_quality': self.medium_quality,
+            'low_quality': self.low_quality,
+            'duplicates_reused': self.duplicates,
+            'quality_threshold': quality_threshold,
+            'average_score': self.score_sum / analyzed if analyzed else 0.0,
+            'worst_images': [
+                {'image': path, 'overall_score': -neg_score}
+                for neg_score, path in sorted(self.worst_images, reverse=True)
+            ]
+        }
+
+
+@dataclass
+class BulkCheckpoint:
+    """Estado persistido del recorrido: hasta dónde llegan los resultados confirmados en disco"""
+    image_directory: str
+    results_path: str
+    last_path: Optional[str] = None  # última imagen (ruta relativa) con resultado confirmado
+    results_offset: int = 0  # bytes del JSONL que corresponden a resultados confirmados
+    completed: bool = False
+    started_at: str = ""
+    updated_at: str = ""
+    summary: BulkSummary = field(default_factory=BulkSummary)
+
+    def save(self, path: Path):
+        """Escritura atómica: fichero temporal, fsync y rename"""
+        self.updated_at = datetime.now().isoformat()
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(asdict(self), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["BulkCheckpoint"]:
+        try:
+            data = json.loads(path.read_text(encoding='utf-8'))
+            summary = data.pop('summary', {})
+            summary['worst_images'] = [tuple(entry) for entry in summary.get('worst_images', [])]
+            return cls(**data, summary=BulkSummary(**summary))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Checkpoint ilegible {path}, se empieza desde el principio: {e}")
+            return None
+
+
+class BulkQualityPipeline:
+    """Analiza un catálogo en streaming con memoria constante
+
+    Como mucho `window` imágenes están en análisis a la vez. Los resultados se
+    escriben en el JSONL en el orden del recorrido, así que todo lo anterior a
+    la última imagen confirmada está en disco. Cada `fsync_every` resultados (o
+    `fsync_interval` segundos) se hace fsync y se guarda el checkpoint; una
+    ejecución interrumpida se reanuda desde ahí. Las líneas escritas después
+    del último checkpoint se descartan y se recalculan.
+    """
+
+    def __init__(self,
+                 analyze: Callable[[Path], Awaitable[Dict[str, Any]]],
+                 image_directory: str,
+                 results_path: str,
+                 extensions: Iterable[str],
+                 recursive: bool = True,
+                 quality_threshold: float = 70.0,
+                 window: int = 32,
+                 fsync_every: int = 200,
+                 fsync_interval: float = 5.0,
+                 progress_every: int = 100,
+                 worst_limit: int = 20,
+                 on_progress: Optional[ProgressCallback] = None):
+        self.analyze = analyze
+        self.image_directory = Path(image_directory)
+        self.results_path = Path(results_path)
+        self.checkpoint_path = self.results_path.with_name(self.results_path.name + ".checkpoint.json")
+        self.extensions = list(extensions)
+        self.recursive = recursive
+        self.quality_threshold = quality_threshold
+        self.window = max(1, window)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.progress_every = progress_every
+        self.worst_limit = worst_limit
+        self.on_progress = on_progress
+
+        self.checkpoint: Optional[BulkCheckpoint] = None
+        self.resumed_from: Optional[str] = None
+        self.processed_this_run = 0
+
+    def _prepare_checkpoint(self, resume: bool) -> BulkCheckpoint:
+        previous = BulkCheckpoint.load(self.checkpoint_path) if resume else None
+        if (previous and not previous.completed
+                and previous.image_directory == str(self.image_directory.resolve())
+                and self.results_path.exists()):
+            self.resumed_from = previous.last_path
+            logger.info(f"Reanudando verificación masiva tras {previous.last_path} "
+                        f"({previous.summary.total_images} imágenes ya procesadas)")
+            return previous
+        return BulkCheckpoint(
+            image_directory=str(self.image_directory.resolve()),
+            results_path=str(self.results_path),
+            started_at=datetime.now().isoformat()
+        )
+
+    async def run(self, resume: bool = True) -> BulkCheckpoint:
+        """Ejecuta (o reanuda) el recorrido completo; devuelve el checkpoint final"""
+        if not self.image_directory.exists():
+            raise ValueError(f"Directorio no encontrado: {self.image_directory}")
+
+        self.results_path.parent.mkdir(parents=True, exist_ok=True)
+        checkpoint = self.checkpoint = self._prepare_checkpoint(resume)
+
+        start = time.monotonic()
+        last_sync = start
+        unsynced = 0
+        in_flight: Deque[Tuple[str, asyncio.Task]] = deque()
+
+        with open(self.results_path, 'a+b') as results_file:
+            # Descartar resultados escritos después del último checkpoint
+            results_file.truncate(checkpoint.results_offset)
+            results_file.seek(checkpoint.results_offset)
+
+            async def emit_oldest():
+                nonlocal unsynced, last_sync
+                relative_path, task = in_flight.popleft()
+                record = await task
+                record['image'] = relative_path
+                results_file.write((json.dumps(record, ensure_ascii=False, default=str) + "\n").encode('utf-8'))
+
+                score = record.get('overall_score') if record.get('success', True) else None
+                checkpoint.summary.add(relative_path, score, self.quality_threshold, self.worst_limit,
+                                       duplicate=bool(record.get('duplicate_of')))
+                checkpoint.last_path = relative_path
+                self.processed_this_run += 1
+                unsynced += 1
+
+                now = time.monotonic()
+                if unsynced >= self.fsync_every or now - last_sync >= self.fsync_interval:
+                    self._sync(results_file)
+                    unsynced, last_sync = 0, now
+                if self.processed_this_run % self.progress_every == 0:
+                    await self._report_progress(start)
+
+            try:
+                paths = iter_image_files(self.image_directory, self.extensions, self.recursive,
+                                         after=checkpoint.last_path)
+                for path, relative_path in paths:
+                    in_flight.append((relative_path, asyncio.create_task(self._analyze_safe(path))))
+                    # Se vacía en orden; la cabeza ya terminada se escribe sin esperar a llenar la ventana
+                    while in_flight and (len(in_flight) >= self.window or in_flight[0][1].done()):
+                        await emit_oldest()
+                while in_flight:
+                    await emit_oldest()
+                checkpoint.completed = True
+            finally:
+                for _, task in in_flight:
+                    task.cancel()
+                self._sync(results_file)
+
+        await self._report_progress(start, final=True)
+        return checkpoint
+
+    async def _analyze_safe(self, path: Path) -> Dict[str, Any]:
+        try:
+            return await self.analyze(path)
+        except Exception as e:
+            logger.warning(f"Error analizando {path}: {e}")
+            return {'success': False, 'image_path': str(path), 'error': str(e)}
+
+    def _sync(self, results_file):
+        """Confirma en disco los resultados escritos y guarda el checkpoint que los referencia"""
+        results_file.flush()
+        os.fsync(results_file.fileno())
+        self.checkpoint.results_offset = results_file.tell()
+        self.checkpoint.save(self.checkpoint_path)
+
+    async def _report_progress(self, start: float, final: bool = False):
+        elapsed = time.monotonic() - start
+        summary = self.checkpoint.summary
+        event = {
+            'event': 'bulk_quality_progress',
+            'image_directory': str(self.image_directory),
+            'processed': summary.total_images,
+            'processed_this_run': self.processed_this_run,
+            'failed': summary.failed,
+            'images_per_second': self.processed_this_run / elapsed if elapsed > 0 else 0.0,
+            'elapsed_seconds': elapsed,
+            'last_image': self.checkpoint.last_path,
+            'completed': final and self.checkpoint.completed
+        }
+        logger.info(f"Verificación masiva: {summary.total_images} imágenes "
+                    f"({event['images_per_second']:.1f} img/s, {summary.failed} errores)")
+        if self.on_progress is None:
+            return
+        try:
+            outcome = self.on_progress(event)
+            if inspect.isawaitable(outcome):
+                await outcome
+        except Exception as e:
+            logger.warning(f"Error notificando progreso: {e}")
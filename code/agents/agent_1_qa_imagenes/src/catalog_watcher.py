@@ -0,0 +1,473 @@
+"""
+Modo watch: análisis incremental de un directorio de catálogo
+Eventos de inotify (o escaneo periódico como alternativa) con debounce e índice de resultados en SQLite
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from loguru import logger
+
+from bulk_pipeline import iter_image_files
+from result_cache import StatSignature, stat_signature
+
+WATCH_BACKENDS = ('auto', 'inotify', 'polling')
+
+# Constantes de <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+ResultCallback = Callable[[Dict[str, Any]], Any]
+
+
+class WatchResultsIndex:
+    """Último resultado de cada imagen del directorio, con la firma del fichero analizado"""
+
+    def __init__(self, db_path: str):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    path TEXT PRIMARY KEY,
+                    inode INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    success INTEGER NOT NULL,
+                    overall_score REAL,
+                    overall_level TEXT,
+                    analyzed_at TEXT NOT NULL,
+                    record TEXT NOT NULL
+                )
+            """)
+
+    def signature(self, path: str) -> Optional[StatSignature]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT inode, mtime_ns, size FROM results WHERE path = ?", (path,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def upsert(self, path: str, signature: StatSignature, record: Dict[str, Any]):
+        success = record.get('success', True)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results "
+                "(path, inode, mtime_ns, size, success, overall_score, overall_level, analyzed_at, record) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, *signature, int(success),
+                 record.get('overall_score') if success else None,
+                 record.get('overall_level') if success else None,
+                 datetime.now().isoformat(),
+                 json.dumps(record, ensure_ascii=False, default=str))
+            )
+
+    def delete(self, path: str) -> int:
+        """Elimina una imagen o, si es un directorio, todo lo que contiene"""
+        prefix = path.rstrip("/") + "/"
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "DELETE FROM results WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(prefix), prefix)
+            )
+        return cursor.rowcount
+
+    def paths(self) -> Iterator[str]:
+        with self.lock:
+            rows = self.conn.execute("SELECT path FROM results").fetchall()
+        return (row[0] for row in rows)
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute("SELECT record FROM results WHERE path = ?", (path,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            total, failed, average = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(1 - success), 0), AVG(overall_score) FROM results"
+            ).fetchone()
+            levels = dict(self.conn.execute(
+                "SELECT overall_level, COUNT(*) FROM results WHERE success = 1 GROUP BY overall_level"
+            ).fetchall())
+        return {
+            'total_images': total,
+            'failed_analyses': failed,
+            'average_score': average or 0.0,
+            'levels': levels
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class InotifyBackend:
+    """Eventos de inotify (Linux) leídos desde el event loop, sin dependencias externas
+
+    Se vigila cada subdirectorio; los que aparecen después se añaden al vuelo.
+    Si se desborda la cola del kernel se pide un escaneo completo.
+    """
+
+    def __init__(self, root: Path, on_change: Callable[[Path], None], on_delete: Callable[[Path], None],
+                 on_rescan: Callable[[], None]):
+        self.root = root
+        self.on_change = on_change
+        self.on_delete = on_delete
+        self.on_rescan = on_rescan
+        self.fd: Optional[int] = None
+        self.watches: Dict[int, Path] = {}
+        self.libc = None
+
+    def start(self):
+        """Abre inotify y vigila el árbol; OSError si no está disponible o se alcanza el límite de watches"""
+        library = ctypes.util.find_library("c")
+        if library is None:
+            raise OSError(errno.ENOSYS, "libc no encontrada")
+        self.libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify no disponible")
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falló")
+        self.fd = fd
+        try:
+            self._watch_tree(self.root)
+        except OSError:
+            self.stop()
+            raise
+        asyncio.get_running_loop().add_reader(fd, self._read_events)
+
+    def _watch_tree(self, directory: Path):
+        self._add_watch(directory)
+        for current, subdirectories, _ in os.walk(directory):
+            for name in subdirectories:
+                self._add_watch(Path(current) / name)
+
+    def _add_watch(self, directory: Path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOENT:
+                return  # desapareció mientras se recorría
+            raise OSError(error, f"inotify_add_watch falló en {directory}: {os.strerror(error)}")
+        self.watches[wd] = directory
+
+    def _read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            self._dispatch(wd, mask, os.fsdecode(name))
+
+    def _dispatch(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("Cola de inotify desbordada: se reescanea el directorio")
+            self.on_rescan()
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        directory = self.watches.get(wd)
+        if directory is None or not name:
+            return
+        path = directory / name
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # Directorio nuevo (o movido dentro): vigilarlo y analizar lo que ya contenga
+                try:
+                    self._watch_tree(path)
+                except OSError as e:
+                    logger.warning(f"No se pudo vigilar {path}, se reescanea por polling: {e}")
+                    self.on_rescan()
+                for current, _, files in os.walk(path):
+                    for file_name in files:
+                        self.on_change(Path(current) / file_name)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.on_delete(path)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self.on_change(path)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.on_delete(path)
+
+    def stop(self):
+        if self.fd is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self.fd)
+            except RuntimeError:
+                pass
+            os.close(self.fd)
+            self.fd = None
+        self.watches.clear()
+
+
+class CatalogWatcher:
+    """Mantiene actualizados los resultados de un directorio analizando solo lo nuevo o modificado
+
+    Al arrancar se reconcilia el índice con el disco (ficheros nuevos,
+    modificados o borrados mientras no se vigilaba). Después los cambios llegan
+    por inotify o, si no está disponible, por escaneos cada `poll_interval`.
+    Cada fichero cambiado espera `debounce` segundos sin cambios de firma antes
+    de encolarse, así que una copia en curso no se analiza a medias, y no se
+    encola si su firma (inodo, mtime, tamaño) coincide con la del índice.
+    """
+
+    def __init__(self,
+                 analyze: Callable[[Path], Awaitable[Dict[str, Any]]],
+                 directory: str,
+                 index_path: str,
+                 extensions: Iterable[str],
+                 backend: str = 'auto',
+                 debounce: float = 1.0,
+                 poll_interval: float = 5.0,
+                 concurrency: int = 4,
+                 on_result: Optional[ResultCallback] = None):
+        if backend not in WATCH_BACKENDS:
+            raise ValueError(f"Backend de watch no soportado: {backend} (disponibles: {', '.join(WATCH_BACKENDS)})")
+        self.analyze = analyze
+        self.root = Path(directory).resolve()
+        self.index = WatchResultsIndex(index_path)
+        self.extensions = list(extensions)
+        self.suffixes = {ext.lower() for ext in self.extensions}
+        self.requested_backend = backend
+        self.backend: Optional[str] = None
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.concurrency = max(1, concurrency)
+        self.on_result = on_result
+
+        # Ruta relativa -> (momento a partir del que encolar, firma vista al programarla)
+        self._pending: Dict[str, Tuple[float, Optional[StatSignature]]] = {}
+        self._queued: Set[str] = set()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._rescan_requested = False
+        self._inotify: Optional[InotifyBackend] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.stats = {'analyzed': 0, 'skipped_unchanged': 0, 'deleted': 0, 'failed': 0, 'rescans': 0}
+
+    def _relative(self, path: Path) -> Optional[str]:
+        try:
+            return path.resolve().relative_to(self.root).as_posix()
+        except ValueError:
+            return None
+
+    def _stat(self, relative: str) -> Optional[StatSignature]:
+        try:
+            return stat_signature((self.root / relative).stat())
+        except OSError:
+            return None
+
+    def _changed(self, path: Path):
+        """Un fichero se creó o modificó: se programa tras el debounce"""
+        if path.suffix.lower() not in self.suffixes:
+            return
+        relative = self._relative(path)
+        if relative is None:
+            return
+        self._pending[relative] = (time.monotonic() + self.debounce, self._stat(relative))
+        self._wakeup.set()
+
+    def _deleted(self, path: Path):
+        relative = self._relative(path)
+        if relative is None:
+            return
+        self._pending.pop(relative, None)
+        removed = self.index.delete(relative)
+        if removed:
+            self.stats['deleted'] += removed
+            logger.info(f"Watch: {removed} resultados eliminados por borrado de {relative}")
+
+    def _request_rescan(self):
+        self._rescan_requested = True
+        self._wakeup.set()
+
+    async def reconcile(self):
+        """Compara el disco con el índice: programa lo nuevo o modificado y olvida lo borrado"""
+
+        def scan() -> Tuple[Set[str], int]:
+            seen = set()
+            changed = 0
+            for path, relative in iter_image_files(self.root, self.extensions, recursive=True):
+                seen.add(relative)
+                signature = self._stat(relative)
+                if signature is not None and signature != self.index.signature(relative):
+                    changed += 1
+                    self._loop.call_soon_threadsafe(self._changed, path)
+            return seen, changed
+
+        seen, changed = await asyncio.to_thread(scan)
+        vanished = [path for path in self.index.paths() if path not in seen]
+        for relative in vanished:
+            self.index.delete(relative)
+        self.stats['deleted'] += len(vanished)
+        self.stats['rescans'] += 1
+        if changed or vanished:
+            logger.info(f"Watch: {changed} imágenes nuevas o modificadas, {len(vanished)} borradas")
+
+    async def _schedule(self):
+        """Encola los ficheros cuyo debounce venció y cuya firma ya no cambia"""
+        while not self._stopped.is_set():
+            if self._rescan_requested:
+                self._rescan_requested = False
+                await self.reconcile()
+
+            now = time.monotonic()
+            for relative, (deadline, seen_signature) in list(self._pending.items()):
+                if deadline > now:
+                    continue
+                signature = self._stat(relative)
+                if signature is None:
+                    del self._pending[relative]
+                elif signature != seen_signature:
+                    # Sigue escribiéndose: otro periodo de debounce
+                    self._pending[relative] = (now + self.debounce, signature)
+                else:
+                    del self._pending[relative]
+                    if signature == self.index.signature(relative):
+                        self.stats['skipped_unchanged'] += 1
+                    elif relative not in self._queued:
+                        self._queued.add(relative)
+                        self._queue.put_nowait(relative)
+
+            timeout = min((deadline for deadline, _ in self._pending.values()), default=now + 3600) - now
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0.01))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self):
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                self._request_rescan()
+
+    async def _work(self):
+        while True:
+            relative = await self._queue.get()
+            try:
+                signature = self._stat(relative)
+                if signature is None:
+                    continue
+                try:
+                    record = await self.analyze(self.root / relative)
+                except Exception as e:
+                    logger.warning(f"Watch: error analizando {relative}: {e}")
+                    record = {'success': False, 'error': str(e)}
+                    self.stats['failed'] += 1
+                record['image'] = relative
+                # Se guarda la firma anterior al análisis: un cambio durante el análisis se vuelve a detectar
+                self.index.upsert(relative, signature, record)
+                self.stats['analyzed'] += 1
+                await self._notify({'event': 'watch_result', **record})
+            finally:
+                self._queued.discard(relative)
+                self._queue.task_done()
+
+    async def _notify(self, event: Dict[str, Any]):
+        if self.on_result is None:
+            return
+        try:
+            outcome = self.on_result(event)
+            if asyncio.iscoroutine(outcome):
+                await outcome
+        except Exception as e:
+            logger.warning(f"Error notificando resultado de watch: {e}")
+
+    def _start_backend(self) -> str:
+        if self.requested_backend in ('auto', 'inotify'):
+            inotify = InotifyBackend(self.root, self._changed, self._deleted, self._request_rescan)
+            try:
+                inotify.start()
+                self._inotify = inotify
+                return 'inotify'
+            except (OSError, AttributeError) as e:
+                if self.requested_backend == 'inotify':
+                    raise
+                logger.warning(f"inotify no disponible, se usa polling cada {self.poll_interval}s: {e}")
+        return 'polling'
+
+    async def run(self):
+        """Vigila el directorio hasta que se llama a `stop()`"""
+        if not self.root.is_dir():
+            raise ValueError(f"Directorio no encontrado: {self.root}")
+        self._loop = asyncio.get_running_loop()
+
+        # Se vigila antes de reconciliar para no perder cambios durante el escaneo inicial
+        self.backend = self._start_backend()
+        logger.info(f"Vigilando {self.root} con {self.backend}")
+        tasks = [asyncio.create_task(self._schedule())]
+        tasks += [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        if self.backend == 'polling':
+            tasks.append(asyncio.create_task(self._poll()))
+        try:
+            await self.reconcile()
+            await self._stopped.wait()
+        finally:
+            if self._inotify is not None:
+                self._inotify.stop()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def idle(self, timeout: float = 30.0) -> bool:
+        """Espera a que no quede nada programado ni en análisis (útil en tests y scripts)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self._pending and not self._queued and not self._rescan_requested:
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'backend': self.backend,
+            'pending': len(self._pending),
+            'queued': len(self._queued),
+            'index': self.index.summary()
+        }
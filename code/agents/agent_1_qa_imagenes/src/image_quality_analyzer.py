@@ -6,18 +6,63 @@ Implementación de métricas de calidad usando OpenCV
 import cv2
 import numpy as np
 import asyncio
+import contextvars
+from contextlib import asynccontextmanager
 from typing import Dict, Any, List, Tuple, Optional
 from datetime import datetime
 from pathlib import Path
 import hashlib
 import json
-from dataclasses import dataclass, asdict
+from urllib.parse import urlparse
+from dataclasses import dataclass, asdict, fields, replace
 from loguru import logger
 
 from config import AgentConfig, QualityLevel, QualityThresholds, QualityWeights
 from quality_metrics import (
     BRISQUEMetric, SharpnessMetric, ExposureMetric, 
-    ResolutionMetric, AspectRatioMetric
+    ResolutionMetric, AspectRatioMetric, MetricResult, PreviewCalibration, TilingConfig
+)
+from analysis_executor import budget_reduction, create_executor, preview_reduction, read_image_size
+from nss_quality import NSSModel
+from perceptual_index import Fingerprint, PerceptualIndex, hamming, is_reusable
+from result_cache import ResultCache, StatSignature, hash_bytes, read_and_hash, stat_signature
+from url_fetcher import ImageFetcher, UrlCache
+
+# Se incrementa cuando cambia el cálculo de las métricas para invalidar resultados guardados
+RESULT_CACHE_VERSION = 2
+
+ANALYSIS_MODES = ('full', 'preview')
+
+DUPLICATE_POLICIES = ('off', 'index', 'reuse')
+
+# Scores a partir de los que cambia el nivel de calidad (ver _determine_quality_level)
+LEVEL_BOUNDARIES = (90, 75, 60, 40)
+
+
+class BatchOrder:
+    """Turnos de un lote: cada petición decide si es casi-duplicado después de las anteriores
+
+    La lectura y el fingerprint terminan en cualquier orden; sin turnos, la
+    imagen que se analiza y la que reutiliza su resultado dependerían de qué
+    hilo acabó antes.
+    """
+
+    def __init__(self, size: int):
+        self.passed = [asyncio.Event() for _ in range(size)]
+
+    async def wait(self, index: int):
+        if index > 0:
+            await self.passed[index - 1].wait()
+
+    async def release(self, index: int):
+        """Da paso a la siguiente petición aunque esta no haya llegado a su turno (cache, error)"""
+        await self.wait(index)
+        self.passed[index].set()
+
+
+# Turno de la petición en curso dentro de analyze_batch
+_batch_turn: contextvars.ContextVar[Optional[Tuple[BatchOrder, int]]] = contextvars.ContextVar(
+    "batch_turn", default=None
 )
 
 @dataclass
@@ -62,6 +107,28 @@ class QualityAnalysisResult:
     # Metadatos adicionales
     file_size: int
     image_format: str
+    analysis_mode: str = "full"  # "preview" si las métricas se calcularon sobre la imagen reducida
+    decode_reduction: int = 1  # factor de reducción al decodificar (preview o presupuesto tiled_max_pixels)
+    worst_region: Optional[Dict[str, Any]] = None  # zona menos nítida (solo en análisis por teselas)
+    duplicate_of: Optional[str] = None  # imagen casi idéntica cuyo análisis se reutilizó
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Representación serializable en JSON"""
+        data = asdict(self)
+        for key, value in data.items():
+            if isinstance(value, QualityLevel):
+                data[key] = value.value
+        data['analysis_timestamp'] = self.analysis_timestamp.isoformat()
+        return data
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QualityAnalysisResult":
+        data = dict(data)
+        data['analysis_timestamp'] = datetime.fromisoformat(data['analysis_timestamp'])
+        for f in fields(cls):
+            if f.type is QualityLevel:
+                data[f.name] = QualityLevel(data[f.name])
+        return cls(**data)
 
 @dataclass
 class QualityAnalysisRequest:
@@ -83,64 +150,175 @@ class ImageQualityAnalyzer:
         self.thresholds = config.quality_thresholds
         self.weights = config.quality_weights
         
+        # Correcciones de las métricas calculadas en modo preview
+        self.preview_calibration = (
+            PreviewCalibration.load(config.preview_calibration_path)
+            if config.preview_calibration_path else PreviewCalibration()
+        )
+        
+        # Análisis por teselas de imágenes grandes
+        self.tiling = TilingConfig(
+            tile_size=config.tile_size,
+            overlap=config.tile_overlap,
+            workers=config.tile_workers
+        )
+        
+        # Modelo de estadísticas naturales contra el que se puntúa BRISQUE/NIQE
+        self.nss_model = NSSModel.load(config.nss_model_path)
+        if config.nss_model_path is None:
+            logger.warning(
+                f"BRISQUE usa el modelo prístino genérico ({self.nss_model.source}); ajustar uno con "
+                "imágenes aprobadas del catálogo (--fit-nss-model) antes de usar sus scores para aceptar o rechazar"
+            )
+        
         # Inicializar métricas
         self.metrics = {
-            'brisque': BRISQUEMetric(self.thresholds),
-            'sharpness': SharpnessMetric(self.thresholds),
+            'brisque': BRISQUEMetric(self.thresholds, self.preview_calibration, self.nss_model),
+            'sharpness': SharpnessMetric(self.thresholds, self.preview_calibration),
             'exposure': ExposureMetric(self.thresholds),
             'resolution': ResolutionMetric(self.thresholds),
             'aspect_ratio': AspectRatioMetric(self.thresholds)
         }
         
-        # Cache de resultados
+        # Cache de resultados: en memoria por encima del persistente en SQLite
         self.analysis_cache: Dict[str, QualityAnalysisResult] = {}
         self.cache_max_size = 1000
+        self.result_cache = ResultCache(config.result_cache_path)
+        
+        # Índice de casi-duplicados (en memoria si la política por defecto lo desactiva);
+        # los análisis en curso se registran para no repetirlos dentro de un lote
+        index_path = config.duplicate_index_path if config.duplicate_policy != 'off' else None
+        self.duplicate_index = PerceptualIndex(index_path, config.duplicate_hash_radius)
+        self.pending_duplicates: Dict[Tuple[str, str], Tuple[Fingerprint, asyncio.Future]] = {}
+        
+        # Descargas por URL: conexiones reutilizadas, tamaño acotado y peticiones condicionales
+        self.url_fetcher = ImageFetcher(
+            max_bytes=config.max_image_size,
+            max_connections=config.url_max_connections,
+            max_per_host=config.url_max_connections_per_host,
+            timeout=config.analysis_timeout,
+            connect_timeout=config.url_connect_timeout,
+            cache=UrlCache(config.url_cache_dir, config.url_cache_max_bytes) if config.url_cache_dir else None
+        )
+        
+        # Decodificación y métricas en hilos o procesos para no bloquear el event loop
+        self.executor = create_executor(config.executor_backend, config.executor_workers)
         
         # Contadores de rendimiento
         self.analysis_count = 0
         self.total_processing_time = 0.0
+        self.cache_hits = 0
+        self.preview_analyses = 0
+        self.preview_escalations = 0
+        self.duplicate_reuses = 0
         
         logger.info(f"ImageQualityAnalyzer inicializado con configuración: {config.agent_id}")
 
     async def analyze_image(self, request: QualityAnalysisRequest) -> QualityAnalysisResult:
         """Analiza la calidad de una imagen"""
         start_time = datetime.now()
+        pending = None
         
         try:
             # Verificar parámetros
             if not any([request.image_path, request.image_data, request.image_url]):
                 raise ValueError("Debe proporcionar al menos una fuente de imagen")
             
-            # Cargar imagen
-            image, image_info = await self._load_image(request)
+            analysis_mode = request.analysis_options.get('analysis_mode', self.config.analysis_mode)
+            if analysis_mode not in ANALYSIS_MODES:
+                raise ValueError(f"Modo de análisis no soportado: {analysis_mode}")
+            duplicate_policy = request.analysis_options.get('duplicate_policy', self.config.duplicate_policy)
+            if duplicate_policy not in DUPLICATE_POLICIES:
+                raise ValueError(f"Política de duplicados no soportada: {duplicate_policy}")
+            options_key = self._get_cache_key(request.analysis_options, analysis_mode)
             
-            # Verificar cache
-            cache_key = self._get_cache_key(image_info, request.analysis_options)
-            if cache_key in self.analysis_cache:
-                logger.debug(f"Usando resultado en cache para {image_info['path']}")
-                return self.analysis_cache[cache_key]
+            # Fichero sin cambios desde el último análisis: se responde sin leerlo.
+            # Lecturas, hashes y consultas SQLite van a un hilo para no bloquear el event loop
+            signature = None
+            if request.image_path:
+                path, signature = self._stat_image(request.image_path)
+                content_hash = await asyncio.to_thread(
+                    self.result_cache.lookup_signature, str(path.resolve()), signature
+                )
+                if content_hash:
+                    cached = await self._get_cached_result(content_hash, options_key, str(path))
+                    if cached is not None:
+                        self.result_cache.stats["signature_hits"] += 1
+                        return self._serve_cached(cached, start_time)
             
-            # Ejecutar análisis
-            logger.info(f"Iniciando análisis de calidad para {image_info['path']}")
+            # Leer la imagen calculando el hash de su contenido
+            image_data, image_info, content_hash = await self._read_image(request)
+            if signature is not None:
+                await asyncio.to_thread(
+                    self.result_cache.record_signature, str(Path(image_info['path']).resolve()), signature, content_hash
+                )
             
-            # Análisis concurrente de métricas
-            metrics_tasks = {
-                'brisque': self.metrics['brisque'].calculate(image),
-                'sharpness': self.metrics['sharpness'].calculate(image),
-                'exposure': self.metrics['exposure'].calculate(image),
-                'resolution': self.metrics['resolution'].calculate(image_info),
-                'aspect_ratio': self.metrics['aspect_ratio'].calculate(image_info)
-            }
+            # Mismo contenido ya analizado (fichero renombrado, copiado o tocado)
+            cached = await self._get_cached_result(content_hash, options_key, image_info['path'])
+            if cached is not None:
+                self.result_cache.stats["content_hits"] += 1
+                return self._serve_cached(cached, start_time)
+            self.result_cache.stats["misses"] += 1
             
-            metrics_results = await asyncio.gather(*metrics_tasks.values())
+            # Casi-duplicado de una imagen ya analizada o en análisis: se reutiliza su resultado
+            fingerprint = None
+            if duplicate_policy != 'off':
+                fingerprint = await self.executor.fingerprint(image_data)
+            if fingerprint is not None and duplicate_policy == 'reuse':
+                # En un lote, la primera petición de un grupo de casi-duplicados es la que se analiza
+                async with self._batch_turn():
+                    duplicate = await self._find_indexed_duplicate(fingerprint, options_key)
+                    waiting = [] if duplicate is not None else self._pending_duplicates(fingerprint, options_key)
+                    if duplicate is None and not waiting:
+                        pending = self._register_pending(content_hash, options_key, fingerprint)
+                for future in waiting:
+                    duplicate = await asyncio.shield(future)
+                    if duplicate is not None:
+                        break
+                if duplicate is not None:
+                    result = self._reuse_duplicate(duplicate, image_info, content_hash, start_time)
+                    await self._update_cache(content_hash, options_key, result)
+                    self._index_fingerprint(content_hash, fingerprint, image_info['path'])
+                    return result
+                if pending is None:
+                    pending = self._register_pending(content_hash, options_key, fingerprint)
+            
+            # Decodificar y calcular métricas fuera del event loop
+            logger.info(f"Iniciando análisis de calidad para {image_info['path']}")
+            original_size = read_image_size(image_data)
+            tiling, min_reduction = self._plan_tiling(original_size)
+            reduction = min_reduction
+            if analysis_mode == 'preview' and original_size:
+                reduction = max(reduction, preview_reduction(original_size, self.config.preview_max_side))
+            metrics_results, dimensions = await self.executor.analyze(
+                image_data, self.metrics, reduction, original_size, tiling
+            )
+            
+            # Preview cerca de un umbral de nivel: se confirma a la mayor resolución permitida
+            if reduction > min_reduction:
+                self.preview_analyses += 1
+                if self._near_level_boundary(self._weighted_score(metrics_results)):
+                    logger.debug(f"Preview dudoso, escalando a análisis completo: {image_info['path']}")
+                    self.preview_escalations += 1
+                    reduction = min_reduction
+                    metrics_results, dimensions = await self.executor.analyze(
+                        image_data, self.metrics, reduction, original_size, tiling
+                    )
+            image_info.update(dimensions)
             
             # Compilar resultados
             result = self._compile_results(
-                image_info, metrics_results, request.analysis_options, start_time
+                image_info, content_hash, metrics_results, request.analysis_options, start_time,
+                analysis_mode='preview' if reduction > min_reduction else 'full',
+                decode_reduction=reduction
             )
             
             # Actualizar cache
-            self._update_cache(cache_key, result)
+            await self._update_cache(content_hash, options_key, result)
+            if fingerprint is not None:
+                self._index_fingerprint(content_hash, fingerprint, image_info['path'])
+            if pending is not None:
+                pending.set_result(result)
             
             # Actualizar estadísticas
             processing_time = (datetime.now() - start_time).total_seconds()
@@ -153,35 +331,64 @@ class ImageQualityAnalyzer:
         except Exception as e:
             logger.error(f"Error durante análisis de imagen: {e}")
             raise
+        finally:
+            if pending is not None and not pending.done():
+                # Los casi-duplicados que esperaban se analizan por su cuenta
+                pending.set_result(None)
 
     async def analyze_batch(self, requests: List[QualityAnalysisRequest]) -> List[QualityAnalysisResult]:
-        """Analiza múltiples imágenes en lote"""
+        """Analiza múltiples imágenes en lote
+
+        Los casi-duplicados del lote esperan al análisis del primero y reutilizan
+        su resultado (según `duplicate_policy`).
+        """
         logger.info(f"Iniciando análisis por lotes de {len(requests)} imágenes")
         
-        # Limitar concurrencia
-        semaphore = asyncio.Semaphore(self.config.max_concurrent_analyses)
+        # Limitar concurrencia (al menos tantos análisis como trabajadores del executor)
+        semaphore = asyncio.Semaphore(max(self.config.max_concurrent_analyses, self.executor.concurrency))
         
-        async def analyze_with_semaphore(request):
-            async with semaphore:
-                return await self.analyze_image(request)
+        order = BatchOrder(len(requests))
+        
+        async def analyze_with_semaphore(index, request):
+            _batch_turn.set((order, index))
+            try:
+                async with semaphore:
+                    return await self.analyze_image(request)
+            finally:
+                await order.release(index)
         
         # Ejecutar análisis con límite de concurrencia
         results = await asyncio.gather(*[
-            analyze_with_semaphore(req) for req in requests
+            analyze_with_semaphore(index, req) for index, req in enumerate(requests)
         ])
         
-        logger.info(f"Análisis por lotes completado - {len(results)} imágenes procesadas")
+        reused = sum(1 for result in results if result.duplicate_of)
+        logger.info(f"Análisis por lotes completado - {len(results)} imágenes procesadas "
+                    f"({reused} casi-duplicados reutilizados)")
         return results
 
-    async def _load_image(self, request: QualityAnalysisRequest) -> Tuple[np.ndarray, Dict[str, Any]]:
-        """Carga imagen desde diferentes fuentes"""
+    def _stat_image(self, image_path: str) -> Tuple[Path, StatSignature]:
+        """Comprueba que el fichero existe y cabe en el límite; devuelve su firma"""
+        path = Path(image_path)
+        
+        if not path.exists():
+            raise FileNotFoundError(f"Archivo no encontrado: {image_path}")
+        
+        stat = path.stat()
+        if stat.st_size > self.config.max_image_size:
+            raise ValueError(f"Imagen demasiado grande: {stat.st_size} bytes")
+        
+        return path, stat_signature(stat)
+
+    async def _read_image(self, request: QualityAnalysisRequest) -> Tuple[bytes, Dict[str, Any], str]:
+        """Lee los bytes de la imagen desde diferentes fuentes junto con su hash de contenido"""
         try:
             if request.image_path:
-                return await self._load_image_from_path(request.image_path)
+                return await self._read_image_from_path(request.image_path)
             elif request.image_data:
-                return await self._load_image_from_data(request.image_data)
+                return await self._read_image_from_data(request.image_data)
             elif request.image_url:
-                return await self._load_image_from_url(request.image_url)
+                return await self._read_image_from_url(request.image_url)
             else:
                 raise ValueError("Fuente de imagen no soportada")
                 
@@ -189,120 +396,227 @@ class ImageQualityAnalyzer:
             logger.error(f"Error cargando imagen: {e}")
             raise
 
-    async def _load_image_from_path(self, image_path: str) -> Tuple[np.ndarray, Dict[str, Any]]:
-        """Carga imagen desde archivo"""
-        path = Path(image_path)
-        
-        if not path.exists():
-            raise FileNotFoundError(f"Archivo no encontrado: {image_path}")
+    async def _read_image_from_path(self, image_path: str) -> Tuple[bytes, Dict[str, Any], str]:
+        """Lee imagen desde archivo en una sola pasada (hash y bytes a la vez)"""
+        path, _ = self._stat_image(image_path)
+        image_data, content_hash = await asyncio.to_thread(read_and_hash, path)
         
-        # Verificar tamaño
-        file_size = path.stat().st_size
-        if file_size > self.config.max_image_size:
-            raise ValueError(f"Imagen demasiado grande: {file_size} bytes")
-        
-        # Cargar con OpenCV
-        image = cv2.imread(str(path))
-        if image is None:
-            raise ValueError(f"No se pudo cargar la imagen: {image_path}")
-        
-        # Información de la imagen
+        # Información de la imagen (las dimensiones se completan al decodificar)
         image_info = {
             'path': str(path),
             'filename': path.name,
-            'width': image.shape[1],
-            'height': image.shape[0],
-            'channels': image.shape[2] if len(image.shape) > 2 else 1,
-            'file_size': file_size,
+            'file_size': len(image_data),
             'format': path.suffix.lower()
         }
         
-        return image, image_info
+        return image_data, image_info, content_hash
 
-    async def _load_image_from_data(self, image_data: bytes) -> Tuple[np.ndarray, Dict[str, Any]]:
-        """Carga imagen desde datos en memoria"""
+    async def _read_image_from_data(self, image_data: bytes) -> Tuple[bytes, Dict[str, Any], str]:
+        """Prepara imagen desde datos en memoria"""
         # Verificar tamaño
         if len(image_data) > self.config.max_image_size:
             raise ValueError(f"Imagen demasiado grande: {len(image_data)} bytes")
         
-        # Convertir bytes a numpy array
-        nparr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if image is None:
-            raise ValueError("No se pudo decodificar la imagen")
-        
         # Información básica
         image_info = {
             'path': '<memory>',
             'filename': 'image_data',
-            'width': image.shape[1],
-            'height': image.shape[0],
-            'channels': image.shape[2] if len(image.shape) > 2 else 1,
             'file_size': len(image_data),
             'format': 'unknown'
         }
         
-        return image, image_info
+        return image_data, image_info, await asyncio.to_thread(hash_bytes, image_data)
 
-    async def _load_image_from_url(self, image_url: str) -> Tuple[np.ndarray, Dict[str, Any]]:
-        """Carga imagen desde URL"""
+    async def _read_image_from_url(self, image_url: str) -> Tuple[bytes, Dict[str, Any], str]:
+        """Descarga imagen desde URL (el hash se calcula mientras se descarga)"""
         try:
-            import aiohttp
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(image_url) as response:
-                    if response.status != 200:
-                        raise ValueError(f"Error HTTP {response.status} al descargar imagen")
-                    
-                    image_data = await response.read()
-                    return await self._load_image_from_data(image_data)
-                    
-        except ImportError:
-            raise ImportError("aiohttp requerido para cargar imágenes desde URL")
+            fetched = await self.url_fetcher.fetch(image_url)
         except Exception as e:
             logger.error(f"Error cargando imagen desde URL {image_url}: {e}")
             raise
+        
+        name = Path(urlparse(image_url).path).name
+        image_info = {
+            'path': image_url,
+            'filename': name or 'image_url',
+            'file_size': len(fetched.data),
+            'format': Path(name).suffix.lower() or 'unknown'
+        }
+        return fetched.data, image_info, fetched.content_hash
+
+    def _plan_tiling(self, original_size: Optional[Tuple[int, int]]) -> Tuple[Optional[TilingConfig], int]:
+        """Teselado y reducción mínima de decodificación según el tamaño leído de la cabecera
 
-    def _get_cache_key(self, image_info: Dict[str, Any], analysis_options: Dict[str, Any]) -> str:
-        """Genera clave de cache basada en información de imagen y opciones"""
-        # Usar path, tamaño y opciones de análisis para el cache
+        Las imágenes grandes se analizan por teselas y, si ni en grises caben en
+        `tiled_max_pixels`, se decodifican reducidas como en el modo preview.
+        """
+        min_pixels = self.config.tiled_min_pixels
+        if original_size is None or min_pixels is None or original_size[0] * original_size[1] < min_pixels:
+            return None, 1
+        return self.tiling, budget_reduction(original_size, self.config.tiled_max_pixels)
+
+    def _near_level_boundary(self, score: float) -> bool:
+        margin = self.config.preview_escalation_margin
+        return any(abs(score - boundary) < margin for boundary in LEVEL_BOUNDARIES)
+
+    def _get_cache_key(self, analysis_options: Dict[str, Any], analysis_mode: str = 'full') -> str:
+        """Clave de opciones y configuración; junto al hash de contenido identifica un resultado"""
+        # Umbrales y pesos forman parte de la clave porque el cache sobrevive a reinicios.
+        # El modo va aparte: pedirlo explícitamente o por configuración da el mismo resultado
         cache_data = {
-            'path': image_info.get('path', ''),
-            'file_size': image_info.get('file_size', 0),
-            'options': analysis_options
+            'version': RESULT_CACHE_VERSION,
+            'mode': analysis_mode,
+            'options': {k: v for k, v in analysis_options.items() if k != 'analysis_mode'},
+            'thresholds': asdict(self.thresholds),
+            'weights': asdict(self.weights),
+            'nss_model': self.nss_model.fingerprint,
+            'tiling': [self.config.tiled_min_pixels, self.config.tiled_max_pixels, self.config.tile_size]
         }
         
-        cache_string = json.dumps(cache_data, sort_keys=True)
+        cache_string = json.dumps(cache_data, sort_keys=True, default=str)
         return hashlib.md5(cache_string.encode()).hexdigest()
 
-    def _update_cache(self, cache_key: str, result: QualityAnalysisResult):
-        """Actualiza cache de resultados"""
+    def metric_options_key(self) -> str:
+        """Clave de los análisis completos con opciones por defecto: los que alimentan la calibración"""
+        return self._get_cache_key({}, 'full')
+
+    async def _load_cached_result(self, content_hash: str, options_key: str) -> Optional[QualityAnalysisResult]:
+        """Busca un resultado en memoria y, si no está, en el cache persistente"""
+        memory_key = f"{content_hash}:{options_key}"
+        result = self.analysis_cache.get(memory_key)
+        
+        if result is None:
+            stored = await asyncio.to_thread(self.result_cache.get, content_hash, options_key)
+            if stored is None:
+                return None
+            result = QualityAnalysisResult.from_dict(stored)
+            self._remember(memory_key, result)
+        return result
+
+    async def _get_cached_result(self, content_hash: str, options_key: str,
+                                 image_path: str) -> Optional[QualityAnalysisResult]:
+        result = await self._load_cached_result(content_hash, options_key)
+        if result is None:
+            return None
+        
+        # El mismo contenido puede llegar con otra ruta (renombrado o copiado)
+        if result.image_path != image_path:
+            result = replace(result, image_path=image_path)
+        return result
+
+    @asynccontextmanager
+    async def _batch_turn(self):
+        """Espera el turno de la petición dentro de su lote (sin lote no espera)"""
+        turn = _batch_turn.get()
+        if turn is None:
+            yield
+            return
+        order, index = turn
+        await order.wait(index)
+        try:
+            yield
+        finally:
+            order.passed[index].set()
+
+    async def _find_indexed_duplicate(self, fingerprint: Fingerprint,
+                                      options_key: str) -> Optional[QualityAnalysisResult]:
+        """Resultado reutilizable de un casi-duplicado indexado con resultado en cache"""
+        tolerance = self.config.duplicate_detail_tolerance
+        index = self.duplicate_index
+        for entry_id in index.near_duplicates(fingerprint):
+            if not is_reusable(fingerprint, index.fingerprint(entry_id), tolerance):
+                continue
+            result = await self._load_cached_result(index.content_hashes[entry_id], options_key)
+            if result is not None:
+                return result
+        return None
+
+    def _pending_duplicates(self, fingerprint: Fingerprint, options_key: str) -> List[asyncio.Future]:
+        """Análisis en curso de casi-duplicados cuyo resultado se podrá reutilizar"""
+        tolerance = self.config.duplicate_detail_tolerance
+        radius = self.duplicate_index.radius
+        return [
+            future for (_, pending_key), (other, future) in self.pending_duplicates.items()
+            if (pending_key == options_key
+                and hamming(fingerprint.phash, other.phash) <= radius
+                and hamming(fingerprint.dhash, other.dhash) <= radius
+                and is_reusable(fingerprint, other, tolerance))
+        ]
+
+    def _register_pending(self, content_hash: str, options_key: str, fingerprint: Fingerprint) -> asyncio.Future:
+        """Anuncia un análisis en curso; se retira del registro al resolverse"""
+        key = (content_hash, options_key)
+        future = asyncio.get_running_loop().create_future()
+        self.pending_duplicates[key] = (fingerprint, future)
+        future.add_done_callback(lambda _: self.pending_duplicates.pop(key, None))
+        return future
+
+    def _reuse_duplicate(self, duplicate: QualityAnalysisResult, image_info: Dict[str, Any],
+                         content_hash: str, start_time: datetime) -> QualityAnalysisResult:
+        logger.debug(f"{image_info['path']} es casi idéntica a {duplicate.image_path}, se reutiliza su análisis")
+        self.duplicate_reuses += 1
+        processing_time = (datetime.now() - start_time).total_seconds()
+        self._update_performance_stats(processing_time)
+        return replace(
+            duplicate,
+            image_path=image_info['path'],
+            image_hash=content_hash,
+            analysis_timestamp=datetime.now(),
+            processing_time=processing_time,
+            file_size=image_info['file_size'],
+            image_format=image_info['format'],
+            duplicate_of=duplicate.duplicate_of or duplicate.image_path
+        )
+
+    def _index_fingerprint(self, content_hash: str, fingerprint: Fingerprint, image_path: str):
+        try:
+            self.duplicate_index.add(content_hash, fingerprint, image_path)
+        except Exception as e:
+            # El análisis es válido aunque no se pueda indexar
+            logger.warning(f"No se pudo actualizar el índice de duplicados: {e}")
+
+    def get_duplicate_clusters(self, min_size: int = 2, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Grupos de imágenes casi idénticas vistas por el analizador"""
+        return self.duplicate_index.clusters(min_size, limit)
+
+    def _serve_cached(self, result: QualityAnalysisResult, start_time: datetime) -> QualityAnalysisResult:
+        logger.debug(f"Usando resultado en cache para {result.image_path}")
+        self.cache_hits += 1
+        self._update_performance_stats((datetime.now() - start_time).total_seconds())
+        return result
+
+    def _remember(self, memory_key: str, result: QualityAnalysisResult):
+        """Guarda un resultado en el cache en memoria"""
         if len(self.analysis_cache) >= self.cache_max_size:
             # Eliminar entrada más antigua
             oldest_key = next(iter(self.analysis_cache))
             del self.analysis_cache[oldest_key]
         
-        self.analysis_cache[cache_key] = result
+        self.analysis_cache[memory_key] = result
+
+    async def _update_cache(self, content_hash: str, options_key: str, result: QualityAnalysisResult):
+        """Actualiza cache de resultados en memoria y en disco"""
+        self._remember(f"{content_hash}:{options_key}", result)
+        try:
+            await asyncio.to_thread(self.result_cache.put, content_hash, options_key, result.to_dict())
+        except Exception as e:
+            # El análisis es válido aunque no se pueda persistir
+            logger.warning(f"No se pudo guardar el resultado en el cache persistente: {e}")
 
     def _compile_results(self, 
                         image_info: Dict[str, Any], 
-                        metrics_results: List[Any],
+                        content_hash: str,
+                        metrics_results: List[MetricResult],
                         analysis_options: Dict[str, Any],
-                        start_time: datetime) -> QualityAnalysisResult:
+                        start_time: datetime,
+                        analysis_mode: str = 'full', decode_reduction: int = 1) -> QualityAnalysisResult:
         """Compila resultados de métricas en resultado final"""
         
         # Extraer resultados de métricas
         brisque_result, sharpness_result, exposure_result, resolution_result, aspect_ratio_result = metrics_results
         
         # Calcular score final ponderado
-        overall_score = (
-            brisque_result['score'] * self.weights.brisque_weight +
-            sharpness_result['score'] * self.weights.sharpness_weight +
-            exposure_result['score'] * self.weights.exposure_weight +
-            resolution_result['score'] * self.weights.resolution_weight +
-            aspect_ratio_result['score'] * self.weights.aspect_ratio_weight
-        )
+        overall_score = self._weighted_score(metrics_results)
         
         # Determinar nivel de calidad general
         overall_level = self._determine_quality_level(overall_score)
@@ -316,35 +630,35 @@ class ImageQualityAnalyzer:
         # Crear resultado final
         result = QualityAnalysisResult(
             image_path=image_info['path'],
-            image_hash=hashlib.md5(str(image_info).encode()).hexdigest(),
+            image_hash=content_hash,
             analysis_timestamp=datetime.now(),
             processing_time=(datetime.now() - start_time).total_seconds(),
             
             # BRISQUE
-            brisque_score=brisque_result['value'],
-            brisque_quality_level=brisque_result['level'],
+            brisque_score=brisque_result.value,
+            brisque_quality_level=brisque_result.level,
             
             # Sharpness
-            sharpness_variance=sharpness_result['variance'],
-            sharpness_score=sharpness_result['score'],
-            sharpness_level=sharpness_result['level'],
+            sharpness_variance=sharpness_result.value,
+            sharpness_score=sharpness_result.score,
+            sharpness_level=sharpness_result.level,
             
             # Exposure
-            exposure_histogram=exposure_result['histogram'],
-            exposure_balance_score=exposure_result['balance_score'],
-            exposure_level=exposure_result['level'],
+            exposure_histogram=exposure_result.metadata['histogram'],
+            exposure_balance_score=exposure_result.value,
+            exposure_level=exposure_result.level,
             
             # Resolution
             width=image_info['width'],
             height=image_info['height'],
             total_pixels=image_info['width'] * image_info['height'],
-            resolution_score=resolution_result['score'],
-            resolution_level=resolution_result['level'],
+            resolution_score=resolution_result.score,
+            resolution_level=resolution_result.level,
             
             # Aspect Ratio
-            aspect_ratio=aspect_ratio_result['aspect_ratio'],
-            aspect_ratio_score=aspect_ratio_result['score'],
-            aspect_ratio_level=aspect_ratio_result['level'],
+            aspect_ratio=aspect_ratio_result.value,
+            aspect_ratio_score=aspect_ratio_result.score,
+            aspect_ratio_level=aspect_ratio_result.level,
             
             # Score final
             overall_score=overall_score,
@@ -356,11 +670,25 @@ class ImageQualityAnalyzer:
             
             # Metadatos
             file_size=image_info['file_size'],
-            image_format=image_info['format']
+            image_format=image_info['format'],
+            analysis_mode=analysis_mode,
+            decode_reduction=decode_reduction,
+            worst_region=sharpness_result.metadata.get('worst_region')
         )
         
         return result
 
+    def _weighted_score(self, metrics_results: List[MetricResult]) -> float:
+        """Score final ponderado (0-100)"""
+        brisque_result, sharpness_result, exposure_result, resolution_result, aspect_ratio_result = metrics_results
+        return (
+            brisque_result.score * self.weights.brisque_weight +
+            sharpness_result.score * self.weights.sharpness_weight +
+            exposure_result.score * self.weights.exposure_weight +
+            resolution_result.score * self.weights.resolution_weight +
+            aspect_ratio_result.score * self.weights.aspect_ratio_weight
+        )
+
     def _determine_quality_level(self, score: float) -> QualityLevel:
         """Determina nivel de calidad basado en score"""
         if score >= 90:
@@ -374,20 +702,20 @@ class ImageQualityAnalyzer:
         else:
             return QualityLevel.REJECTED
 
-    def _collect_issues_and_recommendations(self, metrics_results: List[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+    def _collect_issues_and_recommendations(self, metrics_results: List[MetricResult]) -> Tuple[List[str], List[str]]:
         """Recopila problemas detectados y recomendaciones"""
         issues = []
         recommendations = []
         
         for metric_result in metrics_results:
-            metric_name = metric_result.get('metric_name', 'unknown')
+            metric_name = metric_result.metric_name
             
             # Recopilar problemas
-            for issue in metric_result.get('issues', []):
+            for issue in metric_result.issues:
                 issues.append(f"{metric_name}: {issue}")
             
             # Recopilar recomendaciones
-            for recommendation in metric_result.get('recommendations', []):
+            for recommendation in metric_result.recommendations:
                 recommendations.append(recommendation)
         
         # Recomendaciones generales basadas en problemas
@@ -416,12 +744,26 @@ class ImageQualityAnalyzer:
             'average_processing_time': avg_time,
             'total_processing_time': self.total_processing_time,
             'cache_size': len(self.analysis_cache),
-            'cache_hit_rate': 0.0  # Se podría implementar tracking de hits
+            'cache_hit_rate': self.cache_hits / max(self.analysis_count, 1),
+            'preview_analyses': self.preview_analyses,
+            'preview_escalation_rate': self.preview_escalations / max(self.preview_analyses, 1),
+            'duplicate_reuses': self.duplicate_reuses,
+            'duplicate_index': self.duplicate_index.get_stats(),
+            'url_fetcher': self.url_fetcher.get_stats(),
+            'result_cache': self.result_cache.get_stats()
         }
 
+    async def shutdown(self):
+        """Libera el pool de análisis, la sesión HTTP, el cache persistente y el índice de duplicados"""
+        self.executor.shutdown()
+        await self.url_fetcher.aclose()
+        self.result_cache.close()
+        self.duplicate_index.close()
+
     def clear_cache(self):
         """Limpia el cache de análisis"""
         self.analysis_cache.clear()
+        self.result_cache.clear()
         logger.info("Cache de análisis limpiado")
 
     async def health_check(self) -> Dict[str, Any]:
@@ -431,6 +773,7 @@ class ImageQualityAnalyzer:
             'agent_id': self.config.agent_id,
             'version': '1.0.0',
             'metrics_available': list(self.metrics.keys()),
+            'executor_backend': self.executor.backend,
             'performance_stats': self.get_performance_stats(),
             'cache_size': len(self.analysis_cache),
             'configuration': {
@@ -0,0 +1,152 @@
+"""
+Matriz persistente de métricas por imagen
+Valores de cada análisis en columnas NumPy (.npz), construida de forma incremental desde el cache de resultados
+"""
+
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from loguru import logger
+
+from result_cache import ResultCache
+
+# Columna de la matriz -> campo del resultado (QualityAnalysisResult.to_dict)
+METRIC_FIELDS = {
+    'brisque': 'brisque_score',  # valor BRISQUE (menor es mejor)
+    'sharpness_variance': 'sharpness_variance',
+    'exposure_score': 'exposure_balance_score',
+    'width': 'width',
+    'height': 'height',
+    'aspect_ratio_score': 'aspect_ratio_score',
+    'overall_score': 'overall_score'
+}
+KEY_FIELD = 'image_path'
+
+
+class MetricMatrix:
+    """Una fila por imagen (hash de contenido) y una columna float64 por métrica
+
+    Se guarda como .npz sin pickle: `content_hash` y `path` como bytes de
+    ancho fijo y cada métrica en su propio array, de modo que cargar 100k
+    imágenes es leer unos pocos MB y calibrar no requiere decodificar
+    ninguna imagen ni ningún JSON.
+    """
+
+    def __init__(self, content_hashes: np.ndarray, paths: np.ndarray, columns: Dict[str, np.ndarray],
+                 updated_at: float = 0.0, options_key: str = ""):
+        self.content_hashes = content_hashes
+        self.paths = paths
+        self.columns = columns
+        self.updated_at = updated_at  # created_at más reciente del cache incluido en la matriz
+        self.options_key = options_key  # clave de opciones de los resultados incluidos
+
+    @classmethod
+    def empty(cls, options_key: str = "") -> "MetricMatrix":
+        return cls(np.empty(0, dtype="S32"), np.empty(0, dtype="S1"),
+                   {name: np.empty(0) for name in METRIC_FIELDS}, options_key=options_key)
+
+    def __len__(self) -> int:
+        return len(self.content_hashes)
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.columns[column]
+
+    def subset(self, rows: np.ndarray) -> "MetricMatrix":
+        """Filas seleccionadas por índices o máscara booleana"""
+        return MetricMatrix(self.content_hashes[rows], self.paths[rows],
+                            {name: values[rows] for name, values in self.columns.items()},
+                            self.updated_at, self.options_key)
+
+    def merge(self, other: "MetricMatrix") -> "MetricMatrix":
+        """Une dos matrices; para un mismo hash queda la fila de `other`"""
+        hashes = np.concatenate([self.content_hashes, other.content_hashes])
+        # np.unique devuelve la primera aparición: se busca sobre el orden inverso para quedarse con la última
+        _, reversed_index = np.unique(hashes[::-1], return_index=True)
+        keep = np.sort(len(hashes) - 1 - reversed_index)
+        return MetricMatrix(
+            hashes[keep],
+            np.concatenate([self.paths, other.paths])[keep],
+            {name: np.concatenate([self.columns[name], other.columns[name]])[keep] for name in self.columns},
+            max(self.updated_at, other.updated_at),
+            self.options_key
+        )
+
+    def rows_for(self, keys: Iterable[str]) -> np.ndarray:
+        """Fila de cada clave (hash de contenido o ruta), -1 si no está en la matriz"""
+        encoded = np.array([key.encode() for key in keys], dtype=bytes)
+        rows = np.full(len(encoded), -1, dtype=np.int64)
+        if not len(encoded) or not len(self):
+            return rows
+        for column in (self.paths, self.content_hashes):
+            order = np.argsort(column, kind="stable")
+            ordered = column[order]
+            positions = np.minimum(np.searchsorted(ordered, encoded), len(ordered) - 1)
+            found = (ordered[positions] == encoded) & (rows < 0)
+            rows[found] = order[positions[found]]
+        return rows
+
+    def save(self, path: str):
+        """Escritura atómica: una matriz a medio escribir nunca sustituye a la anterior"""
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(target.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, content_hash=self.content_hashes, path=self.paths,
+                     updated_at=np.float64(self.updated_at), options_key=np.str_(self.options_key),
+                     **self.columns)
+        os.replace(tmp_path, target)
+
+    @classmethod
+    def load(cls, path: str) -> "MetricMatrix":
+        with np.load(path, allow_pickle=False) as data:
+            if set(METRIC_FIELDS) - set(data.files):
+                raise ValueError(f"Matriz de métricas sin las columnas esperadas: {path}")
+            options_key = str(data["options_key"]) if "options_key" in data.files else ""
+            return cls(data["content_hash"], data["path"],
+                       {name: data[name] for name in METRIC_FIELDS}, float(data["updated_at"]), options_key)
+
+
+def refresh_metric_matrix(result_cache: ResultCache, options_key: str,
+                          path: Optional[str] = None) -> MetricMatrix:
+    """Añade a la matriz los análisis de `options_key` guardados en el cache desde su última actualización
+
+    Una matriz guardada con otra clave (umbrales, modo o versión de las
+    métricas distintos) se descarta y se reconstruye. Sin `path` la matriz se
+    construye entera en memoria cada vez.
+    """
+    matrix = MetricMatrix.empty(options_key)
+    if path and Path(path).exists():
+        try:
+            stored = MetricMatrix.load(path)
+            if stored.options_key == options_key:
+                matrix = stored
+            else:
+                logger.info("Matriz de métricas de otra configuración de análisis, se reconstruye")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Matriz de métricas ilegible, se reconstruye: {e}")
+
+    fields = [KEY_FIELD, *METRIC_FIELDS.values()]
+    added = 0
+    for rows in result_cache.iter_fields(fields, options_key, created_after=matrix.updated_at):
+        # Filas (hash, created_at, ruta, *métricas); resultados antiguos sin alguna métrica se descartan
+        rows = [row for row in rows if None not in row[3:]]
+        if not rows:
+            continue
+        hashes, created_at, paths, *values = zip(*rows)
+        batch = MetricMatrix(
+            np.array([h.encode() for h in hashes], dtype="S32"),
+            np.array([(p or "").encode() for p in paths], dtype=bytes),
+            {name: np.array(column, dtype=np.float64) for name, column in zip(METRIC_FIELDS, values)},
+            max(created_at),
+            options_key
+        )
+        matrix = matrix.merge(batch)
+        added += len(batch)
+
+    if added:
+        logger.info(f"Matriz de métricas actualizada: {added} análisis nuevos, {len(matrix)} imágenes")
+        if path:
+            matrix.save(path)
+    return matrix
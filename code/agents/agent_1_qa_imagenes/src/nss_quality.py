@@ -0,0 +1,297 @@
+"""
+Estadísticas de escenas naturales (NSS) para BRISQUE/NIQE
+Coeficientes MSCN, ajuste vectorizado de GGD/AGGD por tablas y modelo prístino gaussiano multivariante
+"""
+
+import hashlib
+import json
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# Ventana gaussiana de BRISQUE (7x7, sigma 7/6) aplicada como filtro separable
+GAUSSIAN_KERNEL = cv2.getGaussianKernel(7, 7 / 6, cv2.CV_32F)
+MSCN_C = 1.0  # estabilizador para luminancia en 0-255
+
+# Productos de coeficientes vecinos: horizontal, vertical y las dos diagonales
+PAIRWISE_SHIFTS = ("horizontal", "vertical", "diagonal", "antidiagonal")
+FEATURES_PER_SCALE = 2 + 4 * len(PAIRWISE_SHIFTS)  # GGD (alfa, sigma²) + AGGD (alfa, eta, sigma_l², sigma_r²)
+NUM_SCALES = 2
+NUM_FEATURES = FEATURES_PER_SCALE * NUM_SCALES  # los 36 descriptores de BRISQUE/NIQE
+
+# rho(alfa) = Γ(2/α)² / (Γ(1/α)·Γ(3/α)) es creciente en alfa: invertirla es una interpolación en tabla
+ALPHA_GRID = np.arange(0.2, 10.0, 0.001)
+_lgamma = np.vectorize(math.lgamma)
+RHO_TABLE = np.exp(2 * _lgamma(2 / ALPHA_GRID) - _lgamma(1 / ALPHA_GRID) - _lgamma(3 / ALPHA_GRID))
+
+DEFAULT_MODEL_PATH = Path(__file__).resolve().parent.parent / "models" / "nss_pristine.json"
+
+
+def mscn_coefficients(stack: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Coeficientes MSCN y desviación local de una pila de imágenes en grises (N, H, W)"""
+    mscn, sigma = _mscn_channels(_to_channels(stack))
+    return mscn.transpose(2, 0, 1), sigma.transpose(2, 0, 1)
+
+
+def _to_channels(stack: np.ndarray) -> np.ndarray:
+    """(N, H, W) o (H, W) -> (H, W, N) float32 contiguo"""
+    stack = np.asarray(stack, dtype=np.float32)
+    if stack.ndim == 2:
+        stack = stack[None]
+    return np.ascontiguousarray(stack.transpose(1, 2, 0))
+
+
+def _mscn_channels(channels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """MSCN sobre (H, W, N): la pila se filtra como una imagen de N canales en una sola llamada"""
+    shape = channels.shape  # OpenCV devuelve 2D cuando N == 1
+    mu = cv2.sepFilter2D(channels, -1, GAUSSIAN_KERNEL, GAUSSIAN_KERNEL,
+                         borderType=cv2.BORDER_REPLICATE).reshape(shape)
+    mu_sq = cv2.sepFilter2D(channels * channels, -1, GAUSSIAN_KERNEL, GAUSSIAN_KERNEL,
+                            borderType=cv2.BORDER_REPLICATE).reshape(shape)
+    sigma = np.sqrt(np.abs(mu_sq - mu * mu))
+    return (channels - mu) / (sigma + MSCN_C), sigma
+
+
+def _pairwise_products(mscn: np.ndarray, height: int, width: int) -> List[np.ndarray]:
+    """Productos con el vecino en cada orientación, ya recortados a (height, width) y contiguos"""
+    core = mscn[:height, :width]
+    return [
+        core * mscn[:height, 1:width + 1],
+        core * mscn[1:height + 1, :width],
+        core * mscn[1:height + 1, 1:width + 1],
+        mscn[:height, 1:width + 1] * mscn[1:height + 1, :width]
+    ]
+
+
+def _block_mean(x: np.ndarray, grid: Tuple[int, int], block: Tuple[int, int]) -> np.ndarray:
+    """Media por bloque de (H, W, N) -> (N, bloques)
+
+    Con factores enteros INTER_AREA promedia exactamente cada bloque, y lo hace
+    para todos los canales a la vez con las rutinas vectorizadas de OpenCV.
+    """
+    rows, cols = grid
+    means = cv2.resize(np.ascontiguousarray(x[:rows * block[0], :cols * block[1]]), (cols, rows),
+                       interpolation=cv2.INTER_AREA)
+    return means.reshape(rows * cols, -1).T
+
+
+def fit_ggd(mean_abs: np.ndarray, mean_sq: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Ajuste por momentos de una gaussiana generalizada centrada: (alfa, sigma²)"""
+    ratio = mean_abs ** 2 / np.maximum(mean_sq, 1e-12)
+    return np.interp(ratio, RHO_TABLE, ALPHA_GRID), mean_sq
+
+
+def fit_aggd(mean_abs: np.ndarray, mean_sq: np.ndarray, left_sq: np.ndarray,
+             right_sq: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Ajuste por momentos de una gaussiana generalizada asimétrica: (alfa, eta, sigma_l², sigma_r²)"""
+    sigma_l, sigma_r = np.sqrt(left_sq), np.sqrt(right_sq)
+    gamma = sigma_l / np.maximum(sigma_r, 1e-12)
+    r_hat = mean_abs ** 2 / np.maximum(mean_sq, 1e-12)
+    ratio = r_hat * (gamma ** 3 + 1) * (gamma + 1) / (gamma ** 2 + 1) ** 2
+    alpha = np.interp(ratio, RHO_TABLE, ALPHA_GRID)
+    # eta = (beta_r - beta_l)·Γ(2/α)/Γ(1/α) = (sigma_r - sigma_l)·sqrt(rho(α))
+    eta = (sigma_r - sigma_l) * np.sqrt(np.interp(alpha, ALPHA_GRID, RHO_TABLE))
+    return alpha, eta, left_sq, right_sq
+
+
+def _scale_features(mscn: np.ndarray, grid: Tuple[int, int], block: Tuple[int, int]) -> np.ndarray:
+    """18 descriptores de una escala por bloque: (N, bloques, 18)"""
+    height, width = grid[0] * block[0], grid[1] * block[1]
+    core = mscn[:height, :width]
+    features = list(fit_ggd(_block_mean(np.abs(core), grid, block), _block_mean(core * core, grid, block)))
+    for product in _pairwise_products(mscn, height, width):
+        sq = product * product
+        negative = product < 0
+        mean_sq = _block_mean(sq, grid, block)
+        neg_sq = _block_mean(np.square(np.minimum(product, 0)), grid, block)
+        neg_fraction = _block_mean(negative.astype(np.float32), grid, block)
+        pos_fraction = _block_mean((product > 0).astype(np.float32), grid, block)
+        features.extend(fit_aggd(
+            _block_mean(np.abs(product), grid, block),
+            mean_sq,
+            neg_sq / np.maximum(neg_fraction, 1e-12),
+            (mean_sq - neg_sq) / np.maximum(pos_fraction, 1e-12)
+        ))
+    return np.stack(features, axis=-1)
+
+
+def nss_features(stack: np.ndarray, patch_size: Optional[int] = None) -> np.ndarray:
+    """Descriptores BRISQUE/NIQE de una pila de imágenes en grises del mismo tamaño
+
+    Con `patch_size` devuelve (N, parches, 36), un vector por parche como en
+    NIQE; sin él, (N, 36) con los descriptores de cada imagen completa como
+    en BRISQUE.
+    """
+    features, _ = nss_patch_features(stack, patch_size)
+    return features if patch_size else features[:, 0]
+
+
+def nss_patch_features(stack: np.ndarray, patch_size: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Descriptores por parche y nitidez de cada parche: ((N, parches, 36), (N, parches))
+
+    La nitidez es la desviación local media del parche, con la que NIQE elige
+    los parches con estructura. La segunda escala se calcula sobre la imagen
+    reducida a la mitad con parches de la mitad de lado, de modo que ambas
+    escalas cubren la misma rejilla. Las pilas admiten hasta 512 imágenes
+    (límite de canales de OpenCV).
+    """
+    current = _to_channels(stack)
+    height, width, _ = current.shape
+    if patch_size:
+        # Recorte para que la rejilla de parches sea la misma en las dos escalas
+        grid = ((height - 2) // patch_size, (width - 2) // patch_size)
+        if grid[0] == 0 or grid[1] == 0:
+            raise ValueError(f"Imagen de {width}x{height} menor que un parche de {patch_size}")
+        current = np.ascontiguousarray(current[:grid[0] * patch_size + 2, :grid[1] * patch_size + 2])
+    else:
+        grid = (1, 1)
+
+    per_scale = []
+    sharpness = None
+    for scale in range(NUM_SCALES):
+        mscn, sigma = _mscn_channels(current)
+        side = patch_size // (2 ** scale) if patch_size else None
+        block = (side, side) if side else (mscn.shape[0] - 1, mscn.shape[1] - 1)
+        if sharpness is None:
+            sharpness = _block_mean(sigma[:-1, :-1], grid, block)
+        per_scale.append(_scale_features(mscn, grid, block))
+        if scale + 1 < NUM_SCALES:
+            h, w, n = current.shape
+            current = cv2.resize(current, (w // 2, h // 2), interpolation=cv2.INTER_AREA).reshape(h // 2, w // 2, n)
+
+    return np.concatenate(per_scale, axis=-1), sharpness
+
+
+@dataclass
+class NSSModel:
+    """Modelo gaussiano multivariante de parches prístinos (NIQE)
+
+    La calidad de una imagen es la distancia entre el gaussiano de sus
+    parches y el del modelo. Para llevarla a la escala 0-100 de BRISQUE
+    (menor es mejor), una imagen a la distancia mediana de las de referencia
+    obtiene `reference_score` y el score crece con la raíz de la distancia
+    relativa: así distorsiones leves y graves quedan repartidas entre los
+    umbrales en lugar de saturar en 100.
+    """
+    mean: np.ndarray
+    cov: np.ndarray
+    reference_distance: float = 1.0
+    reference_score: float = 15.0
+    patch_size: int = 96
+    max_side: int = 1024
+    min_patch_sigma: float = 2.0  # parches más planos (fondos lisos) no aportan estadística
+    source: str = ""
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifica el modelo en las claves de cache: cambiar de modelo cambia los scores"""
+        digest = hashlib.md5(np.ascontiguousarray(self.mean, dtype=np.float64).tobytes())
+        digest.update(repr((self.reference_distance, self.reference_score, self.patch_size, self.max_side, self.min_patch_sigma)).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def working_image(gray: np.ndarray, max_side: int) -> np.ndarray:
+        """Reduce a la mitad hasta que el lado largo no supere `max_side`"""
+        while max(gray.shape[:2]) > max_side:
+            gray = cv2.pyrDown(gray)
+        return gray
+
+    def _textured(self, features: np.ndarray, sharpness: np.ndarray) -> np.ndarray:
+        """Parches con estructura; todos si la imagen es prácticamente plana"""
+        textured = features[sharpness >= self.min_patch_sigma]
+        return textured if len(textured) >= 2 else features
+
+    def distance(self, features: np.ndarray) -> float:
+        """Distancia NIQE entre los parches de una imagen y el modelo prístino"""
+        features = features[np.isfinite(features).all(axis=1)]
+        if len(features) == 0:
+            return float("inf")
+        mean = features.mean(axis=0)
+        cov = np.cov(features, rowvar=False) if len(features) > 1 else np.zeros_like(self.cov)
+        delta = self.mean - mean
+        return float(math.sqrt(max(delta @ np.linalg.pinv((self.cov + cov) / 2) @ delta, 0.0)))
+
+    def to_score(self, distance):
+        """Distancia NIQE -> score 0-100 tipo BRISQUE (acepta arrays)"""
+        return np.minimum(100.0, self.reference_score * np.sqrt(np.asarray(distance) / self.reference_distance))
+
+    def score(self, gray: np.ndarray) -> Tuple[float, float]:
+        """(score 0-100 tipo BRISQUE, distancia NIQE) de una imagen en grises ya reducida"""
+        distance = float(self.distances(gray[None])[0])
+        return float(self.to_score(distance)), distance
+
+    def distances(self, stack: np.ndarray, chunk_size: int = 8) -> np.ndarray:
+        """Distancias NIQE de una pila de imágenes del mismo tamaño
+
+        La extracción se hace por tramos de `chunk_size` imágenes: el trabajo
+        está limitado por memoria y pilas mayores no son más rápidas, solo
+        ocupan más.
+        """
+        distances = []
+        for start in range(0, len(stack), chunk_size):
+            features, sharpness = nss_patch_features(stack[start:start + chunk_size], self.patch_size)
+            distances.extend(self.distance(self._textured(f, s)) for f, s in zip(features, sharpness))
+        return np.array(distances)
+
+    def score_batch(self, stack: np.ndarray) -> np.ndarray:
+        """Scores 0-100 de una pila de imágenes del mismo tamaño"""
+        return self.to_score(self.distances(stack))
+
+    @classmethod
+    def fit(cls, images: Iterable[np.ndarray], reference_score: float = 15.0, patch_size: int = 96,
+            max_side: int = 1024, sharpness_fraction: float = 0.75, source: str = "") -> "NSSModel":
+        """Ajusta el modelo con imágenes de referencia aprobadas (BGR o grises)
+
+        Como en NIQE, de cada imagen se usan los parches con nitidez por encima
+        de `sharpness_fraction` veces la máxima de esa imagen.
+        """
+        grays, selected = [], []
+        for image in images:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+            gray = cls.working_image(gray, max_side)
+            features, sharpness = nss_patch_features(gray, patch_size)
+            selected.append(features[0][sharpness[0] >= sharpness_fraction * sharpness[0].max()])
+            grays.append(gray)
+        if not selected:
+            raise ValueError("Se necesita al menos una imagen de referencia")
+
+        pooled = np.concatenate(selected)
+        pooled = pooled[np.isfinite(pooled).all(axis=1)]
+        model = cls(mean=pooled.mean(axis=0), cov=np.cov(pooled, rowvar=False), reference_score=reference_score,
+                    patch_size=patch_size, max_side=max_side, source=source)
+        median = float(np.median([model.distances(gray[None])[0] for gray in grays]))
+        model.reference_distance = median if median > 0 else 1.0
+        return model
+
+    def save(self, path: str):
+        data = {
+            "mean": self.mean.tolist(),
+            "cov": self.cov.tolist(),
+            "reference_distance": self.reference_distance,
+            "reference_score": self.reference_score,
+            "patch_size": self.patch_size,
+            "max_side": self.max_side,
+            "min_patch_sigma": self.min_patch_sigma,
+            "source": self.source
+        }
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(data))
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "NSSModel":
+        """Carga un modelo; sin ruta, el genérico incluido en el agente"""
+        data = json.loads(Path(path or DEFAULT_MODEL_PATH).read_text())
+        data["mean"] = np.array(data["mean"])
+        data["cov"] = np.array(data["cov"])
+        return cls(**data)
+
+
+def stack_images(images: Sequence[np.ndarray]) -> np.ndarray:
+    """Apila imágenes en grises recortándolas al tamaño común más pequeño"""
+    height = min(image.shape[0] for image in images)
+    width = min(image.shape[1] for image in images)
+    return np.stack([image[:height, :width] for image in images]).astype(np.float32)
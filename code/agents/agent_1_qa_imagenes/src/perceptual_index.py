@@ -0,0 +1,312 @@
+"""
+Índice de casi-duplicados por hash perceptual
+pHash/dHash de 64 bits, búsqueda por radio de Hamming con multi-index hashing y clusters persistidos en SQLite
+"""
+
+import sqlite3
+import threading
+from array import array
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import combinations
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from loguru import logger
+
+HASH_BITS = 64
+CHUNKS = 4  # subhashes de 16 bits: una tabla por subhash
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# Por debajo de esta desviación la imagen es casi plana y su pHash no significa nada
+MIN_FINGERPRINT_STD = 2.0
+# Diferencia de brillo medio (niveles de gris) admitida para reutilizar un análisis;
+# los hashes perceptuales son invariantes al brillo y la exposición no
+MAX_MEAN_SHIFT = 2.0
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    """Huella perceptual de una imagen y los datos que deciden si su análisis es reutilizable"""
+    phash: int
+    dhash: int
+    width: int
+    height: int
+    mean: float  # brillo medio
+    detail: float  # varianza del Laplaciano de la imagen reducida con la que se calculó la huella
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _pack_bits(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def compute_fingerprint(gray: np.ndarray, size: Tuple[int, int]) -> Optional[Fingerprint]:
+    """pHash (DCT 32x32, 8x8 de baja frecuencia contra la mediana) y dHash (gradiente 9x8)
+
+    `gray` es la imagen en grises, normalmente decodificada reducida, y `size`
+    el (ancho, alto) original. Devuelve None si la imagen es casi plana.
+    """
+    mean, std = cv2.meanStdDev(gray)
+    if std[0, 0] < MIN_FINGERPRINT_STD:
+        return None
+
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    coefficients = cv2.dct(small)[:8, :8].ravel()
+    # La componente continua queda fuera de la mediana
+    phash = _pack_bits(coefficients > np.median(coefficients[1:]))
+
+    gradient = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    dhash = _pack_bits(gradient[:, 1:] > gradient[:, :-1])
+
+    laplacian = cv2.Laplacian(gray, cv2.CV_32F)
+    return Fingerprint(
+        phash=phash,
+        dhash=dhash,
+        width=int(size[0]),
+        height=int(size[1]),
+        mean=float(mean[0, 0]),
+        detail=float(laplacian.var())
+    )
+
+
+def is_reusable(a: Fingerprint, b: Fingerprint, detail_tolerance: float) -> bool:
+    """Casi-duplicados cuyo análisis sirve para ambos
+
+    Los hashes no ven resolución, brillo ni un ligero desenfoque, que sí
+    cambian el resultado: se exige misma resolución, mismo brillo medio y
+    detalle (Laplaciano) parecido.
+    """
+    return (a.width == b.width and a.height == b.height
+            and abs(a.mean - b.mean) <= MAX_MEAN_SHIFT
+            and abs(a.detail - b.detail) <= detail_tolerance * max(a.detail, b.detail))
+
+
+def _to_signed(value: int) -> int:
+    """SQLite guarda enteros de 64 bits con signo"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+@lru_cache(maxsize=None)
+def _chunk_masks(radius: int) -> Tuple[int, ...]:
+    """Máscaras de 16 bits con como mucho `radius` bits activos"""
+    masks = [0]
+    for bits in range(1, radius + 1):
+        masks.extend(sum(1 << bit for bit in combo) for combo in combinations(range(CHUNK_BITS), bits))
+    return tuple(masks)
+
+
+class PerceptualIndex:
+    """Índice persistente de huellas perceptuales con consultas por radio de Hamming
+
+    Multi-index hashing: el pHash se parte en 4 subhashes de 16 bits con una
+    tabla por subhash. Si dos hashes distan como mucho `r`, por el principio
+    del palomar coinciden en algún subhash a distancia <= r // 4, así que una
+    consulta solo mira unos pocos cubos en lugar de todo el índice.
+
+    Cada imagen nueva se une (union-find) con sus casi-duplicados, de modo que
+    los clusters se mantienen al insertar y se guardan en SQLite como el padre
+    de cada entrada. En memoria solo hay arrays compactos y las tablas.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, radius: int = 6):
+        # Sin ruta se usa una base de datos en memoria (no sobrevive a reinicios)
+        self.db_path = db_path or ":memory:"
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.radius = radius
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        if db_path:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS perceptual_hashes (
+                    id INTEGER PRIMARY KEY,
+                    content_hash TEXT NOT NULL UNIQUE,
+                    phash INTEGER NOT NULL,
+                    dhash INTEGER NOT NULL,
+                    width INTEGER NOT NULL,
+                    height INTEGER NOT NULL,
+                    mean REAL NOT NULL,
+                    detail REAL NOT NULL,
+                    parent INTEGER NOT NULL,
+                    path TEXT
+                )
+            """)
+        self._reset_memory()
+        self._load()
+
+    def _reset_memory(self):
+        # Entrada i: posición i en cada array (los ids son consecutivos desde 0)
+        self.phashes = array("Q")
+        self.dhashes = array("Q")
+        self.sizes = array("I")  # ancho, alto intercalados
+        self.means = array("f")
+        self.details = array("f")
+        self.parents = array("q")
+        self.content_hashes: List[str] = []
+        self.by_content: Dict[str, int] = {}
+        self.tables: List[Dict[int, array]] = [{} for _ in range(CHUNKS)]
+
+    def _load(self):
+        rows = self.conn.execute(
+            "SELECT id, content_hash, phash, dhash, width, height, mean, detail, parent "
+            "FROM perceptual_hashes ORDER BY id"
+        )
+        for entry_id, content_hash, phash, dhash, width, height, mean, detail, parent in rows:
+            if entry_id != len(self.phashes):
+                logger.warning(f"Índice perceptual con ids no consecutivos en {self.db_path}, se reconstruye")
+                self.clear()
+                return
+            fingerprint = Fingerprint(phash & (1 << HASH_BITS) - 1, dhash & (1 << HASH_BITS) - 1,
+                                      width, height, mean, detail)
+            self._append(content_hash, fingerprint, parent)
+        if self.phashes:
+            logger.info(f"Índice perceptual cargado: {len(self.phashes)} imágenes")
+
+    def _append(self, content_hash: str, fingerprint: Fingerprint, parent: int) -> int:
+        entry_id = len(self.phashes)
+        self.phashes.append(fingerprint.phash)
+        self.dhashes.append(fingerprint.dhash)
+        self.sizes.extend((fingerprint.width, fingerprint.height))
+        self.means.append(fingerprint.mean)
+        self.details.append(fingerprint.detail)
+        self.parents.append(parent)
+        self.content_hashes.append(content_hash)
+        self.by_content[content_hash] = entry_id
+        for chunk, table in enumerate(self.tables):
+            key = (fingerprint.phash >> (chunk * CHUNK_BITS)) & CHUNK_MASK
+            bucket = table.get(key)
+            if bucket is None:
+                bucket = table[key] = array("I")
+            bucket.append(entry_id)
+        return entry_id
+
+    def __len__(self) -> int:
+        return len(self.phashes)
+
+    def fingerprint(self, entry_id: int) -> Fingerprint:
+        return Fingerprint(
+            self.phashes[entry_id], self.dhashes[entry_id],
+            self.sizes[2 * entry_id], self.sizes[2 * entry_id + 1],
+            self.means[entry_id], self.details[entry_id]
+        )
+
+    def query(self, phash: int, radius: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Entradas con pHash a distancia <= radius, como (id, distancia) de menor a mayor"""
+        radius = self.radius if radius is None else radius
+        masks = _chunk_masks(radius // CHUNKS)
+        phashes = self.phashes
+        # Una entrada puede salir en varias tablas; el diccionario las deduplica
+        matches: Dict[int, int] = {}
+        for chunk, table in enumerate(self.tables):
+            key = (phash >> (chunk * CHUNK_BITS)) & CHUNK_MASK
+            for mask in masks:
+                bucket = table.get(key ^ mask)
+                if bucket is None:
+                    continue
+                for entry_id in bucket:
+                    distance = (phashes[entry_id] ^ phash).bit_count()
+                    if distance <= radius:
+                        matches[entry_id] = distance
+        return sorted(matches.items(), key=lambda match: match[1])
+
+    def near_duplicates(self, fingerprint: Fingerprint, radius: Optional[int] = None) -> List[int]:
+        """Ids de casi-duplicados: pHash y dHash dentro del radio, el más parecido primero"""
+        radius = self.radius if radius is None else radius
+        return [
+            entry_id for entry_id, _ in self.query(fingerprint.phash, radius)
+            if (self.dhashes[entry_id] ^ fingerprint.dhash).bit_count() <= radius
+        ]
+
+    def find(self, entry_id: int) -> int:
+        """Raíz del cluster (la entrada más antigua), con compresión de caminos en memoria"""
+        parents = self.parents
+        while parents[entry_id] != entry_id:
+            parents[entry_id] = parents[parents[entry_id]]
+            entry_id = parents[entry_id]
+        return entry_id
+
+    def add(self, content_hash: str, fingerprint: Fingerprint, path: Optional[str] = None) -> int:
+        """Indexa una imagen y la une al cluster de sus casi-duplicados; devuelve su id"""
+        existing = self.by_content.get(content_hash)
+        if existing is not None:
+            return existing
+
+        neighbours = self.near_duplicates(fingerprint)
+        entry_id = self._append(content_hash, fingerprint, len(self.phashes))
+
+        # Las raíces más recientes cuelgan de la más antigua: basta actualizar una fila por unión
+        roots = sorted({self.find(neighbour) for neighbour in neighbours} | {entry_id})
+        root = roots[0]
+        for other in roots[1:]:
+            self.parents[other] = root
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO perceptual_hashes "
+                "(id, content_hash, phash, dhash, width, height, mean, detail, parent, path) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry_id, content_hash, _to_signed(fingerprint.phash), _to_signed(fingerprint.dhash),
+                 fingerprint.width, fingerprint.height, fingerprint.mean, fingerprint.detail,
+                 self.parents[entry_id], path)
+            )
+            self.conn.executemany(
+                "UPDATE perceptual_hashes SET parent = ? WHERE id = ?",
+                [(root, other) for other in roots[1:] if other != entry_id]
+            )
+        return entry_id
+
+    def clusters(self, min_size: int = 2, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Clusters de casi-duplicados, de mayor a menor
+
+        Recorre todo el índice (O(N)); las consultas individuales no lo hacen.
+        """
+        members: Dict[int, List[int]] = {}
+        for entry_id in range(len(self.phashes)):
+            members.setdefault(self.find(entry_id), []).append(entry_id)
+        groups = sorted((ids for ids in members.values() if len(ids) >= min_size),
+                        key=lambda ids: (-len(ids), ids[0]))
+        if limit is not None:
+            groups = groups[:limit]
+
+        clusters = []
+        with self.lock:
+            for ids in groups:
+                placeholders = ",".join("?" * len(ids))
+                paths = dict(self.conn.execute(
+                    f"SELECT id, path FROM perceptual_hashes WHERE id IN ({placeholders})", ids
+                ).fetchall())
+                clusters.append({
+                    'cluster_id': self.content_hashes[ids[0]],
+                    'size': len(ids),
+                    'images': [
+                        {'content_hash': self.content_hashes[i], 'path': paths.get(i)} for i in ids
+                    ]
+                })
+        return clusters
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM perceptual_hashes")
+        self._reset_memory()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'indexed_images': len(self.phashes),
+            'radius': self.radius,
+            'db_path': self.db_path
+        }
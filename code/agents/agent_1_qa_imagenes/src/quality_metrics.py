@@ -5,13 +5,16 @@ Implementación de métricas individuales para análisis de calidad
 
 import cv2
 import numpy as np
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Union
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
+from pathlib import Path
+import json
 import math
 
 from config import QualityLevel, QualityThresholds
+from nss_quality import NSSModel
 
 class MetricType(Enum):
     BRISQUE = "brisque"
@@ -32,17 +35,279 @@ class MetricResult:
     recommendations: List[str]
     metadata: Dict[str, Any]
 
+# log(valor completo) = pendiente * log(valor reducido) + ordenada, por factor de reducción.
+# Ajustado con `benchmarks/analysis_benchmark.py --fit-calibration` sobre fotos de producto
+# sintéticas de 12MP (x2) y 48MP (x4, x8); conviene reajustarlo con el catálogo real
+DEFAULT_SHARPNESS_CORRECTION = {
+    2: (0.987, -1.462),
+    4: (1.638, -6.725),
+    8: (2.299, -12.495)
+}
+
+@dataclass
+class PreviewCalibration:
+    """Correcciones de las métricas calculadas sobre una imagen reducida (modo preview)
+
+    La varianza Laplaciana depende mucho de la escala, por eso se corrige en
+    espacio logarítmico; el score BRISQUE se corrige de forma lineal. La
+    exposición se calcula sobre el histograma, que apenas cambia al reducir.
+    """
+    sharpness: Dict[int, Tuple[float, float]] = field(default_factory=lambda: dict(DEFAULT_SHARPNESS_CORRECTION))
+    brisque: Dict[int, Tuple[float, float]] = field(default_factory=dict)  # valor = pendiente * reducido + ordenada
+    
+    def correct(self, metric: str, scale: int, value: float) -> float:
+        """Estima el valor a resolución completa a partir del medido con reducción `scale`"""
+        if scale <= 1:
+            return value
+        if metric == "sharpness" and scale in self.sharpness:
+            slope, intercept = self.sharpness[scale]
+            return float(math.exp(slope * math.log(max(value, 1e-6)) + intercept))
+        if metric == "brisque" and scale in self.brisque:
+            slope, intercept = self.brisque[scale]
+            return float(slope * value + intercept)
+        return value
+    
+    def save(self, path: str):
+        data = {
+            metric: {str(scale): list(coefficients) for scale, coefficients in getattr(self, metric).items()}
+            for metric in ("sharpness", "brisque")
+        }
+        Path(path).write_text(json.dumps(data, indent=2))
+    
+    @classmethod
+    def load(cls, path: str) -> "PreviewCalibration":
+        data = json.loads(Path(path).read_text())
+        calibration = cls()
+        for metric in ("sharpness", "brisque"):
+            if metric in data:
+                setattr(calibration, metric, {int(k): tuple(v) for k, v in data[metric].items()})
+        return calibration
+
+class ImageContext:
+    """Representaciones de una imagen compartidas por todas las métricas
+
+    La conversión a grises y el histograma de luminancia se calculan una sola
+    vez al construir el contexto; los niveles de pirámide y la Laplaciana se
+    calculan al pedirlos por primera vez y quedan guardados.
+    """
+
+    def __init__(self, image: np.ndarray, scale: int = 1):
+        self.image = image
+        self.scale = scale  # factor de reducción respecto a la imagen original
+        self.height, self.width = image.shape[:2]
+        # Las métricas no modifican la imagen, así que no hace falta copiarla
+        self.gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        self.histogram = cv2.calcHist([self.gray], [0], None, [256], [0, 256]).flatten()
+        self._pyramid: List[np.ndarray] = [self.gray]
+        self._laplacian: Optional[np.ndarray] = None
+        self._laplacian_variance: Optional[float] = None
+
+    @classmethod
+    def ensure(cls, image: Union[np.ndarray, "ImageContext"]) -> "ImageContext":
+        """Devuelve el contexto recibido o lo construye a partir de un array"""
+        return image if isinstance(image, cls) else cls(image)
+
+    @property
+    def total_pixels(self) -> int:
+        return self.width * self.height
+
+    @property
+    def normalized_histogram(self) -> np.ndarray:
+        return self.histogram / max(self.histogram.sum(), 1)
+
+    @property
+    def mean_brightness(self) -> float:
+        return float(np.dot(np.arange(256), self.normalized_histogram))
+
+    @property
+    def brightness_variance(self) -> float:
+        """Varianza de la luminancia obtenida del histograma, sin recorrer la imagen"""
+        levels = np.arange(256)
+        mean = self.mean_brightness
+        return float(np.dot((levels - mean) ** 2, self.normalized_histogram))
+
+    def pyramid(self, level: int) -> np.ndarray:
+        """Imagen en grises reducida `level` veces a la mitad (0 = resolución original)"""
+        while len(self._pyramid) <= level:
+            self._pyramid.append(cv2.pyrDown(self._pyramid[-1]))
+        return self._pyramid[level]
+
+    @property
+    def laplacian(self) -> np.ndarray:
+        if self._laplacian is None:
+            self._laplacian = cv2.Laplacian(self.gray, cv2.CV_64F)
+        return self._laplacian
+
+    @property
+    def laplacian_variance(self) -> float:
+        if self._laplacian_variance is None:
+            _, std = cv2.meanStdDev(self.laplacian)
+            self._laplacian_variance = float(std[0][0] ** 2)
+        return self._laplacian_variance
+
+    @property
+    def worst_region(self) -> Optional[Dict[str, Any]]:
+        """Región con peor nitidez; solo la calcula el análisis por teselas"""
+        return None
+
+
+@dataclass
+class TilingConfig:
+    """Parámetros del análisis por teselas"""
+    tile_size: int = 1024
+    overlap: int = 8  # margen de contexto alrededor de cada tesela (>= radio del kernel más grande)
+    workers: int = 1  # teselas procesadas en paralelo (OpenCV libera el GIL)
+    min_tile_std: float = 5.0  # teselas más planas (fondo liso) no compiten por la peor región
+
+
+@dataclass
+class TileStats:
+    """Estadísticas del núcleo (sin solape) de una tesela"""
+    x: int
+    y: int
+    width: int
+    height: int
+    pixels: int
+    laplacian_mean: float
+    laplacian_variance: float
+    gray_std: float
+    histogram: np.ndarray
+
+
+def compute_tile_stats(gray: np.ndarray, core: Tuple[int, int, int, int], overlap: int) -> TileStats:
+    """Laplaciana e histograma de una tesela; el solape da al kernel el mismo contexto que en la imagen entera"""
+    x0, y0, x1, y1 = core
+    height, width = gray.shape[:2]
+    ox0, oy0 = max(0, x0 - overlap), max(0, y0 - overlap)
+    ox1, oy1 = min(width, x1 + overlap), min(height, y1 + overlap)
+    laplacian = cv2.Laplacian(gray[oy0:oy1, ox0:ox1], cv2.CV_64F)[y0 - oy0:y1 - oy0, x0 - ox0:x1 - ox0]
+    lap_mean, lap_std = cv2.meanStdDev(laplacian)
+    core_gray = gray[y0:y1, x0:x1]
+    _, gray_std = cv2.meanStdDev(core_gray)
+    return TileStats(
+        x=x0, y=y0, width=x1 - x0, height=y1 - y0, pixels=(x1 - x0) * (y1 - y0),
+        laplacian_mean=float(lap_mean[0][0]),
+        laplacian_variance=float(lap_std[0][0] ** 2),
+        gray_std=float(gray_std[0][0]),
+        histogram=cv2.calcHist([core_gray], [0], None, [256], [0, 256]).flatten()
+    )
+
+
+class TiledImageContext(ImageContext):
+    """Contexto de imágenes grandes calculado por teselas solapadas
+
+    Nunca se materializa una imagen intermedia del tamaño completo: histograma
+    y varianza Laplaciana se acumulan tesela a tesela (suma de histogramas y
+    combinación exacta de medias y varianzas), y el resultado coincide con el
+    de ImageContext. Además queda un mapa de nitidez por tesela con el que se
+    localiza la peor región.
+    """
+
+    def __init__(self, gray: np.ndarray, scale: int = 1, tiling: Optional[TilingConfig] = None):
+        if gray.ndim == 3:
+            gray = cv2.cvtColor(gray, cv2.COLOR_BGR2GRAY)
+        self.image = gray
+        self.gray = gray
+        self.scale = scale
+        self.height, self.width = gray.shape[:2]
+        self.tiling = tiling or TilingConfig()
+        self._pyramid: List[np.ndarray] = [gray]
+        self._laplacian: Optional[np.ndarray] = None
+
+        self.tiles = self._compute_tiles()
+        self.histogram = np.sum([tile.histogram for tile in self.tiles], axis=0)
+        self._laplacian_variance = self._merge_laplacian_variance()
+
+    def _tile_grid(self) -> List[Tuple[int, int, int, int]]:
+        size = self.tiling.tile_size
+        return [
+            (x, y, min(x + size, self.width), min(y + size, self.height))
+            for y in range(0, self.height, size)
+            for x in range(0, self.width, size)
+        ]
+
+    def _compute_tiles(self) -> List[TileStats]:
+        grid = self._tile_grid()
+        overlap = self.tiling.overlap
+        if self.tiling.workers > 1 and len(grid) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=self.tiling.workers) as pool:
+                return list(pool.map(lambda core: compute_tile_stats(self.gray, core, overlap), grid))
+        return [compute_tile_stats(self.gray, core, overlap) for core in grid]
+
+    def _merge_laplacian_variance(self) -> float:
+        """Varianza global a partir de (n, media, varianza) de cada tesela"""
+        counts = np.array([tile.pixels for tile in self.tiles], dtype=np.float64)
+        means = np.array([tile.laplacian_mean for tile in self.tiles])
+        variances = np.array([tile.laplacian_variance for tile in self.tiles])
+        mean = np.dot(counts, means) / counts.sum()
+        return float((np.dot(counts, variances) + np.dot(counts, (means - mean) ** 2)) / counts.sum())
+
+    @property
+    def sharpness_map(self) -> np.ndarray:
+        """Varianza Laplaciana por tesela (filas x columnas)"""
+        columns = -(-self.width // self.tiling.tile_size)
+        return np.array([tile.laplacian_variance for tile in self.tiles]).reshape(-1, columns)
+
+    @property
+    def worst_region(self) -> Optional[Dict[str, Any]]:
+        candidates = [tile for tile in self.tiles if tile.gray_std >= self.tiling.min_tile_std] or self.tiles
+        worst = min(candidates, key=lambda tile: tile.laplacian_variance)
+        # Coordenadas en píxeles de la imagen original
+        return {
+            "x": worst.x * self.scale,
+            "y": worst.y * self.scale,
+            "width": worst.width * self.scale,
+            "height": worst.height * self.scale,
+            "laplacian_variance": worst.laplacian_variance,
+            "tiles": len(self.tiles)
+        }
+
+
+def sharpness_scores(laplacian_variance: np.ndarray, thresholds: QualityThresholds) -> np.ndarray:
+    """Score de nitidez (0-100) por varianza Laplaciana: lineal por tramos entre umbrales
+
+    Vectorizada para recalcular scores de muchas imágenes (calibración) con la
+    misma fórmula que `SharpnessMetric`.
+    """
+    variance = np.asarray(laplacian_variance, dtype=np.float64)
+    fair, good, excellent = thresholds.laplacian_fair, thresholds.laplacian_good, thresholds.laplacian_excellent
+    score = np.select(
+        [variance >= excellent, variance >= good, variance >= fair],
+        [100.0,
+         75 + (variance - good) * 25 / (excellent - good),
+         60 + (variance - fair) * 15 / (good - fair)],
+        variance * 60 / fair
+    )
+    return np.clip(score, 0, 100)
+
+def resolution_scores(width: np.ndarray, height: np.ndarray, thresholds: QualityThresholds) -> np.ndarray:
+    """Score de resolución por múltiplos de la resolución mínima (misma fórmula que `ResolutionMetric`)"""
+    total_pixels = np.asarray(width, dtype=np.float64) * np.asarray(height, dtype=np.float64)
+    min_pixels = thresholds.min_width * thresholds.min_height
+    return np.select(
+        [total_pixels >= min_pixels * 4, total_pixels >= min_pixels * 2,
+         total_pixels >= min_pixels, total_pixels >= min_pixels * 0.5],
+        [100.0, 90.0, 75.0, 60.0],
+        30.0
+    )
+
 class BaseMetric(ABC):
     """Clase base para métricas de calidad"""
     
-    def __init__(self, thresholds: QualityThresholds):
+    def __init__(self, thresholds: QualityThresholds, calibration: Optional[PreviewCalibration] = None):
         self.thresholds = thresholds
+        self.calibration = calibration or PreviewCalibration()
         self.name = self.__class__.__name__
     
     @abstractmethod
+    def compute(self, *args) -> MetricResult:
+        """Calcula la métrica (trabajo de CPU síncrono, apto para hilos o procesos)"""
+        pass
+    
     async def calculate(self, *args) -> MetricResult:
         """Calcula la métrica"""
-        pass
+        return self.compute(*args)
     
     def _determine_level(self, score: float) -> QualityLevel:
         """Determina nivel de calidad basado en score"""
@@ -56,26 +321,36 @@ class BaseMetric(ABC):
             return QualityLevel.POOR
         else:
             return QualityLevel.REJECTED
+    
+    def _full_resolution_value(self, context: ImageContext, value: float) -> float:
+        """Aplica la corrección de preview si la imagen del contexto está reducida"""
+        return self.calibration.correct(self.metric_type.value, context.scale, value)
 
 class BRISQUEMetric(BaseMetric):
-    """Métrica BRISQUE para evaluación de calidad sin referencia"""
+    """Métrica BRISQUE para evaluación de calidad sin referencia
+
+    Implementación nativa sobre estadísticas de escenas naturales (ver
+    nss_quality): descriptores BRISQUE por parche comparados con un modelo
+    prístino al estilo NIQE, sin depender de los módulos contrib de OpenCV.
+    La imagen se evalúa reducida a `nss_model.max_side`, la escala con la que
+    se ajustó el modelo, así que el modo preview apenas altera el score.
+    """
     
-    def __init__(self, thresholds: QualityThresholds):
-        super().__init__(thresholds)
+    def __init__(self, thresholds: QualityThresholds, calibration: Optional[PreviewCalibration] = None,
+                 nss_model: Optional[NSSModel] = None):
+        super().__init__(thresholds, calibration)
         self.metric_type = MetricType.BRISQUE
+        self.nss_model = nss_model or NSSModel.load()
     
-    async def calculate(self, image: np.ndarray) -> MetricResult:
+    def compute(self, image: Union[np.ndarray, ImageContext]) -> MetricResult:
         """Calcula score BRISQUE"""
         try:
-            # Convertir a escala de grises si es necesario
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = image.copy()
+            context = ImageContext.ensure(image)
             
             # Calcular score BRISQUE (menor es mejor)
             # BRISQUE score típico: 0-100 (0 = mejor calidad)
-            brisque_score = self._calculate_brisque_score(gray)
+            raw_score, details = self._evaluate(context)
+            brisque_score = self._full_resolution_value(context, raw_score)
             
             # Convertir a score de calidad (mayor es mejor)
             quality_score = max(0, 100 - brisque_score)
@@ -94,36 +369,49 @@ class BRISQUEMetric(BaseMetric):
                 recommendations=recommendations,
                 metadata={
                     "brisque_range": "0-100 (menor es mejor)",
-                    "interpretation": "Blind/Referenceless Image Spatial Quality Evaluator"
+                    "interpretation": "Blind/Referenceless Image Spatial Quality Evaluator",
+                    **details
                 }
             )
             
         except Exception as e:
             return self._create_error_result(f"Error calculando BRISQUE: {str(e)}")
     
-    def _calculate_brisque_score(self, gray_image: np.ndarray) -> float:
-        """Calcula score BRISQUE aproximado usando NIQE"""
+    def _calculate_brisque_score(self, context: ImageContext) -> float:
+        """Score BRISQUE (0-100, menor es mejor) sin corrección de preview"""
+        return self._evaluate(context)[0]
+    
+    def _evaluate(self, context: ImageContext) -> Tuple[float, Dict[str, Any]]:
+        """Score y detalles de la evaluación NSS sobre la imagen a escala de trabajo"""
+        level = 0
+        while max(context.pyramid(level).shape) > self.nss_model.max_side:
+            level += 1
+        gray = context.pyramid(level)
         try:
-            # Usar NIQE como aproximación a BRISQUE
-            # NIQE: Naturalness Image Quality Evaluator
-            niqe_score = cv2.quality.QualityNIQE_create(gray_image).computeScore()
-            return float(niqe_score) if not np.isnan(niqe_score) else 50.0
-        except:
-            # Fallback: calcular métricas alternativas
-            return self._fallback_quality_score(gray_image)
-    
-    def _fallback_quality_score(self, gray_image: np.ndarray) -> float:
-        """Score alternativo cuando BRISQUE no está disponible"""
-        # Calcular métricas básicas de calidad
-        variance = np.var(gray_image)
-        mean_brightness = np.mean(gray_image)
+            score, distance = self.nss_model.score(gray)
+        except ValueError:
+            # Imagen menor que un parche: no hay estadística suficiente
+            return self._fallback_brisque_score(context), {"backend": "fallback"}
+        return score, {
+            "backend": "nss",
+            "niqe_distance": distance,
+            "working_size": f"{gray.shape[1]}x{gray.shape[0]}",
+            "nss_model": self.nss_model.source
+        }
+    
+    def _fallback_brisque_score(self, context: ImageContext) -> float:
+        """Score alternativo (0-100, menor es mejor) para imágenes demasiado pequeñas para el análisis por parches"""
+        # Calcular métricas básicas de calidad (a partir del histograma compartido)
+        variance = context.brightness_variance
+        mean_brightness = context.mean_brightness
         
         # Score basado en varianza y brillo
         # Imagen con buena calidad debe tener buena varianza y brillo equilibrado
         variance_score = min(100, variance / 100)
         brightness_score = 100 - abs(mean_brightness - 128) * 0.5
         
-        return (variance_score + brightness_score) / 2
+        # Invertido a la escala de BRISQUE, como el score NSS
+        return 100 - (variance_score + brightness_score) / 2
     
     def _analyze_brisque_results(self, brisque_score: float) -> Tuple[List[str], List[str]]:
         """Analiza resultados BRISQUE y genera recomendaciones"""
@@ -150,29 +438,24 @@ class BRISQUEMetric(BaseMetric):
             score=0.0,
             level=QualityLevel.POOR,
             issues=[error_msg],
-            recommendations=["Verificar disponibilidad de métricas de OpenCV"],
+            recommendations=["Verificar que la imagen es válida y el modelo NSS está disponible"],
             metadata={"error": error_msg}
         )
 
 class SharpnessMetric(BaseMetric):
     """Métrica de nitidez basada en varianza Laplaciana"""
     
-    def __init__(self, thresholds: QualityThresholds):
-        super().__init__(thresholds)
+    def __init__(self, thresholds: QualityThresholds, calibration: Optional[PreviewCalibration] = None):
+        super().__init__(thresholds, calibration)
         self.metric_type = MetricType.SHARPNESS
     
-    async def calculate(self, image: np.ndarray) -> MetricResult:
+    def compute(self, image: Union[np.ndarray, ImageContext]) -> MetricResult:
         """Calcula score de nitidez usando varianza Laplaciana"""
         try:
-            # Convertir a escala de grises si es necesario
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = image.copy()
+            context = ImageContext.ensure(image)
             
             # Calcular varianza Laplaciana
-            laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-            laplacian_variance = laplacian.var()
+            laplacian_variance = self._full_resolution_value(context, context.laplacian_variance)
             
             # Convertir a score de calidad
             sharpness_score = self._calculate_sharpness_score(laplacian_variance)
@@ -181,6 +464,30 @@ class SharpnessMetric(BaseMetric):
             level = self._determine_level(sharpness_score)
             issues, recommendations = self._analyze_sharpness_results(laplacian_variance)
             
+            metadata = {
+                "laplacian_variance": laplacian_variance,
+                "preview_scale": context.scale,
+                "larger_values_better": True,
+                "threshold_excellent": self.thresholds.laplacian_excellent,
+                "threshold_good": self.thresholds.laplacian_good,
+                "threshold_fair": self.thresholds.laplacian_fair
+            }
+            
+            # Análisis por teselas: zona desenfocada aunque la imagen en conjunto sea nítida
+            worst_region = context.worst_region
+            if worst_region is not None:
+                worst_region["laplacian_variance"] = self._full_resolution_value(
+                    context, worst_region["laplacian_variance"]
+                )
+                metadata["worst_region"] = worst_region
+                if (worst_region["laplacian_variance"] < self.thresholds.laplacian_fair
+                        and laplacian_variance >= self.thresholds.laplacian_fair):
+                    issues.append(
+                        f"Zona desenfocada en ({worst_region['x']}, {worst_region['y']}) "
+                        f"de {worst_region['width']}x{worst_region['height']} píxeles"
+                    )
+                    recommendations.append("Revisar la profundidad de campo o el enfoque en esa zona")
+            
             return MetricResult(
                 metric_name="Sharpness",
                 metric_type=self.metric_type,
@@ -189,13 +496,7 @@ class SharpnessMetric(BaseMetric):
                 level=level,
                 issues=issues,
                 recommendations=recommendations,
-                metadata={
-                    "laplacian_variance": laplacian_variance,
-                    "larger_values_better": True,
-                    "threshold_excellent": self.thresholds.laplacian_excellent,
-                    "threshold_good": self.thresholds.laplacian_good,
-                    "threshold_fair": self.thresholds.laplacian_fair
-                }
+                metadata=metadata
             )
             
         except Exception as e:
@@ -203,16 +504,7 @@ class SharpnessMetric(BaseMetric):
     
     def _calculate_sharpness_score(self, laplacian_variance: float) -> float:
         """Convierte varianza Laplaciana a score de calidad"""
-        if laplacian_variance >= self.thresholds.laplacian_excellent:
-            return 100.0
-        elif laplacian_variance >= self.thresholds.laplacian_good:
-            score = 75 + (laplacian_variance - self.thresholds.laplacian_good) * 25 / (self.thresholds.laplacian_excellent - self.thresholds.laplacian_good)
-        elif laplacian_variance >= self.thresholds.laplacian_fair:
-            score = 60 + (laplacian_variance - self.thresholds.laplacian_fair) * 15 / (self.thresholds.laplacian_good - self.thresholds.laplacian_fair)
-        else:
-            score = max(0, laplacian_variance * 60 / self.thresholds.laplacian_fair)
-        
-        return min(100, max(0, score))
+        return float(sharpness_scores(laplacian_variance, self.thresholds))
     
     def _analyze_sharpness_results(self, laplacian_variance: float) -> Tuple[List[str], List[str]]:
         """Analiza resultados de nitidez"""
@@ -257,18 +549,13 @@ class ExposureMetric(BaseMetric):
         super().__init__(thresholds)
         self.metric_type = MetricType.EXPOSURE
     
-    async def calculate(self, image: np.ndarray) -> MetricResult:
+    def compute(self, image: Union[np.ndarray, ImageContext]) -> MetricResult:
         """Calcula score de exposición basado en histograma"""
         try:
-            # Convertir a escala de grises si es necesario
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = image.copy()
+            context = ImageContext.ensure(image)
             
-            # Calcular histograma
-            histogram = cv2.calcHist([gray], [0], None, [256], [0, 256])
-            histogram = histogram.flatten() / histogram.sum()  # Normalizar
+            # Histograma normalizado del contexto compartido
+            histogram = context.normalized_histogram
             
             # Analizar distribución de exposición
             exposure_analysis = self._analyze_exposure_distribution(histogram)
@@ -395,26 +682,16 @@ class ResolutionMetric(BaseMetric):
         super().__init__(thresholds)
         self.metric_type = MetricType.RESOLUTION
     
-    async def calculate(self, image_info: Dict[str, Any]) -> MetricResult:
+    def compute(self, image_info: Dict[str, Any]) -> MetricResult:
         """Calcula score de resolución"""
         try:
             width = image_info['width']
             height = image_info['height']
             total_pixels = width * height
             
-            # Calcular score basado en resolución mínima
+            # Calcular score basado en resolución mínima (4x, 2x, 1x y 0.5x la mínima)
             min_pixels = self.thresholds.min_width * self.thresholds.min_height
-            
-            if total_pixels >= min_pixels * 4:  # 4x la resolución mínima
-                resolution_score = 100.0
-            elif total_pixels >= min_pixels * 2:  # 2x la resolución mínima
-                resolution_score = 90.0
-            elif total_pixels >= min_pixels:  # Resolución mínima
-                resolution_score = 75.0
-            elif total_pixels >= min_pixels * 0.5:  # Mitad de resolución mínima
-                resolution_score = 60.0
-            else:
-                resolution_score = 30.0
+            resolution_score = float(resolution_scores(width, height, self.thresholds))
             
             # Determinar nivel y problemas
             level = self._determine_level(resolution_score)
@@ -482,7 +759,7 @@ class AspectRatioMetric(BaseMetric):
         super().__init__(thresholds)
         self.metric_type = MetricType.ASPECT_RATIO
     
-    async def calculate(self, image_info: Dict[str, Any]) -> MetricResult:
+    def compute(self, image_info: Dict[str, Any]) -> MetricResult:
         """Calcula score de aspect ratio"""
         try:
             width = image_info['width']
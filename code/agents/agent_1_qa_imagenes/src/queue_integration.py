@@ -4,16 +4,24 @@ Implementa interfaz para Agent Manager y Task Queue
 """
 
 import asyncio
+import csv
+import hashlib
 import json
 import uuid
-from typing import Dict, Any, List, Optional
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional
 from datetime import datetime
 from dataclasses import asdict
+import numpy as np
 from loguru import logger
 
 from src.image_quality_analyzer import ImageQualityAnalyzer, QualityAnalysisRequest, QualityAnalysisResult
 from config import AgentConfig
 from quality_metrics import MetricResult
+from bulk_pipeline import BulkQualityPipeline
+from catalog_watcher import CatalogWatcher
+from metric_matrix import refresh_metric_matrix
+from threshold_calibration import COMPONENTS, calibrate, component_scores
 
 # Imports del sistema de orquestación existente
 import sys
@@ -40,6 +48,7 @@ class ImageQAQueueIntegration:
             'calibrate_thresholds': self._handle_calibrate_thresholds,
             'bulk_quality_check': self._handle_bulk_quality_check
         }
+        self.event_listeners: List[Callable[[Dict[str, Any]], Any]] = []
         
         logger.info("ImageQAQueueIntegration inicializado")
 
@@ -234,47 +243,117 @@ class ImageQAQueueIntegration:
         }
 
     async def _handle_calibrate_thresholds(self, task_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Calibra umbrales basado en conjunto de imágenes de referencia"""
-        reference_images = task_data.get('reference_images', [])
-        quality_profiles = task_data.get('quality_profiles', {})
-        
-        if not reference_images:
-            raise ValueError("Se requiere conjunto de imágenes de referencia")
-        
-        # Analizar imágenes de referencia
-        requests = [QualityAnalysisRequest(image_path=img) for img in reference_images]
-        results = await self.analyzer.analyze_batch(requests)
-        
-        # Calcular estadísticas
-        brisque_scores = [r.brisque_score for r in results]
-        sharpness_scores = [r.sharpness_score for r in results]
-        resolution_scores = [r.resolution_score for r in results]
-        
-        # Calcular nuevos umbrales
-        new_thresholds = {
-            'brisque_excellent': max(15, min(30, min(brisque_scores))),
-            'brisque_good': max(25, min(45, max(brisque_scores))),
-            'brisque_fair': max(35, min(60, max(brisque_scores))),
-            'laplacian_excellent': max(400, min(800, max([r.sharpness_variance for r in results if r.sharpness_variance > 0]))),
-            'laplacian_good': max(200, min(500, min([r.sharpness_variance for r in results if r.sharpness_variance > 100]))),
-            'min_width': max(800, min(1200, min([r.width for r in results]))),
-            'min_height': max(600, min(900, min([r.height for r in results])))
-        }
+        """Calibra umbrales (y, con etiquetas, pesos y umbral de aprobado) sobre la matriz de métricas
+
+        Las métricas salen de los análisis ya guardados en el cache de
+        resultados, sin decodificar ninguna imagen. `reference_images` limita la
+        calibración a esas imágenes (solo se analizan las que no estén en el
+        cache); sin ella se usa todo lo analizado en modo completo con las
+        opciones por defecto y la configuración actual. `labels` ({ruta o hash:
+        aprobada}) o `labels_path` (JSON o CSV ruta,etiqueta) añaden curvas ROC,
+        pesos ajustados (`optimize_weights`) y el score mínimo de aprobado.
+        """
+        config = self.analyzer.config
+        reference_images = task_data.get('reference_images') or []
+        labels = {}
+        if task_data.get('labels_path'):
+            labels.update(self._load_calibration_labels(task_data['labels_path']))
+        labels.update(task_data.get('labels') or {})
+        
+        if reference_images:
+            # Siempre en modo completo: los análisis preview no entran en la matriz de métricas
+            requests = [QualityAnalysisRequest(image_path=img, analysis_options={'analysis_mode': 'full'})
+                        for img in reference_images]
+            reference_hashes = [r.image_hash for r in await self.analyzer.analyze_batch(requests)]
+        
+        matrix = await asyncio.to_thread(
+            refresh_metric_matrix,
+            self.analyzer.result_cache,
+            self.analyzer.metric_options_key(),
+            task_data.get('metric_matrix_path', config.metric_matrix_path)
+        )
+        if reference_images:
+            rows = matrix.rows_for(reference_hashes)
+            matrix = matrix.subset(np.unique(rows[rows >= 0]))
+        if len(matrix) == 0:
+            raise ValueError("No hay análisis guardados para calibrar: se requieren imágenes de referencia")
+        
+        label_values = label_rows = None
+        unmatched_labels = 0
+        if labels:
+            keys = list(labels)
+            rows = matrix.rows_for(keys)
+            found = rows >= 0
+            unmatched_labels = int((~found).sum())
+            label_rows = rows[found]
+            label_values = np.array([self._parse_calibration_label(labels[key])
+                                     for key, hit in zip(keys, found) if hit], dtype=bool)
+            if not len(label_rows):
+                raise ValueError("Ninguna imagen etiquetada está en la matriz de métricas")
+        
+        percentiles = task_data.get('percentiles')  # {umbral: [columna, percentil]}
+        report = await asyncio.to_thread(
+            calibrate,
+            matrix,
+            self.analyzer.thresholds,
+            self.analyzer.weights,
+            label_values,
+            label_rows,
+            {name: tuple(spec) for name, spec in percentiles.items()} if percentiles else None,
+            task_data.get('optimize_weights', True)
+        )
         
+        components = component_scores(matrix, self.analyzer.thresholds)
         return {
             'success': True,
-            'calibrated_thresholds': new_thresholds,
+            **report,
             'reference_analysis': {
-                'total_images': len(results),
-                'average_brisque': sum(brisque_scores) / len(brisque_scores),
-                'average_sharpness': sum(sharpness_scores) / len(sharpness_scores),
-                'average_resolution': sum(resolution_scores) / len(resolution_scores)
+                'total_images': len(matrix),
+                'average_brisque': float(matrix['brisque'].mean()),
+                'average_sharpness': float(components[:, COMPONENTS.index('sharpness')].mean()),
+                'average_resolution': float(components[:, COMPONENTS.index('resolution')].mean())
             },
+            'unmatched_labels': unmatched_labels,
             'recommendation': "Umbrales calibrados basado en imágenes de referencia. Validar con casos de uso específicos."
         }
 
+    def _load_calibration_labels(self, labels_path: str) -> Dict[str, Any]:
+        """Etiquetas de aprobado/rechazado desde JSON ({clave: etiqueta}) o CSV (clave,etiqueta)"""
+        path = Path(labels_path)
+        if path.suffix.lower() == '.json':
+            return json.loads(path.read_text())
+        labels = {}
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                if len(row) >= 2 and row[0].strip():
+                    labels[row[0].strip()] = row[1].strip()
+        # Cabecera opcional: su "etiqueta" no es un valor reconocible
+        first = next(iter(labels), None)
+        if first is not None:
+            try:
+                self._parse_calibration_label(labels[first])
+            except ValueError:
+                del labels[first]
+        return labels
+
+    def _parse_calibration_label(self, value: Any) -> bool:
+        """True si la imagen está aprobada (bool, número o texto como "pass"/"fail")"""
+        if isinstance(value, (bool, int, float)):
+            return bool(value)
+        text = str(value).strip().lower()
+        if text in ('pass', 'passed', 'ok', 'true', '1', 'yes', 'si', 'sí', 'aprobada', 'aprobado'):
+            return True
+        if text in ('fail', 'failed', 'rejected', 'false', '0', 'no', 'rechazada', 'rechazado'):
+            return False
+        raise ValueError(f"Etiqueta de calibración no reconocida: {value}")
+
     async def _handle_bulk_quality_check(self, task_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Verificación masiva de calidad para procesamiento de catálogos"""
+        """Verificación masiva de calidad para procesamiento de catálogos
+
+        Los resultados se escriben uno a uno en un JSONL y el progreso se guarda
+        en un checkpoint junto a él: repetir la tarea tras una interrupción
+        continúa donde se quedó (`resume: False` fuerza empezar de cero).
+        """
         image_directory = task_data.get('image_directory')
         output_report_path = task_data.get('output_report_path')
         quality_threshold = task_data.get('quality_threshold', 70.0)
@@ -283,63 +362,47 @@ class ImageQAQueueIntegration:
         if not image_directory:
             raise ValueError("Se requiere directorio de imágenes")
         
-        import os
-        from pathlib import Path
-        
-        # Buscar imágenes
-        image_dir = Path(image_directory)
-        if not image_dir.exists():
-            raise ValueError(f"Directorio no encontrado: {image_directory}")
-        
-        # Patrones de búsqueda
-        patterns = ['*.jpg', '*.jpeg', '*.png', '*.tiff', '*.bmp']
-        image_paths = []
-        
-        for pattern in patterns:
-            if recursive_search:
-                image_paths.extend(image_dir.rglob(pattern))
-            else:
-                image_paths.extend(image_dir.glob(pattern))
+        results_path = task_data.get('output_results_path') or self._bulk_results_path(image_directory, output_report_path)
+        
+        # Ventana acotada: suficiente para mantener ocupado el executor sin acumular resultados
+        concurrency = max(self.analyzer.config.max_concurrent_analyses, self.analyzer.executor.concurrency)
+        window = task_data.get('max_in_flight', concurrency * 4)
+        
+        async def analyze(path: Path) -> Dict[str, Any]:
+            result = await self.analyzer.analyze_image(QualityAnalysisRequest(image_path=str(path)))
+            return self._format_queue_result(result)
+        
+        pipeline = BulkQualityPipeline(
+            analyze,
+            image_directory,
+            results_path,
+            extensions=self.analyzer.config.supported_formats,
+            recursive=recursive_search,
+            quality_threshold=quality_threshold,
+            window=window,
+            fsync_every=task_data.get('fsync_every', 200),
+            fsync_interval=task_data.get('fsync_interval', 5.0),
+            progress_every=task_data.get('progress_every', 100),
+            on_progress=self._emit_event
+        )
+        checkpoint = await pipeline.run(resume=task_data.get('resume', True))
         
-        if not image_paths:
+        summary = checkpoint.summary
+        if summary.total_images == 0:
             raise ValueError(f"No se encontraron imágenes en {image_directory}")
         
-        logger.info(f"Encontradas {len(image_paths)} imágenes para análisis masivo")
-        
-        # Crear requests
-        requests = [QualityAnalysisRequest(image_path=str(path)) for path in image_paths]
-        
-        # Analizar en lotes para optimizar memoria
-        batch_size = 10
-        all_results = []
+        logger.info(f"Verificación masiva completada: {summary.total_images} imágenes "
+                    f"({pipeline.processed_this_run} en esta ejecución)")
         
-        for i in range(0, len(requests), batch_size):
-            batch = requests[i:i+batch_size]
-            batch_results = await self.analyzer.analyze_batch(batch)
-            all_results.extend(batch_results)
-        
-        # Clasificar resultados
-        high_quality = [r for r in all_results if r.overall_score >= quality_threshold]
-        medium_quality = [r for r in all_results if 50 <= r.overall_score < quality_threshold]
-        low_quality = [r for r in all_results if r.overall_score < 50]
-        
-        # Generar reporte
         report = {
-            'summary': {
-                'total_images': len(all_results),
-                'high_quality': len(high_quality),
-                'medium_quality': len(medium_quality),
-                'low_quality': len(low_quality),
-                'quality_threshold': quality_threshold,
-                'average_score': sum(r.overall_score for r in all_results) / len(all_results)
-            },
-            'high_quality_images': [str(Path(r.image_path).name) for r in high_quality],
-            'medium_quality_images': [str(Path(r.image_path).name) for r in medium_quality],
-            'low_quality_images': [str(Path(r.image_path).name) for r in low_quality],
-            'detailed_results': [self._format_queue_result(r) for r in all_results]
+            'summary': summary.to_report(quality_threshold),
+            'results_path': str(results_path),
+            'checkpoint_path': str(pipeline.checkpoint_path),
+            'started_at': checkpoint.started_at,
+            'completed_at': checkpoint.updated_at
         }
         
-        # Guardar reporte si se especifica ruta
+        # Guardar reporte si se especifica ruta (los resultados detallados quedan en el JSONL)
         if output_report_path:
             try:
                 with open(output_report_path, 'w') as f:
@@ -352,9 +415,55 @@ class ImageQAQueueIntegration:
             'success': True,
             'bulk_check_summary': report['summary'],
             'output_report_path': output_report_path,
-            'recommendations': self._generate_bulk_recommendations(low_quality, medium_quality)
+            'results_path': str(results_path),
+            'resumed_from': pipeline.resumed_from,
+            'processed_this_run': pipeline.processed_this_run,
+            'recommendations': self._generate_bulk_recommendations(summary.low_quality, summary.medium_quality)
         }
 
+    def _bulk_results_path(self, image_directory: str, output_report_path: Optional[str]) -> Path:
+        """JSONL de resultados: junto al reporte o, sin reporte, uno estable por directorio"""
+        if output_report_path:
+            return Path(output_report_path).with_suffix('.jsonl')
+        directory_id = hashlib.md5(str(Path(image_directory).resolve()).encode()).hexdigest()[:12]
+        return Path('reports') / f"bulk_quality_{directory_id}.jsonl"
+
+    def create_directory_watcher(self, image_directory: str, index_path: Optional[str] = None) -> CatalogWatcher:
+        """Watcher del directorio: analiza cada imagen nueva o modificada y emite `watch_result`"""
+        config = self.analyzer.config
+        if index_path is None:
+            directory_id = hashlib.md5(str(Path(image_directory).resolve()).encode()).hexdigest()[:12]
+            index_path = config.watch_index_path or str(Path('cache') / f"watch_{directory_id}.db")
+        
+        async def analyze(path: Path) -> Dict[str, Any]:
+            result = await self.analyzer.analyze_image(QualityAnalysisRequest(image_path=str(path)))
+            return self._format_queue_result(result)
+        
+        return CatalogWatcher(
+            analyze,
+            image_directory,
+            index_path,
+            extensions=config.supported_formats,
+            backend=config.watch_backend,
+            debounce=config.watch_debounce,
+            poll_interval=config.watch_poll_interval,
+            concurrency=max(config.max_concurrent_analyses, self.analyzer.executor.concurrency),
+            on_result=self._emit_event
+        )
+
+    def add_event_listener(self, listener: Callable[[Dict[str, Any]], Any]):
+        """Registra un receptor de eventos de progreso (función o corrutina)"""
+        self.event_listeners.append(listener)
+
+    async def _emit_event(self, event: Dict[str, Any]):
+        for listener in self.event_listeners:
+            try:
+                outcome = listener(event)
+                if asyncio.iscoroutine(outcome):
+                    await outcome
+            except Exception as e:
+                logger.warning(f"Error en receptor de eventos: {e}")
+
     def _format_queue_result(self, result: QualityAnalysisResult) -> Dict[str, Any]:
         """Formatea resultado para sistema de colas"""
         return {
@@ -371,6 +480,7 @@ class ImageQAQueueIntegration:
             },
             'issues': result.issues_detected,
             'recommendations': result.recommendations,
+            'duplicate_of': result.duplicate_of,
             'file_info': {
                 'file_size': result.file_size,
                 'format': result.image_format,
@@ -414,17 +524,17 @@ class ImageQAQueueIntegration:
         elif balance_score >= 60: return "Exposición aceptable con ligeras desviaciones"
         else: return "Problemas de exposición evidentes"
 
-    def _generate_bulk_recommendations(self, low_quality: List, medium_quality: List) -> List[str]:
-        """Genera recomendaciones para procesamiento masivo"""
+    def _generate_bulk_recommendations(self, low_quality: int, medium_quality: int) -> List[str]:
+        """Genera recomendaciones para procesamiento masivo a partir de los conteos"""
         recommendations = []
         
-        if len(low_quality) > 0:
-            recommendations.append(f"{len(low_quality)} imágenes requieren recaptura o reemplazo")
+        if low_quality > 0:
+            recommendations.append(f"{low_quality} imágenes requieren recaptura o reemplazo")
         
-        if len(medium_quality) > 0:
-            recommendations.append(f"{len(medium_quality)} imágenes podrían beneficiarse de post-procesamiento")
+        if medium_quality > 0:
+            recommendations.append(f"{medium_quality} imágenes podrían beneficiarse de post-procesamiento")
         
-        if len(low_quality) / (len(low_quality) + len(medium_quality)) > 0.3:
+        if low_quality and low_quality / (low_quality + medium_quality) > 0.3:
             recommendations.append("Alta proporción de imágenes de baja calidad - revisar proceso de captura")
         
         recommendations.append(f"Considerar establecer estándares de calidad más estrictos")
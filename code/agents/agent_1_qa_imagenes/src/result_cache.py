@@ -0,0 +1,187 @@
+"""
+Cache persistente de resultados de análisis
+Índice de firmas de fichero (inodo, mtime, tamaño) y resultados por hash de contenido en SQLite
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+HASH_CHUNK_SIZE = 1024 * 1024  # 1MB por lectura al calcular el hash
+
+# Firma de un fichero en disco: (inodo, mtime en ns, tamaño)
+StatSignature = Tuple[int, int, int]
+
+
+def stat_signature(stat: os.stat_result) -> StatSignature:
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def new_content_hasher():
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_bytes(data: bytes) -> str:
+    """Hash de contenido de una imagen en memoria"""
+    hasher = new_content_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def read_and_hash(path: Path, chunk_size: int = HASH_CHUNK_SIZE) -> Tuple[bytes, str]:
+    """Lee un fichero por bloques calculando su hash en la misma pasada"""
+    hasher = new_content_hasher()
+    chunks = []
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+            chunks.append(chunk)
+    return b"".join(chunks), hasher.hexdigest()
+
+
+class ResultCache:
+    """Resultados de análisis persistidos en SQLite
+
+    `signatures` relaciona cada ruta con la firma de su fichero y el hash de su
+    contenido: si la firma no cambió, el resultado se recupera sin leer la
+    imagen. `results` guarda los resultados por hash de contenido y clave de
+    opciones, de modo que un fichero renombrado o copiado sigue acertando y uno
+    editado con el mismo tamaño no devuelve un resultado obsoleto.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        # Sin ruta se usa una base de datos en memoria (no sobrevive a reinicios)
+        self.db_path = db_path or ":memory:"
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        if db_path:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+
+        self.stats = {"signature_hits": 0, "content_hits": 0, "misses": 0, "stores": 0}
+
+    def _create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS signatures (
+                    path TEXT PRIMARY KEY,
+                    inode INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    content_hash TEXT NOT NULL,
+                    options_key TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (content_hash, options_key)
+                )
+            """)
+
+    def lookup_signature(self, path: str, signature: StatSignature) -> Optional[str]:
+        """Hash de contenido conocido para la ruta si su firma no ha cambiado"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT inode, mtime_ns, size, content_hash FROM signatures WHERE path = ?",
+                (path,)
+            ).fetchone()
+        if row is None or tuple(row[:3]) != signature:
+            return None
+        return row[3]
+
+    def record_signature(self, path: str, signature: StatSignature, content_hash: str):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO signatures (path, inode, mtime_ns, size, content_hash) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (path, *signature, content_hash)
+            )
+
+    def get(self, content_hash: str, options_key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT result FROM results WHERE content_hash = ? AND options_key = ?",
+                (content_hash, options_key)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError as e:
+            logger.warning(f"Resultado en cache corrupto para {content_hash}, se recalculará: {e}")
+            return None
+
+    def put(self, content_hash: str, options_key: str, result: Dict[str, Any]):
+        self.put_many([(content_hash, options_key, result)])
+
+    def put_many(self, entries: Iterable[Tuple[str, str, Dict[str, Any]]]):
+        """Guarda varios resultados en una sola transacción"""
+        now = time.time()
+        rows = [(h, k, json.dumps(r, ensure_ascii=False, default=str), now) for h, k, r in entries]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results (content_hash, options_key, result, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                rows
+            )
+        self.stats["stores"] += len(rows)
+
+    def iter_fields(self, fields: Sequence[str], options_key: str, created_after: float = 0.0,
+                    batch_size: int = 50_000) -> Iterator[List[Tuple[Any, ...]]]:
+        """Campos de los resultados de `options_key` guardados después de `created_after`, por lotes
+
+        Cada fila es (hash, created_at, *campos). Los campos se extraen con las
+        funciones JSON de SQLite, sin decodificar el resultado completo en Python.
+        Solo los resultados de una misma clave de opciones son comparables: otro
+        modo, otras opciones u otra versión de las métricas dan otras escalas.
+        """
+        columns = ", ".join(f"json_extract(result, '$.{field}')" for field in fields)
+        last_rowid = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT rowid, content_hash, created_at, {columns} FROM results "
+                    "WHERE options_key = ? AND created_at > ? AND rowid > ? ORDER BY rowid LIMIT ?",
+                    (options_key, created_after, last_rowid, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            yield [row[1:] for row in rows]
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM signatures")
+            self.conn.execute("DELETE FROM results")
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["signature_hits"] + self.stats["content_hits"] + self.stats["misses"]
+        hits = self.stats["signature_hits"] + self.stats["content_hits"]
+        return {
+            **self.stats,
+            "stored_results": self.count(),
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "db_path": self.db_path
+        }
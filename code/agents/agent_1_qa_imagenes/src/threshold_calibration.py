@@ -0,0 +1,211 @@
+"""
+Calibración de umbrales y pesos sobre la matriz de métricas
+Percentiles, curvas ROC frente a etiquetas de aprobado/rechazado y ajuste de QualityWeights, todo vectorizado
+"""
+
+from dataclasses import asdict, dataclass, fields, replace
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from config import QualityThresholds, QualityWeights
+from metric_matrix import MetricMatrix
+from quality_metrics import resolution_scores, sharpness_scores
+
+# Umbral -> (columna de la matriz, percentil sobre las imágenes de referencia)
+DEFAULT_PERCENTILES = {
+    'brisque_excellent': ('brisque', 25),
+    'brisque_good': ('brisque', 50),
+    'brisque_fair': ('brisque', 75),
+    'laplacian_excellent': ('sharpness_variance', 75),
+    'laplacian_good': ('sharpness_variance', 50),
+    'laplacian_fair': ('sharpness_variance', 25),
+    'min_width': ('width', 5),
+    'min_height': ('height', 5)
+}
+
+# Componentes del score final en el orden de QualityWeights
+WEIGHT_FIELDS = tuple(f.name for f in fields(QualityWeights))
+COMPONENTS = tuple(name.removesuffix('_weight') for name in WEIGHT_FIELDS)
+
+ROC_POINTS = 101  # puntos de la curva incluidos en el informe
+
+
+@dataclass
+class RocCurve:
+    """Curva ROC de un score (mayor = aprobado) frente a etiquetas binarias"""
+    thresholds: np.ndarray  # de mayor a menor; un score >= umbral se considera aprobado
+    tpr: np.ndarray
+    fpr: np.ndarray
+    auc: float
+
+    def best_threshold(self) -> Tuple[float, float, float]:
+        """Umbral que maximiza el índice de Youden (TPR - FPR), con su TPR y FPR"""
+        best = int(np.argmax(self.tpr - self.fpr))
+        return float(self.thresholds[best]), float(self.tpr[best]), float(self.fpr[best])
+
+    def to_dict(self, points: int = ROC_POINTS) -> Dict[str, Any]:
+        """Resumen serializable; con `points` incluye la curva muestreada en ese número de puntos"""
+        threshold, tpr, fpr = self.best_threshold()
+        data = {'auc': self.auc, 'best_threshold': threshold, 'tpr': tpr, 'fpr': fpr}
+        if points:
+            sample = np.unique(np.linspace(0, len(self.tpr) - 1, min(points, len(self.tpr))).astype(int))
+            data['curve'] = {
+                'thresholds': self.thresholds[sample].tolist(),
+                'tpr': self.tpr[sample].tolist(),
+                'fpr': self.fpr[sample].tolist()
+            }
+        return data
+
+
+def roc_curve(scores: np.ndarray, labels: np.ndarray) -> RocCurve:
+    """Barrido de todos los umbrales de una vez: orden descendente y sumas acumuladas"""
+    labels = np.asarray(labels, dtype=bool)
+    positives = int(labels.sum())
+    negatives = len(labels) - positives
+    if positives == 0 or negatives == 0:
+        raise ValueError("La curva ROC requiere imágenes etiquetadas como aprobadas y como rechazadas")
+
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")
+    ordered = np.asarray(scores, dtype=np.float64)[order]
+    true_positives = np.cumsum(labels[order])
+    # Último índice de cada valor distinto: los empates se aprueban o rechazan juntos
+    distinct = np.r_[np.flatnonzero(np.diff(ordered)), len(ordered) - 1]
+    tpr = true_positives[distinct] / positives
+    fpr = (distinct + 1 - true_positives[distinct]) / negatives
+    # Punto inicial (nada aprobado, umbral por encima del máximo) para que el área cubra toda la curva
+    tpr = np.r_[0.0, tpr]
+    fpr = np.r_[0.0, fpr]
+    thresholds = np.r_[np.nextafter(ordered[0], np.inf), ordered[distinct]]
+    auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+    return RocCurve(thresholds, tpr, fpr, auc)
+
+
+def component_scores(matrix: MetricMatrix, thresholds: QualityThresholds) -> np.ndarray:
+    """Scores (0-100) de cada componente del score final, una columna por campo de QualityWeights
+
+    Nitidez y resolución se recalculan con `thresholds`; BRISQUE, exposición y
+    aspect ratio no dependen de los umbrales y salen de los valores guardados.
+    """
+    return np.column_stack([
+        np.maximum(0.0, 100.0 - matrix['brisque']),
+        sharpness_scores(matrix['sharpness_variance'], thresholds),
+        matrix['exposure_score'],
+        resolution_scores(matrix['width'], matrix['height'], thresholds),
+        matrix['aspect_ratio_score']
+    ])
+
+
+def weight_vector(weights: QualityWeights) -> np.ndarray:
+    return np.array([getattr(weights, name) for name in WEIGHT_FIELDS])
+
+
+def percentile_thresholds(matrix: MetricMatrix, base: QualityThresholds,
+                          percentiles: Optional[Dict[str, Tuple[str, float]]] = None) -> QualityThresholds:
+    """Umbrales en los percentiles indicados de las imágenes de referencia (un np.percentile por columna)"""
+    percentiles = percentiles or DEFAULT_PERCENTILES
+    by_column: Dict[str, list] = {}
+    for name, (column, percentile) in percentiles.items():
+        by_column.setdefault(column, []).append((name, percentile))
+
+    values = {}
+    for column, entries in by_column.items():
+        results = np.percentile(matrix[column], [percentile for _, percentile in entries])
+        values.update({name: float(result) for (name, _), result in zip(entries, results)})
+    for name in ('min_width', 'min_height'):
+        if name in values:
+            values[name] = int(values[name])
+    return replace(base, **values)
+
+
+def optimize_weights(components: np.ndarray, labels: np.ndarray, initial: QualityWeights,
+                     iterations: int = 300, learning_rate: float = 0.5, l2: float = 1e-3) -> QualityWeights:
+    """Pesos no negativos que mejor separan aprobadas de rechazadas
+
+    Regresión logística con gradiente proyectado (pesos >= 0) sobre los scores
+    de componentes escalados a 0-1, con las clases equilibradas para que un
+    conjunto con pocas rechazadas no dé pesos triviales. El resultado se
+    normaliza para sumar 1, como los pesos por defecto: solo importa la
+    proporción entre componentes.
+    """
+    labels = np.asarray(labels, dtype=np.float64)
+    features = components / 100.0
+    mean = features.mean(axis=0)
+    centered = features - mean
+    # Cada clase pesa la mitad de la pérdida
+    sample_weight = np.where(labels > 0, 0.5 / labels.sum(), 0.5 / (len(labels) - labels.sum()))
+
+    w = weight_vector(initial) * 4.0
+    bias = 0.0
+    for _ in range(iterations):
+        probability = 1.0 / (1.0 + np.exp(-(centered @ w + bias)))
+        error = (probability - labels) * sample_weight
+        w = np.maximum(0.0, w - learning_rate * (centered.T @ error + l2 * w))
+        bias -= learning_rate * error.sum()
+
+    if w.sum() <= 0:
+        return initial
+    w = w / w.sum()
+    return QualityWeights(**{name: round(float(value), 4) for name, value in zip(WEIGHT_FIELDS, w)})
+
+
+def calibrate(matrix: MetricMatrix,
+              thresholds: QualityThresholds,
+              weights: QualityWeights,
+              labels: Optional[np.ndarray] = None,
+              labeled_rows: Optional[np.ndarray] = None,
+              percentiles: Optional[Dict[str, Tuple[str, float]]] = None,
+              fit_weights: bool = True) -> Dict[str, Any]:
+    """Calibra umbrales (y, con etiquetas, pesos y umbral de aprobado) sobre la matriz de métricas
+
+    Sin etiquetas los umbrales se toman de los percentiles de todas las
+    imágenes. Con etiquetas, de los percentiles de las aprobadas; además se
+    calcula la ROC de cada componente y del score final, y el umbral de score
+    que mejor separa aprobadas de rechazadas.
+    """
+    if len(matrix) == 0:
+        raise ValueError("La matriz de métricas está vacía")
+
+    report: Dict[str, Any] = {'total_images': len(matrix)}
+    if labels is None:
+        calibrated = percentile_thresholds(matrix, thresholds, percentiles)
+        report['calibrated_thresholds'] = asdict(calibrated)
+        return report
+
+    labels = np.asarray(labels, dtype=bool)
+    labeled = matrix.subset(labeled_rows)
+    passed = labeled.subset(labels)
+    if len(passed) == 0:
+        raise ValueError("Ninguna imagen etiquetada como aprobada")
+    calibrated = percentile_thresholds(passed, thresholds, percentiles)
+
+    components = component_scores(labeled, calibrated)
+    roc = {name: roc_curve(components[:, i], labels).to_dict(points=0)
+           for i, name in enumerate(COMPONENTS)}
+    # BRISQUE y nitidez en bruto: umbral de aceptación directo sobre el valor medido
+    roc['brisque_value'] = _negated(roc_curve(-labeled['brisque'], labels)).to_dict(points=0)
+    roc['sharpness_variance'] = roc_curve(labeled['sharpness_variance'], labels).to_dict(points=0)
+
+    current = roc_curve(components @ weight_vector(weights), labels)
+    report.update({
+        'labeled_images': len(labeled),
+        'passed_images': len(passed),
+        'calibrated_thresholds': asdict(calibrated),
+        'metric_roc': roc,
+        'current_weights': {**asdict(weights), 'auc': current.auc}
+    })
+
+    final = current
+    if fit_weights:
+        fitted_weights = optimize_weights(components, labels, weights)
+        final = roc_curve(components @ weight_vector(fitted_weights), labels)
+        report['calibrated_weights'] = {**asdict(fitted_weights), 'auc': final.auc}
+
+    report['overall_roc'] = final.to_dict()
+    report['pass_threshold'] = final.best_threshold()[0]
+    return report
+
+
+def _negated(curve: RocCurve) -> RocCurve:
+    """ROC calculada sobre el valor negado (menor es mejor): umbrales en la escala original, aprobado si valor <= umbral"""
+    return replace(curve, thresholds=-curve.thresholds)
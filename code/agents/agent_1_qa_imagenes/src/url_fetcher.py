@@ -0,0 +1,260 @@
+"""
+Descarga de imágenes por URL
+Sesión HTTP compartida con límites de conexiones, descarga en streaming acotada y cache condicional (ETag/Last-Modified)
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+from result_cache import new_content_hasher
+
+
+@dataclass
+class CachedUrl:
+    """Validadores HTTP de la última descarga de una URL"""
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: str
+
+
+@dataclass
+class FetchedImage:
+    """Imagen descargada (o revalidada) con el hash de su contenido"""
+    data: bytes  # bytearray en descargas: se decodifica sin copiarlo
+    content_hash: str
+    url: str
+    revalidated: bool = False  # 304: el cuerpo sale del cache local
+
+
+class UrlCache:
+    """Cuerpos descargados y sus validadores, para pedir solo lo que haya cambiado
+
+    Los metadatos van en SQLite y los cuerpos en ficheros por hash de
+    contenido (varias URLs con la misma imagen comparten fichero). Al pasar de
+    `max_bytes` se eliminan las entradas usadas hace más tiempo.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.directory / "index.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS urls (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+
+    def _body_path(self, content_hash: str) -> Path:
+        return self.directory / content_hash[:2] / content_hash
+
+    def lookup(self, url: str) -> Optional[CachedUrl]:
+        """Validadores de la URL si su cuerpo sigue en disco"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified, content_hash FROM urls WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None or not self._body_path(row[2]).exists():
+            return None
+        return CachedUrl(*row)
+
+    def read(self, url: str, content_hash: str) -> Optional[bytes]:
+        try:
+            data = self._body_path(content_hash).read_bytes()
+        except FileNotFoundError:
+            return None
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE urls SET accessed_at = ? WHERE url = ?", (time.time(), url))
+        return data
+
+    def store(self, url: str, etag: Optional[str], last_modified: Optional[str], content_hash: str, data: bytes):
+        path = self._body_path(content_hash)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_name(path.name + ".tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO urls (url, etag, last_modified, content_hash, size, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, content_hash, len(data), time.time())
+            )
+        self._evict()
+
+    def _evict(self):
+        """Elimina las entradas menos usadas hasta volver por debajo de `max_bytes`"""
+        with self.lock:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM urls").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self.conn.execute("SELECT url, content_hash, size FROM urls ORDER BY accessed_at").fetchall()
+            removed = []
+            for url, content_hash, size in rows:
+                if total <= self.max_bytes:
+                    break
+                removed.append((url, content_hash))
+                total -= size
+            with self.conn:
+                self.conn.executemany("DELETE FROM urls WHERE url = ?", [(url,) for url, _ in removed])
+            for _, content_hash in removed:
+                still_used = self.conn.execute(
+                    "SELECT 1 FROM urls WHERE content_hash = ? LIMIT 1", (content_hash,)
+                ).fetchone()
+                if not still_used:
+                    self._body_path(content_hash).unlink(missing_ok=True)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class ImageFetcher:
+    """Descarga imágenes con una sesión aiohttp compartida
+
+    El conector reutiliza conexiones (DNS, TCP y TLS se pagan una vez por
+    host) y limita las conexiones totales y por host, de modo que un lote de
+    URLs del mismo CDN no abre cientos de sockets. El cuerpo se lee por bloques
+    y la descarga se corta al pasar de `max_bytes`. Con cache, las URLs ya
+    descargadas se piden con If-None-Match/If-Modified-Since y un 304 se sirve
+    desde disco.
+    """
+
+    def __init__(self, max_bytes: int, max_connections: int = 64, max_per_host: int = 8,
+                 timeout: float = 30.0, connect_timeout: float = 10.0,
+                 cache: Optional[UrlCache] = None, chunk_size: int = 256 * 1024):
+        self.max_bytes = max_bytes
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.cache = cache
+        self.chunk_size = chunk_size
+
+        self.session = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {"downloads": 0, "revalidated": 0, "bytes_downloaded": 0, "oversize_aborted": 0}
+
+    async def _get_session(self):
+        """Sesión del event loop actual (una sesión no puede usarse desde otro loop)"""
+        loop = asyncio.get_running_loop()
+        if self.session is not None and not self.session.closed and self._loop is loop:
+            return self.session
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError("aiohttp requerido para cargar imágenes desde URL")
+
+        previous, previous_loop = self.session, self._loop
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_per_host,
+            ttl_dns_cache=300
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=self.connect_timeout)
+        )
+        self._loop = loop
+        if previous is not None:
+            await self._close_session(previous, previous_loop)
+        return self.session
+
+    @staticmethod
+    async def _close_session(session, loop: Optional[asyncio.AbstractEventLoop]):
+        """Cierra una sesión en el event loop al que pertenece"""
+        if session.closed:
+            return
+        if loop is asyncio.get_running_loop():
+            await session.close()
+        elif loop is not None and loop.is_running():
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), loop))
+        else:
+            # Su loop ya terminó y cerró las conexiones: solo queda soltar el conector
+            session.detach()
+
+    async def fetch(self, url: str, conditional: bool = True) -> FetchedImage:
+        session = await self._get_session()
+        cached = None
+        if self.cache and conditional:
+            cached = await asyncio.to_thread(self.cache.lookup, url)
+        headers = {}
+        if cached:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and cached:
+                data = await asyncio.to_thread(self.cache.read, url, cached.content_hash)
+                if data is not None:
+                    self.stats["revalidated"] += 1
+                    return FetchedImage(data, cached.content_hash, url, revalidated=True)
+            elif response.status == 200:
+                data, content_hash = await self._read_body(response)
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+                if self.cache and (etag or last_modified):
+                    await asyncio.to_thread(self.cache.store, url, etag, last_modified, content_hash, data)
+                return FetchedImage(data, content_hash, url)
+            else:
+                raise ValueError(f"Error HTTP {response.status} al descargar imagen")
+
+        # 304 pero el cuerpo ya no está en disco: se pide de nuevo sin validadores
+        return await self.fetch(url, conditional=False)
+
+    async def _read_body(self, response):
+        """Lee el cuerpo por bloques calculando su hash; corta al pasar de `max_bytes`"""
+        length = response.content_length
+        if length is not None and length > self.max_bytes:
+            self.stats["oversize_aborted"] += 1
+            raise ValueError(f"Imagen demasiado grande: {length} bytes")
+
+        buffer = bytearray()
+        hasher = new_content_hasher()
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            if len(buffer) + len(chunk) > self.max_bytes:
+                self.stats["oversize_aborted"] += 1
+                raise ValueError(f"Imagen demasiado grande: más de {self.max_bytes} bytes")
+            buffer += chunk
+            hasher.update(chunk)
+
+        self.stats["downloads"] += 1
+        self.stats["bytes_downloaded"] += len(buffer)
+        return buffer, hasher.hexdigest()
+
+    async def aclose(self):
+        """Cierra la sesión HTTP (esperando a que suelte sus conexiones) y el cache de URLs"""
+        session, self.session = self.session, None
+        if session is not None:
+            await self._close_session(session, self._loop)
+        self._loop = None
+        if self.cache:
+            self.cache.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "max_connections": self.max_connections,
+            "max_per_host": self.max_per_host,
+            "conditional_cache": str(self.cache.directory) if self.cache else None
+        }
@@ -9,6 +9,9 @@ import numpy as np
 import cv2
 import tempfile
 import os
+import math
+import json
+from dataclasses import replace
 from pathlib import Path
 from unittest.mock import AsyncMock, patch
 
@@ -19,18 +22,27 @@ sys.path.append(str(Path(__file__).parent / "api"))
 
 from config import AgentConfig, QualityThresholds, QualityWeights
 from src.image_quality_analyzer import ImageQualityAnalyzer, QualityAnalysisRequest
-from src.quality_metrics import BRISQUEMetric, SharpnessMetric, ExposureMetric, ResolutionMetric, AspectRatioMetric
+from src.quality_metrics import BRISQUEMetric, SharpnessMetric, ExposureMetric, ResolutionMetric, AspectRatioMetric, ImageContext, PreviewCalibration, TiledImageContext, TilingConfig
+from src.analysis_executor import preview_reduction
+from src.nss_quality import NUM_FEATURES, fit_aggd, fit_ggd, nss_features
+from src.queue_integration import ImageQAQueueIntegration
+from src.perceptual_index import PerceptualIndex, Fingerprint, hamming
+from src.batch_stream import MultipartSpooler, stream_batch_analysis
+from src.threshold_calibration import roc_curve
 
 class TestImageQualityAnalyzer:
     """Tests para ImageQualityAnalyzer"""
     
     @pytest.fixture
-    def config(self):
+    def config(self, tmp_path):
         """Configuración de test"""
         return AgentConfig(
             agent_id="test_qa_analyzer",
             max_concurrent_analyses=2,
-            analysis_timeout=10
+            analysis_timeout=10,
+            result_cache_path=str(tmp_path / "results.db"),
+            duplicate_index_path=str(tmp_path / "perceptual.db"),
+            url_cache_dir=str(tmp_path / "url_cache")
         )
     
     @pytest.fixture
@@ -241,6 +253,491 @@ class TestImageQualityAnalyzer:
         # El cache se llena durante análisis, verificar que se puede limpiar
         analyzer.clear_cache()
         assert len(analyzer.analysis_cache) == 0
+    
+    @pytest.mark.asyncio
+    async def test_persistent_cache(self, config, sample_image, tmp_path):
+        """Test cache persistente: firma sin lectura, renombrado y edición con mismo tamaño"""
+        image_path = tmp_path / "watch.png"
+        cv2.imwrite(str(image_path), sample_image)
+        
+        first = await ImageQualityAnalyzer(config).analyze_image(QualityAnalysisRequest(image_path=str(image_path)))
+        
+        # Otra instancia (reinicio): la firma no cambió y no se lee el fichero
+        analyzer = ImageQualityAnalyzer(config)
+        with patch("src.image_quality_analyzer.read_and_hash", side_effect=AssertionError("no debe leerse")):
+            cached = await analyzer.analyze_image(QualityAnalysisRequest(image_path=str(image_path)))
+        assert cached.overall_score == first.overall_score
+        assert cached.image_hash == first.image_hash
+        assert analyzer.result_cache.stats["signature_hits"] == 1
+        
+        # Fichero renombrado: acierta por hash de contenido
+        renamed = tmp_path / "renamed.png"
+        image_path.rename(renamed)
+        result = await analyzer.analyze_image(QualityAnalysisRequest(image_path=str(renamed)))
+        assert result.image_path == str(renamed)
+        assert analyzer.result_cache.stats["content_hits"] == 1
+        
+        # Edición en el sitio con el mismo tamaño: se vuelve a analizar
+        data = bytearray(renamed.read_bytes())
+        data[-20] ^= 0xFF
+        renamed.write_bytes(bytes(data))
+        os.utime(renamed, ns=(0, 10 ** 9))
+        analyzer.analysis_cache.clear()
+        try:
+            await analyzer.analyze_image(QualityAnalysisRequest(image_path=str(renamed)))
+        except ValueError:
+            pass  # el byte alterado puede dejar la imagen ilegible
+        assert analyzer.result_cache.stats["misses"] == 1
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("backend", ["inline", "process"])
+    async def test_executor_backends(self, config, sample_image, backend):
+        """Test backends de ejecución: mismos resultados que el pool de hilos por defecto"""
+        _, encoded_img = cv2.imencode('.png', sample_image)
+        request = QualityAnalysisRequest(image_data=encoded_img.tobytes())
+        
+        expected = await ImageQualityAnalyzer(replace(config, result_cache_path=None)).analyze_image(request)
+        
+        analyzer = ImageQualityAnalyzer(replace(config, result_cache_path=None,
+                                                executor_backend=backend, executor_workers=2))
+        try:
+            result = await analyzer.analyze_image(request)
+        finally:
+            await analyzer.shutdown()
+        
+        assert analyzer.executor.backend == backend
+        assert result.overall_score == pytest.approx(expected.overall_score)
+        assert result.sharpness_variance == pytest.approx(expected.sharpness_variance)
+        assert (result.width, result.height) == (600, 800)
+
+    @pytest.mark.asyncio
+    async def test_preview_mode(self, config, tmp_path):
+        """Test modo preview: imagen reducida, dimensiones originales y escalado cerca de umbrales"""
+        rng = np.random.default_rng(0)
+        image = cv2.GaussianBlur(rng.integers(0, 255, (1800, 2400, 3), dtype=np.uint8), (0, 0), 2)
+        image_path = tmp_path / "large.jpg"
+        cv2.imwrite(str(image_path), image)
+        request = QualityAnalysisRequest(image_path=str(image_path), analysis_options={"analysis_mode": "preview"})
+        
+        analyzer = ImageQualityAnalyzer(replace(config, preview_max_side=512, preview_escalation_margin=0.0))
+        result = await analyzer.analyze_image(request)
+        assert result.analysis_mode == "preview"
+        assert (result.width, result.height) == (2400, 1800)
+        assert analyzer.get_performance_stats()['preview_analyses'] == 1
+        
+        # Con un margen que cubre todos los scores se escala siempre a análisis completo
+        analyzer = ImageQualityAnalyzer(replace(config, preview_max_side=512, preview_escalation_margin=100.0,
+                                                result_cache_path=None))
+        escalated = await analyzer.analyze_image(request)
+        assert escalated.analysis_mode == "full"
+        assert analyzer.get_performance_stats()['preview_escalation_rate'] == 1.0
+        
+        with pytest.raises(ValueError):
+            await analyzer.analyze_image(QualityAnalysisRequest(
+                image_path=str(image_path), analysis_options={"analysis_mode": "rapido"}
+            ))
+
+    @pytest.mark.asyncio
+    async def test_bulk_quality_check_resume(self, analyzer, sample_image, tmp_path):
+        """Test verificación masiva: JSONL en orden, checkpoint y reanudación sin repetir imágenes"""
+        catalog = tmp_path / "catalog"
+        for i in range(12):
+            directory = catalog / f"lote_{i % 3}"
+            directory.mkdir(parents=True, exist_ok=True)
+            cv2.imwrite(str(directory / f"img_{i:02d}.jpg"), sample_image)
+        (catalog / "notas.txt").write_text("no es una imagen")
+
+        integration = ImageQAQueueIntegration(analyzer)
+        events = []
+        integration.add_event_listener(events.append)
+        task = {
+            'image_directory': str(catalog),
+            'output_report_path': str(tmp_path / "report.json"),
+            'max_in_flight': 3,
+            'fsync_every': 2,
+            'progress_every': 1
+        }
+
+        class Crash(BaseException):
+            pass
+
+        original = analyzer.analyze_image
+        calls = 0
+
+        async def crashing_analyze(request):
+            nonlocal calls
+            calls += 1
+            if calls > 5:
+                raise Crash()
+            return await original(request)
+
+        with patch.object(analyzer, 'analyze_image', side_effect=crashing_analyze):
+            with pytest.raises(Crash):
+                await integration._handle_bulk_quality_check(task)
+
+        # Escrituras posteriores al último checkpoint (caída antes del fsync) se descartan al reanudar
+        results_path = tmp_path / "report.jsonl"
+        with open(results_path, 'a') as f:
+            f.write('{"image": "parcial"\n')
+
+        result = await integration._handle_bulk_quality_check(task)
+        assert result['success']
+        assert result['resumed_from'] is not None
+        assert result['processed_this_run'] < 12
+        assert result['bulk_check_summary']['total_images'] == 12
+
+        lines = [json.loads(line) for line in results_path.read_text().splitlines()]
+        images = [line['image'] for line in lines]
+        assert images == sorted(images) and len(set(images)) == 12
+        assert events and events[-1]['completed']
+
+        # Una ejecución completada no se reanuda: se vuelve a empezar
+        rerun = await integration._handle_bulk_quality_check(task)
+        assert rerun['resumed_from'] is None
+        assert rerun['processed_this_run'] == 12
+
+    @pytest.mark.asyncio
+    async def test_tiled_analysis(self, config, tmp_path):
+        """Test análisis por teselas: mismas métricas que el completo y peor región localizada"""
+        rng = np.random.default_rng(3)
+        texture = sum(cv2.resize(rng.normal(0, 1, (cells * 3, cells * 4)).astype(np.float32), (1200, 900),
+                                 interpolation=cv2.INTER_CUBIC) for cells in (4, 16, 64, 256))
+        image = cv2.cvtColor(np.clip(128 + 25 * texture, 0, 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+        # Esquina superior derecha desenfocada (una tesela de 300x300)
+        image[:300, 900:] = cv2.GaussianBlur(image[:300, 900:], (0, 0), 6)
+        image_path = tmp_path / "grande.png"
+        cv2.imwrite(str(image_path), image)
+        request = QualityAnalysisRequest(image_path=str(image_path))
+        
+        full = await ImageQualityAnalyzer(replace(config, tiled_min_pixels=None)).analyze_image(request)
+        tiled_config = replace(config, tiled_min_pixels=0, tile_size=300, result_cache_path=None)
+        tiled = await ImageQualityAnalyzer(tiled_config).analyze_image(request)
+        
+        assert full.worst_region is None
+        assert tiled.sharpness_variance == pytest.approx(full.sharpness_variance, rel=0.01)
+        assert tiled.exposure_balance_score == pytest.approx(full.exposure_balance_score, abs=1)
+        assert (tiled.width, tiled.height) == (1200, 900)
+        assert (tiled.worst_region['x'], tiled.worst_region['y']) == (900, 0)
+        assert any("Zona desenfocada" in issue for issue in tiled.issues_detected)
+        
+        # Con un presupuesto de píxeles menor que la imagen se decodifica reducida, sin ser preview
+        budget = ImageQualityAnalyzer(replace(tiled_config, tiled_max_pixels=300_000))
+        reduced = await budget.analyze_image(request)
+        assert reduced.analysis_mode == "full"
+        assert reduced.decode_reduction == 2
+        assert (reduced.width, reduced.height) == (1200, 900)
+        assert reduced.worst_region['width'] == 600
+
+    @pytest.mark.asyncio
+    async def test_near_duplicate_reuse(self, config, tmp_path):
+        """Test casi-duplicados: se reutiliza el análisis solo si el resultado sería el mismo"""
+        def texture(seed):
+            rng = np.random.default_rng(seed)
+            layers = sum(cv2.resize(rng.normal(0, 1, (cells * 3, cells * 4)).astype(np.float32), (800, 600),
+                                    interpolation=cv2.INTER_CUBIC) for cells in (4, 16, 64))
+            return cv2.cvtColor(np.clip(128 + 25 * layers, 0, 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+        
+        base = texture(1)
+        paths = [tmp_path / name for name in ("a.jpg", "b.jpg", "c.jpg", "d.jpg")]
+        cv2.imwrite(str(paths[0]), base, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        cv2.imwrite(str(paths[1]), base, [cv2.IMWRITE_JPEG_QUALITY, 90])  # recompresión
+        cv2.imwrite(str(paths[2]), texture(2), [cv2.IMWRITE_JPEG_QUALITY, 95])  # otra imagen
+        cv2.imwrite(str(paths[3]), cv2.add(base, 40), [cv2.IMWRITE_JPEG_QUALITY, 95])  # más brillante
+        
+        analyzer = ImageQualityAnalyzer(config)
+        results = await analyzer.analyze_batch([QualityAnalysisRequest(image_path=str(p)) for p in paths])
+        
+        assert results[0].duplicate_of is None
+        assert results[1].duplicate_of == str(paths[0])
+        assert results[1].image_path == str(paths[1])
+        assert results[1].overall_score == results[0].overall_score
+        assert results[2].duplicate_of is None
+        # Mismo contenido perceptual pero otra exposición: se agrupa pero se analiza
+        assert results[3].duplicate_of is None
+        assert analyzer.get_performance_stats()['duplicate_reuses'] == 1
+        
+        clusters = analyzer.get_duplicate_clusters()
+        assert len(clusters) == 1
+        assert {image['path'] for image in clusters[0]['images']} == {str(paths[0]), str(paths[1]), str(paths[3])}
+        
+        # El índice y los clusters sobreviven a reinicios
+        await analyzer.shutdown()
+        reloaded = PerceptualIndex(config.duplicate_index_path)
+        assert len(reloaded) == 4
+        assert reloaded.clusters() == clusters
+        
+        # Sin reutilización cada imagen se analiza aunque sea casi idéntica
+        cv2.imwrite(str(tmp_path / "e.jpg"), base, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        fresh = ImageQualityAnalyzer(config)
+        result = await fresh.analyze_image(QualityAnalysisRequest(
+            image_path=str(tmp_path / "e.jpg"), analysis_options={'duplicate_policy': 'index'}
+        ))
+        assert result.duplicate_of is None
+        assert len(fresh.get_duplicate_clusters()[0]['images']) == 4
+    
+    @pytest.mark.asyncio
+    async def test_streaming_batch(self, analyzer, sample_image, tmp_path):
+        """Test lote en streaming: cada fichero se analiza en cuanto llega, sin esperar al resto"""
+        boundary = "qa-test-boundary"
+        encoded = cv2.imencode('.png', sample_image)[1].tobytes()
+        
+        def part(name, content, filename=None):
+            disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else '')
+            return f"--{boundary}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + content + b"\r\n"
+        
+        body = (part("options", b'{"include_histogram": false}')
+                + part("files", encoded, "a.png") + part("files", b"texto", "b.txt") + part("files", encoded, "c.png")
+                + f"--{boundary}--\r\n".encode())
+        received = [0]
+        
+        async def chunks():
+            for offset in range(0, len(body), 4096):
+                received[0] = offset + 4096
+                yield body[offset:offset + 4096]
+                await asyncio.sleep(0)
+        
+        spooler = MultipartSpooler(f"multipart/form-data; boundary={boundary}", max_file_size=10 * 1024 * 1024,
+                                   allowed_suffixes=[".png"], max_files=10, spool_dir=str(tmp_path / "spool"))
+        
+        async def analyze(upload):
+            received_at_start = received[0]
+            result = await analyzer.analyze_image(QualityAnalysisRequest(image_data=upload.read()))
+            return {'score': result.overall_score, 'received': received_at_start, 'options': spooler.fields['options']}
+        
+        events = [event async for event in stream_batch_analysis(spooler.uploads(chunks()), analyze, 2, 4)]
+        results = {event['filename']: event for event in events if event['event'] == 'result'}
+        
+        assert events[-1]['event'] == 'summary'
+        assert (events[-1]['total_files'], events[-1]['successful'], events[-1]['failed']) == (3, 2, 1)
+        # El primer fichero se analizó antes de recibir la petición completa
+        assert results['a.png']['result']['received'] < len(body)
+        assert results['a.png']['result']['options'] == '{"include_histogram": false}'
+        assert "Formato no soportado" in results['b.txt']['error']
+        assert results['c.png']['index'] == 2
+        # Cada fichero se borra al analizarse
+        assert not any(spooler.directory.iterdir())
+        spooler.cleanup()
+        assert not spooler.directory.exists()
+        
+        # Más ficheros de los permitidos: se deja de leer y se informa del error
+        limited = MultipartSpooler(f"multipart/form-data; boundary={boundary}", max_file_size=10 * 1024 * 1024,
+                                   allowed_suffixes=[".png"], max_files=1, spool_dir=str(tmp_path / "spool"))
+        events = [event async for event in stream_batch_analysis(limited.uploads(chunks()), analyze, 2, 4)]
+        assert sorted(event['event'] for event in events[:-1]) == ['error', 'result']
+        assert events[-1]['total_files'] == 1
+        limited.cleanup()
+    
+    @pytest.mark.asyncio
+    async def test_url_fetching(self, config, sample_image):
+        """Test descarga por URL: sesión compartida, revalidación con ETag y corte por tamaño"""
+        from aiohttp import web
+        
+        encoded = cv2.imencode('.png', sample_image)[1].tobytes()
+        etag = '"v1"'
+        requests_seen = []
+        
+        async def image(request):
+            requests_seen.append(request.headers.get('If-None-Match'))
+            if request.headers.get('If-None-Match') == etag:
+                return web.Response(status=304, headers={'ETag': etag})
+            return web.Response(body=encoded, content_type='image/png', headers={'ETag': etag})
+        
+        app = web.Application()
+        app.router.add_get('/img/{name}', image)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            analyzer = ImageQualityAnalyzer(config)
+            url = f"http://127.0.0.1:{port}/img/producto.png"
+            first = await analyzer.analyze_image(QualityAnalysisRequest(image_url=url))
+            second = await analyzer.analyze_image(QualityAnalysisRequest(image_url=url))
+            
+            assert first.image_path == url
+            assert first.image_format == '.png'
+            assert second.overall_score == first.overall_score
+            # La segunda petición es condicional y el servidor no reenvía la imagen
+            assert requests_seen == [None, etag]
+            stats = analyzer.get_performance_stats()['url_fetcher']
+            assert (stats['downloads'], stats['revalidated']) == (1, 1)
+            
+            # Una sola sesión para todas las descargas del loop
+            session = analyzer.url_fetcher.session
+            await analyzer.analyze_image(QualityAnalysisRequest(image_url=url + "?v=2"))
+            assert analyzer.url_fetcher.session is session
+            
+            # La descarga se corta al pasar del tamaño máximo
+            small = ImageQualityAnalyzer(replace(config, max_image_size=len(encoded) - 1, url_cache_dir=None))
+            with pytest.raises(ValueError, match="demasiado grande"):
+                await small.analyze_image(QualityAnalysisRequest(image_url=url))
+            await small.shutdown()
+            await analyzer.shutdown()
+            assert session.closed
+        finally:
+            await runner.cleanup()
+    
+    def test_url_session_per_event_loop(self, config):
+        """Test sesión HTTP: la de un event loop anterior se cierra al crear la del nuevo"""
+        analyzer = ImageQualityAnalyzer(config)
+        first = asyncio.run(analyzer.url_fetcher._get_session())
+        second = asyncio.run(analyzer.url_fetcher._get_session())
+        assert second is not first
+        assert first.closed
+        asyncio.run(analyzer.shutdown())
+        assert second.closed and analyzer.url_fetcher.session is None
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("backend", ["inotify", "polling"])
+    async def test_directory_watch(self, config, sample_image, blurry_image, tmp_path, backend):
+        """Test modo watch: solo se analiza lo nuevo o modificado y el índice sigue al disco"""
+        if backend == "inotify" and not sys.platform.startswith("linux"):
+            pytest.skip("inotify solo existe en Linux")
+        catalog = tmp_path / "catalog"
+        (catalog / "sub").mkdir(parents=True)
+        cv2.imwrite(str(catalog / "a.png"), sample_image)
+        (catalog / "notas.txt").write_text("no es una imagen")
+
+        config = replace(config, watch_backend=backend, watch_debounce=0.1, watch_poll_interval=0.2)
+        integration = ImageQAQueueIntegration(ImageQualityAnalyzer(config))
+        events = []
+        integration.add_event_listener(events.append)
+        index_path = str(tmp_path / "watch.db")
+
+        async def wait_until(condition, timeout=15.0):
+            deadline = asyncio.get_running_loop().time() + timeout
+            while not condition():
+                assert asyncio.get_running_loop().time() < deadline, "timeout esperando al watcher"
+                await asyncio.sleep(0.05)
+
+        watcher = integration.create_directory_watcher(str(catalog), index_path=index_path)
+        task = asyncio.create_task(watcher.run())
+        try:
+            # Reconciliación inicial
+            await wait_until(lambda: watcher.index.get("a.png") is not None)
+            assert watcher.backend == backend
+
+            # Fichero nuevo en un subdirectorio, escrito aparte y renombrado
+            (catalog / "sub" / "b.jpg.part").write_bytes(cv2.imencode('.jpg', sample_image)[1].tobytes())
+            os.replace(catalog / "sub" / "b.jpg.part", catalog / "sub" / "b.jpg")
+            await wait_until(lambda: watcher.index.get("sub/b.jpg") is not None)
+
+            # Modificación: se vuelve a analizar con el contenido nuevo
+            first_score = watcher.index.get("a.png")["overall_score"]
+            cv2.imwrite(str(catalog / "a.png"), blurry_image)
+            await wait_until(lambda: watcher.index.get("a.png")["overall_score"] != first_score)
+
+            # Borrado de un directorio: sus resultados salen del índice
+            (catalog / "sub" / "b.jpg").unlink()
+            (catalog / "sub").rmdir()
+            await wait_until(lambda: watcher.index.get("sub/b.jpg") is None)
+
+            assert watcher.stats['analyzed'] == 3
+            assert [event['image'] for event in events] == ["a.png", "sub/b.jpg", "a.png"]
+            assert all(event['event'] == 'watch_result' for event in events)
+        finally:
+            watcher.stop()
+            await task
+            watcher.index.close()
+
+        # Al reiniciar no se repite nada de lo que no cambió
+        watcher = integration.create_directory_watcher(str(catalog), index_path=index_path)
+        task = asyncio.create_task(watcher.run())
+        try:
+            await wait_until(lambda: watcher.stats['rescans'] >= 1)
+            assert await watcher.idle()
+            assert watcher.stats['analyzed'] == 0
+            assert watcher.index.summary()['total_images'] == 1
+        finally:
+            watcher.stop()
+            await task
+            watcher.index.close()
+
+    @pytest.mark.asyncio
+    async def test_calibrate_from_metric_matrix(self, analyzer, tmp_path):
+        """Test calibración: umbrales, ROC y pesos sobre la matriz persistida, sin reanalizar"""
+        rng = np.random.default_rng(0)
+        paths, labels = [], {}
+        for i, blur in enumerate([0, 0, 1, 1, 3, 5, 9, 15]):
+            # Texturas distintas para que ninguna se reutilice como casi-duplicado de otra
+            texture = rng.integers(0, 256, (600, 800, 3), dtype=np.uint8)
+            image = cv2.GaussianBlur(texture, (0, 0), blur) if blur else texture
+            path = tmp_path / f"ref_{i}.png"
+            cv2.imwrite(str(path), image)
+            paths.append(str(path))
+            labels[str(path)] = "pass" if blur <= 1 else "fail"
+
+        integration = ImageQAQueueIntegration(analyzer)
+        matrix_path = str(tmp_path / "metrics.npz")
+        result = await integration.handle_task({
+            'task_type': 'calibrate_thresholds',
+            'reference_images': paths,
+            'labels': labels,
+            'metric_matrix_path': matrix_path
+        })
+
+        assert result['success'], result
+        assert Path(matrix_path).exists()
+        assert result['reference_analysis']['total_images'] == 8
+        assert result['labeled_images'] == 8 and result['passed_images'] == 4
+        # La nitidez separa perfectamente las nítidas de las desenfocadas
+        assert result['metric_roc']['sharpness_variance']['auc'] == 1.0
+        assert result['overall_roc']['auc'] >= result['current_weights']['auc']
+        assert result['calibrated_weights']['sharpness_weight'] > 0
+        assert sum(v for k, v in result['calibrated_weights'].items() if k != 'auc') == pytest.approx(1.0, abs=1e-3)
+        assert result['calibrated_thresholds']['laplacian_fair'] > 0
+
+        # Resultados de otro modo u otras opciones tienen otras escalas: no entran en la matriz
+        analyzer.result_cache.put("f" * 32, analyzer._get_cache_key({}, 'preview'),
+                                  {'image_path': 'preview.jpg', 'brisque_score': 99.0, 'sharpness_variance': 1e6,
+                                   'exposure_balance_score': 0.0, 'width': 1, 'height': 1,
+                                   'aspect_ratio_score': 0.0, 'overall_score': 0.0})
+        
+        # Sin imágenes de referencia se calibra solo con la matriz: nada se vuelve a analizar
+        analyses = analyzer.get_performance_stats()['total_analyses']
+        result = await integration.handle_task({
+            'task_type': 'calibrate_thresholds',
+            'metric_matrix_path': matrix_path,
+            'percentiles': {'laplacian_fair': ['sharpness_variance', 50]}
+        })
+        assert result['success'], result
+        assert result['total_images'] == 8
+        assert analyzer.get_performance_stats()['total_analyses'] == analyses
+        assert 'metric_roc' not in result
+        sharpness = sorted(r.sharpness_variance for r in await analyzer.analyze_batch(
+            [QualityAnalysisRequest(image_path=p) for p in paths]))
+        assert result['calibrated_thresholds']['laplacian_fair'] == pytest.approx(np.percentile(sharpness, 50))
+
+    def test_roc_curve(self):
+        """Test ROC vectorizada: AUC igual al estadístico de Mann-Whitney, con empates"""
+        rng = np.random.default_rng(1)
+        scores = rng.integers(0, 20, 500).astype(float)
+        labels = rng.random(500) < scores / 25
+        curve = roc_curve(scores, labels)
+        positives, negatives = scores[labels], scores[~labels]
+        pairs = (positives[:, None] > negatives[None, :]) + 0.5 * (positives[:, None] == negatives[None, :])
+        assert curve.auc == pytest.approx(pairs.mean())
+        assert curve.tpr[0] == curve.fpr[0] == 0 and curve.tpr[-1] == curve.fpr[-1] == 1
+        threshold, tpr, fpr = curve.best_threshold()
+        assert tpr == pytest.approx(np.mean(positives >= threshold))
+        assert fpr == pytest.approx(np.mean(negatives >= threshold))
+
+    def test_perceptual_index_query(self):
+        """Test multi-index hashing: mismos vecinos que la búsqueda exhaustiva"""
+        rng = np.random.default_rng(0)
+        index = PerceptualIndex(radius=6)
+        hashes = [int(h) for h in rng.integers(0, 2**64, 3000, dtype=np.uint64)]
+        for i, phash in enumerate(hashes):
+            # Cada décimo hash es una variante con pocos bits cambiados de otro anterior
+            if i % 10 == 9:
+                phash = hashes[i - 5] ^ int(sum(1 << int(b) for b in rng.choice(64, i % 7, replace=False)))
+                hashes[i] = phash
+            index.add(f"hash{i}", Fingerprint(phash, phash, 100, 100, 128.0, 10.0))
+        
+        for query in hashes[::7]:
+            expected = sorted(i for i, h in enumerate(hashes) if hamming(h, query) <= 6)
+            assert sorted(i for i, _ in index.query(query)) == expected
 
 class TestQualityMetrics:
     """Tests para métricas individuales"""
@@ -345,6 +842,109 @@ class TestQualityMetrics:
         assert result.metadata['aspect_ratio'] == result.value
         assert 'closest_common_ratio' in result.metadata
 
+    def test_preview_calibration(self, tmp_path):
+        """Test corrección de preview: identidad a escala 1 y persistencia en JSON"""
+        calibration = PreviewCalibration(sharpness={2: (1.0, math.log(4))}, brisque={2: (1.0, -3.0)})
+        assert calibration.correct("sharpness", 1, 50.0) == 50.0
+        assert calibration.correct("sharpness", 2, 50.0) == pytest.approx(200.0)
+        assert calibration.correct("brisque", 2, 30.0) == pytest.approx(27.0)
+        assert calibration.correct("exposure", 2, 80.0) == 80.0
+        
+        calibration.save(str(tmp_path / "calibration.json"))
+        loaded = PreviewCalibration.load(str(tmp_path / "calibration.json"))
+        assert loaded.sharpness == {2: (1.0, pytest.approx(math.log(4)))}
+        assert preview_reduction((8000, 6000), 1024) == 4
+        assert preview_reduction((800, 600), 1024) == 1
+    
+    def test_image_context(self, sample_image):
+        """Test contexto compartido: grises, histograma y pirámide"""
+        sample_image[100:200, 50:150] = 255
+        context = ImageContext(sample_image)
+        
+        assert context.gray.shape == (400, 300)
+        assert context.histogram.sum() == 400 * 300
+        assert abs(context.mean_brightness - context.gray.mean()) < 1e-6
+        assert abs(context.brightness_variance - context.gray.var()) < 1e-3
+        assert context.pyramid(2).shape == (100, 75)
+        assert abs(context.laplacian_variance - cv2.Laplacian(context.gray, cv2.CV_64F).var()) < 1e-6
+        assert ImageContext.ensure(context) is context
+    
+    @pytest.mark.asyncio
+    async def test_metrics_accept_context(self, thresholds, sample_image):
+        """Test métricas calculadas sobre contexto o array dan el mismo resultado"""
+        cv2.circle(sample_image, (150, 200), 60, (40, 200, 90), -1)
+        context = ImageContext(sample_image)
+        
+        for metric_class in (BRISQUEMetric, SharpnessMetric, ExposureMetric):
+            metric = metric_class(thresholds)
+            from_context = await metric.calculate(context)
+            from_array = await metric.calculate(sample_image)
+            assert from_context.value == pytest.approx(from_array.value)
+            assert from_context.score == pytest.approx(from_array.score)
+    
+    def test_tiled_context(self):
+        """Test contexto por teselas: histograma y varianza Laplaciana exactos, en serie y en paralelo"""
+        rng = np.random.default_rng(2)
+        gray = cv2.GaussianBlur(rng.integers(0, 255, (517, 743), dtype=np.uint8), (0, 0), 1.5)
+        reference = ImageContext(gray)
+        
+        for workers in (1, 3):
+            tiled = TiledImageContext(gray, tiling=TilingConfig(tile_size=128, overlap=1, workers=workers))
+            assert tiled.laplacian_variance == pytest.approx(reference.laplacian_variance, rel=1e-9)
+            assert np.array_equal(tiled.histogram, reference.histogram)
+            assert tiled.sharpness_map.shape == (5, 6)
+    
+    def test_nss_distribution_fits(self):
+        """Test ajuste GGD/AGGD por tablas: recupera los parámetros de muestras sintéticas"""
+        rng = np.random.default_rng(0)
+        gaussian = rng.normal(0, 2, 200000)
+        alpha, sigma_sq = fit_ggd(np.abs(gaussian).mean(), (gaussian ** 2).mean())
+        assert alpha == pytest.approx(2.0, abs=0.05)
+        assert sigma_sq == pytest.approx(4.0, rel=0.02)
+        
+        laplacian = rng.laplace(0, 1, 200000)
+        alpha, _ = fit_ggd(np.abs(laplacian).mean(), (laplacian ** 2).mean())
+        assert alpha == pytest.approx(1.0, abs=0.05)
+        
+        # Gaussiana asimétrica con sigma_l = 1 y sigma_r = 2 (la izquierda tiene probabilidad 1/3)
+        left = rng.random(300000) < 1 / 3
+        samples = np.where(left, -np.abs(rng.normal(0, 1, left.size)), np.abs(rng.normal(0, 2, left.size)))
+        negative = samples < 0
+        alpha, eta, left_sq, right_sq = fit_aggd(
+            np.abs(samples).mean(), (samples ** 2).mean(),
+            (samples[negative] ** 2).mean(), (samples[~negative] ** 2).mean()
+        )
+        assert alpha == pytest.approx(2.0, abs=0.1)
+        assert (left_sq, right_sq) == (pytest.approx(1.0, rel=0.03), pytest.approx(4.0, rel=0.03))
+        assert eta > 0
+    
+    def test_brisque_native_degradation(self, thresholds):
+        """Test BRISQUE nativo: el score empeora con desenfoque y ruido, y el lote coincide con el individual"""
+        rng = np.random.default_rng(1)
+        texture = sum(cv2.resize(rng.normal(0, 1, (cells, cells)).astype(np.float32), (640, 640),
+                                 interpolation=cv2.INTER_CUBIC) for cells in (8, 32, 128, 512))
+        clean = np.clip(128 + 25 * texture, 0, 255).astype(np.uint8)
+        blurred = cv2.GaussianBlur(clean, (0, 0), 3)
+        noisy = np.clip(clean + rng.normal(0, 25, clean.shape), 0, 255).astype(np.uint8)
+        
+        metric = BRISQUEMetric(thresholds)
+        results = [metric.compute(cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)) for image in (clean, blurred, noisy)]
+        assert all(result.metadata["backend"] == "nss" for result in results)
+        assert results[0].value < results[1].value
+        assert results[0].value < results[2].value
+        
+        stack = np.stack([clean, blurred, noisy])
+        assert metric.nss_model.score_batch(stack) == pytest.approx([r.value for r in results])
+        assert nss_features(stack).shape == (3, NUM_FEATURES)
+        
+        # Por debajo de un parche se usa el estimador alternativo, con la misma escala (menor es mejor)
+        rng = np.random.default_rng(1)
+        textured = cv2.cvtColor(np.clip(128 + rng.normal(0, 60, (48, 48)), 0, 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+        small = [metric.compute(image) for image in (textured, np.zeros((48, 48, 3), dtype=np.uint8))]
+        assert all(result.metadata["backend"] == "fallback" for result in small)
+        assert small[0].value < small[1].value
+        assert small[0].score > small[1].score
+
 class TestConfig:
     """Tests para configuración"""
     
@@ -385,7 +985,8 @@ class TestErrorHandling:
     @pytest.fixture
     def analyzer(self):
         """Analyzer para tests de error"""
-        return ImageQualityAnalyzer(AgentConfig())
+        return ImageQualityAnalyzer(AgentConfig(result_cache_path=None, duplicate_index_path=None,
+                                                url_cache_dir=None))
     
     @pytest.mark.asyncio
     async def test_invalid_image_path(self, analyzer):
@@ -0,0 +1,190 @@
+"""
+Autoescalado de réplicas de agentes
+Crea o retira réplicas por tipo de agente según la cola, la espera y la latencia
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from concurrency_limiter import get_available_memory
+
+MB = 1024 ** 2
+
+
+@dataclass
+class AutoscalerConfig:
+    """Límites y umbrales del autoescalado"""
+    enabled: bool = True
+    interval: float = 5.0  # segundos entre evaluaciones
+    min_replicas: int = 1
+    max_replicas: int = 4
+    max_replicas_per_type: Dict[str, int] = field(default_factory=dict)
+    scale_up_queue_per_replica: float = 1.0  # tareas esperando semáforo por réplica
+    scale_up_wait_time: float = 2.0  # espera media (EWMA) de semáforo en segundos
+    scale_up_latency: Optional[float] = None  # latencia EWMA que fuerza escalar si hay cola
+    scale_down_idle_time: float = 60.0
+    cooldown: float = 10.0
+    # Las réplicas comparten el cliente del modelo; solo cuentan su contexto y estado
+    replica_memory_bytes: int = 256 * MB
+    memory_budget_bytes: Optional[int] = None
+    memory_fraction: float = 0.25
+
+
+@dataclass
+class GroupLoad:
+    """Carga agregada de las réplicas de un tipo de agente"""
+    replicas: int
+    queue_depth: int
+    outstanding: int
+    capacity: int
+    wait_ewma: float
+    latency_ewma: float
+
+
+class AgentAutoscaler:
+    """Ajusta el número de réplicas de cada tipo de agente del AgentManager"""
+
+    def __init__(self, agent_manager, config: AutoscalerConfig = None):
+        self.agent_manager = agent_manager
+        self.config = config or AutoscalerConfig()
+
+        self.last_scale: Dict[str, float] = {}
+        self.idle_since: Dict[str, float] = {}
+        self.loop_task: Optional[asyncio.Task] = None
+
+        self.stats = {
+            "evaluations": 0,
+            "scale_ups": 0,
+            "scale_downs": 0,
+            "blocked_by_memory": 0
+        }
+
+    async def start(self):
+        """Inicia el bucle de evaluación en segundo plano"""
+        if not self.config.enabled or self.loop_task is not None:
+            return
+        self.loop_task = asyncio.create_task(self._autoscale_loop())
+        logger.info("Autoescalado de agentes iniciado")
+
+    async def stop(self):
+        if self.loop_task is not None:
+            self.loop_task.cancel()
+            try:
+                await self.loop_task
+            except asyncio.CancelledError:
+                pass
+            self.loop_task = None
+
+    async def _autoscale_loop(self):
+        while True:
+            try:
+                await self.evaluate()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en autoescalado de agentes: {e}")
+            await asyncio.sleep(self.config.interval)
+
+    def group_load(self, agent_ids: List[str]) -> GroupLoad:
+        """Calcula la carga de un grupo de réplicas"""
+        agents = [self.agent_manager.agents[a] for a in agent_ids if a in self.agent_manager.agents]
+        replicas = len(agents) or 1
+        return GroupLoad(
+            replicas=len(agents),
+            queue_depth=sum(a.waiting_tasks for a in agents),
+            outstanding=sum(a.outstanding_tasks for a in agents),
+            capacity=sum(a.config.max_concurrent_tasks for a in agents),
+            wait_ewma=sum(a.metrics.wait_time_ewma for a in agents) / replicas,
+            latency_ewma=sum(a.metrics.latency_ewma for a in agents) / replicas
+        )
+
+    async def evaluate(self) -> Dict[str, str]:
+        """Evalúa cada tipo de agente y escala si procede; devuelve las decisiones tomadas"""
+        self.stats["evaluations"] += 1
+        decisions = {}
+        now = time.monotonic()
+
+        for agent_type, agent_ids in list(self.agent_manager.agent_groups.items()):
+            load = self.group_load(agent_ids)
+            if load.replicas == 0:
+                continue
+
+            if load.outstanding == 0:
+                self.idle_since.setdefault(agent_type, now)
+            else:
+                self.idle_since.pop(agent_type, None)
+
+            if now - self.last_scale.get(agent_type, float("-inf")) < self.config.cooldown:
+                continue
+
+            if self._should_scale_up(agent_type, load):
+                if not self._memory_allows_replica():
+                    self.stats["blocked_by_memory"] += 1
+                    logger.debug(f"Sin memoria para una réplica más de {agent_type}")
+                    continue
+                await self.agent_manager.spawn_replica(agent_type)
+                self.last_scale[agent_type] = now
+                self.stats["scale_ups"] += 1
+                decisions[agent_type] = "scale_up"
+                logger.info(f"Escalando {agent_type} a {load.replicas + 1} réplicas "
+                            f"(cola={load.queue_depth}, espera={load.wait_ewma:.2f}s)")
+
+            elif self._should_scale_down(agent_type, load, now):
+                retired = await self.agent_manager.retire_replica(agent_type)
+                if retired:
+                    self.last_scale[agent_type] = now
+                    self.idle_since[agent_type] = now
+                    self.stats["scale_downs"] += 1
+                    decisions[agent_type] = "scale_down"
+                    logger.info(f"Retirada réplica {retired} de {agent_type}")
+
+        return decisions
+
+    def _max_replicas(self, agent_type: str) -> int:
+        return self.config.max_replicas_per_type.get(agent_type, self.config.max_replicas)
+
+    def _should_scale_up(self, agent_type: str, load: GroupLoad) -> bool:
+        if load.replicas >= self._max_replicas(agent_type):
+            return False
+        if load.queue_depth >= self.config.scale_up_queue_per_replica * load.replicas:
+            return True
+        saturated = load.outstanding >= load.capacity
+        if saturated and load.wait_ewma >= self.config.scale_up_wait_time:
+            return True
+        if (self.config.scale_up_latency is not None and load.queue_depth > 0
+                and load.latency_ewma >= self.config.scale_up_latency):
+            return True
+        return False
+
+    def _should_scale_down(self, agent_type: str, load: GroupLoad, now: float) -> bool:
+        if load.replicas <= self.config.min_replicas:
+            return False
+        idle_since = self.idle_since.get(agent_type)
+        return idle_since is not None and now - idle_since >= self.config.scale_down_idle_time
+
+    def _memory_allows_replica(self) -> bool:
+        """Comprueba el presupuesto de memoria para una réplica adicional"""
+        extra = self.agent_manager.replica_count() + 1
+        if (self.config.memory_budget_bytes is not None
+                and extra * self.config.replica_memory_bytes > self.config.memory_budget_bytes):
+            return False
+        return get_available_memory() * self.config.memory_fraction >= self.config.replica_memory_bytes
+
+    def get_stats(self) -> Dict:
+        """Obtiene métricas de autoescalado por tipo de agente"""
+        groups = {}
+        for agent_type, agent_ids in self.agent_manager.agent_groups.items():
+            load = self.group_load(agent_ids)
+            groups[agent_type] = {
+                "replicas": load.replicas,
+                "queue_depth": load.queue_depth,
+                "outstanding": load.outstanding,
+                "capacity": load.capacity,
+                "wait_ewma": load.wait_ewma,
+                "latency_ewma": load.latency_ewma
+            }
+        return {**self.stats, "groups": groups}
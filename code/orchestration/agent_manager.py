@@ -4,19 +4,27 @@ Maneja la creación, configuración y ciclo de vida de agentes
 """
 
 import asyncio
+import contextvars
 import json
-from typing import Dict, List, Optional, Any, Callable
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Any, Callable, AsyncGenerator
 from datetime import datetime, timedelta
 from enum import Enum
 from dataclasses import dataclass, asdict
 from concurrent.futures import ThreadPoolExecutor
 
 from loguru import logger
-from langchain_ollama import ChatOllama
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
+from ollama_manager import ManagedChatModel
 from task_queue import TaskQueue, TaskPriority
 from state_manager import StateManager
+from agent_autoscaler import AgentAutoscaler, AutoscalerConfig
+from agent_memory import ConversationMemory, MemoryConfig
+from agent_router import AgentRouter
+from circuit_breaker import CircuitBreakerConfig, CircuitBreakerRegistry, CircuitOpenError, CircuitState
+from tracing import get_tracer, token_usage
 
 class AgentType(Enum):
     COORDINATOR = "coordinator"
@@ -33,6 +41,22 @@ class AgentStatus(Enum):
     MAINTENANCE = "maintenance"
     OFFLINE = "offline"
 
+# Cola de salida de tokens de la tarea en curso (solo definida en modo streaming)
+_stream_sink: contextvars.ContextVar[Optional[asyncio.Queue]] = contextvars.ContextVar(
+    "agent_stream_sink", default=None
+)
+
+# Sesión de la tarea en curso: acota el historial que se envía al modelo
+_session_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "agent_session_id", default=None
+)
+
+# Marca de fin de stream
+_STREAM_END = object()
+
+# Peso de la última observación en las medias móviles exponenciales
+EWMA_ALPHA = 0.2
+
 @dataclass
 class AgentConfig:
     """Configuración de un agente"""
@@ -49,6 +73,9 @@ class AgentConfig:
     memory_enabled: bool = True
     learning_enabled: bool = False
     custom_config: Dict[str, Any] = None
+    temperature: float = 0.7
+    seed: Optional[int] = None  # con temperature=0 o semilla fija las respuestas se cachean
+    prefer_resident: bool = False  # servir con un modelo equivalente ya cargado (models.interchangeable)
 
 @dataclass
 class AgentMetrics:
@@ -62,18 +89,27 @@ class AgentMetrics:
     uptime: float = 0.0
     memory_usage: float = 0.0
     cpu_usage: float = 0.0
+    streamed_tasks: int = 0
+    cancelled_streams: int = 0
+    average_time_to_first_token: float = 0.0
+    last_time_to_first_token: Optional[float] = None
+    total_wait_time: float = 0.0
+    wait_time_ewma: float = 0.0
+    latency_ewma: float = 0.0
+    fallback_calls: int = 0
+    rejected_calls: int = 0
 
 @dataclass
 class AgentMemory:
     """Memoria del agente para conversaciones y contexto"""
-    conversation_history: List[Dict] = None
+    conversation: ConversationMemory = None
     learned_patterns: Dict[str, Any] = None
     context_cache: Dict[str, Any] = None
     last_updated: datetime = None
 
     def __post_init__(self):
-        if self.conversation_history is None:
-            self.conversation_history = []
+        if self.conversation is None:
+            self.conversation = ConversationMemory()
         if self.learned_patterns is None:
             self.learned_patterns = {}
         if self.context_cache is None:
@@ -88,15 +124,24 @@ class Agent:
         self.config = config
         self.status = AgentStatus.IDLE
         self.metrics = AgentMetrics()
-        self.memory = AgentMemory()
+        memory_config = MemoryConfig(**(config.custom_config or {}).get("memory", {}))
+        self.memory = AgentMemory(conversation=ConversationMemory(memory_config))
+        self.compaction_task: Optional[asyncio.Task] = None
         
-        # Modelo LLM
-        self.llm_model = None
+        # Circuit breakers (los asigna el AgentManager) y modelos de respaldo
+        self.circuit_breakers: Optional[CircuitBreakerRegistry] = None
+        self.fallback_llms: Dict[str, ManagedChatModel] = {}
+        
+        # Modelo LLM (las llamadas pasan por el OllamaManager y sus cupos)
+        self.ollama_manager = None
+        self.llm_model: Optional[ManagedChatModel] = None
         self.current_tasks = []
         self.task_handlers = {}
+        self.streaming_tasks: Dict[str, asyncio.Task] = {}
         
         # Control de concurrencia
         self.active_tasks = 0
+        self.waiting_tasks = 0
         self.task_semaphore = None
         
         # Callbacks
@@ -107,14 +152,19 @@ class Agent:
         # Inicialización
         self.start_time = datetime.now()
 
-    async def initialize(self, ollama_manager):
-        """Inicializa el agente"""
+    async def initialize(self, ollama_manager, llm_model: ManagedChatModel = None):
+        """Inicializa el agente; las réplicas reciben el cliente del modelo ya creado"""
         try:
+            self.ollama_manager = ollama_manager
+            
             # Configurar semaforo para control de concurrencia
             self.task_semaphore = asyncio.Semaphore(self.config.max_concurrent_tasks)
             
             # Inicializar modelo LLM
-            await self._initialize_model(ollama_manager)
+            if llm_model is not None:
+                self.llm_model = llm_model
+            else:
+                await self._initialize_model(ollama_manager)
             
             # Registrar handlers de tareas
             self._register_task_handlers()
@@ -134,11 +184,10 @@ class Agent:
             # Instalar modelo si es necesario
             await ollama_manager.install_model(self.config.model)
             
-            # Crear instancia del modelo
-            self.llm_model = ChatOllama(
-                model=self.config.model,
-                base_url=ollama_manager.base_url,
-                temperature=0.7
+            # Crear cliente del modelo
+            self.llm_model = ollama_manager.chat_model(
+                self.config.model, temperature=self.config.temperature, seed=self.config.seed,
+                prefer_resident=self.config.prefer_resident
             )
             
         except Exception as e:
@@ -193,70 +242,268 @@ class Agent:
             f"Error en agente {self.config.agent_id}, tarea {task_id}: {error}"
         )
 
-    async def execute_task(self, task_id: str, task_type: str, task_data: Any) -> Dict:
-        """Ejecuta una tarea específica"""
-        async with self.task_semaphore:
+    async def execute_task(self, task_id: str, task_type: str, task_data: Any,
+                           session_id: Optional[str] = None) -> Dict:
+        """Ejecuta una tarea específica
+
+        Con session_id el modelo recibe el historial de las tareas anteriores de
+        esa sesión; sin él, solo el prompt de la tarea (salvo memory.inject_history).
+        """
+        session_token = _session_id.set(session_id)
+        try:
+            return await self._execute_task(task_id, task_type, task_data, session_id)
+        finally:
+            _session_id.reset(session_token)
+
+    async def _execute_task(self, task_id: str, task_type: str, task_data: Any,
+                            session_id: Optional[str]) -> Dict:
+        with get_tracer().span(f"agent.task {self.config.agent_id}", {
+            "agent.id": self.config.agent_id,
+            "task.id": task_id,
+            "task.type": task_type
+        }) as span:
+            async with self._task_slot() as wait_time:
+                span.set_attribute("agent.queue_wait", wait_time)
+                try:
+                    self.status = AgentStatus.BUSY
+                    self.active_tasks += 1
+                    
+                    # Actualizar métricas
+                    self.metrics.total_tasks += 1
+                    self.metrics.last_activity = datetime.now()
+                    
+                    # Notificar inicio de tarea
+                    if self.on_task_start:
+                        await self._safe_callback(self.on_task_start, task_id, task_data)
+                    
+                    # Ejecutar tarea
+                    start_time = datetime.now()
+                    
+                    if task_type in self.task_handlers:
+                        result = await self.task_handlers[task_type](task_data)
+                    else:
+                        result = await self._handle_generic_task(task_type, task_data)
+                    
+                    # Actualizar métricas de tiempo
+                    execution_time = (datetime.now() - start_time).total_seconds()
+                    self._update_timing_metrics(execution_time)
+                    
+                    # Actualizar memoria
+                    self._update_memory(task_id, task_type, task_data, result, session_id)
+                    
+                    # Notificar finalización
+                    if self.on_task_complete:
+                        await self._safe_callback(self.on_task_complete, task_id, result)
+                    
+                    self.metrics.successful_tasks += 1
+                    
+                    return {
+                        "success": True,
+                        "result": result,
+                        "agent_id": self.config.agent_id,
+                        "task_id": task_id,
+                        "execution_time": execution_time,
+                        "timestamp": datetime.now().isoformat()
+                    }
+                    
+                except Exception as e:
+                    self.metrics.failed_tasks += 1
+                    error_msg = f"Error ejecutando tarea {task_type}: {str(e)}"
+                    logger.error(f"Agente {self.config.agent_id}: {error_msg}")
+                    span.set_error(error_msg)
+                    
+                    if self.on_error:
+                        await self._safe_callback(self.on_error, task_id, str(e))
+                    
+                    return {
+                        "success": False,
+                        "error": error_msg,
+                        "agent_id": self.config.agent_id,
+                        "task_id": task_id,
+                        "timestamp": datetime.now().isoformat()
+                    }
+                    
+                finally:
+                    self.status = AgentStatus.IDLE
+                    self.active_tasks -= 1
+
+    @property
+    def outstanding_tasks(self) -> int:
+        """Tareas en ejecución más tareas esperando el semáforo"""
+        return self.active_tasks + self.waiting_tasks
+
+    @asynccontextmanager
+    async def _task_slot(self):
+        """Reserva un hueco del semáforo; devuelve cuánto se ha esperado"""
+        wait_start = time.perf_counter()
+        self.waiting_tasks += 1
+        try:
+            await self.task_semaphore.acquire()
+        finally:
+            self.waiting_tasks -= 1
+        
+        wait_time = time.perf_counter() - wait_start
+        self.metrics.total_wait_time += wait_time
+        self.metrics.wait_time_ewma += EWMA_ALPHA * (wait_time - self.metrics.wait_time_ewma)
+        try:
+            yield wait_time
+        finally:
+            self.task_semaphore.release()
+
+    async def execute_task_stream(self, task_id: str, task_type: str, task_data: Any,
+                                  session_id: Optional[str] = None) -> AsyncGenerator[Dict, None]:
+        """Ejecuta una tarea emitiendo los tokens del modelo a medida que llegan
+        
+        Produce mensajes {"type": "token", ...} y termina con {"type": "result", ...},
+        que contiene el mismo resultado que execute_task. Cerrar el generador o
+        llamar a cancel_task detiene la generación.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        start_time = time.perf_counter()
+        
+        async def run():
+            _stream_sink.set(queue)
             try:
-                self.status = AgentStatus.BUSY
-                self.active_tasks += 1
-                
-                # Actualizar métricas
-                self.metrics.total_tasks += 1
-                self.metrics.last_activity = datetime.now()
-                
-                # Notificar inicio de tarea
-                if self.on_task_start:
-                    await self._safe_callback(self.on_task_start, task_id, task_data)
-                
-                # Ejecutar tarea
-                start_time = datetime.now()
-                
-                if task_type in self.task_handlers:
-                    result = await self.task_handlers[task_type](task_data)
-                else:
-                    result = await self._handle_generic_task(task_type, task_data)
-                
-                # Actualizar métricas de tiempo
-                execution_time = (datetime.now() - start_time).total_seconds()
-                self._update_timing_metrics(execution_time)
-                
-                # Actualizar memoria
-                self._update_memory(task_id, task_type, task_data, result)
-                
-                # Notificar finalización
-                if self.on_task_complete:
-                    await self._safe_callback(self.on_task_complete, task_id, result)
-                
-                self.metrics.successful_tasks += 1
-                
-                return {
-                    "success": True,
-                    "result": result,
-                    "agent_id": self.config.agent_id,
-                    "task_id": task_id,
-                    "execution_time": execution_time,
-                    "timestamp": datetime.now().isoformat()
-                }
-                
-            except Exception as e:
-                self.metrics.failed_tasks += 1
-                error_msg = f"Error ejecutando tarea {task_type}: {str(e)}"
-                logger.error(f"Agente {self.config.agent_id}: {error_msg}")
-                
-                if self.on_error:
-                    await self._safe_callback(self.on_error, task_id, str(e))
-                
-                return {
+                result = await self.execute_task(task_id, task_type, task_data, session_id)
+                await queue.put({"type": "result", **result})
+            finally:
+                await queue.put(_STREAM_END)
+        
+        runner = asyncio.create_task(run())
+        self.streaming_tasks[task_id] = runner
+        first_token_time = None
+        index = 0
+        
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    break
+                if item["type"] == "token":
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter() - start_time
+                        self._record_time_to_first_token(first_token_time)
+                    item.update(task_id=task_id, index=index)
+                    index += 1
+                elif item["type"] == "result":
+                    item["time_to_first_token"] = first_token_time
+                yield item
+            
+            if runner.cancelled():
+                self.metrics.cancelled_streams += 1
+                yield {
+                    "type": "result",
                     "success": False,
-                    "error": error_msg,
+                    "cancelled": True,
+                    "error": "Tarea cancelada",
                     "agent_id": self.config.agent_id,
                     "task_id": task_id,
+                    "time_to_first_token": first_token_time,
                     "timestamp": datetime.now().isoformat()
                 }
-                
-            finally:
-                self.status = AgentStatus.IDLE
-                self.active_tasks -= 1
+        finally:
+            self.streaming_tasks.pop(task_id, None)
+            if not runner.done():
+                runner.cancel()
+                self.metrics.cancelled_streams += 1
+                logger.info(f"Agente {self.config.agent_id}: stream de tarea {task_id} cancelado")
+
+    def cancel_task(self, task_id: str) -> bool:
+        """Cancela una tarea en streaming en curso"""
+        runner = self.streaming_tasks.get(task_id)
+        if runner is None or runner.done():
+            return False
+        runner.cancel()
+        return True
+
+    async def _invoke_llm(self, messages: List) -> AIMessage:
+        """Invoca el modelo; en modo streaming reenvía cada fragmento a la cola de la tarea"""
+        conversation = self.memory.conversation
+        session_id = _session_id.get()
+        if (self.config.memory_enabled and len(conversation)
+                and (session_id is not None or conversation.config.inject_history)):
+            # Historial acotado por tokens entre el prompt de sistema y la petición
+            messages = messages[:-1] + conversation.context_messages(session_id=session_id) + messages[-1:]
+        return await self._guarded_llm_call(messages, self._call_llm, stream=_stream_sink.get() is not None)
+
+    async def _guarded_llm_call(self, messages: List, call: Callable, stream: bool = False) -> AIMessage:
+        """Llama al modelo elegido por los circuit breakers con su span y registrando el resultado"""
+        llm, breakers = self._select_llm()
+        with get_tracer().span(f"llm.call {llm.model}", {
+            "llm.model": llm.model,
+            "llm.fallback": llm is not self.llm_model,
+            "llm.stream": stream
+        }) as span:
+            start = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(call(llm, messages), self.config.timeout)
+            except asyncio.CancelledError:
+                for breaker in breakers:
+                    breaker.release()
+                raise
+            except Exception:
+                for breaker in breakers:
+                    breaker.record_failure(time.perf_counter() - start)
+                raise
+            
+            for breaker in breakers:
+                breaker.record_success(time.perf_counter() - start)
+            prompt_tokens, completion_tokens = token_usage(messages, response)
+            span.set_attributes({"llm.prompt_tokens": prompt_tokens, "llm.completion_tokens": completion_tokens})
+        return response
+
+    async def _call_llm(self, llm: ManagedChatModel, messages: List) -> AIMessage:
+        sink = _stream_sink.get()
+        if sink is None:
+            return await llm.ainvoke(messages)
+        
+        parts = []
+        start = time.perf_counter()
+        stream = llm.astream(messages)
+        try:
+            async for chunk in stream:
+                if chunk.content:
+                    if not parts:
+                        span = get_tracer().current_span()
+                        if span is not None:
+                            span.set_attribute("llm.time_to_first_token", time.perf_counter() - start)
+                    parts.append(chunk.content)
+                    await sink.put({"type": "token", "content": chunk.content})
+        finally:
+            # Al cancelar la tarea se cierra el stream y se libera el cupo del modelo
+            await stream.aclose()
+        return AIMessage(content="".join(parts))
+
+    def _select_llm(self):
+        """Elige el modelo según los circuit breakers: principal, respaldo o fallo inmediato"""
+        registry = self.circuit_breakers
+        if registry is None:
+            return self.llm_model, []
+        
+        primary = [registry.get(f"model:{self.config.model}"), registry.get(f"agent:{self.config.agent_id}")]
+        if registry.try_acquire(primary):
+            return self.llm_model, primary
+        
+        fallback_model = registry.fallback_for(self.config.model)
+        if fallback_model:
+            fallback = [registry.get(f"model:{fallback_model}")]
+            if registry.try_acquire(fallback):
+                self.metrics.fallback_calls += 1
+                if fallback_model not in self.fallback_llms:
+                    self.fallback_llms[fallback_model] = self.ollama_manager.chat_model(
+                        fallback_model, temperature=self.llm_model.temperature, seed=self.llm_model.seed
+                    )
+                return self.fallback_llms[fallback_model], fallback
+        
+        self.metrics.rejected_calls += 1
+        raise CircuitOpenError(f"Circuito abierto para {self.config.model} en agente {self.config.agent_id}")
+
+    def _record_time_to_first_token(self, ttft: float):
+        """Actualiza la media del tiempo hasta el primer token"""
+        self.metrics.streamed_tasks += 1
+        self.metrics.last_time_to_first_token = ttft
+        n = self.metrics.streamed_tasks
+        self.metrics.average_time_to_first_token += (ttft - self.metrics.average_time_to_first_token) / n
 
     async def _safe_callback(self, callback: Callable, *args):
         """Ejecuta un callback de forma segura"""
@@ -271,42 +518,57 @@ class Agent:
     def _update_timing_metrics(self, execution_time: float):
         """Actualiza métricas de tiempo"""
         self.metrics.total_execution_time += execution_time
+        if self.metrics.latency_ewma == 0.0:
+            self.metrics.latency_ewma = execution_time
+        else:
+            self.metrics.latency_ewma += EWMA_ALPHA * (execution_time - self.metrics.latency_ewma)
         
         if self.metrics.total_tasks > 0:
             self.metrics.average_execution_time = (
                 self.metrics.total_execution_time / self.metrics.total_tasks
             )
 
-    def _update_memory(self, task_id: str, task_type: str, task_data: Any, result: Any):
+    def _update_memory(self, task_id: str, task_type: str, task_data: Any, result: Any,
+                       session_id: Optional[str] = None):
         """Actualiza la memoria del agente"""
         try:
-            # Agregar a historial de conversación
-            conversation_entry = {
-                "task_id": task_id,
-                "task_type": task_type,
-                "task_data": task_data,
-                "result": result,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            self.memory.conversation_history.append(conversation_entry)
-            
-            # Mantener solo los últimos 100 elementos
-            if len(self.memory.conversation_history) > 100:
-                self.memory.conversation_history.pop(0)
-            
+            # Agregar a historial de conversación (buffer circular acotado)
+            conversation = self.memory.conversation
+            conversation.append(task_id, task_type, task_data, result, session_id)
             self.memory.last_updated = datetime.now()
             
+            # Resumir los turnos antiguos en segundo plano; el modelo solo se usa si el
+            # historial llega a los prompts
+            if conversation.needs_compaction() and (self.compaction_task is None or self.compaction_task.done()):
+                summarize = self._summarize_memory if self.config.memory_enabled else None
+                self.compaction_task = asyncio.create_task(conversation.compact(summarize))
+            
         except Exception as e:
             logger.error(f"Error actualizando memoria del agente {self.config.agent_id}: {e}")
 
+    async def _summarize_memory(self, summary: str, transcript: str) -> str:
+        """Resume turnos antiguos con el propio modelo del agente"""
+        max_tokens = self.memory.conversation.config.summary_max_tokens
+        prompt = (
+            f"Resumen actual:\n{summary or '(vacío)'}\n\n"
+            f"Nuevos turnos:\n{transcript}\n\n"
+            f"Actualiza el resumen conservando hechos, decisiones y pendientes en menos de {max_tokens} tokens."
+        )
+        # Sin pasar por _call_llm: el resumen no debe emitirse por el stream de la tarea
+        with get_tracer().span(f"agent.memory.compact {self.config.agent_id}", {"agent.id": self.config.agent_id}):
+            response = await self._guarded_llm_call([
+                SystemMessage(content="Eres un asistente que resume conversaciones de forma compacta."),
+                HumanMessage(content=prompt)
+            ], lambda llm, messages: llm.ainvoke(messages))
+        return response.content
+
     # Handlers específicos por tipo de agente
     async def _handle_coordinate_workflow(self, workflow_data: Dict) -> Dict:
         """Maneja coordinación de workflows"""
         system_msg = SystemMessage(content=self.config.system_prompt)
         user_msg = HumanMessage(content=f"Coordinar el siguiente workflow: {workflow_data}")
         
-        response = await self.llm_model.ainvoke([system_msg, user_msg])
+        response = await self._invoke_llm([system_msg, user_msg])
         
         return {
             "type": "workflow_coordination",
@@ -338,7 +600,7 @@ class Agent:
         system_msg = SystemMessage(content=self.config.system_prompt)
         user_msg = HumanMessage(content=f"Analizar los siguientes datos: {data}")
         
-        response = await self.llm_model.ainvoke([system_msg, user_msg])
+        response = await self._invoke_llm([system_msg, user_msg])
         
         return {
             "type": "data_analysis",
@@ -370,7 +632,7 @@ class Agent:
         system_msg = SystemMessage(content=self.config.system_prompt)
         user_msg = HumanMessage(content=f"Generar contenido: {content_data}")
         
-        response = await self.llm_model.ainvoke([system_msg, user_msg])
+        response = await self._invoke_llm([system_msg, user_msg])
         
         return {
             "type": "content_generation",
@@ -402,7 +664,7 @@ class Agent:
         system_msg = SystemMessage(content=self.config.system_prompt)
         user_msg = HumanMessage(content=f"Generar código: {code_data}")
         
-        response = await self.llm_model.ainvoke([system_msg, user_msg])
+        response = await self._invoke_llm([system_msg, user_msg])
         
         return {
             "type": "code_generation",
@@ -472,7 +734,7 @@ class Agent:
         system_msg = SystemMessage(content=self.config.system_prompt)
         user_msg = HumanMessage(content=f"Ejecutar tarea: {task_type}\nDatos: {task_data}")
         
-        response = await self.llm_model.ainvoke([system_msg, user_msg])
+        response = await self._invoke_llm([system_msg, user_msg])
         
         return {
             "type": "generic_task",
@@ -492,9 +754,11 @@ class Agent:
             "status": self.status.value,
             "model": self.config.model,
             "active_tasks": self.active_tasks,
+            "waiting_tasks": self.waiting_tasks,
             "max_concurrent_tasks": self.config.max_concurrent_tasks,
             "uptime_seconds": uptime,
             "metrics": asdict(self.metrics),
+            "memory": self.memory.conversation.get_stats(),
             "last_activity": self.metrics.last_activity.isoformat() if self.metrics.last_activity else None
         }
 
@@ -508,6 +772,9 @@ class Agent:
         
         self.status = AgentStatus.OFFLINE
         
+        if self.compaction_task is not None and not self.compaction_task.done():
+            self.compaction_task.cancel()
+        
         # Limpiar recursos
         if hasattr(self, 'llm_model'):
             self.llm_model = None
@@ -517,7 +784,8 @@ class Agent:
 class AgentManager:
     """Gestor principal de agentes"""
     
-    def __init__(self, coordinator, ollama_manager, task_queue: TaskQueue, state_manager: StateManager):
+    def __init__(self, coordinator, ollama_manager, task_queue: TaskQueue, state_manager: StateManager,
+                 autoscaler_config: AutoscalerConfig = None, circuit_breaker_config: CircuitBreakerConfig = None):
         self.coordinator = coordinator
         self.ollama_manager = ollama_manager
         self.task_queue = task_queue
@@ -527,6 +795,16 @@ class AgentManager:
         self.agents: Dict[str, Agent] = {}
         self.agent_configs: Dict[str, AgentConfig] = {}
         
+        # Réplicas por tipo de plantilla (la primera es la original y nunca se retira)
+        self.agent_groups: Dict[str, List[str]] = {}
+        self.replica_counters: Dict[str, int] = {}
+        self.autoscaler = AgentAutoscaler(self, autoscaler_config)
+        self.router = AgentRouter(self)
+        
+        # Circuit breakers por agente y por modelo; la cola se entera de los circuitos abiertos
+        self.circuit_breakers = CircuitBreakerRegistry(circuit_breaker_config)
+        self.circuit_breakers.add_listener(self._on_circuit_state_change)
+        
         # Plantillas de configuración
         self.agent_templates = self._load_agent_templates()
         
@@ -541,6 +819,9 @@ class AgentManager:
         
         # Control de ejecución
         self.running = False
+        
+        # Se activa cuando existen los agentes por defecto (pueden crearse en segundo plano)
+        self.agents_ready = asyncio.Event()
 
     def _load_agent_templates(self) -> Dict[str, Dict]:
         """Carga plantillas de configuración de agentes"""
@@ -561,7 +842,9 @@ class AgentManager:
                 "system_prompt": "Eres un especialista en análisis de datos y extracción de información.",
                 "skills": ["analisis", "extraccion", "estadistica"],
                 "capabilities": ["data_analysis", "pattern_recognition", "insight_generation"],
-                "max_concurrent_tasks": 3
+                "max_concurrent_tasks": 3,
+                # Análisis reproducible: las peticiones repetidas se sirven desde la caché
+                "temperature": 0.0
             },
             "generator": {
                 "name": "Generador de Contenido",
@@ -592,13 +875,18 @@ class AgentManager:
             }
         }
 
-    async def initialize(self):
-        """Inicializa el gestor de agentes"""
+    async def initialize(self, create_agents: bool = True):
+        """Inicializa el gestor de agentes
+
+        Con create_agents=False los agentes por defecto se crean aparte con
+        create_default_agents() y las tareas esperan a que estén listos.
+        """
         try:
             logger.info("Inicializando Agent Manager...")
             
             # Crear agentes por defecto
-            await self._create_default_agents()
+            if create_agents:
+                await self.create_default_agents()
             
             # Configurar listeners de tareas
             self._setup_task_listeners()
@@ -606,6 +894,7 @@ class AgentManager:
             # Iniciar monitoreo de agentes
             self.running = True
             asyncio.create_task(self._monitor_agents())
+            await self.autoscaler.start()
             
             logger.info("Agent Manager inicializado correctamente")
             
@@ -613,14 +902,33 @@ class AgentManager:
             logger.error(f"Error inicializando Agent Manager: {e}")
             raise
 
-    async def _create_default_agents(self):
-        """Crea los agentes por defecto del sistema"""
+    async def create_default_agents(self):
+        """Crea en paralelo los agentes por defecto del sistema"""
         default_agents = ["coordinator", "analyzer", "generator", "code_executor", "researcher"]
         
-        for agent_type in default_agents:
-            await self.create_agent(agent_type, f"{agent_type}_001")
+        # Un único pull por modelo aunque varios agentes lo compartan
+        models = {self.agent_templates[agent_type]["model"] for agent_type in default_agents}
+        await self.ollama_manager.install_multiple_models(sorted(models))
+        
+        results = await asyncio.gather(
+            *(self.create_agent(agent_type, f"{agent_type}_001") for agent_type in default_agents),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+        self.agents_ready.set()
+
+    async def wait_until_ready(self, timeout: float = 60.0) -> bool:
+        """Espera a que existan los agentes por defecto"""
+        try:
+            await asyncio.wait_for(self.agents_ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
 
-    async def create_agent(self, agent_type: str, agent_id: str = None, custom_config: Dict = None) -> str:
+    async def create_agent(self, agent_type: str, agent_id: str = None, custom_config: Dict = None,
+                           llm_model: ManagedChatModel = None) -> str:
         """Crea un nuevo agente"""
         try:
             # Generar ID si no se proporciona
@@ -647,16 +955,22 @@ class AgentManager:
                 skills=template["skills"],
                 capabilities=template["capabilities"],
                 max_concurrent_tasks=template.get("max_concurrent_tasks", 3),
-                custom_config=custom_config or {}
+                custom_config=custom_config or {},
+                temperature=template.get("temperature", 0.7),
+                seed=template.get("seed"),
+                prefer_resident=template.get("prefer_resident", False)
             )
             
             # Crear e inicializar agente
             agent = Agent(config)
-            await agent.initialize(self.ollama_manager)
+            await agent.initialize(self.ollama_manager, llm_model)
+            agent.circuit_breakers = self.circuit_breakers
+            await self._restore_agent_memory(agent)
             
             # Registrar agente
             self.agents[agent_id] = agent
             self.agent_configs[agent_id] = config
+            self.agent_groups.setdefault(agent_type, []).append(agent_id)
             
             # Actualizar métricas del sistema
             self.system_metrics["total_agents"] += 1
@@ -669,37 +983,180 @@ class AgentManager:
             logger.error(f"Error creando agente {agent_id}: {e}")
             raise
 
+    def _on_circuit_state_change(self, name: str, old_state: CircuitState, new_state: CircuitState):
+        """Informa a la cola para que aplace el trabajo de baja prioridad de los agentes afectados"""
+        if self.task_queue is None:
+            return
+        kind, _, target = name.partition(":")
+        if kind == "model":
+            agent_ids = [agent_id for agent_id, agent in self.agents.items() if agent.config.model == target]
+        else:
+            agent_ids = [target]
+        self.task_queue.report_circuit_state(name, new_state != CircuitState.CLOSED, agent_ids)
+
+    async def _restore_agent_memory(self, agent: Agent):
+        """Recupera la memoria persistida de un agente, si existe"""
+        if self.state_manager is None or not agent.config.memory_enabled:
+            return
+        payload = await self.state_manager.load_agent_memory(agent.config.agent_id)
+        if payload:
+            try:
+                agent.memory.conversation = ConversationMemory.deserialize(
+                    payload, agent.memory.conversation.config
+                )
+            except Exception as e:
+                logger.warning(f"Memoria del agente {agent.config.agent_id} ilegible: {e}")
+
+    async def _persist_agent_memories(self, agent_ids: List[str] = None):
+        """Persiste en lote las memorias modificadas desde el último guardado"""
+        if self.state_manager is None:
+            return
+        memories = {}
+        for agent_id in agent_ids if agent_ids is not None else list(self.agents):
+            conversation = self.agents[agent_id].memory.conversation
+            if conversation.dirty:
+                memories[agent_id] = conversation.serialize()
+                conversation.dirty = False
+        await self.state_manager.save_agent_memories(memories)
+
+    async def spawn_replica(self, agent_type: str) -> str:
+        """Crea una réplica de un tipo de agente compartiendo el cliente del modelo"""
+        group = self.agent_groups.get(agent_type)
+        if not group:
+            return await self.create_agent(agent_type)
+        
+        base = self.agents[group[0]]
+        self.replica_counters[agent_type] = self.replica_counters.get(agent_type, 0) + 1
+        replica_id = f"{group[0]}_r{self.replica_counters[agent_type]:02d}"
+        return await self.create_agent(
+            agent_type, replica_id, base.config.custom_config or None, llm_model=base.llm_model
+        )
+
+    async def retire_replica(self, agent_type: str) -> Optional[str]:
+        """Retira la réplica ociosa más reciente de un tipo; devuelve su ID"""
+        group = self.agent_groups.get(agent_type, [])
+        for agent_id in reversed(group[1:]):
+            agent = self.agents[agent_id]
+            if agent.outstanding_tasks > 0:
+                continue
+            
+            # Sacarla del enrutado antes de esperar a que termine
+            group.remove(agent_id)
+            agent.status = AgentStatus.MAINTENANCE
+            await agent.shutdown()
+            
+            # Sus sesiones siguen en la réplica base con los turnos que tenían
+            base = self.agents[group[0]]
+            base.memory.conversation.absorb(agent.memory.conversation)
+            self.router.reassign_sessions(agent_id, base.config.agent_id)
+            try:
+                await self._persist_agent_memories([agent_id, base.config.agent_id])
+            except Exception as e:
+                logger.error(f"Error guardando la memoria de la réplica {agent_id}: {e}")
+            del self.agents[agent_id]
+            del self.agent_configs[agent_id]
+            self.system_metrics["total_agents"] -= 1
+            return agent_id
+        return None
+
+    def replica_count(self) -> int:
+        """Número de réplicas adicionales creadas por el autoescalado"""
+        return sum(len(group) - 1 for group in self.agent_groups.values() if group)
+
+    def _group_of(self, agent_id: str) -> Optional[str]:
+        for agent_type, group in self.agent_groups.items():
+            if agent_id in group:
+                return agent_type
+        return None
+
+    def select_replica(self, agent_type: str, session_id: str = None) -> Optional[Agent]:
+        """Elige la réplica con menos trabajo pendiente (y menor latencia en caso de empate);
+        con session_id mantiene la sesión en la réplica que guarda su memoria"""
+        candidates = [
+            self.agents[agent_id] for agent_id in self.agent_groups.get(agent_type, [])
+            if self.agents[agent_id].status != AgentStatus.MAINTENANCE
+        ]
+        if not candidates:
+            return None
+        least_loaded = lambda agents: min(agents, key=lambda a: (a.outstanding_tasks, a.metrics.latency_ewma))
+        if session_id is None:
+            return least_loaded(candidates)
+        return self.router.choose(candidates, session_id, pick=least_loaded)
+
+    def route_task(self, task_type: str = None, capability: str = None,
+                   session_id: str = None) -> Optional[Agent]:
+        """Elige agente por tipo de tarea o capacidad (menor tiempo esperado, afinidad por sesión)"""
+        return self.router.route(task_type, capability, session_id)
+
     def _setup_task_listeners(self):
         """Configura listeners para tareas de agentes"""
         self.task_queue.add_task_listener("agent_task", self._handle_agent_task)
 
+    def _resolve_agent(self, task) -> Optional[Agent]:
+        """Enruta a la réplica menos cargada del tipo (o del grupo del agente indicado), o a la
+        que ya atiende la sesión; sin agente ni tipo, el router elige por capacidad o tipo de tarea"""
+        agent_id = task.get("agent_id")
+        agent_type = task.get("agent_type") or self._group_of(agent_id)
+        if agent_type:
+            return self.select_replica(agent_type, task.get("session_id"))
+        if agent_id is None:
+            return self.route_task(task.get("task_type"), task.get("capability"), task.get("session_id"))
+        return None
+
     async def _handle_agent_task(self, task):
         """Maneja tareas dirigidas a agentes específicos"""
-        try:
-            agent_id = task.get("agent_id")
-            task_type = task.get("task_type")
-            task_data = task.get("task_data")
-            task_id = task.get("task_id")
-            
-            if agent_id not in self.agents:
-                logger.warning(f"Agente {agent_id} no encontrado")
-                return
-            
-            agent = self.agents[agent_id]
-            
-            # Verificar si el agente puede aceptar más tareas
-            if agent.active_tasks >= agent.config.max_concurrent_tasks:
-                logger.warning(f"Agente {agent_id} sobrecargado, reintentando más tarde...")
-                return
-            
-            # Ejecutar tarea
-            result = await agent.execute_task(task_id, task_type, task_data)
-            
-            # Enviar resultado
-            await self.task_queue.submit_result(task_id, result)
-            
-        except Exception as e:
-            logger.error(f"Error manejando tarea de agente: {e}")
+        trace_parent = task.get("trace_parent")
+        with get_tracer().span("agent.dispatch", {"task.id": str(task.get("task_id"))},
+                               parent=tuple(trace_parent) if trace_parent else None) as span:
+            try:
+                agent_id = task.get("agent_id")
+                task_type = task.get("task_type")
+                task_data = task.get("task_data")
+                task_id = task.get("task_id")
+                
+                agent = self._resolve_agent(task)
+                if agent is None and not self.agents_ready.is_set():
+                    # Los agentes por defecto aún se están creando en segundo plano
+                    await self.wait_until_ready()
+                    agent = self._resolve_agent(task)
+                
+                if agent is None:
+                    logger.warning(f"Agente {agent_id or task.get('agent_type') or task_type} no encontrado")
+                    span.set_error("Sin agente disponible")
+                    return
+                span.set_attributes({"agent.id": agent.config.agent_id, "agent.outstanding": agent.outstanding_tasks})
+                
+                # Si todas las réplicas están ocupadas la tarea espera en el semáforo,
+                # y esa cola es la señal que usa el autoescalado
+                if agent.active_tasks >= agent.config.max_concurrent_tasks:
+                    logger.debug(f"Agente {agent.config.agent_id} saturado, tarea {task_id} en cola")
+                
+                # Ejecutar tarea (en streaming, los tokens se publican según llegan)
+                if task.get("stream"):
+                    result = None
+                    async for chunk in agent.execute_task_stream(task_id, task_type, task_data,
+                                                                 task.get("session_id")):
+                        if chunk["type"] == "token":
+                            await self.task_queue.publish_partial_result(task_id, chunk)
+                        else:
+                            result = chunk
+                else:
+                    result = await agent.execute_task(task_id, task_type, task_data, task.get("session_id"))
+                
+                # Enviar resultado
+                await self.task_queue.submit_result(task_id, result)
+                
+            except Exception as e:
+                span.set_error(str(e))
+                logger.error(f"Error manejando tarea de agente: {e}")
+
+    async def cancel_task(self, task_id: str) -> bool:
+        """Cancela una tarea en streaming en el agente que la esté ejecutando"""
+        for agent in self.agents.values():
+            if agent.cancel_task(task_id):
+                logger.info(f"Tarea {task_id} cancelada en agente {agent.config.agent_id}")
+                return True
+        return False
 
     async def _monitor_agents(self):
         """Monitorea el estado de los agentes"""
@@ -707,6 +1164,8 @@ class AgentManager:
             try:
                 await self._update_agent_metrics()
                 await self._check_agent_health()
+                await self._persist_agent_memories()
+                self.router.cleanup_sessions()
                 await self._cleanup_inactive_agents()
                 
                 await asyncio.sleep(30)  # Check every 30 seconds
@@ -736,6 +1195,14 @@ class AgentManager:
             "failed_agents": failed,
             "total_tasks": sum(agent.metrics.total_tasks for agent in self.agents.values())
         })
+        
+        # Tiempo hasta el primer token ponderado por tareas en streaming
+        streamed = sum(agent.metrics.streamed_tasks for agent in self.agents.values())
+        if streamed:
+            self.system_metrics["average_time_to_first_token"] = sum(
+                agent.metrics.average_time_to_first_token * agent.metrics.streamed_tasks
+                for agent in self.agents.values()
+            ) / streamed
 
     async def _check_agent_health(self):
         """Verifica la salud de los agentes"""
@@ -769,6 +1236,9 @@ class AgentManager:
         return {
             "system_metrics": self.system_metrics,
             "agents": {agent_id: agent.get_status() for agent_id, agent in self.agents.items()},
+            "autoscaler": self.autoscaler.get_stats(),
+            "router": self.router.get_stats(),
+            "circuit_breakers": self.circuit_breakers.get_stats(),
             "agent_types": {
                 agent_type.value: len(await self.get_agents_by_type(agent_type))
                 for agent_type in AgentType
@@ -780,12 +1250,15 @@ class AgentManager:
         logger.info("Cerrando Agent Manager...")
         
         self.running = False
+        await self.autoscaler.stop()
         
         # Cerrar todos los agentes
         for agent in self.agents.values():
             await agent.shutdown()
+        await self._persist_agent_memories()
         
         self.agents.clear()
         self.agent_configs.clear()
+        self.agent_groups.clear()
         
         logger.info("Agent Manager cerrado")
\ No newline at end of file
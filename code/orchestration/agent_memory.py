@@ -0,0 +1,230 @@
+"""
+Memoria conversacional acotada de los agentes
+Ventana de turnos recientes limitada por tokens y resumen compacto de los turnos antiguos
+"""
+
+import json
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+# Aproximación habitual para modelos tipo Llama: ~4 caracteres por token
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estima el número de tokens de un texto"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Recorta un texto a un número aproximado de tokens"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + "…"
+
+
+@dataclass
+class MemoryConfig:
+    """Límites de la memoria conversacional"""
+    max_turns: int = 100  # capacidad del buffer circular
+    context_token_budget: int = 1024  # tokens de historial que se envían al modelo
+    max_turn_tokens: int = 256  # recorte de cada entrada/salida almacenada
+    keep_recent_turns: int = 6  # turnos que nunca se resumen
+    summarize_every: int = 10  # turnos antiguos acumulados antes de resumir
+    summary_max_tokens: int = 256
+    max_session_summaries: int = 100  # resúmenes de sesión conservados (los más recientes)
+    # Historial de todo el agente en cada prompt (resumen incluido); sin él solo se envían
+    # los turnos de la misma sesión cuando la tarea trae session_id
+    inject_history: bool = False
+
+
+@dataclass
+class ConversationTurn:
+    """Turno almacenado: tarea recibida y resultado producido"""
+    task_id: str
+    task_type: str
+    input: str
+    output: str
+    timestamp: str
+    session_id: Optional[str] = None
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.input) + estimate_tokens(self.output)
+
+
+class ConversationMemory:
+    """Buffer circular de turnos con resumen incremental de los más antiguos
+
+    Los turnos de cada sesión se resumen aparte (`session_summaries`) y ese resumen
+    acompaña al historial de la sesión; `summary` recoge los turnos sin sesión.
+    """
+
+    def __init__(self, config: MemoryConfig = None):
+        self.config = config or MemoryConfig()
+        self.turns: deque = deque(maxlen=self.config.max_turns)
+        self.summary = ""
+        self.session_summaries: Dict[str, str] = {}
+        self.summarized_turns = 0
+        self.dropped_turns = 0
+        self.dirty = False
+
+    def append(self, task_id: str, task_type: str, task_data: Any, result: Any,
+               session_id: Optional[str] = None):
+        """Agrega un turno, recortando entrada y salida al máximo configurado"""
+        if len(self.turns) == self.turns.maxlen:
+            # El resumen no dio abasto: el turno más antiguo se pierde sin resumir
+            self.dropped_turns += 1
+
+        self.turns.append(ConversationTurn(
+            task_id=task_id,
+            task_type=task_type,
+            input=truncate_to_tokens(self._to_text(task_data), self.config.max_turn_tokens),
+            output=truncate_to_tokens(self._to_text(result), self.config.max_turn_tokens),
+            timestamp=datetime.now().isoformat(),
+            session_id=session_id
+        ))
+        self.dirty = True
+
+    def _to_text(self, value: Any) -> str:
+        if isinstance(value, str):
+            return value
+        return json.dumps(value, ensure_ascii=False, default=str)
+
+    def context_messages(self, token_budget: Optional[int] = None, session_id: Optional[str] = None) -> List:
+        """Mensajes de historial (resumen + turnos recientes) dentro del presupuesto de tokens
+
+        Con `session_id` solo se incluyen el resumen y los turnos de esa sesión.
+        """
+        budget = token_budget if token_budget is not None else self.config.context_token_budget
+        messages = []
+
+        summary = self.summary if session_id is None else self.session_summaries.get(session_id, "")
+        if summary:
+            summary = truncate_to_tokens(summary, min(budget, self.config.summary_max_tokens))
+            budget -= estimate_tokens(summary)
+            messages.append(SystemMessage(content=f"Resumen de la conversación anterior: {summary}"))
+
+        # Turnos más recientes primero hasta agotar el presupuesto
+        recent = []
+        for turn in reversed(self.turns):
+            if session_id is not None and turn.session_id != session_id:
+                continue
+            if turn.tokens > budget:
+                break
+            budget -= turn.tokens
+            recent.append(turn)
+
+        for turn in reversed(recent):
+            messages.append(HumanMessage(content=f"[{turn.task_type}] {turn.input}"))
+            messages.append(AIMessage(content=turn.output))
+        return messages
+
+    def absorb(self, other: "ConversationMemory"):
+        """Incorpora los turnos de otra memoria (la de una réplica retirada) en orden temporal
+
+        Si no caben todos se conservan los más recientes.
+        """
+        for session_id, summary in other.session_summaries.items():
+            if session_id not in self.session_summaries:
+                self._set_session_summary(session_id, summary)
+        if not other.turns:
+            return
+        turns = sorted([*self.turns, *other.turns], key=lambda turn: turn.timestamp)
+        self.dropped_turns += max(len(turns) - self.config.max_turns, 0)
+        self.turns = deque(turns, maxlen=self.config.max_turns)
+        self.dirty = True
+
+    def needs_compaction(self) -> bool:
+        return len(self.turns) - self.config.keep_recent_turns >= self.config.summarize_every
+
+    async def compact(self, summarize: Optional[Callable[[str, str], Awaitable[str]]] = None):
+        """Pliega los turnos antiguos en el resumen de su sesión (o en el general)
+
+        `summarize(resumen_actual, turnos)` devuelve el nuevo resumen. Solo se llama
+        para los resúmenes que llegan al prompt: los de sesión y, con inject_history,
+        el general. Sin él (o si falla) se conserva un resumen extractivo recortado.
+        """
+        n_old = len(self.turns) - self.config.keep_recent_turns
+        if n_old <= 0:
+            return
+
+        old_turns = [self.turns[i] for i in range(n_old)]
+        by_session: Dict[Optional[str], List[ConversationTurn]] = {}
+        for turn in old_turns:
+            by_session.setdefault(turn.session_id, []).append(turn)
+
+        for session_id, turns in by_session.items():
+            current = self.summary if session_id is None else self.session_summaries.get(session_id, "")
+            transcript = "\n".join(f"- [{t.task_type}] {t.input} -> {t.output}" for t in turns)
+
+            new_summary = None
+            if summarize is not None and (session_id is not None or self.config.inject_history):
+                try:
+                    new_summary = await summarize(current, transcript)
+                except Exception as e:
+                    logger.warning(f"Error resumiendo memoria, se usa resumen extractivo: {e}")
+            if not new_summary:
+                new_summary = f"{current}\n{transcript}".strip()
+
+            new_summary = truncate_to_tokens(new_summary, self.config.summary_max_tokens)
+            if session_id is None:
+                self.summary = new_summary
+            else:
+                self._set_session_summary(session_id, new_summary)
+
+        # Pueden haber llegado turnos nuevos durante el resumen: solo se retiran los resumidos
+        summarized = {id(turn) for turn in old_turns}
+        while self.turns and id(self.turns[0]) in summarized:
+            self.turns.popleft()
+
+        self.summarized_turns += n_old
+        self.dirty = True
+
+    def _set_session_summary(self, session_id: str, summary: str):
+        """Guarda el resumen de una sesión descartando los de las sesiones menos recientes"""
+        self.session_summaries.pop(session_id, None)
+        self.session_summaries[session_id] = summary
+        while len(self.session_summaries) > self.config.max_session_summaries:
+            del self.session_summaries[next(iter(self.session_summaries))]
+
+    def serialize(self) -> bytes:
+        """Serializa la memoria comprimida con zlib"""
+        data = {
+            "summary": self.summary,
+            "session_summaries": self.session_summaries,
+            "summarized_turns": self.summarized_turns,
+            "turns": [vars(turn) for turn in self.turns]
+        }
+        return zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+    @classmethod
+    def deserialize(cls, payload: bytes, config: MemoryConfig = None) -> "ConversationMemory":
+        memory = cls(config)
+        data = json.loads(zlib.decompress(payload).decode("utf-8"))
+        memory.summary = data.get("summary", "")
+        memory.session_summaries = data.get("session_summaries", {})
+        memory.summarized_turns = data.get("summarized_turns", 0)
+        for turn in data.get("turns", []):
+            memory.turns.append(ConversationTurn(**turn))
+        return memory
+
+    def get_stats(self) -> Dict:
+        return {
+            "turns": len(self.turns),
+            "summarized_turns": self.summarized_turns,
+            "dropped_turns": self.dropped_turns,
+            "summary_tokens": estimate_tokens(self.summary) if self.summary else 0,
+            "session_summaries": len(self.session_summaries),
+            "window_tokens": sum(turn.tokens for turn in self.turns)
+        }
+
+    def __len__(self) -> int:
+        return len(self.turns)
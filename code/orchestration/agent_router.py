@@ -0,0 +1,137 @@
+"""
+Enrutado de tareas entre agentes
+Elige por capacidad o tipo de tarea el agente con menor tiempo esperado de finalización
+"""
+
+import random
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# Latencia supuesta para agentes sin historial (segundos)
+DEFAULT_LATENCY = 1.0
+
+
+class AgentRouter:
+    """Router de dos opciones aleatorias (power of two choices) con afinidad por sesión
+
+    El coste de un agente es su latencia EWMA multiplicada por las "rondas" de
+    trabajo que tiene delante según la ocupación de su semáforo. Las sesiones
+    conversacionales se mantienen en el mismo agente (que guarda su memoria)
+    salvo que esté claramente sobrecargado.
+    """
+
+    def __init__(self, agent_manager, sticky_ttl: float = 600.0,
+                 sticky_overload_factor: float = 2.0, seed: Optional[int] = None):
+        self.agent_manager = agent_manager
+        self.sticky_ttl = sticky_ttl
+        self.sticky_overload_factor = sticky_overload_factor
+        self.random = random.Random(seed)
+
+        # session_id -> (agent_id, último uso)
+        self.sessions: Dict[str, Tuple[str, float]] = {}
+
+        self.stats = {
+            "routed": 0,
+            "sticky_hits": 0,
+            "sticky_breaks": 0,
+            "no_candidates": 0
+        }
+
+    def candidates(self, task_type: Optional[str] = None, capability: Optional[str] = None) -> List:
+        """Agentes disponibles que declaran la capacidad o manejan el tipo de tarea"""
+        agents = []
+        for agent in self.agent_manager.agents.values():
+            # Las réplicas en retirada están en mantenimiento
+            if agent.status.value == "maintenance":
+                continue
+            if capability is not None and capability not in agent.config.capabilities:
+                continue
+            if task_type is not None and task_type not in agent.task_handlers:
+                continue
+            agents.append(agent)
+        return agents
+
+    def expected_completion(self, agent) -> float:
+        """Tiempo esperado hasta completar una tarea nueva en el agente"""
+        latency = agent.metrics.latency_ewma or DEFAULT_LATENCY
+        capacity = max(agent.config.max_concurrent_tasks, 1)
+        rounds = agent.outstanding_tasks // capacity + 1
+        # La ocupación desempata entre agentes con el mismo número de rondas
+        return latency * rounds + latency * (agent.outstanding_tasks % capacity) / (capacity * 10)
+
+    def route(self, task_type: Optional[str] = None, capability: Optional[str] = None,
+              session_id: Optional[str] = None):
+        """Devuelve el agente elegido o None si ninguno puede atender la tarea"""
+        candidates = self.candidates(task_type, capability)
+        if not candidates:
+            self.stats["no_candidates"] += 1
+            logger.warning(f"Sin agentes para tarea={task_type} capacidad={capability}")
+            return None
+
+        return self.choose(candidates, session_id)
+
+    def choose(self, candidates: List, session_id: Optional[str] = None,
+               pick: Optional[Callable[[List], object]] = None):
+        """Elige entre candidatos respetando la afinidad de la sesión
+
+        `pick` decide cuando no hay afinidad aplicable (por defecto, dos opciones aleatorias).
+        """
+        self.stats["routed"] += 1
+        now = time.monotonic()
+
+        if session_id is not None:
+            sticky = self._sticky_agent(session_id, candidates, now)
+            if sticky is not None:
+                self.sessions[session_id] = (sticky.config.agent_id, now)
+                self.stats["sticky_hits"] += 1
+                return sticky
+
+        chosen = (pick or self._power_of_two)(candidates)
+        if session_id is not None:
+            self.sessions[session_id] = (chosen.config.agent_id, now)
+        return chosen
+
+    def _sticky_agent(self, session_id: str, candidates: List, now: float):
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            return None
+        agent_id, last_used = entry
+        if now - last_used > self.sticky_ttl:
+            del self.sessions[session_id]
+            return None
+
+        agent = next((a for a in candidates if a.config.agent_id == agent_id), None)
+        if agent is None:
+            return None
+
+        # Romper la afinidad solo si el agente va muy por detrás del mejor
+        best = min(self.expected_completion(a) for a in candidates)
+        if self.expected_completion(agent) > best * self.sticky_overload_factor:
+            self.stats["sticky_breaks"] += 1
+            return None
+        return agent
+
+    def _power_of_two(self, candidates: List):
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = self.random.sample(candidates, 2)
+        return min((first, second), key=self.expected_completion)
+
+    def reassign_sessions(self, old_agent_id: str, new_agent_id: str) -> List[str]:
+        """Traslada las sesiones de un agente que se retira a otro; devuelve las sesiones movidas"""
+        moved = [s for s, (agent_id, _) in self.sessions.items() if agent_id == old_agent_id]
+        for session_id in moved:
+            self.sessions[session_id] = (new_agent_id, self.sessions[session_id][1])
+        return moved
+
+    def cleanup_sessions(self):
+        """Elimina afinidades caducadas"""
+        now = time.monotonic()
+        expired = [s for s, (_, last) in self.sessions.items() if now - last > self.sticky_ttl]
+        for session_id in expired:
+            del self.sessions[session_id]
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, "sessions": len(self.sessions)}
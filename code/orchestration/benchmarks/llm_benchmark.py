@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+"""
+Benchmark de rendimiento LLM sobre el servidor Ollama simulado
+Mide throughput y latencia de OllamaManager, tareas de agentes y workflows bajo concurrencia
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+# Agregar el directorio de orquestación al path
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+from loguru import logger
+
+from mock_ollama_server import MockOllamaConfig, MockOllamaServer
+from ollama_manager import OllamaManager
+from task_queue import TaskQueue
+from state_manager import StateManager
+from agent_manager import AgentManager
+from agent_autoscaler import AutoscalerConfig
+from circuit_breaker import CircuitBreakerConfig, CircuitState
+from langgraph_coordinator import LangGraphCoordinator
+from tracing import OTLPJsonFileExporter, get_tracer
+
+SCENARIOS = ("ollama_generate", "agent_tasks", "agent_stream",
+             "agent_skewed_static", "agent_skewed_autoscaled",
+             "agent_routing_static", "agent_routing_p2c", "outage_recovery", "workflows",
+             "workflow_resume")
+
+# Tareas de agente que realmente invocan al modelo
+AGENT_LLM_TASKS = {
+    "coordinator": "coordinate_workflow",
+    "analyzer": "analyze_data",
+    "generator": "generate_content",
+    "code_executor": "generate_code",
+    "researcher": "summarize_findings"
+}
+
+
+def attach_trace_exporter(args):
+    """Exporta las trazas del tracer activo (el coordinador lo reconfigura al inicializarse)"""
+    if args.trace_output:
+        get_tracer().add_exporter(OTLPJsonFileExporter(args.trace_output))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float, **extra) -> Dict[str, Any]:
+    """Resume latencias y throughput de un escenario"""
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "latency_mean": statistics.mean(latencies) if latencies else 0.0,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        **extra
+    }
+
+
+async def run_concurrently(n_requests: int, concurrency: int,
+                           job: Callable[[int], Awaitable[bool]]) -> Dict[str, Any]:
+    """Ejecuta n_requests trabajos con como máximo `concurrency` en vuelo"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def timed(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ok = await job(i)
+            except Exception as e:
+                logger.debug(f"Petición {i} fallida: {e}")
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[timed(i) for i in range(n_requests)])
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def bench_ollama_generate(manager: OllamaManager, args) -> Dict[str, Any]:
+    """Generaciones directas repartidas entre varios modelos"""
+    models = ["llama3.1:8b", "mistral:7b", "phi3:mini"]
+
+    async def job(i: int) -> bool:
+        response = await manager.generate(models[i % len(models)], f"Prompt de benchmark {i}")
+        return bool(response.response)
+
+    result = await run_concurrently(args.requests, args.concurrency, job)
+    result["concurrency"] = manager.get_concurrency_stats()
+    return result
+
+
+async def bench_agent_tasks(manager: OllamaManager, args, stream: bool = False) -> Dict[str, Any]:
+    """Tareas de agentes (vía OllamaManager) contra el servidor simulado, opcionalmente en streaming"""
+    agent_manager = AgentManager(
+        coordinator=None,
+        ollama_manager=manager,
+        task_queue=TaskQueue(),
+        state_manager=None
+    )
+    agent_ids = []
+    for agent_type in AGENT_LLM_TASKS:
+        agent_ids.append((await agent_manager.create_agent(agent_type, f"bench_{agent_type}"), agent_type))
+
+    ttfts: List[float] = []
+
+    async def job(i: int) -> bool:
+        agent_id, agent_type = agent_ids[i % len(agent_ids)]
+        agent = agent_manager.agents[agent_id]
+        task_type = AGENT_LLM_TASKS[agent_type]
+        if not stream:
+            result = await agent.execute_task(f"bench_task_{i}", task_type, {"item": i})
+            return result["success"]
+
+        result = None
+        async for chunk in agent.execute_task_stream(f"bench_task_{i}", task_type, {"item": i}):
+            if chunk["type"] == "result":
+                result = chunk
+        if result.get("time_to_first_token") is not None:
+            ttfts.append(result["time_to_first_token"])
+        return result["success"]
+
+    try:
+        result = await run_concurrently(args.requests, args.concurrency, job)
+        if stream:
+            result["ttft_mean"] = statistics.mean(ttfts) if ttfts else 0.0
+            result["ttft_p95"] = percentile(ttfts, 0.95)
+        return result
+    finally:
+        await agent_manager.shutdown()
+
+
+async def bench_agent_skewed(manager: OllamaManager, args, autoscale: bool) -> Dict[str, Any]:
+    """Carga concentrada en un solo tipo de agente, con réplicas fijas o autoescaladas"""
+    agent_manager = AgentManager(
+        coordinator=None,
+        ollama_manager=manager,
+        task_queue=TaskQueue(),
+        state_manager=None,
+        autoscaler_config=AutoscalerConfig(
+            enabled=autoscale,
+            interval=0.1,
+            cooldown=0.2,
+            max_replicas=args.max_replicas
+        )
+    )
+    for agent_type in AGENT_LLM_TASKS:
+        await agent_manager.create_agent(agent_type, f"bench_{agent_type}")
+    await agent_manager.autoscaler.start()
+
+    async def job(i: int) -> bool:
+        # 90% de las tareas van al analizador
+        agent_type = "analyzer" if i % 10 else list(AGENT_LLM_TASKS)[i % len(AGENT_LLM_TASKS)]
+        agent = agent_manager.select_replica(agent_type)
+        result = await agent.execute_task(f"bench_task_{i}", AGENT_LLM_TASKS[agent_type], {"item": i})
+        return result["success"]
+
+    try:
+        result = await run_concurrently(args.requests, args.concurrency, job)
+        result["autoscaler"] = agent_manager.autoscaler.get_stats()
+        return result
+    finally:
+        await agent_manager.shutdown()
+
+
+async def bench_agent_routing(manager: OllamaManager, args, use_router: bool) -> Dict[str, Any]:
+    """Varios analizadores equivalentes: asignación fija por el llamador frente al router"""
+    agent_manager = AgentManager(
+        coordinator=None,
+        ollama_manager=manager,
+        task_queue=TaskQueue(),
+        state_manager=None,
+        autoscaler_config=AutoscalerConfig(enabled=False)
+    )
+    analyzers = []
+    for n in range(args.routing_agents):
+        agent_id = await agent_manager.create_agent("analyzer", f"bench_analyzer_{n + 1}")
+        analyzers.append(agent_manager.agents[agent_id])
+
+    async def job(i: int) -> bool:
+        if use_router:
+            agent = agent_manager.route_task("analyze_data", session_id=f"session_{i % 20}")
+        else:
+            # El 70% de los llamadores tiene fijado el primer analizador
+            agent = analyzers[0] if i % 10 < 7 else analyzers[i % len(analyzers)]
+        result = await agent.execute_task(f"bench_task_{i}", "analyze_data", {"item": i})
+        return result["success"]
+
+    try:
+        result = await run_concurrently(args.requests, args.concurrency, job)
+        result["tasks_per_agent"] = {a.config.agent_id: a.metrics.total_tasks for a in analyzers}
+        if use_router:
+            result["router"] = agent_manager.router.get_stats()
+        return result
+    finally:
+        await agent_manager.shutdown()
+
+
+async def bench_outage_recovery(manager: OllamaManager, args, server: MockOllamaServer) -> Dict[str, Any]:
+    """Inyecta una caída total del servidor y mide el fallo rápido y la recuperación de los circuitos"""
+    agent_manager = AgentManager(
+        coordinator=None,
+        ollama_manager=manager,
+        task_queue=TaskQueue(),
+        state_manager=None,
+        autoscaler_config=AutoscalerConfig(enabled=False),
+        circuit_breaker_config=CircuitBreakerConfig(
+            min_calls=5,
+            window_seconds=10.0,
+            open_duration=args.open_duration,
+            fallback_models={}
+        )
+    )
+    agent_id = await agent_manager.create_agent("analyzer", "bench_analyzer")
+    agent = agent_manager.agents[agent_id]
+    breaker = agent_manager.circuit_breakers.get(f"model:{agent.config.model}")
+
+    outage_start = args.outage_warmup
+    outage_end = outage_start + args.outage_seconds
+    deadline = outage_end + args.outage_seconds * 2 + args.open_duration * 4
+    samples: List[tuple] = []  # (instante, éxito, latencia)
+    closed_at = None
+    start = time.perf_counter()
+
+    async def client(worker: int):
+        i = 0
+        while time.perf_counter() - start < deadline and closed_at is None:
+            t0 = time.perf_counter()
+            result = await agent.execute_task(f"outage_{worker}_{i}", "analyze_data", {"item": i})
+            samples.append((t0 - start, result["success"], time.perf_counter() - t0))
+            i += 1
+            await asyncio.sleep(0.01)
+
+    async def fault_injector():
+        nonlocal closed_at
+        await asyncio.sleep(outage_start)
+        server.config.failure_rate = 1.0
+        await asyncio.sleep(args.outage_seconds)
+        server.config.failure_rate = 0.0
+        while time.perf_counter() - start < deadline:
+            if breaker.state == CircuitState.CLOSED and breaker.stats["times_opened"]:
+                closed_at = time.perf_counter() - start
+                return
+            await asyncio.sleep(0.01)
+
+    try:
+        await asyncio.gather(fault_injector(), *[client(w) for w in range(args.concurrency)])
+    finally:
+        server.config.failure_rate = args.failure_rate
+        await agent_manager.shutdown()
+
+    during = [lat for t, ok, lat in samples if outage_start <= t < outage_end and not ok]
+    first_success = min((t for t, ok, _ in samples if ok and t >= outage_end), default=None)
+    result = summarize([lat for _, ok, lat in samples if ok], sum(1 for _, ok, _ in samples if not ok),
+                       time.perf_counter() - start)
+    result.update({
+        "outage_seconds": args.outage_seconds,
+        "failfast_latency_p50": percentile(during, 0.50),
+        "server_failures": breaker.stats["failures"],
+        "rejected_by_breaker": breaker.stats["rejected"],
+        "first_success_after_outage": first_success - outage_end if first_success is not None else None,
+        "recovery_time": closed_at - outage_end if closed_at is not None else None
+    })
+    return result
+
+
+async def bench_workflows(manager: OllamaManager, args, data_dir: Path) -> Dict[str, Any]:
+    """Workflows completos del coordinador LangGraph"""
+    state_manager = StateManager(
+        db_path=str(data_dir / "bench_state.db"),
+        config_path=str(data_dir / "state_config.yaml")
+    )
+    await state_manager.initialize()
+    coordinator = LangGraphCoordinator(
+        ollama_manager=manager,
+        state_manager=state_manager,
+        task_queue=TaskQueue(),
+        config_path=str(data_dir / "coordination_config.yaml")
+    )
+    await coordinator.initialize()
+    attach_trace_exporter(args)
+    workflow_types = list(coordinator.compiled_workflows)
+    parallelism: List[float] = []
+
+    async def job(i: int) -> bool:
+        workflow_id = f"bench_workflow_{i}"
+        start = time.perf_counter()
+        await coordinator._start_workflow({
+            "workflow_id": workflow_id,
+            "type": workflow_types[i % len(workflow_types)],
+            "data": {
+                "item": i,
+                "datasets": [f"dataset_{n}" for n in range(3)],
+                "processing_tasks": ["resumir", "extraer_puntos_clave"]
+            }
+        })
+        makespan = time.perf_counter() - start
+        workflow = coordinator.active_workflows[workflow_id]
+        # Suma de la duración de los pasos frente al tiempo total: >1 indica solapamiento
+        step_time = sum(
+            r.get("work_time", r.get("duration", 0.0)) for r in workflow.results.values() if isinstance(r, dict)
+        )
+        parallelism.append(step_time / makespan if makespan > 0 else 0.0)
+        return workflow.status.value == "completed"
+
+    try:
+        result = await run_concurrently(max(1, args.requests // 4), args.concurrency, job)
+        result["step_time_over_makespan"] = statistics.mean(parallelism) if parallelism else 0.0
+        return result
+    finally:
+        await coordinator.shutdown()
+        await state_manager.shutdown()
+        get_tracer().flush()
+
+
+async def bench_workflow_resume(manager: OllamaManager, args, server: MockOllamaServer,
+                                data_dir: Path) -> Dict[str, Any]:
+    """Workflows que fallan a mitad y se reanudan desde sus checkpoints"""
+    state_manager = StateManager(
+        db_path=str(data_dir / "resume_state.db"),
+        config_path=str(data_dir / "state_config.yaml")
+    )
+    await state_manager.initialize()
+    coordinator = LangGraphCoordinator(
+        ollama_manager=manager,
+        state_manager=state_manager,
+        task_queue=TaskQueue(),
+        config_path=str(data_dir / "coordination_config.yaml")
+    )
+    await coordinator.initialize()
+    attach_trace_exporter(args)
+    data = {"requirement": "Calcular Fibonacci", "language": "python"}
+
+    def llm_calls() -> int:
+        return server.stats["requests"] - server.stats["failures_injected"]
+
+    # Referencia: llamadas al modelo de un workflow sin fallos
+    calls = llm_calls()
+    await coordinator._start_workflow({"workflow_id": "resume_reference", "type": "code_generation", "data": data})
+    full_calls = llm_calls() - calls
+
+    latencies: List[float] = []
+    recomputed: List[int] = []
+    errors = 0
+
+    async def fault_injector(threshold: int):
+        while server.stats["requests"] < threshold:
+            await asyncio.sleep(0.005)
+        server.config.failure_rate = 1.0
+
+    start = time.perf_counter()
+    try:
+        for i in range(max(1, args.requests // 8)):
+            workflow_id = f"resume_workflow_{i}"
+            calls = llm_calls()
+            injector = asyncio.create_task(fault_injector(server.stats["requests"] + args.resume_fail_after))
+            await coordinator._start_workflow({"workflow_id": workflow_id, "type": "code_generation", "data": data})
+            injector.cancel()
+            server.config.failure_rate = args.failure_rate
+            calls_before_failure = llm_calls() - calls
+
+            t0 = time.perf_counter()
+            calls = llm_calls()
+            workflow = await coordinator.resume_workflow(workflow_id)
+            if workflow is None or workflow.status.value != "completed":
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - t0)
+            recomputed.append(calls_before_failure + llm_calls() - calls - full_calls)
+
+        result = summarize(latencies, errors, time.perf_counter() - start)
+        result.update({
+            "llm_calls_per_workflow": full_calls,
+            "recomputed_llm_calls": statistics.mean(recomputed) if recomputed else 0.0,
+            "skipped_nodes": coordinator.metrics["skipped_nodes"],
+            "checkpoints": coordinator.checkpointer.get_stats()
+        })
+        return result
+    finally:
+        server.config.failure_rate = args.failure_rate
+        await coordinator.shutdown()
+        await state_manager.shutdown()
+        get_tracer().flush()
+
+
+async def run_benchmarks(args) -> Dict[str, Any]:
+    config = MockOllamaConfig(
+        first_token_latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        load_time=args.load_time,
+        max_parallel=args.max_parallel,
+        failure_rate=args.failure_rate
+    )
+
+    results: Dict[str, Any] = {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "latency": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+            "response_tokens": args.response_tokens,
+            "load_time": args.load_time,
+            "max_parallel": args.max_parallel,
+            "failure_rate": args.failure_rate,
+            "max_replicas": args.max_replicas,
+            "routing_agents": args.routing_agents
+        },
+        "scenarios": {}
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        async with MockOllamaServer(config) as server:
+            manager = OllamaManager(host=server.host, port=server.port)
+            await manager.initialize()
+            attach_trace_exporter(args)
+            try:
+                for scenario in args.scenarios:
+                    logger.warning(f"Ejecutando escenario {scenario}...")
+                    if scenario == "ollama_generate":
+                        result = await bench_ollama_generate(manager, args)
+                    elif scenario == "agent_tasks":
+                        result = await bench_agent_tasks(manager, args)
+                    elif scenario == "agent_stream":
+                        result = await bench_agent_tasks(manager, args, stream=True)
+                    elif scenario == "outage_recovery":
+                        result = await bench_outage_recovery(manager, args, server)
+                    elif scenario == "workflow_resume":
+                        result = await bench_workflow_resume(manager, args, server, Path(tmp))
+                    elif scenario.startswith("agent_routing"):
+                        result = await bench_agent_routing(manager, args, use_router=scenario.endswith("p2c"))
+                    elif scenario.startswith("agent_skewed"):
+                        result = await bench_agent_skewed(manager, args, autoscale=scenario.endswith("autoscaled"))
+                    else:
+                        result = await bench_workflows(manager, args, Path(tmp))
+                    results["scenarios"][scenario] = result
+            finally:
+                await manager.shutdown()
+            results["server_stats"] = dict(server.stats)
+
+    return results
+
+
+def compare_with_baseline(results: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """Devuelve las regresiones de throughput o latencia p95 respecto al baseline"""
+    regressions = []
+    for scenario, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        if previous["throughput_rps"] and current["throughput_rps"] < previous["throughput_rps"] * (1 - max_regression):
+            regressions.append(
+                f"{scenario}: throughput {current['throughput_rps']:.2f} < {previous['throughput_rps']:.2f} rps"
+            )
+        if previous["latency_p95"] and current["latency_p95"] > previous["latency_p95"] * (1 + max_regression):
+            regressions.append(
+                f"{scenario}: latencia p95 {current['latency_p95']:.3f}s > {previous['latency_p95']:.3f}s"
+            )
+    return regressions
+
+
+def print_report(results: Dict):
+    print(f"\n{'Escenario':<25}{'Peticiones':>11}{'Errores':>9}{'RPS':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for scenario, r in results["scenarios"].items():
+        print(f"{scenario:<25}{r['requests']:>11}{r['errors']:>9}{r['throughput_rps']:>9.2f}"
+              f"{r['latency_p50']:>9.3f}{r['latency_p95']:>9.3f}{r['latency_p99']:>9.3f}")
+        if "ttft_mean" in r:
+            print(f"{'':<25}TTFT media {r['ttft_mean']:.3f}s, p95 {r['ttft_p95']:.3f}s")
+        if "step_time_over_makespan" in r:
+            print(f"{'':<25}tiempo de pasos / makespan {r['step_time_over_makespan']:.2f}")
+        if "recomputed_llm_calls" in r:
+            print(f"{'':<25}llamadas por workflow {r['llm_calls_per_workflow']}, "
+                  f"recalculadas al reanudar {r['recomputed_llm_calls']:.1f}, "
+                  f"compresión {r['checkpoints']['compression_ratio']:.1f}x")
+        if "recovery_time" in r:
+            recovery = f"{r['recovery_time']:.2f}s" if r["recovery_time"] is not None else "sin recuperar"
+            print(f"{'':<25}fallo rápido p50 {r['failfast_latency_p50'] * 1000:.1f}ms, "
+                  f"rechazadas {r['rejected_by_breaker']}, recuperación {recovery}")
+        if "autoscaler" in r:
+            replicas = {t: g["replicas"] for t, g in r["autoscaler"]["groups"].items()}
+            print(f"{'':<25}escalados {r['autoscaler']['scale_ups']}, réplicas {replicas}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LLM sobre Ollama simulado")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02, help="Latencia hasta el primer token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=500.0)
+    parser.add_argument("--response-tokens", type=int, default=32)
+    parser.add_argument("--load-time", type=float, default=0.0)
+    parser.add_argument("--max-parallel", type=int, default=4)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--max-replicas", type=int, default=4, help="Réplicas máximas por tipo de agente")
+    parser.add_argument("--routing-agents", type=int, default=4, help="Analizadores en los escenarios de enrutado")
+    parser.add_argument("--outage-seconds", type=float, default=2.0, help="Duración de la caída inyectada")
+    parser.add_argument("--outage-warmup", type=float, default=0.5, help="Tráfico sano antes de la caída")
+    parser.add_argument("--open-duration", type=float, default=0.5, help="Tiempo que un circuito permanece abierto")
+    parser.add_argument("--resume-fail-after", type=int, default=2,
+                        help="Llamadas al modelo antes de inyectar el fallo en workflow_resume")
+    parser.add_argument("--output", type=str, help="Guardar resultados en JSON")
+    parser.add_argument("--trace-output", type=str,
+                        help="Exportar las trazas en OTLP/JSON (ver trace_report.py)")
+    parser.add_argument("--baseline", type=str, help="JSON de resultados previos para detectar regresiones")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Degradación relativa tolerada frente al baseline")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="DEBUG" if args.verbose else "WARNING")
+
+    results = asyncio.run(run_benchmarks(args))
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, default=str)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.max_regression)
+        if regressions:
+            print("\nRegresiones detectadas:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print("\nSin regresiones respecto al baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Servidor simulado de la API HTTP de Ollama
+Permite probar y medir OllamaManager, AgentManager y LangGraphCoordinator sin GPU ni red
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from aiohttp import web
+from loguru import logger
+
+
+@dataclass
+class MockOllamaConfig:
+    """Parámetros de latencia, rendimiento y fallos del servidor simulado"""
+    models: List[str] = field(default_factory=lambda: [
+        "llama3.1:8b", "mistral:7b", "codellama:7b", "phi3:mini"
+    ])
+    first_token_latency: float = 0.05  # segundos hasta el primer token
+    tokens_per_second: float = 200.0
+    response_tokens: int = 64
+    load_time: float = 0.0  # arranque en frío por modelo
+    max_loaded_models: int = 3
+    max_parallel: int = 4  # peticiones que el "GPU" procesa a la vez
+    failure_rate: float = 0.0  # probabilidad de responder con error
+    failure_status: int = 500
+    seed: Optional[int] = 42
+
+
+class MockOllamaServer:
+    """Implementación en proceso de /api/generate, /api/chat, /api/tags y afines"""
+
+    def __init__(self, config: MockOllamaConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockOllamaConfig()
+        self.host = host
+        self.port = port
+        self.runner: Optional[web.AppRunner] = None
+
+        self.random = random.Random(self.config.seed)
+        self.gpu = None
+        self.loaded_models: "OrderedDict[str, float]" = OrderedDict()
+        self.load_locks: Dict[str, asyncio.Lock] = {}
+
+        self.stats = {
+            "requests": 0,
+            "failures_injected": 0,
+            "tokens_generated": 0,
+            "model_loads": 0,
+            "client_disconnects": 0
+        }
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/tags", self._handle_tags)
+        app.router.add_get("/api/ps", self._handle_ps)
+        app.router.add_get("/api/version", self._handle_version)
+        app.router.add_post("/api/show", self._handle_show)
+        app.router.add_post("/api/pull", self._handle_pull)
+        app.router.add_post("/api/generate", self._handle_generate)
+        app.router.add_post("/api/chat", self._handle_chat)
+        return app
+
+    async def start(self):
+        """Arranca el servidor; con port=0 se elige un puerto libre"""
+        self.gpu = asyncio.Semaphore(self.config.max_parallel)
+        self.runner = web.AppRunner(self.create_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Servidor Ollama simulado escuchando en {self.base_url}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    # Endpoints de información
+    async def _handle_tags(self, request: web.Request) -> web.Response:
+        models = [
+            {"name": name, "model": name, "size": 4_000_000_000, "digest": f"mock-{name}"}
+            for name in self.config.models
+        ]
+        return web.json_response({"models": models})
+
+    async def _handle_ps(self, request: web.Request) -> web.Response:
+        models = [{"name": name, "model": name, "size_vram": 4_000_000_000} for name in self.loaded_models]
+        return web.json_response({"models": models})
+
+    async def _handle_version(self, request: web.Request) -> web.Response:
+        return web.json_response({"version": "0.0.0-mock"})
+
+    async def _handle_show(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        name = data.get("name") or data.get("model")
+        if name not in self.config.models:
+            return web.json_response({"error": f"model '{name}' not found"}, status=404)
+        return web.json_response({"name": name, "family": name.split(":")[0], "size": "mock"})
+
+    async def _handle_pull(self, request: web.Request) -> web.StreamResponse:
+        data = await request.json()
+        name = data.get("name") or data.get("model")
+        if name not in self.config.models:
+            self.config.models.append(name)
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        for status in ("pulling manifest", "verifying", "success"):
+            await response.write((json.dumps({"status": status}) + "\n").encode())
+        await response.write_eof()
+        return response
+
+    # Endpoints de inferencia
+    async def _handle_generate(self, request: web.Request) -> web.StreamResponse:
+        data = await request.json()
+        return await self._serve_completion(request, data, chat=False)
+
+    async def _handle_chat(self, request: web.Request) -> web.StreamResponse:
+        data = await request.json()
+        return await self._serve_completion(request, data, chat=True)
+
+    async def _serve_completion(self, request: web.Request, data: Dict, chat: bool) -> web.StreamResponse:
+        self.stats["requests"] += 1
+        model = data.get("model", "")
+        stream = data.get("stream", True)
+
+        if model not in self.config.models:
+            return web.json_response({"error": f"model '{model}' not found"}, status=404)
+
+        if self.config.failure_rate and self.random.random() < self.config.failure_rate:
+            self.stats["failures_injected"] += 1
+            return web.json_response({"error": "fallo inyectado"}, status=self.config.failure_status)
+
+        start = time.monotonic()
+        load_duration = await self._ensure_loaded(model)
+
+        # Un prompt vacío solo carga el modelo
+        empty = not data.get("messages") if chat else not data.get("prompt")
+        options = data.get("options") or {}
+        n_tokens = 0 if empty else min(self.config.response_tokens, options.get("num_predict") or self.config.response_tokens)
+
+        if not stream:
+            async with self.gpu:
+                if n_tokens:
+                    await asyncio.sleep(self.config.first_token_latency + n_tokens / self.config.tokens_per_second)
+            text = "".join(self._token(i) for i in range(n_tokens))
+            self.stats["tokens_generated"] += n_tokens
+            return web.json_response(self._final_chunk(model, text, n_tokens, load_duration, start, chat))
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        try:
+            async with self.gpu:
+                if n_tokens:
+                    await asyncio.sleep(self.config.first_token_latency)
+                for i in range(n_tokens):
+                    await response.write((json.dumps(self._chunk(model, self._token(i), chat)) + "\n").encode())
+                    self.stats["tokens_generated"] += 1
+                    await asyncio.sleep(1.0 / self.config.tokens_per_second)
+            final = self._final_chunk(model, "", n_tokens, load_duration, start, chat)
+            await response.write((json.dumps(final) + "\n").encode())
+            await response.write_eof()
+        except ConnectionResetError:
+            # El cliente canceló el stream: Ollama aborta la generación
+            self.stats["client_disconnects"] += 1
+        return response
+
+    async def _ensure_loaded(self, model: str) -> float:
+        """Simula la carga del modelo en memoria; devuelve la duración de carga"""
+        if model in self.loaded_models:
+            self.loaded_models.move_to_end(model)
+            return 0.0
+
+        lock = self.load_locks.setdefault(model, asyncio.Lock())
+        async with lock:
+            if model in self.loaded_models:
+                return 0.0
+            start = time.monotonic()
+            if self.config.load_time:
+                await asyncio.sleep(self.config.load_time)
+            while len(self.loaded_models) >= self.config.max_loaded_models:
+                self.loaded_models.popitem(last=False)
+            self.loaded_models[model] = time.time()
+            self.stats["model_loads"] += 1
+            return time.monotonic() - start
+
+    def _token(self, index: int) -> str:
+        return f"token{index} "
+
+    def _chunk(self, model: str, text: str, chat: bool) -> Dict:
+        chunk = {"model": model, "created_at": self._now(), "done": False}
+        if chat:
+            chunk["message"] = {"role": "assistant", "content": text}
+        else:
+            chunk["response"] = text
+        return chunk
+
+    def _final_chunk(self, model: str, text: str, n_tokens: int, load_duration: float,
+                     start: float, chat: bool) -> Dict:
+        chunk = self._chunk(model, text, chat)
+        chunk.update({
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((time.monotonic() - start) * 1e9),
+            "load_duration": int(load_duration * 1e9),
+            "prompt_eval_count": 8,
+            "eval_count": n_tokens,
+            "eval_duration": int(n_tokens / self.config.tokens_per_second * 1e9)
+        })
+        return chunk
+
+    def _now(self) -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor Ollama simulado")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.05, help="Latencia hasta el primer token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--response-tokens", type=int, default=64)
+    parser.add_argument("--load-time", type=float, default=0.0, help="Tiempo de carga en frío (s)")
+    parser.add_argument("--max-parallel", type=int, default=4)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = MockOllamaConfig(
+        first_token_latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        load_time=args.load_time,
+        max_parallel=args.max_parallel,
+        failure_rate=args.failure_rate
+    )
+    server = MockOllamaServer(config, host=args.host, port=args.port)
+
+    async def on_startup(app):
+        server.gpu = asyncio.Semaphore(config.max_parallel)
+
+    app = server.create_app()
+    app.on_startup.append(on_startup)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Circuit breakers para las llamadas a modelos
+Cortan el tráfico hacia agentes o modelos que fallan o se ralentizan y lo reabren de forma gradual
+"""
+
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """El circuito está abierto y la llamada se rechaza sin intentarla"""
+
+
+@dataclass
+class CircuitBreakerConfig:
+    """Umbrales de la ventana deslizante y tiempos de recuperación"""
+    window_size: int = 20  # últimas llamadas consideradas
+    window_seconds: float = 60.0  # las llamadas más antiguas no cuentan
+    min_calls: int = 5  # llamadas mínimas en ventana para evaluar
+    failure_rate_threshold: float = 0.5
+    slow_call_threshold: float = 30.0  # segundos
+    slow_call_rate_threshold: float = 0.8
+    open_duration: float = 15.0  # tiempo abierto antes de probar de nuevo
+    half_open_max_calls: int = 1  # sondas simultáneas en semiabierto
+    half_open_successes: int = 2  # éxitos necesarios para cerrar
+    fallback_models: Dict[str, str] = field(default_factory=lambda: {
+        "llama3.1:8b": "phi3:mini",
+        "mistral:7b": "phi3:mini",
+        "codellama:7b": "phi3:mini"
+    })
+
+
+class CircuitBreaker:
+    """Circuit breaker con ventana deslizante de errores y latencia"""
+
+    def __init__(self, name: str, config: CircuitBreakerConfig = None,
+                 on_state_change: Optional[Callable[[str, CircuitState, CircuitState], None]] = None):
+        self.name = name
+        self.config = config or CircuitBreakerConfig()
+        self.on_state_change = on_state_change
+
+        self._state = CircuitState.CLOSED
+        self.calls: deque = deque(maxlen=self.config.window_size)  # (timestamp, ok, duración)
+        self.opened_at: Optional[float] = None
+        self.outage_started_at: Optional[float] = None
+        self.half_open_in_flight = 0
+        self.half_open_successes = 0
+
+        self.stats = {
+            "calls": 0,
+            "failures": 0,
+            "slow_calls": 0,
+            "rejected": 0,
+            "times_opened": 0
+        }
+        self.recovery_times: deque = deque(maxlen=100)
+
+    @property
+    def state(self) -> CircuitState:
+        # El paso de abierto a semiabierto se evalúa al consultar el estado
+        if (self._state == CircuitState.OPEN
+                and time.monotonic() - self.opened_at >= self.config.open_duration):
+            self._transition(CircuitState.HALF_OPEN)
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Indica si se puede llamar; en semiabierto reserva una sonda"""
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.HALF_OPEN and self.half_open_in_flight < self.config.half_open_max_calls:
+            self.half_open_in_flight += 1
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    def release(self):
+        """Devuelve una sonda reservada sin registrar resultado"""
+        if self.half_open_in_flight > 0:
+            self.half_open_in_flight -= 1
+
+    def record_success(self, duration: float):
+        self._record(True, duration)
+
+    def record_failure(self, duration: float):
+        self._record(False, duration)
+
+    def _record(self, ok: bool, duration: float):
+        now = time.monotonic()
+        slow = duration >= self.config.slow_call_threshold
+        self.stats["calls"] += 1
+        self.stats["failures"] += 0 if ok else 1
+        self.stats["slow_calls"] += 1 if slow else 0
+
+        if self._state == CircuitState.HALF_OPEN:
+            self.release()
+            if ok and not slow:
+                self.half_open_successes += 1
+                if self.half_open_successes >= self.config.half_open_successes:
+                    self._transition(CircuitState.CLOSED)
+            else:
+                self._transition(CircuitState.OPEN)
+            return
+
+        self.calls.append((now, ok, duration))
+        if self._state == CircuitState.CLOSED and self._window_exceeded(now):
+            self._transition(CircuitState.OPEN)
+
+    def _window_exceeded(self, now: float) -> bool:
+        while self.calls and now - self.calls[0][0] > self.config.window_seconds:
+            self.calls.popleft()
+        if len(self.calls) < self.config.min_calls:
+            return False
+
+        total = len(self.calls)
+        failures = sum(1 for _, ok, _ in self.calls if not ok)
+        slow = sum(1 for _, _, d in self.calls if d >= self.config.slow_call_threshold)
+        return (failures / total >= self.config.failure_rate_threshold
+                or slow / total >= self.config.slow_call_rate_threshold)
+
+    def _transition(self, new_state: CircuitState):
+        old_state = self._state
+        if old_state == new_state:
+            return
+        self._state = new_state
+        now = time.monotonic()
+
+        if new_state == CircuitState.OPEN:
+            if old_state == CircuitState.CLOSED:
+                self.stats["times_opened"] += 1
+                self.outage_started_at = now
+            self.opened_at = now
+            self.half_open_in_flight = 0
+            logger.warning(f"Circuito {self.name} abierto")
+        elif new_state == CircuitState.HALF_OPEN:
+            self.half_open_in_flight = 0
+            self.half_open_successes = 0
+            logger.info(f"Circuito {self.name} semiabierto, probando recuperación")
+        else:
+            self.calls.clear()
+            if self.outage_started_at is not None:
+                self.recovery_times.append(now - self.outage_started_at)
+                logger.info(f"Circuito {self.name} cerrado tras {self.recovery_times[-1]:.1f}s")
+
+        if self.on_state_change:
+            try:
+                self.on_state_change(self.name, old_state, new_state)
+            except Exception as e:
+                logger.error(f"Error notificando cambio de circuito {self.name}: {e}")
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "state": self.state.value,
+            "window_calls": len(self.calls),
+            "last_recovery_time": self.recovery_times[-1] if self.recovery_times else None
+        }
+
+
+class CircuitBreakerRegistry:
+    """Circuit breakers compartidos por nombre (p. ej. "model:mistral:7b", "agent:analyzer_001")"""
+
+    def __init__(self, config: CircuitBreakerConfig = None):
+        self.config = config or CircuitBreakerConfig()
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.listeners: List[Callable[[str, CircuitState, CircuitState], None]] = []
+
+    def get(self, name: str) -> CircuitBreaker:
+        if name not in self.breakers:
+            self.breakers[name] = CircuitBreaker(name, self.config, self._notify)
+        return self.breakers[name]
+
+    def add_listener(self, callback: Callable[[str, CircuitState, CircuitState], None]):
+        self.listeners.append(callback)
+
+    def _notify(self, name: str, old_state: CircuitState, new_state: CircuitState):
+        for callback in self.listeners:
+            callback(name, old_state, new_state)
+
+    def try_acquire(self, breakers: List[CircuitBreaker]) -> bool:
+        """Pide paso a todos los breakers; si alguno rechaza, devuelve las sondas tomadas"""
+        acquired = []
+        for breaker in breakers:
+            if not breaker.allow_request():
+                for taken in acquired:
+                    taken.release()
+                return False
+            acquired.append(breaker)
+        return True
+
+    def fallback_for(self, model: str) -> Optional[str]:
+        return self.config.fallback_models.get(model)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        return {name: breaker.get_stats() for name, breaker in self.breakers.items()}
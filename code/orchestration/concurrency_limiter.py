@@ -0,0 +1,260 @@
+"""
+Limitador de concurrencia por modelo
+Controla cuántas generaciones simultáneas admite cada modelo de Ollama
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+# Bytes aproximados por parámetro para modelos cuantizados (Q4 + overhead de runtime)
+BYTES_PER_PARAMETER = 0.6
+GB = 1024 ** 3
+
+
+def estimate_model_footprint(model_name: str, size_hint: Optional[str] = None) -> int:
+    """Estima la memoria (bytes) que ocupa un modelo a partir de su tamaño en parámetros"""
+    text = (size_hint or model_name.split(":")[-1]).lower()
+
+    # Mixture of experts: "8x7b" -> 56B parámetros
+    match = re.search(r"(\d+)x(\d+(?:\.\d+)?)b", text)
+    if match:
+        params = int(match.group(1)) * float(match.group(2))
+    else:
+        match = re.search(r"(\d+(?:\.\d+)?)b", text)
+        if match:
+            params = float(match.group(1))
+        elif "mini" in text:
+            params = 3.8
+        else:
+            params = 7.0  # Tamaño por defecto razonable para modelos locales
+
+    return int(params * 1e9 * BYTES_PER_PARAMETER)
+
+
+def get_available_memory() -> int:
+    """Obtiene la memoria RAM disponible en bytes"""
+    if PSUTIL_AVAILABLE:
+        return int(psutil.virtual_memory().available)
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 8 * GB
+
+
+@dataclass
+class ModelSlotStats:
+    """Métricas de cola y espera de un modelo"""
+    capacity: int
+    in_use: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    total_acquired: int = 0
+    total_timeouts: int = 0
+    total_cancelled: int = 0
+    total_wait_time: float = 0.0
+    recent_waits: deque = field(default_factory=lambda: deque(maxlen=1000))
+
+    def to_dict(self) -> Dict:
+        waits = sorted(self.recent_waits)
+        p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "total_acquired": self.total_acquired,
+            "total_timeouts": self.total_timeouts,
+            "total_cancelled": self.total_cancelled,
+            "average_wait_time": self.total_wait_time / max(self.total_acquired, 1),
+            "p95_wait_time": p95
+        }
+
+
+class ModelSlots:
+    """Cupos de ejecución de un modelo con cola FIFO o por prioridad"""
+
+    def __init__(self, model: str, capacity: int, policy: str = "priority"):
+        self.model = model
+        self.policy = policy
+        self.stats = ModelSlotStats(capacity=capacity)
+        self._waiters: List[tuple] = []  # (-prioridad, secuencia, future)
+        self._sequence = itertools.count()
+
+    @property
+    def capacity(self) -> int:
+        return self.stats.capacity
+
+    def resize(self, capacity: int):
+        """Ajusta la capacidad y despierta a los que esperan si hay cupos nuevos"""
+        self.stats.capacity = max(1, capacity)
+        self._wake_waiters()
+
+    async def acquire(self, priority: int = 0, timeout: Optional[float] = None) -> float:
+        """Reserva un cupo; devuelve el tiempo de espera en segundos"""
+        start = time.monotonic()
+
+        if self.stats.in_use < self.capacity and self.stats.queue_depth == 0:
+            self.stats.in_use += 1
+            return self._record_acquire(start)
+
+        future = asyncio.get_running_loop().create_future()
+        rank = -priority if self.policy == "priority" else 0
+        heapq.heappush(self._waiters, (rank, next(self._sequence), future))
+        self._update_queue_depth()
+
+        try:
+            if timeout is None:
+                await future
+            else:
+                await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(future):
+                # El cupo se concedió justo al expirar: lo conservamos
+                return self._record_acquire(start)
+            self.stats.total_timeouts += 1
+            logger.warning(f"Timeout esperando cupo para {self.model} tras {timeout}s")
+            raise
+        except asyncio.CancelledError:
+            if not self._abandon(future):
+                # Ya se nos había asignado el cupo; devolverlo antes de propagar
+                self.release()
+            self.stats.total_cancelled += 1
+            raise
+
+        return self._record_acquire(start)
+
+    def release(self):
+        """Libera un cupo y lo cede al siguiente en la cola"""
+        self.stats.in_use = max(0, self.stats.in_use - 1)
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self._waiters and self.stats.in_use < self.capacity:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.stats.in_use += 1
+            future.set_result(True)
+        self._update_queue_depth()
+
+    def _abandon(self, future: asyncio.Future) -> bool:
+        """Retira un future de la cola; False si ya había recibido cupo"""
+        if future.done() and not future.cancelled():
+            return False
+        future.cancel()
+        self._update_queue_depth()
+        return True
+
+    def _record_acquire(self, start: float) -> float:
+        wait = time.monotonic() - start
+        self.stats.total_acquired += 1
+        self.stats.total_wait_time += wait
+        self.stats.recent_waits.append(wait)
+        return wait
+
+    def _update_queue_depth(self):
+        depth = sum(1 for _, _, f in self._waiters if not f.done())
+        self.stats.queue_depth = depth
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, depth)
+
+
+class ModelConcurrencyLimiter:
+    """Limitador de concurrencia independiente por modelo
+
+    La capacidad de cada modelo se calcula a partir de su huella de memoria y de
+    la RAM disponible, de modo que los modelos pequeños (phi3) admiten más
+    peticiones simultáneas y no quedan detrás de los grandes (llama3.1). Un cupo
+    global (max_total_slots) acota la carga total sobre Ollama; se pide después
+    del cupo del modelo para que las peticiones que esperan a un modelo saturado
+    no retengan capacidad global.
+    """
+
+    def __init__(self,
+                 max_slots_per_model: int = 3,
+                 memory_fraction: float = 0.5,
+                 policy: str = "priority",
+                 default_timeout: Optional[float] = None,
+                 max_total_slots: Optional[int] = None):
+        if policy not in ("fifo", "priority"):
+            raise ValueError(f"Política de cola no soportada: {policy}")
+
+        self.max_slots_per_model = max_slots_per_model
+        self.memory_fraction = memory_fraction
+        self.policy = policy
+        self.default_timeout = default_timeout
+
+        self.model_footprints: Dict[str, int] = {}
+        self.slots: Dict[str, ModelSlots] = {}
+        self.global_slots = ModelSlots("*", max_total_slots or max_slots_per_model, policy)
+
+    def register_model(self, model: str, footprint_bytes: Optional[int] = None, size_hint: str = None):
+        """Registra (o actualiza) la huella de memoria de un modelo"""
+        if footprint_bytes is None:
+            footprint_bytes = estimate_model_footprint(model, size_hint)
+        self.model_footprints[model] = footprint_bytes
+
+        if model in self.slots:
+            self.slots[model].resize(self._compute_capacity(model))
+
+    def _compute_capacity(self, model: str) -> int:
+        """Calcula cuántas peticiones paralelas admite un modelo"""
+        footprint = self.model_footprints.get(model) or estimate_model_footprint(model)
+        budget = get_available_memory() * self.memory_fraction
+        capacity = int(budget // max(footprint, 1))
+        return max(1, min(self.max_slots_per_model, capacity))
+
+    def _get_slots(self, model: str) -> ModelSlots:
+        if model not in self.slots:
+            capacity = self._compute_capacity(model)
+            self.slots[model] = ModelSlots(model, capacity, self.policy)
+            logger.debug(f"Cupos para {model}: {capacity}")
+        return self.slots[model]
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: int = 0, timeout: Optional[float] = None):
+        """Context manager que reserva un cupo del modelo y uno global durante la generación
+
+        timeout limita la espera total de ambos cupos.
+        """
+        slots = self._get_slots(model)
+        timeout = timeout if timeout is not None else self.default_timeout
+        wait = await slots.acquire(priority, timeout)
+        try:
+            remaining = None if timeout is None else max(0.0, timeout - wait)
+            await self.global_slots.acquire(priority, remaining)
+        except BaseException:
+            slots.release()
+            raise
+        try:
+            yield
+        finally:
+            self.global_slots.release()
+            slots.release()
+
+    @property
+    def active_requests(self) -> int:
+        return self.global_slots.stats.in_use
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Obtiene métricas por modelo"""
+        return {model: slots.stats.to_dict() for model, slots in self.slots.items()}
+
+    def get_global_stats(self) -> Dict:
+        """Obtiene métricas del cupo global"""
+        return self.global_slots.stats.to_dict()
@@ -5,19 +5,22 @@ Maneja la orquestación y coordinación de agentes
 
 import asyncio
 import json
-from typing import Dict, List, Optional, Any, AsyncGenerator
+import time
+from typing import Dict, List, Optional, Any, AsyncGenerator, Annotated, Callable, Union
 from datetime import datetime
 from enum import Enum
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 
 from langgraph.graph import StateGraph, END
-from langchain_ollama import ChatOllama
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from loguru import logger
 import yaml
 
+from ollama_manager import ManagedChatModel
 from state_manager import StateManager
 from task_queue import TaskQueue
+from workflow_checkpoint import WorkflowCheckpointer, CheckpointConfig, START_NODE
+from tracing import configure_tracing, get_tracer, token_usage
 
 class AgentStatus(Enum):
     IDLE = "idle"
@@ -44,18 +47,41 @@ class AgentState:
     performance_metrics: Dict[str, float]
     config: Dict[str, Any]
 
+def _merge_results(current: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """Reducer de resultados: las ramas paralelas escriben claves distintas"""
+    return {**current, **update}
+
+def _latest(current: Any, update: Any) -> Any:
+    return update
+
+def _most_recent(current: datetime, update: datetime) -> datetime:
+    return max(current, update)
+
+def _append_nodes(current: List[str], update: List[str]) -> List[str]:
+    return current + [node for node in update if node not in current]
+
 @dataclass
 class WorkflowState:
-    """Estado del workflow en ejecución"""
+    """Estado del workflow en ejecución
+
+    Los campos con reducer admiten varias escrituras en el mismo paso del grafo,
+    que es lo que ocurre cuando se ejecutan ramas en paralelo.
+    """
     workflow_id: str
     name: str
     status: TaskStatus
-    current_step: str
+    current_step: Annotated[str, _latest]
     agents: List[str]
     context: Dict[str, Any]
-    results: Dict[str, Any]
+    results: Annotated[Dict[str, Any], _merge_results]
     created_at: datetime
-    updated_at: datetime
+    updated_at: Annotated[datetime, _most_recent]
+    workflow_type: str = "unknown"
+    # Nodos terminados (con checkpoint); al reanudar no se vuelven a ejecutar
+    completed_nodes: Annotated[List[str], _append_nodes] = field(default_factory=list)
+
+# Semánticas de unión de ramas paralelas
+JOIN_MERGES = ("dict", "list", "concat")
 
 @dataclass
 class CoordinationContext:
@@ -80,7 +106,7 @@ class LangGraphCoordinator:
         
         # Agentes activos
         self.active_agents: Dict[str, AgentState] = {}
-        self.agent_models: Dict[str, ChatOllama] = {}
+        self.agent_models: Dict[str, ManagedChatModel] = {}
         
         # Workflows en ejecución
         self.active_workflows: Dict[str, WorkflowState] = {}
@@ -88,15 +114,21 @@ class LangGraphCoordinator:
         # Gráfico de LangGraph
         self.graph = None
         self.workflow_graphs: Dict[str, StateGraph] = {}
+        self.compiled_workflows: Dict[str, Any] = {}
         
         # Configuración
         self.config = {}
         
+        # Checkpoints por nodo para reanudar workflows interrumpidos
+        self.checkpointer: Optional[WorkflowCheckpointer] = None
+        
         # Métricas
         self.metrics = {
             "total_workflows": 0,
             "completed_workflows": 0,
             "failed_workflows": 0,
+            "resumed_workflows": 0,
+            "skipped_nodes": 0,
             "average_execution_time": 0.0,
             "active_agents": 0
         }
@@ -106,14 +138,25 @@ class LangGraphCoordinator:
         try:
             # Cargar configuración
             await self._load_config()
+            configure_tracing(self.config.get("tracing", {}))
             
-            # Crear modelo base
+            # Comprobar en paralelo todos los modelos antes de crear los agentes
             base_model = self.config.get("default_model", "llama3.1:8b")
+            await self._ensure_models(base_model)
+            
+            # Crear modelo base
             await self._initialize_base_model(base_model)
             
             # Crear agente coordinador
             await self._create_coordinator_agent()
             
+            # Crear agentes por rol para los pasos de los workflows
+            await self._create_role_agents()
+            
+            # Checkpoints por nodo
+            checkpoint_config = self.config.get("coordination", {}).get("checkpoint", {})
+            self.checkpointer = WorkflowCheckpointer(self.state_manager, CheckpointConfig(**checkpoint_config))
+            
             # Configurar workflow graphs
             await self._initialize_workflow_graphs()
             
@@ -142,7 +185,20 @@ class LangGraphCoordinator:
             "coordination": {
                 "max_concurrent_workflows": 5,
                 "agent_timeout": 300,
-                "workflow_timeout": 1800
+                "workflow_timeout": 1800,
+                "max_parallel_items": 4,
+                "resume_interrupted": True,
+                "checkpoint": {
+                    "enabled": True,
+                    "batch_size": 20,
+                    "flush_interval": 1.0
+                }
+            },
+            "tracing": {
+                "enabled": True,
+                "max_spans": 10000,
+                "batch_size": 256,
+                "otlp_json_path": None
             },
             "agents": {
                 "coordinator": {
@@ -164,18 +220,21 @@ class LangGraphCoordinator:
             }
         }
 
+    async def _ensure_models(self, base_model: str):
+        """Instala o verifica a la vez cada modelo distinto del coordinador y los roles"""
+        models = {base_model}
+        models.update(role_config["model"] for role_config in self.config.get("agents", {}).values()
+                      if "model" in role_config)
+        await self.ollama_manager.install_multiple_models(sorted(models))
+
     async def _initialize_base_model(self, model_name: str):
         """Inicializa el modelo base"""
         try:
             # Asegurar que el modelo esté disponible
             await self.ollama_manager.install_model(model_name)
             
-            # Crear instancia de ChatOllama
-            self.base_model = ChatOllama(
-                model=model_name,
-                base_url=self.ollama_manager.base_url,
-                temperature=0.7
-            )
+            # Cliente de chat que pasa por los cupos del OllamaManager
+            self.base_model = self.ollama_manager.chat_model(model_name, temperature=0.7)
             
             logger.info(f"Modelo base inicializado: {model_name}")
             
@@ -194,11 +253,7 @@ class LangGraphCoordinator:
             await self.ollama_manager.install_model(model_name)
             
             # Crear modelo específico del coordinador
-            coordinator_model = ChatOllama(
-                model=model_name,
-                base_url=self.ollama_manager.base_url,
-                temperature=0.3
-            )
+            coordinator_model = self.ollama_manager.chat_model(model_name, temperature=0.3)
             
             # Crear agente coordinador
             coordinator_state = AgentState(
@@ -222,6 +277,37 @@ class LangGraphCoordinator:
             logger.error(f"Error creando agente coordinador: {e}")
             raise
 
+    async def _create_role_agents(self):
+        """Crea los agentes especializados definidos en la configuración"""
+        for role, role_config in self.config.get("agents", {}).items():
+            if role in self.active_agents:
+                continue
+            try:
+                model_name = role_config["model"]
+                await self.ollama_manager.install_model(model_name)
+                
+                self.agent_models[role] = self.ollama_manager.chat_model(
+                    model_name, temperature=role_config.get("temperature", 0.7), seed=role_config.get("seed"),
+                    prefer_resident=role_config.get("prefer_resident", False)
+                )
+                self.active_agents[role] = AgentState(
+                    agent_id=role,
+                    name=role_config.get("name", role),
+                    status=AgentStatus.IDLE,
+                    current_task=None,
+                    skills=role_config.get("skills", []),
+                    model=model_name,
+                    last_activity=datetime.now(),
+                    performance_metrics={},
+                    config={"system_prompt": role_config.get("system_prompt", "")}
+                )
+                
+            except Exception as e:
+                logger.error(f"Error creando agente {role}: {e}")
+                raise
+        
+        logger.info(f"Agentes de rol creados: {[a for a in self.active_agents if a != 'coordinator']}")
+
     async def _initialize_workflow_graphs(self):
         """Inicializa los gráficos de workflow"""
         try:
@@ -237,6 +323,10 @@ class LangGraphCoordinator:
             doc_process_graph = self._create_document_processing_workflow()
             self.workflow_graphs["document_processing"] = doc_process_graph
             
+            # Un StateGraph solo es ejecutable una vez compilado
+            for workflow_type, graph in self.workflow_graphs.items():
+                self.compiled_workflows[workflow_type] = graph.compile()
+            
             logger.info("Gráficos de workflow inicializados")
             
         except Exception as e:
@@ -248,13 +338,13 @@ class LangGraphCoordinator:
         graph = StateGraph(WorkflowState)
         
         # Nodos
-        graph.add_node("initialize", self._analyze_initialize)
-        graph.add_node("data_extraction", self._extract_data)
-        graph.add_node("data_analysis", self._analyze_data)
-        graph.add_node("generate_report", self._generate_report)
-        graph.add_node("finalize", self._finalize_workflow)
+        self._add_node(graph, "initialize", self._analyze_initialize)
+        self._add_node(graph, "data_extraction", self._extract_data)
+        self._add_node(graph, "data_analysis", self._analyze_data)
+        self._add_node(graph, "generate_report", self._generate_report)
+        self._add_node(graph, "finalize", self._finalize_workflow)
         
-        # Flujo
+        # Flujo (data_analysis procesa en paralelo cada conjunto de datos)
         graph.set_entry_point("initialize")
         graph.add_edge("initialize", "data_extraction")
         graph.add_edge("data_extraction", "data_analysis")
@@ -268,19 +358,22 @@ class LangGraphCoordinator:
         """Crea el workflow de generación de código"""
         graph = StateGraph(WorkflowState)
         
-        graph.add_node("initialize", self._code_initialize)
-        graph.add_node("requirement_analysis", self._analyze_requirements)
-        graph.add_node("code_generation", self._generate_code)
-        graph.add_node("testing", self._test_code)
-        graph.add_node("optimization", self._optimize_code)
-        graph.add_node("finalize", self._finalize_workflow)
+        self._add_node(graph, "initialize", self._code_initialize)
+        self._add_node(graph, "requirement_analysis", self._analyze_requirements)
+        self._add_node(graph, "code_generation", self._generate_code)
+        self._add_node(graph, "testing", self._test_code)
+        self._add_node(graph, "optimization", self._optimize_code)
+        self._add_node(graph, "review", self._make_join_node("review", ["testing", "optimization"], merge="dict"))
+        self._add_node(graph, "finalize", self._finalize_workflow)
         
+        # Testing y optimización parten del mismo código y se ejecutan en paralelo
         graph.set_entry_point("initialize")
         graph.add_edge("initialize", "requirement_analysis")
         graph.add_edge("requirement_analysis", "code_generation")
         graph.add_edge("code_generation", "testing")
-        graph.add_edge("testing", "optimization")
-        graph.add_edge("optimization", "finalize")
+        graph.add_edge("code_generation", "optimization")
+        graph.add_edge(["testing", "optimization"], "review")
+        graph.add_edge("review", "finalize")
         graph.add_edge("finalize", END)
         
         return graph
@@ -289,23 +382,51 @@ class LangGraphCoordinator:
         """Crea el workflow de procesamiento de documentos"""
         graph = StateGraph(WorkflowState)
         
-        graph.add_node("initialize", self._doc_initialize)
-        graph.add_node("document_parsing", self._parse_document)
-        graph.add_node("content_analysis", self._analyze_content)
-        graph.add_node("transformation", self._transform_content)
-        graph.add_node("output_generation", self._generate_output)
-        graph.add_node("finalize", self._finalize_workflow)
+        self._add_node(graph, "initialize", self._doc_initialize)
+        self._add_node(graph, "document_parsing", self._parse_document)
+        self._add_node(graph, "content_analysis", self._analyze_content)
+        self._add_node(graph, "transformation", self._transform_content)
+        self._add_node(graph, "merge_content", self._make_join_node(
+            "merge_content", ["content_analysis", "transformation"], merge="concat"
+        ))
+        self._add_node(graph, "output_generation", self._generate_output)
+        self._add_node(graph, "finalize", self._finalize_workflow)
         
+        # Análisis y transformaciones solo dependen del documento parseado
         graph.set_entry_point("initialize")
         graph.add_edge("initialize", "document_parsing")
         graph.add_edge("document_parsing", "content_analysis")
-        graph.add_edge("content_analysis", "transformation")
-        graph.add_edge("transformation", "output_generation")
+        graph.add_edge("document_parsing", "transformation")
+        graph.add_edge(["content_analysis", "transformation"], "merge_content")
+        graph.add_edge("merge_content", "output_generation")
         graph.add_edge("output_generation", "finalize")
         graph.add_edge("finalize", END)
         
         return graph
 
+    def _add_node(self, graph: StateGraph, name: str, node: Callable):
+        """Agrega un nodo que guarda checkpoint al terminar"""
+        graph.add_node(name, self._checkpointed(name, node))
+
+    def _checkpointed(self, name: str, node: Callable):
+        async def run(state: WorkflowState) -> Dict:
+            with get_tracer().span(f"node {name}", {"workflow.id": state.workflow_id,
+                                                    "node.name": name}) as span:
+                if name in state.completed_nodes:
+                    # Reanudación: su resultado ya viene en el estado restaurado
+                    self.metrics["skipped_nodes"] += 1
+                    span.set_attribute("node.skipped", True)
+                    return {}
+                update = await node(state)
+                if self.checkpointer is not None:
+                    await self.checkpointer.record(state.workflow_id, name, {
+                        "results": update.get("results", {}),
+                        "current_step": update.get("current_step", name)
+                    })
+                return {**update, "completed_nodes": [name]}
+        
+        return run
+
     async def start_coordination(self):
         """Inicia la coordinación de agentes"""
         logger.info("Iniciando coordinación de agentes...")
@@ -316,6 +437,11 @@ class LangGraphCoordinator:
         # Iniciar monitor de workflows
         asyncio.create_task(self._monitor_workflows())
         
+        if self.checkpointer is not None:
+            await self.checkpointer.start()
+            if self.config.get("coordination", {}).get("resume_interrupted", True):
+                asyncio.create_task(self._resume_interrupted_workflows())
+        
         logger.info("Coordinación de agentes iniciada")
 
     async def _process_task_queue(self, task: Dict):
@@ -326,6 +452,8 @@ class LangGraphCoordinator:
             
             if task_type == "new_workflow":
                 await self._start_workflow(task_data)
+            elif task_type == "resume_workflow":
+                await self.resume_workflow(task_data.get("workflow_id"))
             elif task_type == "agent_task":
                 await self._execute_agent_task(task_data)
             elif task_type == "system_monitoring":
@@ -354,31 +482,135 @@ class LangGraphCoordinator:
                 context=workflow_data,
                 results={},
                 created_at=datetime.now(),
-                updated_at=datetime.now()
+                updated_at=datetime.now(),
+                workflow_type=workflow_type
+            )
+            
+            # Lo necesario para reconstruir el estado inicial al reanudar; los checkpoints
+            # de una ejecución anterior con el mismo ID no deben mezclarse con esta
+            if self.checkpointer is not None:
+                await self.checkpointer.discard(workflow_id)
+                await self.checkpointer.record(workflow_id, START_NODE, {
+                    "type": workflow_type,
+                    "name": workflow_state.name,
+                    "context": workflow_data,
+                    "created_at": workflow_state.created_at.isoformat()
+                })
+            
+            await self._run_workflow(workflow_state)
+            
+        except Exception as e:
+            logger.error(f"Error iniciando workflow: {e}")
+
+    async def resume_workflow(self, workflow_id: str) -> Optional[WorkflowState]:
+        """Reanuda un workflow desde sus checkpoints sin repetir los nodos terminados"""
+        try:
+            active = self.active_workflows.get(workflow_id)
+            if active is not None and active.status != TaskStatus.FAILED:
+                logger.warning(f"El workflow {workflow_id} está {active.status.value}, no se reanuda")
+                return active
+            if self.checkpointer is None:
+                raise RuntimeError("Checkpoints no disponibles")
+            
+            checkpoints = await self.checkpointer.load(workflow_id)
+            start = checkpoints.pop(START_NODE, None)
+            if start is None:
+                logger.warning(f"Sin checkpoints para reanudar el workflow {workflow_id}")
+                return None
+            if start["type"] not in self.compiled_workflows:
+                raise ValueError(f"Tipo de workflow no soportado: {start['type']}")
+            
+            # Los checkpoints llegan en orden de ejecución
+            results = {}
+            current_step = "initialize"
+            for node, data in checkpoints.items():
+                results.update(data.get("results", {}))
+                current_step = data.get("current_step", node)
+            
+            workflow_state = WorkflowState(
+                workflow_id=workflow_id,
+                name=start["name"],
+                status=TaskStatus.RUNNING,
+                current_step=current_step,
+                agents=[],
+                context=start["context"],
+                results=results,
+                created_at=datetime.fromisoformat(start["created_at"]),
+                updated_at=datetime.now(),
+                workflow_type=start["type"],
+                completed_nodes=list(checkpoints)
             )
             
-            self.active_workflows[workflow_id] = workflow_state
+            self.metrics["resumed_workflows"] += 1
+            logger.info(f"Reanudando workflow {workflow_id} tras {current_step} "
+                        f"({len(checkpoints)} nodos completados)")
+            return await self._run_workflow(workflow_state)
             
-            # Ejecutar workflow
-            graph = self.workflow_graphs[workflow_type]
+        except Exception as e:
+            logger.error(f"Error reanudando workflow {workflow_id}: {e}")
+            return None
+
+    async def _resume_interrupted_workflows(self):
+        """Reanuda los workflows que quedaron a medias en una ejecución anterior"""
+        try:
+            for workflow_id in await self.checkpointer.pending_workflows():
+                if workflow_id in self.active_workflows:
+                    continue
+                # Los que fallaron con el proceso vivo se reanudan solo a petición
+                persisted = await self.state_manager.load_workflow_state(workflow_id)
+                if persisted and persisted.get("status") == TaskStatus.FAILED.value:
+                    continue
+                asyncio.create_task(self.resume_workflow(workflow_id))
+        except Exception as e:
+            logger.error(f"Error reanudando workflows interrumpidos: {e}")
+
+    async def _run_workflow(self, workflow_state: WorkflowState) -> WorkflowState:
+        """Ejecuta el grafo de un workflow y actualiza su estado y las métricas"""
+        workflow_id = workflow_state.workflow_id
+        self.active_workflows[workflow_id] = workflow_state
+        
+        graph = self.compiled_workflows[workflow_state.workflow_type]
+        start = time.perf_counter()
+        with get_tracer().span(f"workflow {workflow_state.workflow_type}", {
+            "workflow.id": workflow_id,
+            "workflow.type": workflow_state.workflow_type,
+            "workflow.resumed": bool(workflow_state.completed_nodes)
+        }) as span:
             try:
                 final_state = await graph.ainvoke(workflow_state)
+                workflow_state.results = final_state["results"]
+                workflow_state.current_step = final_state["current_step"]
+                workflow_state.updated_at = final_state["updated_at"]
+                workflow_state.completed_nodes = final_state["completed_nodes"]
                 workflow_state.status = TaskStatus.COMPLETED
                 logger.success(f"Workflow {workflow_id} completado")
                 
             except Exception as e:
                 workflow_state.status = TaskStatus.FAILED
+                span.set_error(str(e))
                 logger.error(f"Error ejecutando workflow {workflow_id}: {e}")
+                # Los nodos terminados quedan guardados para reanudar
+                if self.checkpointer is not None:
+                    try:
+                        await self.checkpointer.flush()
+                    except Exception as flush_error:
+                        logger.error(f"Error guardando checkpoints del workflow {workflow_id}: {flush_error}")
             
-            # Actualizar métricas
-            self.metrics["total_workflows"] += 1
-            if workflow_state.status == TaskStatus.COMPLETED:
-                self.metrics["completed_workflows"] += 1
-            else:
-                self.metrics["failed_workflows"] += 1
-            
-        except Exception as e:
-            logger.error(f"Error iniciando workflow: {e}")
+            span.set_attribute("workflow.status", workflow_state.status.value)
+        
+        # Actualizar métricas
+        self.metrics["total_workflows"] += 1
+        if workflow_state.status == TaskStatus.COMPLETED:
+            self.metrics["completed_workflows"] += 1
+            # Media incremental del tiempo real de los workflows completados
+            execution_time = time.perf_counter() - start
+            self.metrics["average_execution_time"] += (
+                (execution_time - self.metrics["average_execution_time"]) / self.metrics["completed_workflows"]
+            )
+        else:
+            self.metrics["failed_workflows"] += 1
+        
+        return workflow_state
 
     async def _execute_agent_task(self, task_config: Dict):
         """Ejecuta una tarea específica de agente"""
@@ -412,39 +644,47 @@ class LangGraphCoordinator:
 
     async def _run_agent_task(self, agent: AgentState, task: str, context: Dict) -> Dict:
         """Ejecuta una tarea específica en un agente"""
-        try:
-            # Obtener modelo del agente
-            model = self.agent_models[agent.agent_id]
-            
-            # Crear prompt
-            system_prompt = agent.config.get("system_prompt", "")
-            full_prompt = f"{system_prompt}\n\nTarea: {task}\nContexto: {json.dumps(context, indent=2)}"
-            
-            # Ejecutar modelo
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=task)
-            ]
-            
-            response = await model.ainvoke(messages)
-            
-            return {
-                "agent_id": agent.agent_id,
-                "task": task,
-                "result": response.content,
-                "success": True,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"Error ejecutando tarea: {e}")
-            return {
-                "agent_id": agent.agent_id,
-                "task": task,
-                "result": f"Error: {str(e)}",
-                "success": False,
-                "timestamp": datetime.now().isoformat()
-            }
+        with get_tracer().span(f"agent.task {agent.agent_id}", {"agent.id": agent.agent_id}) as task_span:
+            try:
+                # Obtener modelo del agente
+                model = self.agent_models[agent.agent_id]
+                
+                # Crear prompt
+                system_prompt = agent.config.get("system_prompt", "")
+                full_prompt = f"{system_prompt}\n\nTarea: {task}\nContexto: {json.dumps(context, indent=2)}"
+                
+                # Ejecutar modelo
+                messages = [
+                    SystemMessage(content=system_prompt),
+                    HumanMessage(content=task)
+                ]
+                
+                with get_tracer().span(f"llm.call {model.model}", {"llm.model": model.model}) as span:
+                    response = await model.ainvoke(messages)
+                    prompt_tokens, completion_tokens = token_usage(messages, response)
+                    span.set_attributes({
+                        "llm.prompt_tokens": prompt_tokens,
+                        "llm.completion_tokens": completion_tokens
+                    })
+                
+                return {
+                    "agent_id": agent.agent_id,
+                    "task": task,
+                    "result": response.content,
+                    "success": True,
+                    "timestamp": datetime.now().isoformat()
+                }
+                
+            except Exception as e:
+                task_span.set_error(str(e))
+                logger.error(f"Error ejecutando tarea: {e}")
+                return {
+                    "agent_id": agent.agent_id,
+                    "task": task,
+                    "result": f"Error: {str(e)}",
+                    "success": False,
+                    "timestamp": datetime.now().isoformat()
+                }
 
     async def _monitor_workflows(self):
         """Monitorea workflows en ejecución"""
@@ -490,7 +730,13 @@ class LangGraphCoordinator:
         """Persiste los resultados del workflow"""
         try:
             workflow = self.active_workflows[workflow_id]
-            await self.state_manager.save_workflow_state(workflow_id, asdict(workflow))
+            state_data = asdict(workflow)
+            state_data["status"] = workflow.status.value
+            await self.state_manager.save_workflow_state(workflow_id, state_data)
+            
+            # Un workflow completado ya no necesita sus checkpoints
+            if workflow.status == TaskStatus.COMPLETED and self.checkpointer is not None:
+                await self.checkpointer.discard(workflow_id)
         except Exception as e:
             logger.error(f"Error persistiendo resultados del workflow: {e}")
 
@@ -501,115 +747,194 @@ class LangGraphCoordinator:
                 agent for agent in self.active_agents.values()
                 if agent.status == AgentStatus.BUSY
             ])
+            # average_execution_time se actualiza al terminar cada workflow (_run_workflow)
             
-            # Calcular tiempo promedio de ejecución
-            total_workflows = self.metrics["total_workflows"]
-            if total_workflows > 0:
-                completed = self.metrics["completed_workflows"]
-                if completed > 0:
-                    # Esta es una métrica simplificada
-                    self.metrics["average_execution_time"] = 120.0  # Placeholder
-                    
         except Exception as e:
             logger.error(f"Error actualizando métricas: {e}")
 
     # Métodos de nodos de workflow
-    async def _analyze_initialize(self, state: WorkflowState) -> WorkflowState:
+    #
+    # Los nodos devuelven actualizaciones parciales del estado; así varias ramas
+    # pueden ejecutarse en el mismo paso y sus resultados se combinan con el reducer.
+    def _step_update(self, step: str, result: Any) -> Dict:
+        return {"current_step": step, "updated_at": datetime.now(), "results": {step: result}}
+
+    def _get_role_agent(self, role: str) -> AgentState:
+        agent = self.active_agents.get(role)
+        if agent is None:
+            # Sin agente especializado configurado, el coordinador asume el paso
+            agent = self.active_agents["coordinator"]
+        return agent
+
+    def _build_step_task(self, state: WorkflowState, instruction: str, inputs: List[str], item: Any = None) -> str:
+        """Compone la tarea de un paso con el contexto y los resultados de los pasos previos"""
+        parts = [instruction, f"Contexto: {json.dumps(state.context, ensure_ascii=False, default=str)[:2000]}"]
+        for name in inputs:
+            previous = state.results.get(name)
+            if previous is not None:
+                output = previous.get("output", previous) if isinstance(previous, dict) else previous
+                parts.append(f"Resultado de {name}: {str(output)[:2000]}")
+        if item is not None:
+            parts.append(f"Elemento a procesar: {json.dumps(item, ensure_ascii=False, default=str)}")
+        return "\n\n".join(parts)
+
+    async def _run_role_task(self, role: str, task: str, context: Dict) -> Dict:
+        agent = self._get_role_agent(role)
+        result = await self._run_agent_task(agent, task, context)
+        if not result["success"]:
+            raise RuntimeError(result["result"])
+        return result
+
+    async def _run_step(self, state: WorkflowState, step: str, role: str,
+                        instruction: str, inputs: List[str] = None) -> Dict:
+        """Ejecuta un paso del workflow con el agente del rol indicado"""
+        start = time.perf_counter()
+        task = self._build_step_task(state, instruction, inputs or [])
+        result = await self._run_role_task(role, task, state.context)
+        return self._step_update(step, {
+            "output": result["result"],
+            "agent_id": result["agent_id"],
+            "duration": time.perf_counter() - start
+        })
+
+    async def _run_map_step(self, state: WorkflowState, step: str, role: str, instruction: str,
+                            items_key: str, inputs: List[str] = None,
+                            max_concurrency: Optional[int] = None) -> Dict:
+        """Procesa en paralelo cada elemento de context[items_key] con un límite de concurrencia"""
+        start = time.perf_counter()
+        items = state.context.get(items_key) or [None]
+        if max_concurrency is None:
+            max_concurrency = self.config.get("coordination", {}).get("max_parallel_items", 4)
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        
+        work_time = 0.0
+        
+        async def process(item):
+            nonlocal work_time
+            async with semaphore:
+                item_start = time.perf_counter()
+                task = self._build_step_task(state, instruction, inputs or [], item)
+                result = await self._run_role_task(role, task, state.context)
+                work_time += time.perf_counter() - item_start
+                return result["result"]
+        
+        outputs = await asyncio.gather(*[process(item) for item in items])
+        return self._step_update(step, {
+            "output": list(outputs),
+            "items": len(items),
+            "duration": time.perf_counter() - start,
+            "work_time": work_time
+        })
+
+    def _make_join_node(self, name: str, branches: List[str],
+                        merge: Union[str, Callable[[Dict[str, Any]], Any]] = "dict"):
+        """Crea un nodo que combina los resultados de ramas paralelas
+
+        merge: "dict" ({rama: salida}), "list" (salidas en orden), "concat" (texto
+        unido) o una función que recibe {rama: resultado} y devuelve la salida.
+        """
+        if not callable(merge) and merge not in JOIN_MERGES:
+            raise ValueError(f"Semántica de unión no soportada: {merge}")
+        
+        async def join(state: WorkflowState) -> Dict:
+            branch_results = {branch: state.results.get(branch) for branch in branches}
+            outputs = {
+                branch: result.get("output") if isinstance(result, dict) else result
+                for branch, result in branch_results.items()
+            }
+            if callable(merge):
+                merged = merge(branch_results)
+            elif merge == "list":
+                merged = [outputs[branch] for branch in branches]
+            elif merge == "concat":
+                merged = "\n\n".join(
+                    "\n".join(map(str, output)) if isinstance(output, list) else str(output)
+                    for output in outputs.values() if output is not None
+                )
+            else:
+                merged = outputs
+            return self._step_update(name, {"output": merged, "branches": branches, "duration": 0.0})
+        
+        return join
+
+    async def _analyze_initialize(self, state: WorkflowState) -> Dict:
         """Nodo de inicialización del análisis"""
         logger.info(f"Iniciando análisis para workflow {state.workflow_id}")
-        state.current_step = "data_extraction"
-        state.updated_at = datetime.now()
-        return state
+        return {"current_step": "initialize", "updated_at": datetime.now()}
 
-    async def _extract_data(self, state: WorkflowState) -> WorkflowState:
+    async def _extract_data(self, state: WorkflowState) -> Dict:
         """Nodo de extracción de datos"""
-        # Implementar extracción de datos
-        state.current_step = "data_analysis"
-        state.updated_at = datetime.now()
-        return state
-
-    async def _analyze_data(self, state: WorkflowState) -> WorkflowState:
-        """Nodo de análisis de datos"""
-        # Implementar análisis de datos
-        state.current_step = "generate_report"
-        state.updated_at = datetime.now()
-        return state
-
-    async def _generate_report(self, state: WorkflowState) -> WorkflowState:
+        return await self._run_step(state, "data_extraction", "analyzer",
+                                    "Extrae los datos relevantes de la entrada.")
+
+    async def _analyze_data(self, state: WorkflowState) -> Dict:
+        """Nodo de análisis de datos (un análisis por conjunto de datos, en paralelo)"""
+        return await self._run_map_step(state, "data_analysis", "analyzer",
+                                        "Analiza los datos e identifica patrones.",
+                                        items_key="datasets", inputs=["data_extraction"])
+
+    async def _generate_report(self, state: WorkflowState) -> Dict:
         """Nodo de generación de reportes"""
-        # Implementar generación de reportes
-        state.current_step = "finalize"
-        state.updated_at = datetime.now()
-        return state
+        return await self._run_step(state, "generate_report", "generator",
+                                    "Redacta un informe con los hallazgos.", inputs=["data_analysis"])
 
-    async def _code_initialize(self, state: WorkflowState) -> WorkflowState:
+    async def _code_initialize(self, state: WorkflowState) -> Dict:
         """Nodo de inicialización de generación de código"""
         logger.info(f"Iniciando generación de código para workflow {state.workflow_id}")
-        state.current_step = "requirement_analysis"
-        state.updated_at = datetime.now()
-        return state
+        return {"current_step": "initialize", "updated_at": datetime.now()}
 
-    async def _analyze_requirements(self, state: WorkflowState) -> WorkflowState:
+    async def _analyze_requirements(self, state: WorkflowState) -> Dict:
         """Nodo de análisis de requisitos"""
-        state.current_step = "code_generation"
-        state.updated_at = datetime.now()
-        return state
+        return await self._run_step(state, "requirement_analysis", "analyzer",
+                                    "Analiza los requisitos y define la especificación.")
 
-    async def _generate_code(self, state: WorkflowState) -> WorkflowState:
+    async def _generate_code(self, state: WorkflowState) -> Dict:
         """Nodo de generación de código"""
-        state.current_step = "testing"
-        state.updated_at = datetime.now()
-        return state
+        return await self._run_step(state, "code_generation", "code_executor",
+                                    "Genera el código que cumple la especificación.",
+                                    inputs=["requirement_analysis"])
 
-    async def _test_code(self, state: WorkflowState) -> WorkflowState:
+    async def _test_code(self, state: WorkflowState) -> Dict:
         """Nodo de testing de código"""
-        state.current_step = "optimization"
-        state.updated_at = datetime.now()
-        return state
+        return await self._run_step(state, "testing", "code_executor",
+                                    "Escribe pruebas para el código generado.", inputs=["code_generation"])
 
-    async def _optimize_code(self, state: WorkflowState) -> WorkflowState:
+    async def _optimize_code(self, state: WorkflowState) -> Dict:
         """Nodo de optimización de código"""
-        state.current_step = "finalize"
-        state.updated_at = datetime.now()
-        return state
+        return await self._run_step(state, "optimization", "code_executor",
+                                    "Propón optimizaciones para el código generado.", inputs=["code_generation"])
 
-    async def _doc_initialize(self, state: WorkflowState) -> WorkflowState:
+    async def _doc_initialize(self, state: WorkflowState) -> Dict:
         """Nodo de inicialización de procesamiento de documentos"""
         logger.info(f"Iniciando procesamiento de documentos para workflow {state.workflow_id}")
-        state.current_step = "document_parsing"
-        state.updated_at = datetime.now()
-        return state
+        return {"current_step": "initialize", "updated_at": datetime.now()}
 
-    async def _parse_document(self, state: WorkflowState) -> WorkflowState:
+    async def _parse_document(self, state: WorkflowState) -> Dict:
         """Nodo de parsing de documentos"""
-        state.current_step = "content_analysis"
-        state.updated_at = datetime.now()
-        return state
+        return await self._run_step(state, "document_parsing", "analyzer",
+                                    "Extrae la estructura y el contenido del documento.")
 
-    async def _analyze_content(self, state: WorkflowState) -> WorkflowState:
+    async def _analyze_content(self, state: WorkflowState) -> Dict:
         """Nodo de análisis de contenido"""
-        state.current_step = "transformation"
-        state.updated_at = datetime.now()
-        return state
+        return await self._run_step(state, "content_analysis", "analyzer",
+                                    "Analiza el contenido del documento.", inputs=["document_parsing"])
 
-    async def _transform_content(self, state: WorkflowState) -> WorkflowState:
-        """Nodo de transformación de contenido"""
-        state.current_step = "output_generation"
-        state.updated_at = datetime.now()
-        return state
+    async def _transform_content(self, state: WorkflowState) -> Dict:
+        """Nodo de transformación de contenido (una tarea de procesamiento por elemento)"""
+        return await self._run_map_step(state, "transformation", "generator",
+                                        "Aplica la tarea de procesamiento indicada al documento.",
+                                        items_key="processing_tasks", inputs=["document_parsing"])
 
-    async def _generate_output(self, state: WorkflowState) -> WorkflowState:
+    async def _generate_output(self, state: WorkflowState) -> Dict:
         """Nodo de generación de salida"""
-        state.current_step = "finalize"
-        state.updated_at = datetime.now()
-        return state
+        return await self._run_step(state, "output_generation", "generator",
+                                    "Genera la salida final en el formato solicitado.",
+                                    inputs=["merge_content"])
 
-    async def _finalize_workflow(self, state: WorkflowState) -> WorkflowState:
+    async def _finalize_workflow(self, state: WorkflowState) -> Dict:
         """Nodo final del workflow"""
         logger.info(f"Finalizando workflow {state.workflow_id}")
-        state.status = TaskStatus.COMPLETED
-        state.updated_at = datetime.now()
-        return state
+        return {"status": TaskStatus.COMPLETED, "current_step": "finalize", "updated_at": datetime.now()}
 
     async def _system_monitoring(self, config: Dict):
         """Tarea de monitoreo del sistema"""
@@ -700,6 +1025,11 @@ class LangGraphCoordinator:
         for agent in self.active_agents.values():
             agent.status = AgentStatus.OFFLINE
         
+        # Guardar los checkpoints pendientes
+        if self.checkpointer is not None:
+            await self.checkpointer.stop()
+        get_tracer().flush()
+        
         logger.info("LangGraph Coordinator cerrado")
 
     async def get_status(self) -> Dict:
@@ -708,5 +1038,7 @@ class LangGraphCoordinator:
             "active_agents": len(self.active_agents),
             "active_workflows": len(self.active_workflows),
             "metrics": self.metrics,
-            "workflow_types": list(self.workflow_graphs.keys())
+            "workflow_types": list(self.workflow_graphs.keys()),
+            "checkpoints": self.checkpointer.get_stats() if self.checkpointer else {},
+            "tracing": get_tracer().get_stats()
         }
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+Residencia de modelos en Ollama
+Registra qué modelos están cargados en memoria y mide los arranques en frío
+"""
+
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+
+from loguru import logger
+
+# Por encima de este tiempo de carga se considera que el modelo arrancó en frío
+COLD_START_THRESHOLD = 0.5
+
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_keep_alive(keep_alive: Union[str, int, float, None]) -> Optional[float]:
+    """Segundos que Ollama mantiene el modelo cargado; None si no caduca (valor negativo)"""
+    if keep_alive is None:
+        return None
+    if isinstance(keep_alive, (int, float)):
+        seconds = float(keep_alive)
+    else:
+        parts = re.findall(r"(-?\d+(?:\.\d+)?)(ms|h|m|s)?", keep_alive.strip())
+        if not parts:
+            return None
+        seconds = sum(float(value) * _DURATION_UNITS[unit or "s"] for value, unit in parts)
+    return None if seconds < 0 else seconds
+
+
+def _parse_expires_at(value: Optional[str]) -> Optional[float]:
+    """Convierte el expires_at ISO 8601 de /api/ps en timestamp"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+@dataclass
+class ResidentModel:
+    """Modelo cargado en memoria por Ollama"""
+    name: str
+    loaded_at: float
+    last_used: float
+    expires_at: Optional[float] = None
+    size_vram: int = 0
+
+
+class ModelResidency:
+    """Seguimiento de modelos residentes y preferencia por modelos ya cargados"""
+
+    def __init__(self, keep_alive: str = "30m", max_resident: int = 3):
+        self.keep_alive = keep_alive
+        self.keep_alive_seconds = parse_keep_alive(keep_alive)
+        self.max_resident = max_resident
+        self.resident: Dict[str, ResidentModel] = {}
+        self.last_refresh = 0.0
+
+        self.stats = {
+            "warm_requests": 0,
+            "cold_starts": 0,
+            "evictions_observed": 0
+        }
+        self.load_times: deque = deque(maxlen=1000)
+
+    def is_resident(self, model: str) -> bool:
+        entry = self.resident.get(model)
+        if entry is None:
+            return False
+        if entry.expires_at is not None and entry.expires_at < time.time():
+            del self.resident[model]
+            return False
+        return True
+
+    def record_request(self, model: str, load_duration: float = 0.0):
+        """Registra una petición servida y si tuvo que cargar el modelo"""
+        now = time.time()
+        if load_duration >= COLD_START_THRESHOLD or not self.is_resident(model):
+            if load_duration >= COLD_START_THRESHOLD:
+                self.stats["cold_starts"] += 1
+                self.load_times.append(load_duration)
+            self._mark_loaded(model, now)
+        else:
+            self.stats["warm_requests"] += 1
+
+        # Ollama descarga el modelo cuando pasa keep_alive sin peticiones
+        entry = self.resident[model]
+        entry.last_used = now
+        entry.expires_at = now + self.keep_alive_seconds if self.keep_alive_seconds is not None else None
+
+    def _mark_loaded(self, model: str, now: float):
+        # Ollama descarga el modelo menos usado al superar su límite de modelos cargados
+        while len(self.resident) >= self.max_resident and model not in self.resident:
+            lru = min(self.resident.values(), key=lambda m: m.last_used)
+            del self.resident[lru.name]
+            self.stats["evictions_observed"] += 1
+            logger.debug(f"Modelo {lru.name} probablemente descargado por Ollama")
+        self.resident[model] = ResidentModel(name=model, loaded_at=now, last_used=now)
+
+    def update_from_ps(self, models: List[Dict]):
+        """Sincroniza el estado con la respuesta de /api/ps"""
+        now = time.time()
+        loaded = {}
+        for model in models:
+            name = model.get("name") or model.get("model")
+            if not name:
+                continue
+            previous = self.resident.get(name)
+            loaded[name] = ResidentModel(
+                name=name,
+                loaded_at=previous.loaded_at if previous else now,
+                last_used=previous.last_used if previous else now,
+                expires_at=_parse_expires_at(model.get("expires_at")),
+                size_vram=model.get("size_vram", 0)
+            )
+        for name in set(self.resident) - set(loaded):
+            self.stats["evictions_observed"] += 1
+            logger.debug(f"Modelo {name} ya no está residente")
+        self.resident = loaded
+        self.last_refresh = now
+
+    def choose(self, candidates: List[str], queue_depths: Dict[str, int] = None) -> str:
+        """Elige entre modelos equivalentes, prefiriendo los ya cargados y menos ocupados"""
+        if not candidates:
+            raise ValueError("Se requiere al menos un modelo candidato")
+        queue_depths = queue_depths or {}
+        # Orden estable: residente primero, luego menor cola, luego orden del llamador
+        return min(
+            candidates,
+            key=lambda m: (not self.is_resident(m), queue_depths.get(m, 0), candidates.index(m))
+        )
+
+    def get_stats(self) -> Dict:
+        """Obtiene métricas de residencia y arranques en frío"""
+        loads = sorted(self.load_times)
+        p99 = loads[min(len(loads) - 1, int(len(loads) * 0.99))] if loads else 0.0
+        return {
+            **self.stats,
+            "resident_models": sorted(self.resident),
+            "keep_alive": self.keep_alive,
+            "p99_load_time": p99,
+            "average_load_time": sum(loads) / len(loads) if loads else 0.0
+        }
@@ -7,11 +7,18 @@ import asyncio
 import subprocess
 import json
 import aiohttp
-from typing import List, Dict, Optional, AsyncGenerator
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
 from loguru import logger
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 import time
 
+from langchain_ollama import ChatOllama
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from concurrency_limiter import ModelConcurrencyLimiter
+from model_residency import ModelResidency
+from response_cache import ResponseCache, make_cache_key, is_deterministic
+
 @dataclass
 class ModelInfo:
     """Información sobre un modelo disponible"""
@@ -30,18 +37,81 @@ class ModelResponse:
     tokens: int
     time: float
     context: Optional[str] = None
+    cached: bool = False
+
+# Marca de fin de stream
+_STREAM_END = object()
+
+class ManagedChatModel:
+    """Cliente de chat con la interfaz de ChatOllama (ainvoke/astream) cuyas llamadas
+    pasan por el OllamaManager: cupos de concurrencia, caché de respuestas y residencia"""
+
+    def __init__(self, manager: "OllamaManager", model: str, temperature: float = 0.7,
+                 seed: Optional[int] = None, priority: int = 0, prefer_resident: bool = False):
+        self.manager = manager
+        self.model = model
+        self.temperature = temperature
+        self.seed = seed
+        self.priority = priority
+        self.prefer_resident = prefer_resident
+        self.base_url = manager.base_url
+
+    async def ainvoke(self, messages: List) -> AIMessage:
+        return await self.manager.chat(self.model, messages, temperature=self.temperature, seed=self.seed,
+                                       priority=self.priority, prefer_resident=self.prefer_resident)
+
+    def astream(self, messages: List) -> AsyncGenerator[AIMessageChunk, None]:
+        return self.manager.chat_stream(self.model, messages, temperature=self.temperature, seed=self.seed,
+                                        priority=self.priority, prefer_resident=self.prefer_resident)
 
 class OllamaManager:
-    def __init__(self, host: str = "localhost", port: int = 11434):
+    def __init__(self,
+                 host: str = "localhost",
+                 port: int = 11434,
+                 max_concurrent_requests: int = 3,
+                 max_requests_per_model: Optional[int] = None,
+                 queue_policy: str = "priority",
+                 queue_timeout: Optional[float] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 preload_models: Optional[List[str]] = None,
+                 keep_alive: str = "30m",
+                 max_loaded_models: int = 3,
+                 interchangeable_models: Optional[List[List[str]]] = None,
+                 residency_refresh_interval: float = 10.0):
         self.host = host
         self.port = port
         self.base_url = f"http://{host}:{port}"
         self.available_models = {}
         self.installed_models = set()
         self.session = None
-        self.max_concurrent_requests = 3
+        self.max_concurrent_requests = max_concurrent_requests
         self.active_requests = 0
         
+        # Concurrencia por modelo (cupos según memoria del modelo) bajo un límite global
+        self.limiter = ModelConcurrencyLimiter(
+            max_slots_per_model=max_requests_per_model or max_concurrent_requests,
+            policy=queue_policy,
+            default_timeout=queue_timeout,
+            max_total_slots=max_concurrent_requests
+        )
+        
+        # Clientes de chat por (modelo, temperatura, semilla) para ManagedChatModel
+        self.chat_clients: Dict[tuple, ChatOllama] = {}
+        
+        # Caché opcional de respuestas deterministas (temperature=0 o seed fija)
+        self.response_cache = response_cache
+        
+        # Residencia de modelos: precarga, keep_alive y preferencia por modelos cargados
+        self.preload_models = preload_models or []
+        self.residency = ModelResidency(keep_alive=keep_alive, max_resident=max_loaded_models)
+        # /api/ps se consulta en segundo plano, nunca en el camino de una petición
+        self.residency_refresh_interval = residency_refresh_interval
+        self.residency_task: Optional[asyncio.Task] = None
+        # Grupos de modelos equivalentes: con prefer_resident se sirve con el que ya esté cargado
+        self.interchangeable_models = {
+            model: list(group) for group in interchangeable_models or [] for model in group
+        }
+        
         # Lista de modelos recomendados
         self.recommended_models = {
             "llama3.1:8b": {
@@ -81,9 +151,37 @@ class OllamaManager:
                 "use_case": "Eficiente, tareas ligeras"
             }
         }
+        
+        for model_name, model_data in self.recommended_models.items():
+            self.limiter.register_model(model_name, size_hint=model_data["size"])
+
+    @classmethod
+    def from_config(cls, config: Dict, **overrides) -> "OllamaManager":
+        """Crea el gestor a partir de coordination_config.yaml (secciones ollama y models)"""
+        ollama = config.get("ollama", {})
+        settings = {
+            "host": ollama.get("host", "localhost"),
+            "port": ollama.get("port", 11434),
+            "max_concurrent_requests": ollama.get("concurrent_requests", 3),
+            "max_requests_per_model": ollama.get("concurrent_requests_per_model"),
+            "preload_models": ollama.get("preload_models"),
+            "keep_alive": ollama.get("keep_alive", "30m"),
+            "max_loaded_models": ollama.get("max_loaded_models", 3),
+            "interchangeable_models": config.get("models", {}).get("interchangeable"),
+            "residency_refresh_interval": ollama.get("residency_refresh_interval", 10.0)
+        }
+        cache_config = dict(ollama.get("response_cache") or {})
+        if cache_config.pop("enabled", False) and "response_cache" not in overrides:
+            settings["response_cache"] = ResponseCache(**cache_config)
+        settings.update(overrides)
+        return cls(**settings)
+
+    async def initialize(self, warm_up: bool = True):
+        """Inicializa la conexión con Ollama
 
-    async def initialize(self):
-        """Inicializa la conexión con Ollama"""
+        Con warm_up=False la precarga de preload_models queda para quien llame
+        a warm_up_models (p. ej. en segundo plano durante el arranque).
+        """
         try:
             # Crear sesión HTTP
             timeout = aiohttp.ClientTimeout(total=30)
@@ -92,8 +190,13 @@ class OllamaManager:
             # Verificar conexión con Ollama
             await self._check_ollama_status()
             
-            # Cargar modelos instalados
-            await self._load_installed_models()
+            # Cargar modelos instalados y sincronizar los residentes a la vez
+            await asyncio.gather(self._load_installed_models(), self.refresh_resident_models())
+            self.residency_task = asyncio.create_task(self._refresh_residency_loop())
+            
+            # Precargar los configurados
+            if warm_up and self.preload_models:
+                await self.warm_up_models(self.preload_models)
             
             logger.info(f"Ollama Manager inicializado en {self.base_url}")
             
@@ -125,10 +228,69 @@ class OllamaManager:
                     models = data.get('models', [])
                     for model in models:
                         self.installed_models.add(model['name'])
+                        # El tamaño en disco aproxima la memoria que ocupará cargado
+                        if model.get('size'):
+                            self.limiter.register_model(model['name'], footprint_bytes=model['size'])
                     logger.info(f"Modelos instalados: {list(self.installed_models)}")
         except Exception as e:
             logger.error(f"Error cargando modelos instalados: {e}")
 
+    async def refresh_resident_models(self):
+        """Consulta /api/ps para saber qué modelos están cargados en memoria"""
+        try:
+            async with self.session.get(f"{self.base_url}/api/ps") as response:
+                if response.status == 200:
+                    data = await response.json()
+                    self.residency.update_from_ps(data.get('models', []))
+        except Exception as e:
+            logger.debug(f"No se pudo consultar modelos residentes: {e}")
+
+    async def _refresh_residency_loop(self):
+        """Mantiene sincronizados los modelos residentes sin bloquear las peticiones"""
+        while True:
+            await asyncio.sleep(self.residency_refresh_interval)
+            await self.refresh_resident_models()
+
+    async def warm_up_models(self, models: List[str]) -> Dict[str, bool]:
+        """Carga modelos en memoria con una petición vacía para evitar arranques en frío"""
+        async def warm_up(model: str) -> bool:
+            if model not in self.installed_models:
+                logger.warning(f"Modelo {model} no instalado, se omite la precarga")
+                return False
+            try:
+                # Un prompt vacío hace que Ollama cargue el modelo sin generar tokens
+                payload = {"model": model, "prompt": "", "keep_alive": self.residency.keep_alive, "stream": False}
+                async with self.session.post(f"{self.base_url}/api/generate", json=payload) as response:
+                    if response.status != 200:
+                        raise Exception(f"Estado de respuesta: {response.status}")
+                    data = await response.json()
+                self.residency.record_request(model, data.get('load_duration', 0) / 1e9)
+                logger.info(f"✓ Modelo {model} precargado")
+                return True
+            except Exception as e:
+                logger.error(f"Error precargando modelo {model}: {e}")
+                return False
+        
+        results = await asyncio.gather(*[warm_up(model) for model in models])
+        return dict(zip(models, results))
+
+    async def select_model(self, candidates: List[str]) -> str:
+        """Elige entre modelos intercambiables, priorizando los ya residentes
+
+        Usa el estado de residencia que refresca la tarea de fondo y las
+        peticiones servidas; los modelos cuyo keep_alive venció no cuentan.
+        """
+        queue_depths = {
+            model: stats["queue_depth"] + stats["in_use"]
+            for model, stats in self.limiter.get_stats().items()
+        }
+        return self.residency.choose(candidates, queue_depths)
+
+    def candidates_for(self, model: str) -> List[str]:
+        """Modelo pedido seguido de sus equivalentes configurados"""
+        group = self.interchangeable_models.get(model, [])
+        return [model] + [other for other in group if other != model]
+
     async def is_ollama_available(self) -> bool:
         """Verifica si Ollama está disponible"""
         try:
@@ -210,16 +372,66 @@ class OllamaManager:
                       temperature: float = 0.7,
                       top_k: int = 40,
                       top_p: float = 0.9,
-                      max_tokens: int = 512) -> ModelResponse:
-        """Genera una respuesta usando un modelo específico"""
+                      max_tokens: int = 512,
+                      priority: int = 0,
+                      queue_timeout: Optional[float] = None,
+                      seed: Optional[int] = None,
+                      use_cache: bool = True,
+                      prefer_resident: bool = False) -> ModelResponse:
+        """Genera una respuesta usando un modelo específico
+        
+        Con prefer_resident, si el modelo tiene equivalentes configurados, se usa
+        el que ya esté cargado (o el menos ocupado); el modelo usado queda en
+        ModelResponse.model. La petición espera un cupo del
+        modelo (mayor prioridad primero, FIFO entre iguales); queue_timeout
+        limita esa espera. Si hay caché de respuestas y la salida es
+        reproducible, se consulta antes de inferir. ModelResponse.time mide
+        la generación sin la espera del cupo.
+        """
+        lookup_start = time.time()
+        if prefer_resident and model in self.interchangeable_models:
+            model = await self.select_model(self.candidates_for(model))
+        
+        options = {
+            "temperature": temperature,
+            "top_k": top_k,
+            "top_p": top_p,
+            "num_predict": max_tokens
+        }
+        if seed is not None:
+            options["seed"] = seed
+        
+        cache_key = None
+        if use_cache and self.response_cache is not None and is_deterministic(options):
+            cache_key = make_cache_key(model, prompt, system_prompt, context, options)
+            cached = await self.response_cache.aget(cache_key)
+            if cached is not None:
+                # Copia: el diccionario es el que guarda el nivel en memoria
+                return ModelResponse(**{**cached, "time": time.time() - lookup_start, "cached": True})
         
-        # Controlar concurrencia
-        while self.active_requests >= self.max_concurrent_requests:
-            await asyncio.sleep(0.1)
+        async with self.limiter.slot(model, priority=priority, timeout=queue_timeout):
+            start_time = time.time()
+            self.active_requests += 1
+            try:
+                response = await self._generate(
+                    model, prompt, system_prompt, context, options, start_time
+                )
+            finally:
+                self.active_requests -= 1
         
-        self.active_requests += 1
-        start_time = time.time()
+        if cache_key is not None:
+            await self.response_cache.aput(cache_key, model, asdict(response))
         
+        return response
+
+    async def _generate(self,
+                        model: str,
+                        prompt: str,
+                        system_prompt: Optional[str],
+                        context: Optional[str],
+                        options: Dict,
+                        start_time: float) -> ModelResponse:
+        """Ejecuta la petición de generación contra la API de Ollama"""
         try:
             # Verificar que el modelo esté instalado
             if model not in self.installed_models:
@@ -230,12 +442,8 @@ class OllamaManager:
             payload = {
                 "model": model,
                 "prompt": prompt,
-                "options": {
-                    "temperature": temperature,
-                    "top_k": top_k,
-                    "top_p": top_p,
-                    "num_predict": max_tokens
-                },
+                "options": options,
+                "keep_alive": self.residency.keep_alive,
                 "stream": False
             }
             
@@ -253,6 +461,7 @@ class OllamaManager:
                     data = await response.json()
                     
                     elapsed_time = time.time() - start_time
+                    self.residency.record_request(model, data.get('load_duration', 0) / 1e9)
                     
                     return ModelResponse(
                         model=model,
@@ -267,47 +476,234 @@ class OllamaManager:
         except Exception as e:
             logger.error(f"Error generando respuesta con {model}: {e}")
             raise
-        finally:
-            self.active_requests -= 1
 
     async def generate_stream(self, 
                             model: str, 
                             prompt: str,
                             system_prompt: str = None,
+                            priority: int = 0,
+                            queue_timeout: Optional[float] = None,
+                            prefer_resident: bool = False,
                             **kwargs) -> AsyncGenerator[str, None]:
         """Genera respuesta en modo stream"""
+        if prefer_resident and model in self.interchangeable_models:
+            model = await self.select_model(self.candidates_for(model))
         
         payload = {
             "model": model,
             "prompt": prompt,
             "stream": True,
+            "keep_alive": self.residency.keep_alive,
             **kwargs
         }
         
         if system_prompt:
             payload["system"] = system_prompt
         
+        async def produce():
+            try:
+                async with self.session.post(
+                    f"{self.base_url}/api/generate",
+                    json=payload
+                ) as response:
+                    if response.status == 200:
+                        async for line in response.content:
+                            if line:
+                                try:
+                                    data = json.loads(line.decode().strip())
+                                    chunk = data.get('response', '')
+                                    if chunk:
+                                        yield chunk
+                                        
+                                    if data.get('done', False):
+                                        self.residency.record_request(
+                                            model, data.get('load_duration', 0) / 1e9
+                                        )
+                                        break
+                                        
+                                except json.JSONDecodeError:
+                                    continue
+            except Exception as e:
+                logger.error(f"Error en streaming de {model}: {e}")
+        
+        stream = self._stream_in_slot(model, priority, queue_timeout, produce)
         try:
-            async with self.session.post(
-                f"{self.base_url}/api/generate",
-                json=payload
-            ) as response:
-                if response.status == 200:
-                    async for line in response.content:
-                        if line:
-                            try:
-                                data = json.loads(line.decode().strip())
-                                chunk = data.get('response', '')
-                                if chunk:
-                                    yield chunk
-                                    
-                                if data.get('done', False):
-                                    break
-                                    
-                            except json.JSONDecodeError:
-                                continue
-        except Exception as e:
-            logger.error(f"Error en streaming de {model}: {e}")
+            async for chunk in stream:
+                yield chunk
+        finally:
+            # Cerrar el stream interno al abandonar este devuelve el cupo en el acto
+            await stream.aclose()
+
+    async def _stream_in_slot(self, model: str, priority: int, queue_timeout: Optional[float],
+                              produce: Callable[[], AsyncGenerator[Any, None]]) -> AsyncGenerator[Any, None]:
+        """Reenvía lo que emite produce() mientras ocupa un cupo del modelo
+
+        La generación corre en una tarea propia que libera el cupo al terminar,
+        aunque el consumidor abandone el generador sin cerrarlo; cerrarlo la cancela.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def run():
+            try:
+                async with self.limiter.slot(model, priority=priority, timeout=queue_timeout):
+                    self.active_requests += 1
+                    try:
+                        async for item in produce():
+                            queue.put_nowait(item)
+                    finally:
+                        self.active_requests -= 1
+            finally:
+                queue.put_nowait(_STREAM_END)
+        
+        producer = asyncio.create_task(run())
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    break
+                yield item
+            # Propaga los errores de la generación (p. ej. timeout esperando cupo)
+            await producer
+        finally:
+            if not producer.done():
+                producer.cancel()
+                await asyncio.gather(producer, return_exceptions=True)
+
+    def chat_model(self, model: str, temperature: float = 0.7, seed: Optional[int] = None,
+                   priority: int = 0, prefer_resident: bool = False) -> ManagedChatModel:
+        """Cliente de chat para agentes y coordinador que pasa por este gestor"""
+        return ManagedChatModel(self, model, temperature=temperature, seed=seed, priority=priority,
+                                prefer_resident=prefer_resident)
+
+    def _chat_client(self, model: str, temperature: float, seed: Optional[int]) -> ChatOllama:
+        key = (model, temperature, seed)
+        if key not in self.chat_clients:
+            self.chat_clients[key] = ChatOllama(
+                model=model,
+                base_url=self.base_url,
+                temperature=temperature,
+                seed=seed,
+                keep_alive=self.residency.keep_alive
+            )
+        return self.chat_clients[key]
+
+    def _chat_cache_key(self, model: str, messages: List, temperature: float,
+                        seed: Optional[int], use_cache: bool) -> Optional[str]:
+        """Clave de caché de una conversación, o None si la respuesta no es reproducible"""
+        options = {"temperature": temperature}
+        if seed is not None:
+            options["seed"] = seed
+        if not use_cache or self.response_cache is None or not is_deterministic(options):
+            return None
+        prompt = json.dumps([(message.type, message.content) for message in messages], default=str)
+        return make_cache_key(model, prompt, None, None, options)
+
+    async def chat(self,
+                   model: str,
+                   messages: List,
+                   temperature: float = 0.7,
+                   seed: Optional[int] = None,
+                   priority: int = 0,
+                   queue_timeout: Optional[float] = None,
+                   use_cache: bool = True,
+                   prefer_resident: bool = False) -> AIMessage:
+        """Conversa con un modelo (mensajes de LangChain) bajo los cupos del modelo
+
+        Con caché de respuestas y salida reproducible, una conversación repetida
+        se sirve sin inferir (response_metadata["cached"] lo indica). Con
+        prefer_resident se usa el equivalente ya cargado, como en generate; el
+        modelo usado queda en response_metadata["model"].
+        """
+        if prefer_resident and model in self.interchangeable_models:
+            model = await self.select_model(self.candidates_for(model))
+        cache_key = self._chat_cache_key(model, messages, temperature, seed, use_cache)
+        if cache_key is not None:
+            cached = await self.response_cache.aget(cache_key)
+            if cached is not None:
+                return AIMessage(content=cached["content"], usage_metadata=cached.get("usage_metadata"),
+                                 response_metadata={"model": model, "cached": True})
+        
+        client = self._chat_client(model, temperature, seed)
+        async with self.limiter.slot(model, priority=priority, timeout=queue_timeout):
+            self.active_requests += 1
+            try:
+                response = await client.ainvoke(messages)
+            finally:
+                self.active_requests -= 1
+        
+        self.residency.record_request(model, (response.response_metadata.get('load_duration') or 0) / 1e9)
+        response.response_metadata["model"] = model
+        if cache_key is not None:
+            await self.response_cache.aput(cache_key, model, {
+                "content": response.content, "usage_metadata": response.usage_metadata
+            })
+        return response
+
+    async def chat_stream(self,
+                          model: str,
+                          messages: List,
+                          temperature: float = 0.7,
+                          seed: Optional[int] = None,
+                          priority: int = 0,
+                          queue_timeout: Optional[float] = None,
+                          use_cache: bool = True,
+                          prefer_resident: bool = False) -> AsyncGenerator[AIMessageChunk, None]:
+        """Conversa con un modelo en modo stream bajo los cupos del modelo
+
+        Una respuesta en caché se emite de una vez; las reproducibles se guardan
+        al terminar el stream. prefer_resident funciona como en chat.
+        """
+        if prefer_resident and model in self.interchangeable_models:
+            model = await self.select_model(self.candidates_for(model))
+        cache_key = self._chat_cache_key(model, messages, temperature, seed, use_cache)
+        if cache_key is not None:
+            cached = await self.response_cache.aget(cache_key)
+            if cached is not None:
+                yield AIMessageChunk(content=cached["content"], usage_metadata=cached.get("usage_metadata"),
+                                     response_metadata={"model": model, "cached": True, "done": True})
+                return
+        
+        client = self._chat_client(model, temperature, seed)
+        parts = []
+        
+        async def produce():
+            async for chunk in client.astream(messages):
+                parts.append(chunk.content)
+                if chunk.response_metadata.get('done'):
+                    self.residency.record_request(
+                        model, (chunk.response_metadata.get('load_duration') or 0) / 1e9
+                    )
+                    if cache_key is not None:
+                        await self.response_cache.aput(cache_key, model, {
+                            "content": "".join(parts), "usage_metadata": chunk.usage_metadata
+                        })
+                yield chunk
+        
+        stream = self._stream_in_slot(model, priority, queue_timeout, produce)
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            # Cerrar el stream interno al abandonar este devuelve el cupo en el acto
+            await stream.aclose()
+
+    def get_concurrency_stats(self) -> Dict[str, Dict]:
+        """Obtiene profundidad de cola, cupos y tiempos de espera por modelo"""
+        return self.limiter.get_stats()
+
+    def get_global_concurrency_stats(self) -> Dict:
+        """Obtiene la ocupación y la espera del límite global de peticiones"""
+        return self.limiter.get_global_stats()
+
+    def get_residency_stats(self) -> Dict:
+        """Obtiene modelos residentes y métricas de arranque en frío"""
+        return self.residency.get_stats()
+
+    def get_cache_stats(self) -> Dict:
+        """Obtiene estadísticas de la caché de respuestas"""
+        if self.response_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.response_cache.get_stats()}
 
     async def list_installed_models(self) -> List[str]:
         """Lista los modelos instalados"""
@@ -366,8 +762,13 @@ class OllamaManager:
 
     async def shutdown(self):
         """Cierra la conexión con Ollama"""
+        if self.residency_task is not None:
+            self.residency_task.cancel()
+            await asyncio.gather(self.residency_task, return_exceptions=True)
         if self.session:
             await self.session.close()
+        if self.response_cache is not None:
+            self.response_cache.close()
         logger.info("Ollama Manager cerrado")
 
     async def cleanup_diskspace(self) -> bool:
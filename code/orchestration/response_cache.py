@@ -0,0 +1,312 @@
+"""
+Caché de respuestas deterministas para OllamaManager
+Nivel en memoria (LRU) y nivel en disco (SQLite) con TTL y límites de tamaño
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+
+def make_cache_key(model: str, prompt: str, system_prompt: Optional[str],
+                   context: Any, options: Dict[str, Any]) -> str:
+    """Genera la clave de caché a partir de modelo, prompt, system y opciones"""
+    key_data = {
+        "model": model,
+        "prompt": prompt,
+        "system": system_prompt or "",
+        "context": context,
+        "options": options
+    }
+    key_string = json.dumps(key_data, sort_keys=True, default=str)
+    return hashlib.sha256(key_string.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(options: Dict[str, Any]) -> bool:
+    """Una respuesta solo es reproducible con temperatura 0 o con semilla fija"""
+    return options.get("temperature") == 0 or options.get("seed") is not None
+
+
+class ResponseCache:
+    """Caché de dos niveles para respuestas de modelos"""
+
+    def __init__(self,
+                 db_path: Optional[str] = "data/response_cache.db",
+                 max_memory_entries: int = 512,
+                 max_disk_entries: int = 50000,
+                 max_disk_bytes: int = 256 * 1024 * 1024,
+                 ttl_seconds: int = 7 * 24 * 3600,
+                 access_flush_size: int = 256,
+                 expiry_sweep_interval: float = 60.0):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.access_flush_size = access_flush_size
+        self.expiry_sweep_interval = expiry_sweep_interval
+
+        # Nivel en memoria: clave -> (expira_en, payload)
+        self.memory: "OrderedDict[str, tuple]" = OrderedDict()
+
+        # Nivel en disco
+        self.db_connection = None
+        self.db_lock = threading.RLock()
+        # Tamaño del nivel en disco mantenido al vuelo para no recontar la tabla en cada escritura
+        self.disk_entries = 0
+        self.disk_bytes = 0
+        # Últimos accesos pendientes de escribir (el orden LRU solo se necesita al desalojar)
+        self.pending_access: Dict[str, float] = {}
+        self.last_sweep = 0.0
+
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0
+        }
+
+        if self.db_path:
+            self._initialize_database()
+
+    def _initialize_database(self):
+        """Crea la tabla de respuestas si no existe"""
+        try:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            self.db_connection = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30.0)
+            self.db_connection.execute("PRAGMA journal_mode = WAL")
+            self.db_connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    cache_key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self.db_connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)"
+            )
+            self.db_connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_responses_expires ON responses(expires_at)"
+            )
+            self.db_connection.commit()
+            self.disk_entries, self.disk_bytes = self.db_connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM responses"
+            ).fetchone()
+        except Exception as e:
+            logger.error(f"Error inicializando caché de respuestas en disco: {e}")
+            self.db_connection = None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Busca una respuesta, primero en memoria y luego en disco"""
+        now = time.time()
+        payload = self._memory_get(key, now)
+        if payload is not None:
+            return payload
+        return self._after_disk_get(key, self._disk_get(key, now), now)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """Como get, con la lectura en disco en un hilo para no bloquear el event loop"""
+        now = time.time()
+        payload = self._memory_get(key, now)
+        if payload is not None:
+            return payload
+        if self.db_connection is None:
+            return self._after_disk_get(key, None, now)
+        return self._after_disk_get(key, await asyncio.to_thread(self._disk_get, key, now), now)
+
+    def put(self, key: str, model: str, payload: Dict[str, Any]):
+        """Guarda una respuesta en ambos niveles"""
+        expires_at = time.time() + self.ttl_seconds
+        self._memory_put(key, payload, expires_at)
+        self._disk_put(key, model, payload, expires_at)
+        self.stats["stores"] += 1
+
+    async def aput(self, key: str, model: str, payload: Dict[str, Any]):
+        """Como put, con la escritura en disco en un hilo"""
+        expires_at = time.time() + self.ttl_seconds
+        self._memory_put(key, payload, expires_at)
+        if self.db_connection is not None:
+            await asyncio.to_thread(self._disk_put, key, model, payload, expires_at)
+        self.stats["stores"] += 1
+
+    def _memory_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        expires_at, payload = entry
+        if expires_at > now:
+            self.memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return payload
+        del self.memory[key]
+        self.stats["expired"] += 1
+        return None
+
+    def _after_disk_get(self, key: str, payload: Optional[Dict[str, Any]], now: float) -> Optional[Dict[str, Any]]:
+        if payload is not None:
+            self.stats["disk_hits"] += 1
+            self._memory_put(key, payload, now + self.ttl_seconds)
+            return payload
+        self.stats["misses"] += 1
+        return None
+
+    def _memory_put(self, key: str, payload: Dict[str, Any], expires_at: float):
+        self.memory[key] = (expires_at, payload)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _disk_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        if self.db_connection is None:
+            return None
+        try:
+            with self.db_lock:
+                row = self.db_connection.execute(
+                    "SELECT payload, expires_at, size_bytes FROM responses WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[1] <= now:
+                    self.db_connection.execute("DELETE FROM responses WHERE cache_key = ?", (key,))
+                    self.db_connection.commit()
+                    self.pending_access.pop(key, None)
+                    self.disk_entries -= 1
+                    self.disk_bytes -= row[2]
+                    self.stats["expired"] += 1
+                    return None
+                # El acceso se anota en memoria y se escribe por lotes
+                self.pending_access[key] = now
+                if len(self.pending_access) >= self.access_flush_size:
+                    self._flush_access()
+                    self.db_connection.commit()
+            return json.loads(row[0])
+        except Exception as e:
+            logger.error(f"Error leyendo caché de respuestas: {e}")
+            return None
+
+    def _disk_put(self, key: str, model: str, payload: Dict[str, Any], expires_at: float):
+        if self.db_connection is None:
+            return
+        try:
+            serialized = json.dumps(payload, default=str)
+            now = time.time()
+            with self.db_lock:
+                previous = self.db_connection.execute(
+                    "SELECT size_bytes FROM responses WHERE cache_key = ?", (key,)
+                ).fetchone()
+                self.db_connection.execute("""
+                    INSERT OR REPLACE INTO responses
+                    (cache_key, model, payload, size_bytes, created_at, last_access, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (key, model, serialized, len(serialized), now, now, expires_at))
+                self.pending_access.pop(key, None)
+                if previous is None:
+                    self.disk_entries += 1
+                else:
+                    self.disk_bytes -= previous[0]
+                self.disk_bytes += len(serialized)
+                self._enforce_disk_limits(now)
+                self.db_connection.commit()
+        except Exception as e:
+            logger.error(f"Error guardando en caché de respuestas: {e}")
+
+    def _within_limits(self) -> bool:
+        return self.disk_entries <= self.max_disk_entries and self.disk_bytes <= self.max_disk_bytes
+
+    def _flush_access(self):
+        """Escribe los últimos accesos anotados (con db_lock tomado)"""
+        if not self.pending_access:
+            return
+        self.db_connection.executemany(
+            "UPDATE responses SET last_access = ? WHERE cache_key = ?",
+            [(accessed, key) for key, accessed in self.pending_access.items()]
+        )
+        self.pending_access.clear()
+
+    def _enforce_disk_limits(self, now: float):
+        """Elimina entradas caducadas y las menos usadas si se superan los límites
+
+        Las caducadas se barren como mucho cada expiry_sweep_interval segundos
+        (o antes si hay que liberar espacio); con los límites cumplidos no se
+        recorre la tabla.
+        """
+        if now - self.last_sweep >= self.expiry_sweep_interval or not self._within_limits():
+            self.last_sweep = now
+            expired, expired_bytes = self.db_connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM responses WHERE expires_at <= ?", (now,)
+            ).fetchone()
+            if expired:
+                self.db_connection.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+                self.disk_entries -= expired
+                self.disk_bytes -= expired_bytes
+                self.stats["expired"] += expired
+
+        if self._within_limits():
+            return
+
+        # Borrar en orden LRU hasta volver a estar por debajo de ambos límites
+        self._flush_access()
+        rows = self.db_connection.execute(
+            "SELECT cache_key, size_bytes FROM responses ORDER BY last_access ASC"
+        )
+        to_delete = []
+        for cache_key, size_bytes in rows:
+            if self._within_limits():
+                break
+            to_delete.append((cache_key,))
+            self.disk_entries -= 1
+            self.disk_bytes -= size_bytes
+        rows.close()
+
+        self.db_connection.executemany("DELETE FROM responses WHERE cache_key = ?", to_delete)
+        self.stats["evictions"] += len(to_delete)
+
+    def clear(self):
+        """Vacía ambos niveles de la caché"""
+        self.memory.clear()
+        if self.db_connection is not None:
+            with self.db_lock:
+                self.db_connection.execute("DELETE FROM responses")
+                self.db_connection.commit()
+                self.pending_access.clear()
+                self.disk_entries = 0
+                self.disk_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Obtiene estadísticas de aciertos de la caché"""
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_entries": self.disk_entries,
+            "disk_bytes": self.disk_bytes
+        }
+
+    def close(self):
+        """Cierra la conexión a la base de datos"""
+        if self.db_connection is not None:
+            with self.db_lock:
+                try:
+                    self._flush_access()
+                    self.db_connection.commit()
+                except Exception as e:
+                    logger.error(f"Error guardando accesos de la caché de respuestas: {e}")
+                self.db_connection.close()
+            self.db_connection = None
@@ -10,6 +10,8 @@ import sys
 import argparse
 from pathlib import Path
 
+import yaml
+
 # Agregar el directorio actual al path
 sys.path.append(str(Path(__file__).parent))
 
@@ -18,56 +20,65 @@ from langgraph_coordinator import LangGraphCoordinator
 from task_queue import TaskQueue
 from agent_manager import AgentManager
 from state_manager import StateManager
+from startup_graph import StartupGraph
 from loguru import logger
 
 class OrchestrationSystem:
-    def __init__(self, config_path: str = "config/system_config.yaml"):
+    def __init__(self, config_path: str = "config/system_config.yaml",
+                 coordination_config_path: str = "config/coordination_config.yaml"):
         self.config_path = config_path
+        self.coordination_config_path = coordination_config_path
         self.ollama_manager = None
         self.coordinator = None
         self.task_queue = None
         self.agent_manager = None
         self.state_manager = None
+        self.startup = None
         self.running = False
 
     async def initialize(self):
-        """Inicializa todos los componentes del sistema"""
+        """Inicializa todos los componentes del sistema
+
+        Los componentes independientes arrancan en paralelo según sus dependencias.
+        La precarga de modelos y la creación de agentes continúan en segundo plano:
+        el sistema acepta peticiones antes y las tareas de agente esperan a que
+        los agentes estén listos.
+        """
         try:
             logger.info("Iniciando Sistema de Coordinación Local...")
             
-            # 1. Inicializar gestión de estado
             self.state_manager = StateManager()
-            await self.state_manager.initialize()
-            logger.info("✓ Gestor de estado inicializado")
-            
-            # 2. Inicializar Ollama
-            self.ollama_manager = OllamaManager()
-            await self.ollama_manager.initialize()
-            logger.info("✓ Gestor Ollama inicializado")
-            
-            # 3. Inicializar sistema de colas
+            # Precarga, keep_alive y modelos equivalentes salen de la configuración de coordinación
+            self.ollama_manager = OllamaManager.from_config(self._load_coordination_config())
             self.task_queue = TaskQueue()
-            await self.task_queue.initialize()
-            logger.info("✓ Sistema de colas inicializado")
-            
-            # 4. Inicializar coordinador LangGraph
             self.coordinator = LangGraphCoordinator(
                 ollama_manager=self.ollama_manager,
                 state_manager=self.state_manager,
-                task_queue=self.task_queue
+                task_queue=self.task_queue,
+                config_path=self.coordination_config_path
             )
-            await self.coordinator.initialize()
-            logger.info("✓ Coordinador LangGraph inicializado")
-            
-            # 5. Inicializar gestión de agentes
             self.agent_manager = AgentManager(
                 coordinator=self.coordinator,
                 ollama_manager=self.ollama_manager,
                 task_queue=self.task_queue,
                 state_manager=self.state_manager
             )
-            await self.agent_manager.initialize()
-            logger.info("✓ Gestor de agentes inicializado")
+            
+            self.startup = StartupGraph()
+            self.startup.add("state_manager", self._init_state_manager)
+            self.startup.add("ollama_manager", self._init_ollama_manager)
+            self.startup.add("task_queue", self._init_task_queue)
+            self.startup.add("coordinator", self._init_coordinator,
+                             depends_on=["state_manager", "ollama_manager", "task_queue"])
+            self.startup.add("agent_manager", self._init_agent_manager,
+                             depends_on=["state_manager", "ollama_manager", "task_queue"])
+            # El coordinador ya ha comprobado los modelos: ni la precarga ni los agentes repiten el pull
+            self.startup.add("model_warmup", self._warm_up_models, depends_on=["coordinator"], background=True)
+            self.startup.add("agents", self.agent_manager.create_default_agents,
+                             depends_on=["agent_manager", "coordinator"], background=True)
+            
+            await self.startup.run()
+            self.startup.log_report()
             
             logger.success("Sistema de coordinación inicializado correctamente")
             
@@ -75,6 +86,46 @@ class OrchestrationSystem:
             logger.error(f"Error durante la inicialización: {e}")
             raise
 
+    def _load_coordination_config(self) -> dict:
+        try:
+            with open(self.coordination_config_path, 'r', encoding='utf-8') as f:
+                return yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            logger.warning(f"Archivo de configuración no encontrado: {self.coordination_config_path}")
+            return {}
+
+    async def _init_state_manager(self):
+        await self.state_manager.initialize()
+        logger.info("✓ Gestor de estado inicializado")
+
+    async def _init_ollama_manager(self):
+        await self.ollama_manager.initialize(warm_up=False)
+        logger.info("✓ Gestor Ollama inicializado")
+
+    async def _init_task_queue(self):
+        await self.task_queue.initialize()
+        logger.info("✓ Sistema de colas inicializado")
+
+    async def _init_coordinator(self):
+        await self.coordinator.initialize()
+        logger.info("✓ Coordinador LangGraph inicializado")
+
+    async def _init_agent_manager(self):
+        await self.agent_manager.initialize(create_agents=False)
+        logger.info("✓ Gestor de agentes inicializado (agentes en segundo plano)")
+
+    async def _warm_up_models(self):
+        models = self.ollama_manager.preload_models or [self.coordinator.config.get("default_model", "llama3.1:8b")]
+        await self.ollama_manager.warm_up_models(models)
+
+    async def wait_until_ready(self, timeout: float = None) -> bool:
+        """Espera a que terminen también los arranques en segundo plano"""
+        if self.startup is None:
+            return False
+        ready = await self.startup.wait_all(timeout)
+        self.startup.log_report()
+        return ready
+
     async def start(self):
         """Inicia el sistema completo"""
         if not self.running:
@@ -101,6 +152,8 @@ class OrchestrationSystem:
         logger.info("Cerrando sistema...")
         self.running = False
         
+        if self.startup:
+            await self.startup.cancel()
         if self.agent_manager:
             await self.agent_manager.shutdown()
         if self.coordinator:
@@ -137,6 +190,7 @@ class OrchestrationSystem:
     async def run_example(self, example_name: str):
         """Ejecuta un ejemplo específico"""
         await self.initialize()
+        await self.wait_until_ready()
         await self.coordinator.run_workflow_example(example_name)
 
 async def main():
@@ -0,0 +1,166 @@
+"""
+Arranque del sistema por grafo de dependencias
+Inicializa en paralelo los componentes independientes y deja los pesos opcionales en segundo plano
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+
+@dataclass
+class StartupComponent:
+    """Componente del arranque con sus dependencias y tiempos"""
+    name: str
+    init: Callable[[], Awaitable]
+    depends_on: List[str] = field(default_factory=list)
+    background: bool = False  # no bloquea el arranque; se espera con wait_ready
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+    status: str = "pending"  # pending | running | ready | failed
+    error: Optional[str] = None
+    started_at: Optional[float] = None  # segundos desde el inicio del arranque
+    duration: Optional[float] = None
+    dependency_wait: float = 0.0
+
+
+class StartupGraph:
+    """Ejecuta las inicializaciones en cuanto sus dependencias están listas
+
+    `run()` vuelve cuando terminan los componentes obligatorios; los marcados
+    como `background` siguen en curso y su disponibilidad se consulta con
+    `is_ready`/`wait_ready`.
+    """
+
+    def __init__(self):
+        self.components: Dict[str, StartupComponent] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.start_time: Optional[float] = None
+        self.foreground_time: Optional[float] = None
+
+    def add(self, name: str, init: Callable[[], Awaitable], depends_on: List[str] = None,
+            background: bool = False):
+        """Registra un componente; `init` es una corrutina sin argumentos"""
+        if name in self.components:
+            raise ValueError(f"Componente de arranque duplicado: {name}")
+        self.components[name] = StartupComponent(name, init, list(depends_on or []), background)
+
+    def _validate(self):
+        for component in self.components.values():
+            for dependency in component.depends_on:
+                if dependency not in self.components:
+                    raise ValueError(f"{component.name} depende de un componente desconocido: {dependency}")
+                if self.components[dependency].background and not component.background:
+                    raise ValueError(f"{component.name} no puede depender del componente en segundo plano {dependency}")
+
+        # Detección de ciclos por orden topológico
+        pending = {name: set(c.depends_on) for name, c in self.components.items()}
+        while pending:
+            free = [name for name, deps in pending.items() if not deps]
+            if not free:
+                raise ValueError(f"Dependencias cíclicas en el arranque: {sorted(pending)}")
+            for name in free:
+                del pending[name]
+            for deps in pending.values():
+                deps.difference_update(free)
+
+    async def run(self):
+        """Arranca todos los componentes; vuelve cuando los obligatorios están listos"""
+        self._validate()
+        self.start_time = time.perf_counter()
+        for name in self.components:
+            self.tasks[name] = asyncio.create_task(self._start(self.components[name]))
+
+        foreground = [self.tasks[name] for name, c in self.components.items() if not c.background]
+        try:
+            await asyncio.gather(*foreground)
+        except Exception:
+            for task in self.tasks.values():
+                task.cancel()
+            raise
+        self.foreground_time = time.perf_counter() - self.start_time
+
+    async def _start(self, component: StartupComponent):
+        wait_start = time.perf_counter()
+        for dependency in component.depends_on:
+            dep = self.components[dependency]
+            await dep.ready.wait()
+            if dep.status != "ready":
+                component.status = "failed"
+                component.error = f"Dependencia {dependency} fallida"
+                component.ready.set()
+                if component.background:
+                    logger.error(f"{component.name} no arranca: {component.error}")
+                    return
+                raise RuntimeError(f"{component.name}: {component.error}")
+
+        start = time.perf_counter()
+        component.dependency_wait = start - wait_start
+        component.started_at = start - self.start_time
+        component.status = "running"
+        try:
+            await component.init()
+            component.status = "ready"
+        except Exception as e:
+            component.status = "failed"
+            component.error = str(e)
+            if component.background:
+                logger.error(f"Error en arranque en segundo plano de {component.name}: {e}")
+                return
+            raise
+        finally:
+            component.duration = time.perf_counter() - start
+            component.ready.set()
+
+    def is_ready(self, name: str) -> bool:
+        component = self.components.get(name)
+        return component is not None and component.status == "ready"
+
+    async def wait_ready(self, name: str, timeout: Optional[float] = None) -> bool:
+        """Espera a que un componente termine de arrancar; devuelve si quedó listo"""
+        component = self.components[name]
+        try:
+            await asyncio.wait_for(component.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return component.status == "ready"
+
+    async def wait_all(self, timeout: Optional[float] = None) -> bool:
+        """Espera también a los componentes en segundo plano"""
+        results = await asyncio.gather(*(self.wait_ready(name, timeout) for name in self.components))
+        return all(results)
+
+    async def cancel(self):
+        """Cancela los arranques que sigan en curso (p. ej. al cerrar el sistema)"""
+        for task in self.tasks.values():
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    def get_timings(self) -> Dict[str, Dict]:
+        """Tiempos de cada componente en segundos"""
+        return {
+            name: {
+                "status": c.status,
+                "background": c.background,
+                "started_at": c.started_at,
+                "duration": c.duration,
+                "dependency_wait": c.dependency_wait,
+                "error": c.error
+            }
+            for name, c in self.components.items()
+        }
+
+    def log_report(self):
+        """Registra en el log la tabla de tiempos del arranque"""
+        for name, timing in self.get_timings().items():
+            if timing["duration"] is None:
+                logger.info(f"  {name:<16} {timing['status']}")
+                continue
+            mode = "segundo plano" if timing["background"] else "bloqueante"
+            logger.info(f"  {name:<16} inicio +{timing['started_at']:.2f}s, "
+                        f"duración {timing['duration']:.2f}s ({mode}, {timing['status']})")
+        if self.foreground_time is not None:
+            logger.info(f"Sistema listo para atender peticiones en {self.foreground_time:.2f}s")
@@ -210,6 +210,28 @@ class StateManager:
                     )
                 """)
                 
+                # Tabla de memoria conversacional de agentes (comprimida con zlib)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS agent_memory (
+                        agent_id TEXT PRIMARY KEY,
+                        payload BLOB NOT NULL,
+                        size_bytes INTEGER NOT NULL,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                # Checkpoints por nodo de workflows en curso (comprimidos con zlib)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS workflow_checkpoints (
+                        workflow_id TEXT NOT NULL,
+                        node TEXT NOT NULL,
+                        sequence INTEGER NOT NULL,
+                        payload BLOB NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (workflow_id, node)
+                    )
+                """)
+                
                 # Índices para mejorar rendimiento
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_workflows_status ON workflows(status)")
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_workflows_type ON workflows(workflow_type)")
@@ -316,6 +338,44 @@ class StateManager:
         
         return None
 
+    async def save_agent_memories(self, memories: Dict[str, bytes]):
+        """Guarda en una sola transacción la memoria comprimida de varios agentes"""
+        if not memories:
+            return
+        try:
+            with self.get_db_connection() as conn:
+                conn.executemany("""
+                    INSERT OR REPLACE INTO agent_memory (agent_id, payload, size_bytes, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                """, [(agent_id, payload, len(payload)) for agent_id, payload in memories.items()])
+                conn.commit()
+            
+            self.stats["saved_states"] += len(memories)
+            self.stats["db_operations"] += 1
+            
+        except Exception as e:
+            self.stats["failed_operations"] += 1
+            logger.error(f"Error guardando memoria de agentes: {e}")
+
+    async def load_agent_memory(self, agent_id: str) -> Optional[bytes]:
+        """Carga la memoria comprimida de un agente"""
+        try:
+            with self.get_db_connection() as conn:
+                row = conn.execute(
+                    "SELECT payload FROM agent_memory WHERE agent_id = ?", (agent_id,)
+                ).fetchone()
+            
+            self.stats["db_operations"] += 1
+            if row:
+                self.stats["loaded_states"] += 1
+                return row[0]
+                
+        except Exception as e:
+            self.stats["failed_operations"] += 1
+            logger.error(f"Error cargando memoria del agente {agent_id}: {e}")
+        
+        return None
+
     async def get_all_agents(self) -> List[Dict]:
         """Obtiene todos los agentes registrados"""
         try:
@@ -438,6 +498,64 @@ class StateManager:
         
         return None
 
+    async def save_workflow_checkpoints(self, checkpoints: List[tuple]):
+        """Guarda en una transacción un lote de checkpoints (workflow_id, nodo, secuencia, payload)"""
+        if not checkpoints:
+            return
+        try:
+            with self.get_db_connection() as conn:
+                conn.executemany("""
+                    INSERT OR REPLACE INTO workflow_checkpoints (workflow_id, node, sequence, payload)
+                    VALUES (?, ?, ?, ?)
+                """, checkpoints)
+                conn.commit()
+            
+            self.stats["saved_states"] += len(checkpoints)
+            self.stats["db_operations"] += 1
+            
+        except Exception as e:
+            self.stats["failed_operations"] += 1
+            logger.error(f"Error guardando checkpoints de workflows: {e}")
+            raise
+
+    async def load_workflow_checkpoints(self, workflow_id: str) -> List[tuple]:
+        """Carga los checkpoints de un workflow en orden de ejecución: [(nodo, payload)]"""
+        try:
+            with self.get_db_connection() as conn:
+                rows = conn.execute("""
+                    SELECT node, payload FROM workflow_checkpoints
+                    WHERE workflow_id = ? ORDER BY sequence
+                """, (workflow_id,)).fetchall()
+            
+            self.stats["db_operations"] += 1
+            return rows
+            
+        except Exception as e:
+            self.stats["failed_operations"] += 1
+            logger.error(f"Error cargando checkpoints del workflow {workflow_id}: {e}")
+            return []
+
+    async def get_checkpointed_workflows(self) -> List[str]:
+        """IDs de workflows con checkpoints pendientes (no finalizados)"""
+        try:
+            with self.get_db_connection() as conn:
+                rows = conn.execute("SELECT DISTINCT workflow_id FROM workflow_checkpoints").fetchall()
+            return [row[0] for row in rows]
+        except Exception as e:
+            logger.error(f"Error listando workflows con checkpoints: {e}")
+            return []
+
+    async def delete_workflow_checkpoints(self, workflow_id: str):
+        """Elimina los checkpoints de un workflow terminado"""
+        try:
+            with self.get_db_connection() as conn:
+                conn.execute("DELETE FROM workflow_checkpoints WHERE workflow_id = ?", (workflow_id,))
+                conn.commit()
+            self.stats["db_operations"] += 1
+        except Exception as e:
+            self.stats["failed_operations"] += 1
+            logger.error(f"Error eliminando checkpoints del workflow {workflow_id}: {e}")
+
     async def get_workflows_by_status(self, status: str) -> List[Dict]:
         """Obtiene workflows por estado"""
         try:
@@ -17,6 +17,8 @@ import threading
 
 from loguru import logger
 
+from tracing import SpanKind, get_tracer
+
 class TaskPriority(Enum):
     LOW = 1
     NORMAL = 2
@@ -72,11 +74,15 @@ class TaskResult:
             self.timestamp = datetime.now()
 
 class TaskQueue:
-    def __init__(self, max_workers: int = 10, queue_size: int = 1000):
+    def __init__(self, max_workers: int = 10, queue_size: int = 1000,
+                 shed_below: TaskPriority = TaskPriority.NORMAL,
+                 shed_policy: str = "defer",
+                 defer_seconds: float = 30.0):
         self.max_workers = max_workers
         self.queue_size = queue_size
         self.active_tasks: Dict[str, Task] = {}
-        self.task_heap: List[tuple] = []  # (priority, scheduled_time, task_id)
+        self.task_heap: List[tuple] = []  # (-priority, scheduled_time, task_id) de tareas ya vencidas
+        self.delayed_heap: List[tuple] = []  # (scheduled_time, -priority, task_id) de tareas programadas
         self.completed_tasks: Dict[str, Task] = {}
         self.task_history: List[Task] = []
         
@@ -88,6 +94,18 @@ class TaskQueue:
         self.task_listeners: Dict[str, List[Callable]] = {}
         self.task_callbacks: Dict[str, Callable] = {}
         
+        # Suscriptores a resultados parciales (streaming) por tarea
+        self.partial_subscribers: Dict[str, List[asyncio.Queue]] = {}
+        
+        # Descarte de carga mientras haya circuit breakers abiertos
+        if shed_policy not in ("defer", "reject"):
+            raise ValueError(f"Política de descarte no soportada: {shed_policy}")
+        self.shed_below = shed_below
+        self.shed_policy = shed_policy
+        self.defer_seconds = defer_seconds
+        self.open_circuits: Dict[str, datetime] = {}
+        self.circuit_agents: Dict[str, frozenset] = {}  # agentes afectados por cada circuito abierto
+        
         # Estadísticas
         self.stats = {
             "total_tasks": 0,
@@ -95,7 +113,9 @@ class TaskQueue:
             "failed_tasks": 0,
             "average_execution_time": 0.0,
             "queue_depth": 0,
-            "active_workers": 0
+            "active_workers": 0,
+            "deferred_tasks": 0,
+            "shed_tasks": 0
         }
         
         # Control de ejecución
@@ -156,28 +176,32 @@ class TaskQueue:
         with self.lock:
             current_time = datetime.now()
             
-            # Limpiar tareas completadas de la cola
-            while self.task_heap and (self.task_heap[0][2] not in self.active_tasks or
-                                    self.active_tasks[self.task_heap[0][2]].status != TaskStatus.PENDING):
-                heapq.heappop(self.task_heap)
-            
-            # Verificar si hay tareas disponibles
-            if not self.task_heap:
-                return None
+            # Pasar al heap principal las tareas programadas que ya vencieron
+            while self.delayed_heap and self.delayed_heap[0][0] <= current_time:
+                scheduled_at, priority, task_id = heapq.heappop(self.delayed_heap)
+                heapq.heappush(self.task_heap, (priority, scheduled_at, task_id))
             
-            # Obtener la tarea con mayor prioridad y tiempo
-            _, _, task_id = self.task_heap[0]
-            
-            if task_id in self.active_tasks:
-                task = self.active_tasks[task_id]
-                
-                # Verificar si es hora de ejecutar la tarea
-                if task.scheduled_at <= current_time:
-                    heapq.heappop(self.task_heap)
+            # Obtener la tarea con mayor prioridad y tiempo; las entradas de tareas
+            # canceladas, terminadas o reprogramadas se descartan al llegar a la cima
+            while self.task_heap:
+                _, scheduled_at, task_id = heapq.heappop(self.task_heap)
+                task = self.active_tasks.get(task_id)
+                if task is not None and task.status == TaskStatus.PENDING and task.scheduled_at == scheduled_at:
                     return task
             
             return None
 
+    def _push_task(self, task: Task):
+        """Encola una tarea; si está programada a futuro espera en el heap diferido
+        para no bloquear a las que ya pueden ejecutarse (llamar con el lock tomado)"""
+        if task.scheduled_at > datetime.now():
+            heapq.heappush(self.delayed_heap, (task.scheduled_at, -task.priority.value, task.task_id))
+        else:
+            heapq.heappush(self.task_heap, (-task.priority.value, task.scheduled_at, task.task_id))
+
+    def _queue_depth(self) -> int:
+        return sum(1 for task in self.active_tasks.values() if task.status == TaskStatus.PENDING)
+
     def _execute_task(self, worker_id: str, task: Task):
         """Ejecuta una tarea"""
         try:
@@ -190,8 +214,16 @@ class TaskQueue:
             
             logger.info(f"Worker {worker_id} ejecutando tarea {task.task_id}")
             
-            # Ejecutar la tarea según su tipo
-            result = asyncio.run(self._execute_task_by_type(task))
+            # Ejecutar la tarea según su tipo; el span cuelga del que la envió a la cola
+            trace_parent = (task.metadata or {}).get("trace_parent")
+            with get_tracer().span(f"queue.task {task.task_type.value}", {
+                "task.id": task.task_id,
+                "task.priority": task.priority.name,
+                "queue.wait": (task.started_at - task.created_at).total_seconds(),
+                "queue.retry_count": task.retry_count,
+                "queue.worker": worker_id
+            }, kind=SpanKind.CONSUMER, parent=tuple(trace_parent) if trace_parent else None):
+                result = asyncio.run(self._execute_task_by_type(task))
             
             # Actualizar estado y resultado
             task.status = TaskStatus.COMPLETED
@@ -295,11 +327,7 @@ class TaskQueue:
             task.scheduled_at = datetime.now() + timedelta(seconds=2 ** task.retry_count)
             
             with self.lock:
-                heapq.heappush(self.task_heap, (
-                    task.priority.value,
-                    task.scheduled_at,
-                    task.task_id
-                ))
+                self._push_task(task)
             
             logger.warning(f"Tarea {task.task_id} reintentada ({task.retry_count}/{task.max_retries})")
         else:
@@ -335,7 +363,7 @@ class TaskQueue:
         while self.running:
             try:
                 with self.lock:
-                    self.stats["queue_depth"] = len(self.task_heap)
+                    self.stats["queue_depth"] = self._queue_depth()
                     self.stats["total_tasks"] = len(self.active_tasks) + len(self.completed_tasks)
                 
                 await asyncio.sleep(30)  # Check every 30 seconds
@@ -400,6 +428,12 @@ class TaskQueue:
         if scheduled_at is None:
             scheduled_at = datetime.now()
         
+        # Propagar la traza activa a la ejecución en el worker
+        metadata = dict(metadata or {})
+        trace_parent = get_tracer().current_parent()
+        if trace_parent is not None:
+            metadata.setdefault("trace_parent", list(trace_parent))
+        
         # Crear tarea
         task = Task(
             task_id=task_id,
@@ -413,19 +447,32 @@ class TaskQueue:
             scheduled_at=scheduled_at,
             max_retries=max_retries,
             dependencies=dependencies or [],
-            metadata=metadata or {}
+            metadata=metadata
         )
         
+        # Con circuitos abiertos para su agente o modelo, el trabajo de baja prioridad
+        # se aplaza o se descarta
+        shed = self._should_shed(task)
+        if shed and self.shed_policy == "defer":
+            task.scheduled_at = max(task.scheduled_at, datetime.now() + timedelta(seconds=self.defer_seconds))
+            self.stats["deferred_tasks"] += 1
+        
+        if shed and self.shed_policy == "reject":
+            task.status = TaskStatus.CANCELLED
+            task.error = "Descartada por sobrecarga: circuitos abiertos"
+            task.completed_at = datetime.now()
+            with self.lock:
+                self.completed_tasks[task_id] = task
+            self.stats["shed_tasks"] += 1
+            logger.warning(f"Tarea {task_id} de prioridad {priority.name} descartada (circuitos abiertos)")
+            return task_id
+        
         # Agregar a cola activa
         with self.lock:
             self.active_tasks[task_id] = task
             
             # Agregar a heap de prioridades
-            heapq.heappush(self.task_heap, (
-                priority.value,
-                scheduled_at,
-                task_id
-            ))
+            self._push_task(task)
         
         logger.info(f"Tarea {task_id} agregada a la cola")
         return task_id
@@ -497,12 +544,9 @@ class TaskQueue:
             if task_id in self.active_tasks:
                 task = self.active_tasks[task_id]
                 if task.status == TaskStatus.PENDING:
+                    # Su entrada en el heap se descarta al desencolar
                     task.status = TaskStatus.CANCELLED
                     
-                    # Remover del heap
-                    self.task_heap = [(p, t, tid) for p, t, tid in self.task_heap if tid != task_id]
-                    heapq.heapify(self.task_heap)
-                    
                     logger.info(f"Tarea {task_id} cancelada")
                     return True
                     
@@ -513,10 +557,11 @@ class TaskQueue:
         with self.lock:
             return {
                 "active_tasks": len(self.active_tasks),
-                "queue_depth": len(self.task_heap),
+                "queue_depth": self._queue_depth(),
                 "completed_tasks": len(self.completed_tasks),
                 "active_workers": len([t for t in self.workers.values() if t.is_alive()]),
                 "stats": self.stats,
+                "open_circuits": list(self.open_circuits),
                 "task_types": {
                     task_type.value: len([t for t in self.active_tasks.values() if t.task_type == task_type])
                     for task_type in TaskType
@@ -553,6 +598,89 @@ class TaskQueue:
                 del self.active_tasks[task_id]
                 
                 logger.info(f"Resultado enviado para tarea {task_id}")
+        
+        self._close_partial_stream(task_id, result)
+
+    @property
+    def is_degraded(self) -> bool:
+        return bool(self.open_circuits)
+
+    def _circuit_affects(self, name: str, task: Task) -> bool:
+        """Un circuito "agent:<id>" afecta a las tareas de ese agente y uno "model:<modelo>"
+        a las de ese modelo o de los agentes que lo usan"""
+        kind, _, target = name.partition(":")
+        if task.agent_id is not None and task.agent_id in self.circuit_agents.get(name, ()):
+            return True
+        if kind == "agent":
+            return task.agent_id == target
+        if kind == "model":
+            payload_model = task.payload.get("model") if isinstance(task.payload, dict) else None
+            return target in ((task.metadata or {}).get("model"), payload_model)
+        return False
+
+    def _should_shed(self, task: Task) -> bool:
+        return (task.priority.value < self.shed_below.value
+                and any(self._circuit_affects(name, task) for name in self.open_circuits))
+
+    def report_circuit_state(self, name: str, is_open: bool, agent_ids: Optional[List[str]] = None):
+        """Registra la apertura o cierre de un circuit breaker
+
+        agent_ids indica los agentes cuyas tareas dependen del circuito (p. ej. los
+        que usan el modelo); solo se degrada el trabajo dirigido a ellos.
+        """
+        if is_open:
+            newly_open = name not in self.open_circuits
+            self.open_circuits.setdefault(name, datetime.now())
+            self.circuit_agents[name] = frozenset(agent_ids or ())
+            if newly_open:
+                logger.warning(f"Circuito {name} abierto: se aplaza su trabajo bajo {self.shed_below.name}")
+                self._defer_pending_low_priority(name)
+        elif self.open_circuits.pop(name, None) is not None:
+            self.circuit_agents.pop(name, None)
+            logger.info(f"Circuito {name} cerrado: su trabajo vuelve a la cola normal")
+
+    def _defer_pending_low_priority(self, name: str):
+        """Aplaza las tareas pendientes de baja prioridad ya encoladas que dependen del circuito"""
+        defer_until = datetime.now() + timedelta(seconds=self.defer_seconds)
+        with self.lock:
+            deferred = 0
+            for task in self.active_tasks.values():
+                if (task.status == TaskStatus.PENDING and task.priority.value < self.shed_below.value
+                        and task.scheduled_at < defer_until and self._circuit_affects(name, task)):
+                    # La entrada anterior queda obsoleta y se descarta al desencolar
+                    task.scheduled_at = defer_until
+                    self._push_task(task)
+                    deferred += 1
+            self.stats["deferred_tasks"] += deferred
+
+    async def publish_partial_result(self, task_id: str, chunk: Dict):
+        """Publica un resultado parcial (p. ej. tokens) a los suscriptores de la tarea"""
+        for queue in self.partial_subscribers.get(task_id, []):
+            queue.put_nowait(chunk)
+
+    async def stream_task_results(self, task_id: str) -> AsyncGenerator[Dict, None]:
+        """Itera los resultados parciales de una tarea hasta que se envía el resultado final"""
+        queue: asyncio.Queue = asyncio.Queue()
+        self.partial_subscribers.setdefault(task_id, []).append(queue)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            subscribers = self.partial_subscribers.get(task_id, [])
+            if queue in subscribers:
+                subscribers.remove(queue)
+            if not subscribers:
+                self.partial_subscribers.pop(task_id, None)
+
+    def _close_partial_stream(self, task_id: str, result: Optional[Dict] = None):
+        """Entrega el resultado final a los suscriptores y cierra sus streams"""
+        for queue in self.partial_subscribers.get(task_id, []):
+            if result is not None:
+                queue.put_nowait({"type": "result", **result})
+            queue.put_nowait(None)
 
     async def start_listener(self, callback: Callable):
         """Inicia un listener de tareas"""
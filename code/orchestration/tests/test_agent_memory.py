@@ -0,0 +1,171 @@
+"""
+Tests de la memoria conversacional de los agentes y su relación con las réplicas
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import pytest_asyncio
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "benchmarks"))
+
+from mock_ollama_server import MockOllamaConfig, MockOllamaServer
+from ollama_manager import OllamaManager
+from state_manager import StateManager
+from agent_manager import AgentManager
+from agent_autoscaler import AutoscalerConfig
+from agent_memory import ConversationMemory, MemoryConfig, estimate_tokens
+from tracing import get_tracer
+
+
+@pytest_asyncio.fixture
+async def agent_manager(tmp_path):
+    """Gestor de agentes con estado en un directorio temporal contra el servidor Ollama simulado"""
+    async with MockOllamaServer(MockOllamaConfig(first_token_latency=0.0, response_tokens=4)) as server:
+        manager = OllamaManager(host=server.host, port=server.port)
+        await manager.initialize()
+        state_manager = StateManager(
+            db_path=str(tmp_path / "state.db"),
+            config_path=str(tmp_path / "state_config.yaml")
+        )
+        await state_manager.initialize()
+        agent_manager = AgentManager(
+            coordinator=None,
+            ollama_manager=manager,
+            task_queue=None,
+            state_manager=state_manager,
+            autoscaler_config=AutoscalerConfig(enabled=False)
+        )
+        agent_manager.server = server
+        try:
+            yield agent_manager
+        finally:
+            await agent_manager.shutdown()
+            await state_manager.shutdown()
+            await manager.shutdown()
+
+
+async def _run(agent_manager: AgentManager, task_id: str, session_id: str = None):
+    task = {"agent_type": "analyzer", "task_type": "analyze_data", "session_id": session_id}
+    agent = agent_manager._resolve_agent(task)
+    result = await agent.execute_task(task_id, "analyze_data", {"item": task_id}, session_id)
+    assert result["success"]
+    return agent.config.agent_id
+
+
+@pytest.mark.asyncio
+async def test_session_stays_on_replica_with_its_memory(agent_manager):
+    """Los turnos de una sesión van a la misma réplica; sin sesión se reparten"""
+    await agent_manager.create_agent("analyzer", "analyzer_001")
+    await agent_manager.spawn_replica("analyzer")
+
+    assert len({await _run(agent_manager, f"free_{i}") for i in range(2)}) == 2
+
+    used = {await _run(agent_manager, f"s_{i}", "s1") for i in range(4)}
+    assert len(used) == 1
+    conversation = agent_manager.agents[used.pop()].memory.conversation
+    assert [t.task_id for t in conversation.turns if t.session_id == "s1"] == [f"s_{i}" for i in range(4)]
+
+
+@pytest.mark.asyncio
+async def test_retired_replica_memory_is_saved_and_handed_over(agent_manager):
+    """Al retirar una réplica su memoria se persiste y sus sesiones siguen en la réplica base"""
+    await agent_manager.create_agent("analyzer", "analyzer_001")
+    replica_id = await agent_manager.spawn_replica("analyzer")
+    agent_manager.router.sessions["s1"] = (replica_id, time.monotonic())
+
+    assert await _run(agent_manager, "t1", "s1") == replica_id
+    assert await agent_manager.retire_replica("analyzer") == replica_id
+
+    assert await agent_manager.state_manager.load_agent_memory(replica_id) is not None
+    assert agent_manager.router.sessions["s1"][0] == "analyzer_001"
+    assert await _run(agent_manager, "t2", "s1") == "analyzer_001"
+    turns = agent_manager.agents["analyzer_001"].memory.conversation.turns
+    assert [t.task_id for t in turns if t.session_id == "s1"] == ["t1", "t2"]
+
+
+def test_context_respects_token_budget():
+    """El historial enviado no supera el presupuesto y prioriza los turnos recientes"""
+    memory = ConversationMemory(MemoryConfig(context_token_budget=60, max_turn_tokens=20))
+    for i in range(10):
+        memory.append(f"t{i}", "analyze_data", "x" * 40, "y" * 40, "s1")
+    memory.session_summaries["s1"] = "hechos previos"
+
+    messages = memory.context_messages(session_id="s1")
+    used = sum(estimate_tokens(message.content) for message in messages)
+    assert used <= 60 + len(messages)
+    assert "hechos previos" in messages[0].content
+    assert messages[-2].content.startswith("[analyze_data]") and len(messages) < 20
+    assert memory.context_messages(session_id="otra") == []
+
+
+@pytest.mark.asyncio
+async def test_compaction_only_summarizes_injected_history():
+    """El modelo resume solo los turnos de sesión; los demás se pliegan de forma extractiva"""
+    calls = []
+
+    async def summarize(summary, transcript):
+        calls.append(transcript)
+        return f"resumen de {transcript.count('- [')} turnos"
+
+    memory = ConversationMemory(MemoryConfig(keep_recent_turns=2, summarize_every=4))
+    for i in range(3):
+        memory.append(f"free_{i}", "analyze_data", f"libre {i}", "ok")
+    for i in range(3):
+        memory.append(f"s_{i}", "analyze_data", f"sesion {i}", "ok", "s1")
+    assert memory.needs_compaction()
+
+    await memory.compact(summarize)
+    assert len(calls) == 1 and "sesion 0" in calls[0]
+    assert memory.session_summaries["s1"] == "resumen de 1 turnos"
+    assert "libre 2" in memory.summary
+    assert [t.task_id for t in memory.turns] == ["s_1", "s_2"]
+    assert "resumen de 1 turnos" in memory.context_messages(session_id="s1")[0].content
+
+    # Con inject_history el resumen general también llega al prompt y se pide al modelo
+    memory = ConversationMemory(MemoryConfig(keep_recent_turns=0, summarize_every=1, inject_history=True))
+    memory.append("free", "analyze_data", "libre", "ok")
+    await memory.compact(summarize)
+    assert len(calls) == 2 and memory.summary == "resumen de 1 turnos"
+
+
+@pytest.mark.asyncio
+async def test_memory_persistence_round_trip(agent_manager):
+    """Turnos y resúmenes sobreviven al guardado en el StateManager y a la recuperación"""
+    await agent_manager.create_agent("analyzer", "analyzer_001")
+    conversation = agent_manager.agents["analyzer_001"].memory.conversation
+    conversation.append("t1", "analyze_data", {"item": 1}, {"ok": True}, "s1")
+    conversation.summary = "general"
+    conversation.session_summaries["s1"] = "de la sesión"
+
+    await agent_manager._persist_agent_memories()
+    assert not conversation.dirty
+    agent = agent_manager.agents["analyzer_001"]
+    agent.memory.conversation = ConversationMemory(conversation.config)
+    await agent_manager._restore_agent_memory(agent)
+
+    restored = agent.memory.conversation
+    assert restored.summary == "general"
+    assert restored.session_summaries == {"s1": "de la sesión"}
+    assert [(t.task_id, t.session_id) for t in restored.turns] == [("t1", "s1")]
+
+
+@pytest.mark.asyncio
+async def test_agent_summary_goes_through_breakers_and_tracing(agent_manager):
+    """El resumen en segundo plano cuenta en el circuit breaker del modelo y genera su span"""
+    memory_config = {"keep_recent_turns": 1, "summarize_every": 2}
+    await agent_manager.create_agent("analyzer", "analyzer_001", {"memory": memory_config})
+    agent = agent_manager.agents["analyzer_001"]
+    for i in range(3):
+        result = await agent.execute_task(f"t{i}", "analyze_data", {"item": i}, "s1")
+        assert result["success"]
+    await agent.compaction_task
+
+    assert agent.memory.conversation.session_summaries["s1"]
+    assert agent_manager.circuit_breakers.get("model:mistral:7b").stats["calls"] == 4
+    get_tracer().flush()
+    names = [span.name for span in get_tracer().collector.get_spans()]
+    assert "agent.memory.compact analyzer_001" in names
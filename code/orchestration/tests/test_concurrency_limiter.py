@@ -0,0 +1,142 @@
+"""
+Tests de los cupos de concurrencia por modelo y del límite global
+"""
+
+import asyncio
+import gc
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "benchmarks"))
+
+from mock_ollama_server import MockOllamaConfig, MockOllamaServer
+from ollama_manager import OllamaManager
+from concurrency_limiter import ModelConcurrencyLimiter
+from agent_manager import AgentManager
+from agent_autoscaler import AutoscalerConfig
+
+
+async def _hold(limiter: ModelConcurrencyLimiter, model: str, release: asyncio.Event, acquired: list):
+    async with limiter.slot(model):
+        acquired.append(model)
+        await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_global_cap_bounds_total_load():
+    """Con cupos libres por modelo, el límite global sigue acotando las peticiones simultáneas"""
+    limiter = ModelConcurrencyLimiter(max_slots_per_model=3, max_total_slots=2)
+    release = asyncio.Event()
+    acquired = []
+    holders = [asyncio.create_task(_hold(limiter, model, release, acquired))
+               for model in ("llama3.1:8b", "mistral:7b", "phi3:mini")]
+    await asyncio.sleep(0.05)
+
+    assert len(acquired) == 2
+    assert limiter.active_requests == 2
+    assert limiter.get_global_stats()["queue_depth"] == 1
+
+    release.set()
+    await asyncio.gather(*holders)
+    assert len(acquired) == 3 and limiter.active_requests == 0
+
+
+@pytest.mark.asyncio
+async def test_small_model_does_not_queue_behind_saturated_model():
+    """Las peticiones que esperan a un modelo saturado no retienen cupos globales"""
+    limiter = ModelConcurrencyLimiter(max_slots_per_model=1, max_total_slots=2)
+    release = asyncio.Event()
+    acquired = []
+    holders = [asyncio.create_task(_hold(limiter, "llama3.1:8b", release, acquired)) for _ in range(3)]
+    await asyncio.sleep(0.05)
+
+    async with limiter.slot("phi3:mini", timeout=0.1):
+        assert limiter.active_requests == 2
+
+    release.set()
+    await asyncio.gather(*holders)
+
+
+@pytest.mark.asyncio
+async def test_timeout_waiting_global_slot_releases_model_slot():
+    limiter = ModelConcurrencyLimiter(max_slots_per_model=2, max_total_slots=1)
+    release = asyncio.Event()
+    holder = asyncio.create_task(_hold(limiter, "llama3.1:8b", release, []))
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(asyncio.TimeoutError):
+        async with limiter.slot("mistral:7b", timeout=0.05):
+            pass
+    assert limiter.get_stats()["mistral:7b"]["in_use"] == 0
+
+    release.set()
+    await holder
+
+
+@pytest.mark.asyncio
+async def test_response_time_excludes_slot_wait_and_abandoned_stream_releases_slot():
+    """ModelResponse.time no incluye la cola; un stream abandonado no retiene su cupo"""
+    config = MockOllamaConfig(first_token_latency=0.2, response_tokens=4, tokens_per_second=1000)
+    async with MockOllamaServer(config) as server:
+        manager = OllamaManager(host=server.host, port=server.port, max_concurrent_requests=1)
+        await manager.initialize()
+        try:
+            start = time.perf_counter()
+            first, second = await asyncio.gather(
+                manager.generate("phi3:mini", "uno"), manager.generate("phi3:mini", "dos")
+            )
+            assert time.perf_counter() - start >= 0.4
+            assert max(first.time, second.time) < 0.35
+
+            # Se lee un fragmento y se abandona el generador sin cerrarlo
+            stream = manager.generate_stream("phi3:mini", "tres")
+            assert await stream.__anext__()
+            assert manager.limiter.active_requests == 1
+            del stream
+            gc.collect()
+            for _ in range(50):
+                if manager.limiter.active_requests == 0:
+                    break
+                await asyncio.sleep(0.02)
+            assert manager.limiter.active_requests == 0
+
+            # Cerrarlo cancela la generación y devuelve el cupo de inmediato
+            stream = manager.generate_stream("phi3:mini", "cuatro")
+            assert await stream.__anext__()
+            await stream.aclose()
+            assert manager.limiter.active_requests == 0
+        finally:
+            await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_agent_calls_use_model_slots():
+    """Las llamadas de los agentes pasan por los cupos del OllamaManager"""
+    async with MockOllamaServer(MockOllamaConfig(first_token_latency=0.0, response_tokens=4)) as server:
+        manager = OllamaManager(host=server.host, port=server.port)
+        await manager.initialize()
+        agent_manager = AgentManager(
+            coordinator=None,
+            ollama_manager=manager,
+            task_queue=None,
+            state_manager=None,
+            autoscaler_config=AutoscalerConfig(enabled=False)
+        )
+        try:
+            await agent_manager.create_agent("analyzer", "analyzer_001")
+            agent = agent_manager.agents["analyzer_001"]
+            result = await agent.execute_task("t1", "analyze_data", {"item": 1})
+            assert result["success"]
+            chunks = [chunk async for chunk in agent.execute_task_stream("t2", "analyze_data", {"item": 2})]
+            assert chunks[-1]["success"]
+
+            stats = manager.get_concurrency_stats()["mistral:7b"]
+            assert stats["total_acquired"] == 2 and stats["in_use"] == 0
+            assert manager.get_global_concurrency_stats()["total_acquired"] == 2
+        finally:
+            await agent_manager.shutdown()
+            await manager.shutdown()
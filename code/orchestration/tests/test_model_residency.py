@@ -0,0 +1,96 @@
+"""
+Tests de residencia de modelos y preferencia por modelos ya cargados
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+import yaml
+from langchain_core.messages import HumanMessage
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "benchmarks"))
+
+from mock_ollama_server import MockOllamaConfig, MockOllamaServer
+from ollama_manager import OllamaManager
+from model_residency import ModelResidency, parse_keep_alive
+from agent_manager import AgentManager
+from agent_autoscaler import AutoscalerConfig
+
+CONFIG_PATH = Path(__file__).parent.parent / "config" / "coordination_config.yaml"
+
+
+def test_keep_alive_and_expires_at():
+    """Los modelos cuyo keep_alive venció dejan de contar como residentes"""
+    assert parse_keep_alive("30m") == 1800
+    assert parse_keep_alive("1h30m") == 5400
+    assert parse_keep_alive(-1) is None
+
+    residency = ModelResidency(keep_alive="1s")
+    residency.record_request("mistral:7b")
+    assert residency.resident["mistral:7b"].expires_at == pytest.approx(time.time() + 1, abs=0.1)
+
+    past = (datetime.now(timezone.utc) - timedelta(seconds=5)).isoformat()
+    future = (datetime.now(timezone.utc) + timedelta(minutes=5)).isoformat()
+    residency.update_from_ps([{"name": "llama3.1:8b", "expires_at": past},
+                              {"name": "mistral:7b", "expires_at": future}])
+    assert not residency.is_resident("llama3.1:8b")
+    assert residency.choose(["llama3.1:8b", "mistral:7b"]) == "mistral:7b"
+
+
+@pytest.mark.asyncio
+async def test_shipped_config_does_not_substitute_models():
+    """Con la configuración por defecto una petición se sirve con el modelo pedido"""
+    config = yaml.safe_load(CONFIG_PATH.read_text(encoding="utf-8"))
+    async with MockOllamaServer(MockOllamaConfig(first_token_latency=0.0, response_tokens=4)) as server:
+        manager = OllamaManager.from_config(config, host=server.host, port=server.port, response_cache=None)
+        await manager.initialize(warm_up=False)
+        try:
+            await manager.warm_up_models(["mistral:7b"])
+            response = await manager.generate("llama3.1:8b", "hola")
+            assert response.model == "llama3.1:8b"
+        finally:
+            await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_agent_opt_in_prefers_resident_model_without_polling(monkeypatch):
+    """Un agente con prefer_resident usa el equivalente cargado y la elección no consulta /api/ps"""
+    async with MockOllamaServer(MockOllamaConfig(first_token_latency=0.0, response_tokens=4)) as server:
+        manager = OllamaManager(host=server.host, port=server.port,
+                                interchangeable_models=[["llama3.1:8b", "mistral:7b"]])
+        await manager.initialize()
+        agent_manager = AgentManager(
+            coordinator=None,
+            ollama_manager=manager,
+            task_queue=None,
+            state_manager=None,
+            autoscaler_config=AutoscalerConfig(enabled=False)
+        )
+        try:
+            await manager.warm_up_models(["mistral:7b"])
+            refreshes = []
+
+            async def counting_refresh():
+                refreshes.append(time.time())
+
+            monkeypatch.setattr(manager, "refresh_resident_models", counting_refresh)
+            manager.residency.last_refresh = 0.0
+
+            await agent_manager.create_agent("generator", "generator_001", {"prefer_resident": True})
+            await agent_manager.create_agent("coordinator", "coordinator_001")
+            generator = agent_manager.agents["generator_001"]
+            response = await generator.llm_model.ainvoke([HumanMessage(content="hola")])
+            assert response.response_metadata["model"] == "mistral:7b"
+
+            # Sin opt-in el coordinador (también llama3.1) no se sustituye
+            coordinator = agent_manager.agents["coordinator_001"]
+            response = await coordinator.llm_model.ainvoke([HumanMessage(content="hola")])
+            assert response.response_metadata["model"] == "llama3.1:8b"
+            assert refreshes == []
+        finally:
+            await agent_manager.shutdown()
+            await manager.shutdown()
@@ -0,0 +1,155 @@
+"""
+Tests de la caché de respuestas deterministas
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+import yaml
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "benchmarks"))
+
+from mock_ollama_server import MockOllamaConfig, MockOllamaServer
+from ollama_manager import OllamaManager
+from response_cache import ResponseCache
+from agent_manager import AgentManager
+from agent_autoscaler import AutoscalerConfig
+from langgraph_coordinator import LangGraphCoordinator
+from state_manager import StateManager
+from task_queue import TaskQueue
+
+
+def test_disk_limits_with_running_counters(tmp_path):
+    """Los contadores de tamaño siguen a la tabla y el desalojo respeta el último acceso"""
+    cache = ResponseCache(db_path=str(tmp_path / "cache.db"), max_memory_entries=1,
+                          max_disk_entries=3, access_flush_size=1000)
+    for i in range(3):
+        cache.put(f"k{i}", "m", {"response": f"r{i}"})
+    # Acceso a k0 solo anotado en memoria: debe contar para el orden LRU al desalojar
+    cache.memory.clear()
+    assert cache.get("k0") == {"response": "r0"}
+    assert cache.pending_access
+
+    cache.put("k3", "m", {"response": "r3"})
+    cache.memory.clear()
+    assert cache.get("k1") is None
+    assert cache.get("k0") is not None
+
+    cache.put("k3", "m", {"response": "otra respuesta más larga"})
+    count, total_bytes = cache.db_connection.execute(
+        "SELECT COUNT(*), SUM(size_bytes) FROM responses"
+    ).fetchone()
+    assert count == 3
+    assert (cache.disk_entries, cache.disk_bytes) == (count, total_bytes)
+    cache.close()
+
+    # Los contadores se reconstruyen al abrir la base de datos
+    reopened = ResponseCache(db_path=str(tmp_path / "cache.db"))
+    assert (reopened.disk_entries, reopened.disk_bytes) == (count, total_bytes)
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_cached_generate_does_not_mutate_stored_payload(tmp_path):
+    """Una respuesta servida desde la caché no altera la entrada guardada"""
+    cache = ResponseCache(db_path=str(tmp_path / "cache.db"))
+    async with MockOllamaServer(MockOllamaConfig(first_token_latency=0.0, response_tokens=4)) as server:
+        manager = OllamaManager(host=server.host, port=server.port, response_cache=cache)
+        await manager.initialize()
+        try:
+            first = await manager.generate("phi3:mini", "hola", temperature=0)
+            second = await manager.generate("phi3:mini", "hola", temperature=0)
+        finally:
+            await manager.shutdown()
+
+    assert not first.cached and second.cached
+    assert second.response == first.response
+    _, stored = next(iter(cache.memory.values()))
+    assert stored["cached"] is False
+    assert stored["time"] == first.time
+
+
+def test_from_config_builds_response_cache(tmp_path):
+    """La sección ollama.response_cache de la configuración activa la caché"""
+    config = {"ollama": {"response_cache": {"enabled": True, "db_path": str(tmp_path / "cache.db"),
+                                            "max_memory_entries": 8}}}
+    manager = OllamaManager.from_config(config)
+    assert manager.response_cache is not None
+    assert manager.response_cache.max_memory_entries == 8
+    manager.response_cache.close()
+
+    assert OllamaManager.from_config({"ollama": {"response_cache": {"enabled": False}}}).response_cache is None
+
+
+@pytest.mark.asyncio
+async def test_agent_and_coordinator_calls_hit_the_cache(tmp_path):
+    """Las llamadas de agentes y coordinador reproducibles se sirven desde la caché"""
+    async with MockOllamaServer(MockOllamaConfig(first_token_latency=0.0, response_tokens=4)) as server:
+        manager = OllamaManager(host=server.host, port=server.port,
+                                response_cache=ResponseCache(db_path=str(tmp_path / "cache.db")))
+        await manager.initialize()
+        agent_manager = AgentManager(
+            coordinator=None,
+            ollama_manager=manager,
+            task_queue=None,
+            state_manager=None,
+            autoscaler_config=AutoscalerConfig(enabled=False)
+        )
+        try:
+            await agent_manager.create_agent("analyzer", "analyzer_001")
+            await agent_manager.create_agent("generator", "generator_001")
+            analyzer = agent_manager.agents["analyzer_001"]
+            generator = agent_manager.agents["generator_001"]
+            requests = server.stats["requests"]
+
+            # El analizador (temperature=0) repite la misma petición: una sola inferencia
+            first = await analyzer.execute_task("a1", "analyze_data", {"item": 1})
+            second = await analyzer.execute_task("a2", "analyze_data", {"item": 1})
+            assert server.stats["requests"] == requests + 1
+            assert second["result"]["insights"] == first["result"]["insights"]
+
+            # En streaming la respuesta en caché se emite igual
+            chunks = [chunk async for chunk in analyzer.execute_task_stream("a3", "analyze_data", {"item": 1})]
+            assert server.stats["requests"] == requests + 1
+            assert "".join(c["content"] for c in chunks if c["type"] == "token") == first["result"]["insights"]
+
+            # Datos distintos: fallo de caché
+            await analyzer.execute_task("a4", "analyze_data", {"item": 2})
+            assert server.stats["requests"] == requests + 2
+
+            # El generador no es reproducible (temperature=0.7): nunca se consulta la caché
+            stats = manager.get_cache_stats()
+            await generator.execute_task("g1", "generate_content", {"topic": "x"})
+            await generator.execute_task("g2", "generate_content", {"topic": "x"})
+            assert server.stats["requests"] == requests + 4
+            assert manager.get_cache_stats()["misses"] == stats["misses"]
+
+            # El coordinador usa el mismo camino para sus roles
+            (tmp_path / "coordination_config.yaml").write_text(yaml.safe_dump({
+                "default_model": "mistral:7b",
+                "agents": {
+                    "coordinator": {"model": "mistral:7b", "system_prompt": "coordina"},
+                    "analyzer": {"model": "mistral:7b", "system_prompt": "analiza", "temperature": 0}
+                }
+            }))
+            state_manager = StateManager(db_path=str(tmp_path / "state.db"),
+                                         config_path=str(tmp_path / "state_config.yaml"))
+            await state_manager.initialize()
+            coordinator = LangGraphCoordinator(manager, state_manager, TaskQueue(),
+                                               config_path=str(tmp_path / "coordination_config.yaml"))
+            await coordinator.initialize()
+            try:
+                role = coordinator.active_agents["analyzer"]
+                first = await coordinator._run_agent_task(role, "resumir", {})
+                second = await coordinator._run_agent_task(role, "resumir", {})
+            finally:
+                await coordinator.shutdown()
+                await state_manager.shutdown()
+            assert first["success"] and second["result"] == first["result"]
+            assert server.stats["requests"] == requests + 5
+            assert manager.get_cache_stats()["memory_hits"] == 3
+        finally:
+            await agent_manager.shutdown()
+            await manager.shutdown()
@@ -0,0 +1,108 @@
+"""
+Tests de prioridades y descarte de carga de la cola de tareas
+"""
+
+import asyncio
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "benchmarks"))
+
+from mock_ollama_server import MockOllamaConfig, MockOllamaServer
+from ollama_manager import OllamaManager
+from task_queue import TaskQueue, TaskPriority, TaskType
+from agent_manager import AgentManager
+from agent_autoscaler import AutoscalerConfig
+from circuit_breaker import CircuitBreakerConfig, CircuitState
+
+
+@pytest.mark.asyncio
+async def test_deferred_low_priority_does_not_block_higher_priorities():
+    """Las tareas LOW aplazadas esperan aparte y no retienen a las de mayor prioridad"""
+    queue = TaskQueue(defer_seconds=0.2)
+    queue.report_circuit_state("model:x", True)
+
+    deferred_id = await queue.submit_task(TaskType.AGENT_TASK, {"model": "x"}, priority=TaskPriority.LOW)
+    other_low_id = await queue.submit_task(TaskType.AGENT_TASK, {"model": "y"}, priority=TaskPriority.LOW)
+    normal_id = await queue.submit_task(TaskType.AGENT_TASK, {"model": "x"}, priority=TaskPriority.NORMAL)
+    urgent_id = await queue.submit_task(TaskType.AGENT_TASK, {"model": "x"}, priority=TaskPriority.URGENT)
+
+    assert queue.active_tasks[deferred_id].scheduled_at > datetime.now()
+    assert [queue._get_next_task().task_id for _ in range(3)] == [urgent_id, normal_id, other_low_id]
+    assert queue._get_next_task() is None
+
+    # Al vencer el aplazamiento la tarea vuelve a la cola
+    await asyncio.sleep(0.25)
+    assert queue._get_next_task().task_id == deferred_id
+
+
+@pytest.mark.asyncio
+async def test_pending_tasks_deferred_only_for_the_open_circuit():
+    """Abrir un circuito aplaza solo las tareas pendientes de sus agentes"""
+    queue = TaskQueue()
+    affected = await queue.submit_agent_task("analyzer_001", {}, TaskPriority.LOW)
+    unaffected = await queue.submit_agent_task("code_executor_001", {}, TaskPriority.LOW)
+    high = await queue.submit_agent_task("analyzer_001", {}, TaskPriority.HIGH)
+
+    queue.report_circuit_state("model:mistral:7b", True, ["analyzer_001"])
+    assert queue.stats["deferred_tasks"] == 1
+    assert [queue._get_next_task().task_id for _ in range(2)] == [high, unaffected]
+    assert queue._get_next_task() is None
+    assert queue.active_tasks[affected].scheduled_at > datetime.now()
+
+    queue.report_circuit_state("model:mistral:7b", False)
+    assert not queue.is_degraded
+    fresh = await queue.submit_agent_task("analyzer_001", {}, TaskPriority.LOW)
+    assert queue._get_next_task().task_id == fresh
+
+
+@pytest.mark.asyncio
+async def test_model_outage_degrades_only_its_agents():
+    """Inyecta una caída del servidor y comprueba apertura, descarte acotado y recuperación"""
+    async with MockOllamaServer(MockOllamaConfig(first_token_latency=0.0, response_tokens=4)) as server:
+        manager = OllamaManager(host=server.host, port=server.port)
+        await manager.initialize()
+        queue = TaskQueue(shed_policy="reject")
+        agent_manager = AgentManager(
+            coordinator=None,
+            ollama_manager=manager,
+            task_queue=queue,
+            state_manager=None,
+            autoscaler_config=AutoscalerConfig(enabled=False),
+            circuit_breaker_config=CircuitBreakerConfig(min_calls=3, open_duration=0.2, fallback_models={})
+        )
+        try:
+            await agent_manager.create_agent("analyzer", "analyzer_001")
+            await agent_manager.create_agent("code_executor", "code_executor_001")
+            analyzer = agent_manager.agents["analyzer_001"]
+            breaker = agent_manager.circuit_breakers.get("model:mistral:7b")
+
+            server.config.failure_rate = 1.0
+            for i in range(3):
+                result = await analyzer.execute_task(f"fail_{i}", "analyze_data", {"item": i})
+                assert not result["success"]
+            assert breaker.state == CircuitState.OPEN
+            assert "model:mistral:7b" in queue.open_circuits
+
+            rejected = await queue.submit_agent_task("analyzer_001", {}, TaskPriority.LOW)
+            kept = await queue.submit_agent_task("code_executor_001", {}, TaskPriority.LOW)
+            assert queue.completed_tasks[rejected].error.startswith("Descartada")
+            assert kept in queue.active_tasks
+
+            # Tras la caída, las sondas en semiabierto cierran el circuito
+            server.config.failure_rate = 0.0
+            await asyncio.sleep(0.25)
+            for i in range(2):
+                result = await analyzer.execute_task(f"probe_{i}", "analyze_data", {"item": i})
+                assert result["success"]
+            assert breaker.state == CircuitState.CLOSED
+            assert not queue.is_degraded
+            accepted = await queue.submit_agent_task("analyzer_001", {}, TaskPriority.LOW)
+            assert accepted in queue.active_tasks
+        finally:
+            await agent_manager.shutdown()
+            await manager.shutdown()
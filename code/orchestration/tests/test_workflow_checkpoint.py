@@ -0,0 +1,79 @@
+"""
+Tests de checkpoints y reanudación de workflows
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+import pytest_asyncio
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "benchmarks"))
+
+from mock_ollama_server import MockOllamaConfig, MockOllamaServer
+from ollama_manager import OllamaManager
+from task_queue import TaskQueue
+from state_manager import StateManager
+from langgraph_coordinator import LangGraphCoordinator
+from workflow_checkpoint import START_NODE
+
+
+@pytest_asyncio.fixture
+async def coordinator(tmp_path):
+    """Coordinador con estado en un directorio temporal contra el servidor Ollama simulado"""
+    async with MockOllamaServer(MockOllamaConfig(first_token_latency=0.0, response_tokens=4)) as server:
+        manager = OllamaManager(host=server.host, port=server.port)
+        await manager.initialize()
+        state_manager = StateManager(
+            db_path=str(tmp_path / "state.db"),
+            config_path=str(tmp_path / "state_config.yaml")
+        )
+        await state_manager.initialize()
+        coordinator = LangGraphCoordinator(
+            ollama_manager=manager,
+            state_manager=state_manager,
+            task_queue=TaskQueue(),
+            config_path=str(tmp_path / "coordination_config.yaml")
+        )
+        await coordinator.initialize()
+        coordinator.server = server
+        try:
+            yield coordinator
+        finally:
+            await coordinator.shutdown()
+            await state_manager.shutdown()
+            await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_reused_workflow_id_discards_previous_checkpoints(coordinator):
+    """Reiniciar un workflow con un ID ya usado no reanuda sobre los nodos de la ejecución anterior"""
+    workflow_id = "reused_workflow"
+    # Checkpoints de una ejecución anterior que falló tras generar código
+    await coordinator.checkpointer.record(workflow_id, START_NODE, {
+        "type": "code_generation", "name": "anterior", "context": {"requirement": "viejo"},
+        "created_at": "2026-01-01T00:00:00"
+    })
+    await coordinator.checkpointer.record(workflow_id, "code_generation", {
+        "results": {"code_generation": "resultado obsoleto"}, "current_step": "code_generation"
+    })
+    await coordinator.checkpointer.flush()
+
+    # La nueva ejecución falla en su primer nodo con modelo
+    coordinator.server.config.failure_rate = 1.0
+    await coordinator._start_workflow({
+        "workflow_id": workflow_id, "type": "code_generation", "data": {"requirement": "nuevo"}
+    })
+
+    checkpoints = await coordinator.checkpointer.load(workflow_id)
+    assert "code_generation" not in checkpoints
+    assert checkpoints[START_NODE]["context"] == {"requirement": "nuevo"}
+
+    # Al reanudar se recalculan los nodos y no aparece el resultado obsoleto
+    coordinator.server.config.failure_rate = 0.0
+    workflow = await coordinator.resume_workflow(workflow_id)
+    assert workflow is not None
+    assert workflow.status.value == "completed"
+    assert workflow.context == {"requirement": "nuevo"}
+    assert "resultado obsoleto" not in str(workflow.results)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Informe de trazas de workflows
+Muestra en forma de flame graph textual dónde se va el tiempo de los workflows más lentos
+"""
+
+import argparse
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+sys.path.append(str(Path(__file__).parent))
+
+from tracing import Span, load_otlp_json
+
+# Atributos que se muestran junto a cada span
+SHOWN_ATTRIBUTES = {
+    "queue.wait": "cola {:.3f}s",
+    "agent.queue_wait": "espera {:.3f}s",
+    "llm.prompt_tokens": "in {} tok",
+    "llm.completion_tokens": "out {} tok",
+    "llm.time_to_first_token": "ttft {:.3f}s",
+    "node.skipped": "reanudado",
+    "llm.fallback": "respaldo"
+}
+
+
+def build_children(spans: List[Span]) -> Dict[str, List[Span]]:
+    """Hijos de cada span ordenados por inicio"""
+    children = defaultdict(list)
+    for span in spans:
+        if span.parent_span_id:
+            children[span.parent_span_id].append(span)
+    for siblings in children.values():
+        siblings.sort(key=lambda s: s.start_time_ns)
+    return children
+
+
+def slowest_workflows(spans: List[Span], top: int = 5) -> List[Span]:
+    """Spans raíz de workflow más largos (o cualquier raíz si no hay workflows)"""
+    known = {span.span_id for span in spans}
+    roots = [s for s in spans if not s.parent_span_id or s.parent_span_id not in known]
+    workflows = [s for s in roots if s.name.startswith("workflow")] or roots
+    return sorted(workflows, key=lambda s: s.duration, reverse=True)[:top]
+
+
+def self_time(span: Span, children: Dict[str, List[Span]]) -> float:
+    """Tiempo del span no cubierto por ningún hijo (los hijos paralelos se solapan)"""
+    covered = 0
+    cursor = span.start_time_ns
+    for child in children.get(span.span_id, []):
+        start = max(child.start_time_ns, cursor)
+        end = min(child.end_time_ns, span.end_time_ns)
+        if end > start:
+            covered += end - start
+            cursor = end
+    return max(0.0, span.duration - covered / 1e9)
+
+
+def category(span: Span) -> str:
+    return span.name.split(" ", 1)[0]
+
+
+def time_breakdown(roots: List[Span], children: Dict[str, List[Span]]) -> List[Tuple[str, float]]:
+    """Tiempo propio acumulado por categoría de span (workflow, node, agent.task, llm.call...)"""
+    totals = defaultdict(float)
+    stack = list(roots)
+    while stack:
+        span = stack.pop()
+        totals[category(span)] += self_time(span, children)
+        stack.extend(children.get(span.span_id, []))
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def _describe(span: Span) -> str:
+    details = []
+    for key, template in SHOWN_ATTRIBUTES.items():
+        value = span.attributes.get(key)
+        if value is None or value is False:
+            continue
+        details.append(template.format(value))
+    if span.error:
+        details.append(f"ERROR {span.error[:60]}")
+    return ", ".join(details)
+
+
+def render_trace(root: Span, children: Dict[str, List[Span]], width: int = 50,
+                 min_duration: float = 0.0) -> List[str]:
+    """Líneas del árbol del workflow con una barra situada en su instante de inicio"""
+    total = max(root.end_time_ns - root.start_time_ns, 1)
+    lines = []
+
+    def walk(span: Span, depth: int):
+        if depth > 0 and span.duration < min_duration:
+            return
+        offset = int((span.start_time_ns - root.start_time_ns) / total * width)
+        length = max(1, round((span.end_time_ns - span.start_time_ns) / total * width))
+        bar = (" " * offset + "█" * length)[:width].ljust(width)
+        label = ("  " * depth + span.name)[:45]
+        pct = (span.end_time_ns - span.start_time_ns) / total * 100
+        lines.append(f"{label:<45} {span.duration:>8.3f}s {pct:>5.1f}% |{bar}| {_describe(span)}".rstrip())
+        for child in children.get(span.span_id, []):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return lines
+
+
+def render_report(spans: List[Span], top: int = 5, width: int = 50, min_duration: float = 0.0) -> str:
+    """Informe de los workflows más lentos y reparto del tiempo por categoría"""
+    children = build_children(spans)
+    roots = slowest_workflows(spans, top)
+    if not roots:
+        return "No hay trazas"
+
+    out = []
+    for root in roots:
+        workflow_id = root.attributes.get("workflow.id", root.trace_id[:8])
+        status = root.attributes.get("workflow.status", "error" if root.error else "ok")
+        out.append(f"\n== {root.name} ({workflow_id}) {root.duration:.3f}s [{status}]")
+        out.extend(render_trace(root, children, width, min_duration))
+
+    breakdown = time_breakdown(roots, children)
+    total = sum(seconds for _, seconds in breakdown) or 1.0
+    out.append("\nTiempo propio por tipo de span:")
+    for name, seconds in breakdown:
+        out.append(f"  {name:<20} {seconds:>9.3f}s {seconds / total * 100:>5.1f}%")
+    return "\n".join(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Desglose de tiempos de los workflows más lentos")
+    parser.add_argument("path", nargs="?", default="logs/traces.jsonl", help="Fichero OTLP/JSON de trazas")
+    parser.add_argument("--top", type=int, default=5, help="Número de workflows a mostrar")
+    parser.add_argument("--width", type=int, default=50, help="Ancho de las barras")
+    parser.add_argument("--min-duration", type=float, default=0.0,
+                        help="Oculta spans más cortos (segundos)")
+    args = parser.parse_args()
+
+    try:
+        spans = load_otlp_json(args.path)
+    except FileNotFoundError:
+        print(f"No existe el fichero de trazas: {args.path}")
+        sys.exit(1)
+    print(render_report(spans, args.top, args.width, args.min_duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Trazas de ejecución del sistema de coordinación
+Spans por workflow, nodo, tarea de agente y llamada al modelo, exportables en JSON compatible con OTLP
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from agent_memory import estimate_tokens
+
+SERVICE_NAME = "orchestration"
+SCOPE_NAME = "orchestration.tracing"
+
+# (trace_id, span_id) del span padre; es lo que viaja dentro de las tareas de la cola
+TraceParent = Tuple[str, str]
+
+
+class SpanKind(Enum):
+    """Tipos de span con su código OTLP"""
+    INTERNAL = 1
+    SERVER = 2
+    CLIENT = 3
+    PRODUCER = 4
+    CONSUMER = 5
+
+
+@dataclass
+class Span:
+    """Intervalo de trabajo con sus atributos y su enlace al span padre"""
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str]
+    kind: SpanKind = SpanKind.INTERNAL
+    start_time_ns: int = 0
+    end_time_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        """Duración en segundos (hasta ahora si el span sigue abierto)"""
+        end = self.end_time_ns if self.end_time_ns is not None else time.time_ns()
+        return (end - self.start_time_ns) / 1e9
+
+    @property
+    def context(self) -> TraceParent:
+        return self.trace_id, self.span_id
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        self.attributes.update(attributes)
+
+    def set_error(self, message: str):
+        self.error = message
+
+    def to_otlp(self) -> Dict:
+        """Representación OTLP/JSON del span"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id or "",
+            "name": self.name,
+            "kind": self.kind.value,
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns or self.start_time_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1}
+        }
+
+    @classmethod
+    def from_otlp(cls, data: Dict) -> "Span":
+        return cls(
+            name=data["name"],
+            trace_id=data["traceId"],
+            span_id=data["spanId"],
+            parent_span_id=data.get("parentSpanId") or None,
+            kind=SpanKind(data.get("kind", 1)),
+            start_time_ns=int(data["startTimeUnixNano"]),
+            end_time_ns=int(data["endTimeUnixNano"]),
+            attributes={a["key"]: _from_otlp_value(a["value"]) for a in data.get("attributes", [])},
+            error=data.get("status", {}).get("message") if data.get("status", {}).get("code") == 2 else None
+        )
+
+
+class _NoopSpan(Span):
+    """Span que no registra nada cuando las trazas están desactivadas"""
+
+    def __init__(self):
+        super().__init__(name="", trace_id="", span_id="", parent_span_id=None)
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        pass
+
+    def set_error(self, message: str):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _from_otlp_value(value: Dict) -> Any:
+    if "intValue" in value:
+        return int(value["intValue"])
+    if "doubleValue" in value:
+        return float(value["doubleValue"])
+    if "boolValue" in value:
+        return value["boolValue"]
+    return value.get("stringValue")
+
+
+def token_usage(messages: List, response) -> Tuple[int, int]:
+    """Tokens de entrada y salida de una llamada; estimados si el modelo no los informa"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    prompt_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+    return prompt_tokens, estimate_tokens(str(response.content))
+
+
+class InMemoryCollector:
+    """Colector en proceso con los últimos spans terminados"""
+
+    def __init__(self, max_spans: int = 10000):
+        self.spans: deque = deque(maxlen=max_spans)
+        self.lock = threading.Lock()
+
+    def export(self, spans: List[Span]):
+        with self.lock:
+            self.spans.extend(spans)
+
+    def get_spans(self, trace_id: Optional[str] = None) -> List[Span]:
+        with self.lock:
+            spans = list(self.spans)
+        if trace_id is not None:
+            spans = [span for span in spans if span.trace_id == trace_id]
+        return spans
+
+    def clear(self):
+        with self.lock:
+            self.spans.clear()
+
+    def shutdown(self):
+        pass
+
+
+class OTLPJsonFileExporter:
+    """Escribe lotes de spans como líneas OTLP/JSON (formato del file exporter de OpenTelemetry)"""
+
+    def __init__(self, path: str, service_name: str = SERVICE_NAME):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.service_name = service_name
+        self.lock = threading.Lock()
+
+    def export(self, spans: List[Span]):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": self.service_name}}
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": SCOPE_NAME},
+                    "spans": [span.to_otlp() for span in spans]
+                }]
+            }]
+        }
+        line = json.dumps(payload, ensure_ascii=False, default=str)
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def shutdown(self):
+        pass
+
+
+def load_otlp_json(path: str) -> List[Span]:
+    """Lee los spans de un fichero OTLP/JSON (una línea por lote)"""
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource in json.loads(line).get("resourceSpans", []):
+                for scope in resource.get("scopeSpans", []):
+                    spans.extend(Span.from_otlp(span) for span in scope.get("spans", []))
+    return spans
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Crea spans anidados según el contexto (tarea asyncio o hilo) y los exporta por lotes
+
+    Los spans terminados se acumulan hasta `batch_size` o hasta que termina un
+    span raíz, y entonces se envían al colector en memoria y a los exportadores.
+    """
+
+    def __init__(self, enabled: bool = True, max_spans: int = 10000, batch_size: int = 256):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.collector = InMemoryCollector(max_spans)
+        self.exporters: List = []
+
+        self.pending: List[Span] = []
+        self.lock = threading.Lock()
+        self.stats = {"spans": 0, "exported_batches": 0, "export_errors": 0}
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def current_parent(self) -> Optional[TraceParent]:
+        """Contexto del span activo para propagarlo a otro hilo o proceso"""
+        span = _current_span.get()
+        return span.context if span is not None else None
+
+    @contextmanager
+    def span(self, name: str, attributes: Dict[str, Any] = None, kind: SpanKind = SpanKind.INTERNAL,
+             parent: Optional[TraceParent] = None) -> Iterator[Span]:
+        """Abre un span hijo del activo (o de `parent`) durante el bloque"""
+        if not self.enabled:
+            yield _NOOP_SPAN
+            return
+
+        if parent is None:
+            active = _current_span.get()
+            parent = active.context if active is not None else None
+        trace_id, parent_span_id = parent if parent is not None else (os.urandom(16).hex(), None)
+
+        span = Span(
+            name=name,
+            trace_id=trace_id,
+            span_id=os.urandom(8).hex(),
+            parent_span_id=parent_span_id,
+            kind=kind,
+            start_time_ns=time.time_ns(),
+            attributes=dict(attributes or {})
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # El bloque terminó en otro contexto (p. ej. un generador cerrado desde fuera)
+                pass
+            span.end_time_ns = time.time_ns()
+            self._finish(span)
+
+    def _finish(self, span: Span):
+        with self.lock:
+            self.pending.append(span)
+            self.stats["spans"] += 1
+            if len(self.pending) < self.batch_size and span.parent_span_id is not None:
+                return
+            batch, self.pending = self.pending, []
+        self._export(batch)
+
+    def _export(self, batch: List[Span]):
+        self.collector.export(batch)
+        for exporter in self.exporters:
+            try:
+                exporter.export(batch)
+            except Exception as e:
+                self.stats["export_errors"] += 1
+                logger.error(f"Error exportando trazas: {e}")
+        self.stats["exported_batches"] += 1
+
+    def flush(self):
+        """Exporta los spans pendientes"""
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            self._export(batch)
+
+    def shutdown(self):
+        self.flush()
+        for exporter in self.exporters:
+            exporter.shutdown()
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, "pending": len(self.pending), "retained": len(self.collector.spans)}
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """Tracer compartido por coordinador, agentes y cola"""
+    return _tracer
+
+
+def configure_tracing(config: Dict[str, Any]) -> Tracer:
+    """Reconfigura el tracer compartido a partir de la sección `tracing` de la configuración"""
+    global _tracer
+    _tracer.flush()
+    _tracer = Tracer(
+        enabled=config.get("enabled", True),
+        max_spans=config.get("max_spans", 10000),
+        batch_size=config.get("batch_size", 256)
+    )
+    if _tracer.enabled and config.get("otlp_json_path"):
+        _tracer.add_exporter(OTLPJsonFileExporter(config["otlp_json_path"]))
+    return _tracer
@@ -0,0 +1,142 @@
+"""
+Checkpoints de workflows
+Guarda tras cada nodo su actualización de estado para poder reanudar un workflow interrumpido
+"""
+
+import asyncio
+import json
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# Nodo ficticio con los datos necesarios para reconstruir el estado inicial
+START_NODE = "__start__"
+
+
+@dataclass
+class CheckpointConfig:
+    """Parámetros de escritura de checkpoints"""
+    enabled: bool = True
+    batch_size: int = 20  # checkpoints pendientes que fuerzan una escritura
+    flush_interval: float = 1.0  # máximo tiempo que un checkpoint espera en memoria
+    compression_level: int = 6
+
+
+def decode_checkpoint(payload: bytes) -> Dict[str, Any]:
+    """Deserializa un checkpoint (JSON comprimido con zlib)"""
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+class WorkflowCheckpointer:
+    """Acumula checkpoints por nodo y los escribe por lotes en el StateManager
+
+    Un checkpoint espera en memoria como mucho `flush_interval` segundos, de modo
+    que una caída abrupta solo pierde los nodos terminados en ese intervalo. Los
+    fallos dentro del proceso fuerzan una escritura inmediata.
+    """
+
+    def __init__(self, state_manager, config: CheckpointConfig = None):
+        self.state_manager = state_manager
+        self.config = config or CheckpointConfig()
+
+        self.pending: List[Tuple[str, str, int, bytes]] = []
+        self.flush_lock = asyncio.Lock()
+        self.flush_task: Optional[asyncio.Task] = None
+
+        self.stats = {
+            "checkpoints": 0,
+            "flushes": 0,
+            "raw_bytes": 0,
+            "compressed_bytes": 0,
+            "failed_flushes": 0
+        }
+
+    async def start(self):
+        """Inicia la escritura periódica en segundo plano"""
+        if not self.config.enabled or self.flush_task is not None:
+            return
+        self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Detiene la escritura periódica y vacía lo pendiente"""
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.config.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error escribiendo checkpoints: {e}")
+
+    async def record(self, workflow_id: str, node: str, data: Dict[str, Any]):
+        """Registra el checkpoint de un nodo terminado"""
+        if not self.config.enabled:
+            return
+        raw = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        payload = zlib.compress(raw, self.config.compression_level)
+        # La secuencia ordena los checkpoints también entre reinicios del proceso
+        self.pending.append((workflow_id, node, time.time_ns(), payload))
+
+        self.stats["checkpoints"] += 1
+        self.stats["raw_bytes"] += len(raw)
+        self.stats["compressed_bytes"] += len(payload)
+
+        if len(self.pending) >= self.config.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        """Escribe en una sola transacción los checkpoints pendientes"""
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, []
+            try:
+                await self.state_manager.save_workflow_checkpoints(batch)
+                self.stats["flushes"] += 1
+            except Exception:
+                # Se reintentan en la siguiente escritura
+                self.pending = batch + self.pending
+                self.stats["failed_flushes"] += 1
+                raise
+
+    async def load(self, workflow_id: str) -> Dict[str, Dict[str, Any]]:
+        """Checkpoints de un workflow por nodo, en orden de ejecución"""
+        await self.flush()
+        rows = await self.state_manager.load_workflow_checkpoints(workflow_id)
+        checkpoints = {}
+        for node, payload in rows:
+            try:
+                checkpoints[node] = decode_checkpoint(payload)
+            except Exception as e:
+                logger.warning(f"Checkpoint corrupto {workflow_id}/{node}, se recalculará: {e}")
+        return checkpoints
+
+    async def discard(self, workflow_id: str):
+        """Elimina los checkpoints de un workflow que ya no se reanudará"""
+        async with self.flush_lock:
+            self.pending = [entry for entry in self.pending if entry[0] != workflow_id]
+        await self.state_manager.delete_workflow_checkpoints(workflow_id)
+
+    async def pending_workflows(self) -> List[str]:
+        """Workflows con checkpoints guardados"""
+        await self.flush()
+        return await self.state_manager.get_checkpointed_workflows()
+
+    def get_stats(self) -> Dict:
+        raw = self.stats["raw_bytes"]
+        return {
+            **self.stats,
+            "pending": len(self.pending),
+            "compression_ratio": raw / self.stats["compressed_bytes"] if raw else 0.0
+        }